@@ -2,16 +2,57 @@
 """
 Netrix Core - premium tunnel manager for Netrix
 """
-import os, sys, time, subprocess, shutil, socket, signal, urllib.request, platform, json, stat, hashlib, ipaddress, re, datetime
+import time
+_STARTUP_T0 = time.perf_counter()
+import os, sys, subprocess, shutil, socket, signal, json, stat, re
 from typing import Optional, Dict, Any, List
 from pathlib import Path
 
-try:
-    import yaml
-except ImportError:
+# ========== Lazy Imports ==========
+# The script is run from cron and health probes; heavy modules are imported on first use only.
+STARTUP_IMPORT_TIMES: List[tuple] = []
+
+class _LazyModule:
+    """Module proxy that imports `name` (and optional submodules) on first attribute access."""
+    def __init__(self, name: str, *submodules: str, on_missing=None):
+        self.__dict__.update(_name=name, _submodules=submodules, _on_missing=on_missing, _module=None)
+
+    def _load(self):
+        module = self.__dict__["_module"]
+        if module is None:
+            import importlib
+            t0 = time.perf_counter()
+            try:
+                module = importlib.import_module(self._name)
+                for sub in self._submodules:
+                    importlib.import_module(f"{self._name}.{sub}")
+            except ImportError:
+                if self._on_missing:
+                    self._on_missing()
+                raise
+            STARTUP_IMPORT_TIMES.append((self._name, (time.perf_counter() - t0) * 1000.0))
+            self.__dict__["_module"] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+def _yaml_missing():
     print("❌ PyYAML library not found. Install with: pip install pyyaml")
     sys.exit(1)
 
+yaml = _LazyModule("yaml", on_missing=_yaml_missing)
+urllib = _LazyModule("urllib", "request", "error")
+platform = _LazyModule("platform")
+hashlib = _LazyModule("hashlib")
+ipaddress = _LazyModule("ipaddress")
+datetime = _LazyModule("datetime")
+
+def yaml_safe_load(stream):
+    """yaml.safe_load, using the libyaml C loader when PyYAML was built with it."""
+    loader = getattr(yaml, "CSafeLoader", None) or yaml.SafeLoader
+    return yaml.load(stream, Loader=loader)
+
 # ========== Version ==========
 VERSION = "3.0.0"
 
@@ -22,6 +63,7 @@ NETRIX_BINARY = "/usr/local/bin/netrix"
 NETRIX_SYSCTL_FILE = Path("/etc/sysctl.d/99-netrix-performance.conf")
 NETRIX_LIMITS_FILE = Path("/etc/security/limits.d/99-netrix.conf")
 NETRIX_PROFILE_LIMITS_FILE = Path("/etc/profile.d/netrix-limits.sh")
+NETRIX_CONNTRACK_MODPROBE_FILE = Path("/etc/modprobe.d/netrix-conntrack.conf")
 
 def _read_proc_text(path: str) -> str:
     try:
@@ -29,18 +71,19 @@ def _read_proc_text(path: str) -> str:
     except Exception:
         return ""
 
-def resolve_netrix_config_dir() -> Path:
-    """Return a writable config directory, even if /root/netrix is a file."""
+def resolve_netrix_config_dir(create: bool = False) -> Path:
+    """Return the config directory, even if /root/netrix is a file. Only creates it when `create` is set."""
     preferred = NETRIX_CONFIG_DIR
+    fallback = NETRIX_CONFIG_DIR_FALLBACK
     try:
         if preferred.exists() and not preferred.is_dir():
-            fallback = NETRIX_CONFIG_DIR_FALLBACK
-            fallback.mkdir(parents=True, exist_ok=True)
+            if create:
+                fallback.mkdir(parents=True, exist_ok=True)
             return fallback
-        preferred.mkdir(parents=True, exist_ok=True)
+        if create:
+            preferred.mkdir(parents=True, exist_ok=True)
         return preferred
     except Exception:
-        fallback = NETRIX_CONFIG_DIR_FALLBACK
         fallback.mkdir(parents=True, exist_ok=True)
         return fallback
 
@@ -643,15 +686,26 @@ def compact_maps(maps: List[Dict[str, str]]) -> List[Dict[str, str]]:
     
     return compacted
 
-def configure_encryption() -> dict:
+def configure_encryption(side: str = "server") -> dict:
+    """
+    Encryption answers. Only the server picks the AEAD from this CPU; the client must use
+    whatever the server chose, so its default is the fixed chacha and it is told to match.
+    """
     config = {}
     print(f"\n  {BOLD}{FG_CYAN}Encryption{RESET}")
     encryption_enabled = ask_yesno(f"  {BOLD}Enable encryption{RESET}", default=True)
     config["enabled"] = encryption_enabled
     if encryption_enabled:
-        print(f"  {FG_CYAN}[1]{RESET} {FG_WHITE}ChaCha20-Poly1305{RESET}")
-        print(f"  {FG_CYAN}[2]{RESET} {FG_WHITE}AES-256-GCM{RESET}")
-        algo_choice = ask_int(f"  {BOLD}Algorithm{RESET}", min_=1, max_=2, default=1)
+        if side == "server":
+            rec = cpu_capability_profile()["recommended_encryption"]
+            mark = {rec["algorithm"]: f" {FG_GREEN}(recommended: {rec['reason']}){RESET}"}
+        else:
+            rec = {"algorithm": "chacha"}
+            mark = {}
+            print(f"  {FG_YELLOW}Pick the same algorithm as the server (its config: encryption.algorithm){RESET}")
+        print(f"  {FG_CYAN}[1]{RESET} {FG_WHITE}ChaCha20-Poly1305{RESET}{mark.get('chacha', '')}")
+        print(f"  {FG_CYAN}[2]{RESET} {FG_WHITE}AES-256-GCM{RESET}{mark.get('aes-gcm', '')}")
+        algo_choice = ask_int(f"  {BOLD}Algorithm{RESET}", min_=1, max_=2, default=2 if rec["algorithm"] == "aes-gcm" else 1)
         config["algorithm"] = "chacha" if algo_choice == 1 else "aes-gcm"
         config["key"] = ask_nonempty(f"  {BOLD}Encryption key{RESET}")
     else:
@@ -787,19 +841,29 @@ def configure_buffer_pools() -> dict:
     return config
 
 
-def configure_compression() -> dict:
+def configure_compression(side: str = "server") -> dict:
+    """Compression answers; like encryption, only the server takes the CPU recommendation and the client matches it."""
     config = {}
     _section("COMPRESSION")
     compression_enabled = ask_yesno(f"  {BOLD}Enable compression{RESET}", default=True)
     config["enabled"] = compression_enabled
     if compression_enabled:
-        print(f"  {FG_CYAN}[1]{RESET} {FG_WHITE}LZ4{RESET}")
-        print(f"  {FG_CYAN}[2]{RESET} {FG_WHITE}Zstd{RESET}")
-        print(f"  {FG_CYAN}[3]{RESET} {FG_WHITE}Snappy{RESET}")
-        algo_choice = ask_int(f"  {BOLD}Algorithm{RESET}", min_=1, max_=3, default=1)
+        if side == "server":
+            rec = cpu_capability_profile()["recommended_compression"]
+            mark = {rec["algorithm"]: f" {FG_GREEN}(recommended: {rec['reason']}){RESET}"}
+        else:
+            rec = {"algorithm": "lz4", "level": 0}
+            mark = {}
+            print(f"  {FG_YELLOW}Pick the same algorithm as the server (its config: compression.algorithm){RESET}")
+        print(f"  {FG_CYAN}[1]{RESET} {FG_WHITE}LZ4{RESET}{mark.get('lz4', '')}")
+        print(f"  {FG_CYAN}[2]{RESET} {FG_WHITE}Zstd{RESET}{mark.get('zstd', '')}")
+        print(f"  {FG_CYAN}[3]{RESET} {FG_WHITE}Snappy{RESET}{mark.get('snappy', '')}")
         algo_map = {1: "lz4", 2: "zstd", 3: "snappy"}
+        default_choice = {v: k for k, v in algo_map.items()}.get(rec["algorithm"], 1)
+        algo_choice = ask_int(f"  {BOLD}Algorithm{RESET}", min_=1, max_=3, default=default_choice)
         config["algorithm"] = algo_map[algo_choice]
-        config["level"] = ask_int(f"  {BOLD}Level{RESET}", min_=1, max_=19, default=3) if algo_choice == 2 else 0
+        zstd_level = rec["level"] if rec["algorithm"] == "zstd" and rec["level"] else 3
+        config["level"] = ask_int(f"  {BOLD}Level{RESET}", min_=1, max_=19, default=zstd_level) if algo_choice == 2 else 0
         config["min_size"] = ask_int(f"  {BOLD}Min Size{RESET}", min_=0, max_=65536, default=1024)
         config["max_size"] = ask_int(f"  {BOLD}Max Size{RESET}", min_=1024, max_=131072, default=65536)
     else:
@@ -897,6 +961,13 @@ def configure_l3_security(label: str = "L3") -> dict:
         "kdf_iterations": kdf_iterations,
     }
 
+def ask_tun_streams() -> int:
+    """TUN streams prompt defaulting to compute_tun_streams() for this host's cores and multi-queue support."""
+    rec = compute_tun_streams(multi_queue=kernel_tun_multiqueue())
+    hint = f"recommended {rec['streams']} for {rec['cores']} cores" + ("" if rec["multi_queue"] is not False else ", no multi-queue TUN")
+    return ask_int(f"  {BOLD}TUN Streams:{RESET} {FG_WHITE}(1 = lowest jitter; {hint}; tune later with 'tun'){RESET}",
+                   min_=1, max_=TUN_STREAMS_MAX, default=rec["streams"])
+
 def configure_l3_tun(role: str, label: str = "L3") -> dict:
     print(f"\n  {BOLD}{FG_CYAN}{label} TUN Configuration:{RESET}")
     default_name = "netrix"
@@ -906,7 +977,7 @@ def configure_l3_tun(role: str, label: str = "L3") -> dict:
     tun_local = ask_nonempty(f"  {BOLD}Local TUN CIDR:{RESET}", default=default_local)
     tun_remote = ask_nonempty(f"  {BOLD}Remote TUN CIDR:{RESET}", default=default_remote)
     tun_mtu = ask_int(f"  {BOLD}MTU:{RESET}", min_=576, max_=9000, default=1320)
-    tun_streams = ask_int(f"  {BOLD}TUN Streams:{RESET} {FG_WHITE}(1 = lowest jitter; 2-8 for parallel; max L3: 64){RESET}", min_=1, max_=64, default=1)
+    tun_streams = ask_tun_streams()
     prefix = "server_l3" if role == "server" else "client_l3"
     while True:
         health_port = ask_free_port("Health Port", default=1234, protocols=("tcp",))
@@ -950,6 +1021,23 @@ def _maps_to_port_strings(maps: List[Dict[str, str]]) -> List[str]:
             out.append(f"{bind}={target}")
     return out
 
+def cfg_mapped_ports(cfg: dict) -> Dict[str, set]:
+    """Local bind ports of a parsed config's tcp_ports/udp_ports mappings, per protocol."""
+    ports: Dict[str, set] = {"tcp": set(), "udp": set()}
+    for proto in ports:
+        entries = [str(e) for e in cfg.get(f"{proto}_ports") or [] if str(e).strip()]
+        if not entries:
+            continue
+        try:
+            maps = parse_advanced_ports(",".join(entries), proto)
+        except Exception:
+            continue
+        for m in maps:
+            port = m.get("bind", "").rpartition(":")[2]
+            if port.isdigit():
+                ports[proto].add(int(port))
+    return ports
+
 
 def configure_l3_port_mappings(label: str = "L3") -> tuple[List[str], List[str]]:
     print(f"\n  {BOLD}{FG_CYAN}{label} Port Forwarding (Iran / Server Side){RESET}")
@@ -1039,12 +1127,7 @@ def configure_l3_runtime(role: str, label: str = "L3") -> dict:
         icmp_code = ask_int(f"  {BOLD}ICMP Code:{RESET}", min_=0, max_=255, default=0)
 
     print(f"\n  {BOLD}{FG_CYAN}{label} Runtime:{RESET}")
-    print(f"  {FG_CYAN}[1]{RESET} {FG_WHITE}balanced{RESET}")
-    print(f"  {FG_CYAN}[2]{RESET} {FG_WHITE}aggressive{RESET}")
-    print(f"  {FG_CYAN}[3]{RESET} {FG_WHITE}latency{RESET}")
-    print(f"  {FG_CYAN}[4]{RESET} {FG_WHITE}cpu-efficient{RESET}")
-    profile_choice = ask_int(f"\n  {BOLD}Select profile:{RESET}", min_=1, max_=4, default=1)
-    profile = {1: "balanced", 2: "aggressive", 3: "latency", 4: "cpu-efficient"}[profile_choice]
+    profile = ask_profile()
     heartbeat_interval = ask_int(f"  {BOLD}Heartbeat Interval:{RESET} {FG_WHITE}(seconds){RESET}", min_=1, max_=300, default=5)
     heartbeat_timeout = ask_int(f"  {BOLD}Heartbeat Timeout:{RESET} {FG_WHITE}(seconds){RESET}", min_=1, max_=600, default=30)
     l3_channel_size = ask_int(
@@ -1124,12 +1207,13 @@ def _l3_config_stem(tun_cfg: dict) -> str:
         s = str(hp).strip()
         return s if s else "1234"
 
-def create_l3_server_config_file(cfg: dict) -> Path:
-    NETRIX_CONFIG_DIR.mkdir(parents=True, exist_ok=True)
+def create_l3_server_config_file(cfg: dict, config_dir: Optional[Path] = None) -> Path:
+    config_dir = config_dir or NETRIX_CONFIG_DIR
+    config_dir.mkdir(parents=True, exist_ok=True)
     tun_cfg = cfg.get("tun_config") or {}
     l3_cfg = cfg.get("l3_config") or {}
     stem = _l3_config_stem(tun_cfg)
-    config_path = NETRIX_CONFIG_DIR / f"server_l3_{stem}.yaml"
+    config_path = config_dir / f"server_l3_{stem}.yaml"
     yaml_l3, carrier = _l3_build_yaml_block(l3_cfg)
     yaml_data = {
         "mode": "server",
@@ -1148,6 +1232,7 @@ def create_l3_server_config_file(cfg: dict) -> Path:
         "udp_ports": cfg.get("udp_ports", []),
         "verbose": cfg.get("verbose", False),
     }
+    apply_cfg_overrides(yaml_data, cfg)
     transport_note = f"Netrix L3 ({carrier} outer carrier)"
     comments = {
         "transport": transport_note,
@@ -1169,12 +1254,13 @@ def create_l3_server_config_file(cfg: dict) -> Path:
         pass
     return config_path
 
-def create_l3_client_config_file(cfg: dict) -> Path:
-    NETRIX_CONFIG_DIR.mkdir(parents=True, exist_ok=True)
+def create_l3_client_config_file(cfg: dict, config_dir: Optional[Path] = None) -> Path:
+    config_dir = config_dir or NETRIX_CONFIG_DIR
+    config_dir.mkdir(parents=True, exist_ok=True)
     tun_cfg = cfg.get("tun_config") or {}
     l3_cfg = cfg.get("l3_config") or {}
     stem = _l3_config_stem(tun_cfg)
-    config_path = NETRIX_CONFIG_DIR / f"client_l3_{stem}.yaml"
+    config_path = config_dir / f"client_l3_{stem}.yaml"
     yaml_l3, carrier = _l3_build_yaml_block(l3_cfg)
     yaml_data = {
         "mode": "client",
@@ -1191,6 +1277,7 @@ def create_l3_client_config_file(cfg: dict) -> Path:
         "l3": yaml_l3,
         "verbose": cfg.get("verbose", False),
     }
+    apply_cfg_overrides(yaml_data, cfg)
     transport_note = f"Netrix L3 ({carrier} outer carrier)"
     comments = {
         "transport": transport_note,
@@ -1228,6 +1315,8 @@ def create_server_l3_tunnel():
         "direct": False,
     }
     config_path = create_server_config_file(0, cfg)
+    configure_path_mtu(config_path)
+    warn_memory_budget(config_path)
     print()
     print(f"  {BOLD}{FG_CYAN}{'═' * 60}{RESET}")
     c_ok(f"  ✅ Configuration saved: {FG_WHITE}{config_path}{RESET}")
@@ -1256,6 +1345,8 @@ def create_client_l3_tunnel():
         "direct": False,
     }
     config_path = create_client_config_file(cfg)
+    configure_path_mtu(config_path)
+    warn_memory_budget(config_path)
     print()
     print(f"  {BOLD}{FG_CYAN}{'═' * 60}{RESET}")
     c_ok(f"  ✅ Configuration saved: {FG_WHITE}{config_path}{RESET}")
@@ -1275,6 +1366,9 @@ def get_config_path(tport: int) -> Path:
 
 def get_default_smux_config(profile: str = "balanced") -> dict:
     """تنظیمات پیش‌فرض SMUX بر اساس profile - همگام با netrix.go"""
+    base, layers = resolve_profile(profile)
+    if layers:
+        return {**get_default_smux_config(base), **profile_section_overrides(profile, "smux")}
     profiles = {
         "balanced": {
             "keepalive": 15,  
@@ -1342,13 +1436,16 @@ def _extract_ip_from_addr(addr: str) -> str:
 
 def get_default_kcp_config(profile: str = "balanced") -> dict:
     """تنظیمات پیش‌فرض KCP بر اساس profile - از KCP_PROFILES همگام با netrix.go"""
+    base, layers = resolve_profile(profile)
+    if layers:
+        return {**KCP_PROFILES[base], **profile_section_overrides(profile, "kcp")}
     return KCP_PROFILES.get((profile or "balanced").strip().lower(), KCP_PROFILES["balanced"])
 
 def get_default_rawsocket_config(profile: str = "balanced") -> dict:
     """
     تنظیمات پیش‌فرض rawsocket (KCP+FEC) — جدا از KCP؛ از RAWSOCKET_* و RAWSOCKET_PROFILES.
     """
-    p = (profile or "balanced").strip().lower()
+    p, layers = resolve_profile(profile)
     base = {
         "mtu": RAWSOCKET_MTU,
         "snd_wnd": RAWSOCKET_SND_WND,
@@ -1357,7 +1454,7 @@ def get_default_rawsocket_config(profile: str = "balanced") -> dict:
         "parity_shard": RAWSOCKET_PARITY_SHARD,
         "sock_buf": RAWSOCKET_SOCK_BUF,
     }
-    out = {**base, **RAWSOCKET_PROFILES.get(p, {})}
+    out = {**base, **RAWSOCKET_PROFILES.get(p, {}), **(profile_section_overrides(profile, "rawsocket") if layers else {})}
     out["mtu"] = max(576, min(9000, int(out.get("mtu", RAWSOCKET_MTU))))
     for k in ("snd_wnd", "rcv_wnd", "data_shard", "parity_shard", "sock_buf"):
         v = int(out.get(k) or 0)
@@ -1370,8 +1467,12 @@ def _l3_build_yaml_block(l3_cfg: dict) -> tuple[dict, str]:
     """Build the l3: YAML map exactly as netrix.go expects (defaults + carrier-specific keys)."""
     carrier = (l3_cfg.get("carrier") or L3_KERNEL_DEFAULT_CARRIER).strip().lower()
     profile = (l3_cfg.get("profile") or L3_KERNEL_DEFAULT_PROFILE).strip().lower()
+    l3_overrides = profile_section_overrides(profile, "l3")
+    if l3_overrides:
+        # custom profile values fill in what the wizard/spec left at 0 or unset
+        l3_cfg = {**l3_cfg, **{k: v for k, v in l3_overrides.items() if not l3_cfg.get(k)}}
     yaml_l3: dict = {
-        "profile": profile,
+        "profile": builtin_profile_name(profile),
         "carrier": carrier,
         "listen_ip": l3_cfg.get("listen_ip", ""),
         "dst_ip": l3_cfg.get("dst_ip", ""),
@@ -1509,7 +1610,7 @@ def detect_rawsocket_pcap_defaults() -> Dict[str, Any]:
         pass
     return out
 
-def get_default_advanced_config(transport: str) -> dict:
+def get_default_advanced_config(transport: str, profile: Optional[str] = None) -> dict:
     """تنظیمات پیش‌فرض Advanced بر اساس transport - همگام با netrix.go (مقادیر همان عددهای هسته)"""
     base_config = {
         "tcp_nodelay": True,
@@ -1544,15 +1645,1534 @@ def get_default_advanced_config(transport: str) -> dict:
             "websocket_compression": False    
         })
     
+    if profile:
+        base_config.update(profile_section_overrides(profile, "advanced"))
     return base_config
 
+# ========== Custom Profiles ==========
+# profiles/<name>.yaml next to the tunnel configs: {base: <profile>, description: ..., smux: {...},
+# kcp: {...}, rawsocket: {...}, advanced: {...}, l3: {...}}. Sections override the base profile key by
+# key through the get_default_* functions; the core only knows the built-in names, so configs carry `base`.
+BUILTIN_PROFILES = ("balanced", "aggressive", "latency", "cpu-efficient")
+PROFILE_SECTIONS = ("smux", "kcp", "rawsocket", "advanced", "l3")
+_CUSTOM_PROFILES: Optional[Dict[str, dict]] = None
+
+def profiles_dir() -> Path:
+    return resolve_netrix_config_dir() / "profiles"
+
+def load_custom_profiles(refresh: bool = False) -> Dict[str, dict]:
+    """name -> profile data of every readable profiles/*.yaml (cached per run)."""
+    global _CUSTOM_PROFILES
+    if _CUSTOM_PROFILES is None or refresh:
+        profiles = {}
+        for path in sorted(profiles_dir().glob("*.yaml")):
+            try:
+                data = yaml_safe_load(path.read_text(encoding="utf-8")) or {}
+            except Exception:
+                continue
+            if isinstance(data, dict) and path.stem.lower() not in BUILTIN_PROFILES:
+                profiles[path.stem.lower()] = data
+        _CUSTOM_PROFILES = profiles
+    return _CUSTOM_PROFILES
+
+def available_profiles() -> List[str]:
+    return list(BUILTIN_PROFILES) + sorted(load_custom_profiles())
+
+def resolve_profile(name: str) -> tuple[str, List[dict]]:
+    """(built-in base, custom layers from base-most to `name`). Unknown names resolve to balanced, like the built-ins."""
+    name = (name or "balanced").strip().lower()
+    customs = load_custom_profiles() if name not in BUILTIN_PROFILES else {}
+    layers: List[dict] = []
+    seen = set()
+    while name in customs and name not in seen:
+        seen.add(name)
+        layers.insert(0, customs[name])
+        name = str(customs[name].get("base") or "balanced").strip().lower()
+    return (name if name in BUILTIN_PROFILES else "balanced"), layers
+
+def builtin_profile_name(name: str) -> str:
+    """The built-in profile the core should see for `name`."""
+    return resolve_profile(name)[0]
+
+def profile_section_overrides(name: str, section: str) -> dict:
+    overrides: dict = {}
+    for layer in resolve_profile(name)[1]:
+        if isinstance(layer.get(section), dict):
+            overrides.update(layer[section])
+    return overrides
+
+def profile_comment(name: str) -> str:
+    base = builtin_profile_name(name)
+    if base == (name or "balanced").strip().lower():
+        return "Performance profile (default: balanced)"
+    return f"Performance profile (custom profile '{name}' on {base})"
+
+def profile_values(name: str, transport: str = "kcpmux") -> Dict[str, dict]:
+    """Every section of a resolved profile, for display and diffing."""
+    return {
+        "smux": get_default_smux_config(name),
+        "kcp": get_default_kcp_config(name),
+        "rawsocket": get_default_rawsocket_config(name),
+        "advanced": get_default_advanced_config(transport, name),
+        "l3": profile_section_overrides(name, "l3"),
+    }
+
+def diff_profile_values(left: Dict[str, dict], right: Dict[str, dict]) -> List[tuple]:
+    """(dotted key, left value, right value) for every key whose value differs."""
+    rows = []
+    for section in PROFILE_SECTIONS:
+        a, b = left.get(section) or {}, right.get(section) or {}
+        for key in sorted(set(a) | set(b)):
+            if a.get(key) != b.get(key):
+                rows.append((f"{section}.{key}", a.get(key), b.get(key)))
+    return rows
+
+def ask_profile() -> str:
+    """Profile menu of the wizards: the built-ins followed by custom profiles."""
+    names = available_profiles()
+    customs = load_custom_profiles()
+    for i, name in enumerate(names, 1):
+        note = ""
+        if name in customs:
+            desc = str(customs[name].get("description") or "").strip()
+            note = f" {FG_WHITE}(custom on {builtin_profile_name(name)}{': ' + desc if desc else ''}){RESET}"
+        print(f"  {FG_CYAN}[{i}]{RESET} {FG_WHITE}{name}{RESET}{note}")
+    choice = ask_int(f"\n  {BOLD}Select profile:{RESET}", min_=1, max_=len(names), default=1)
+    return names[choice - 1]
+
+# ========== Path Sizing ==========
+KCP_SEGMENT_OVERHEAD = 24           # KCP segment header bytes (conv..len)
+SIZING_HEADROOM = 2                 # windows/buffers hold 2x BDP to absorb RTT jitter and bursts
+SIZING_MIN_BUFFER = 1024 * 1024
+SIZING_MAX_BUFFER = 64 * 1024 * 1024
+SIZING_MIN_STREAM_BUFFER = 512 * 1024
+SIZING_MIN_WINDOW = 64              # KCP/rawsocket windows, in segments
+SIZING_MAX_WINDOW = 32768
+
+def _round_pow2(n: int) -> int:
+    return 1 << max(0, (int(n) - 1).bit_length())
+
+def _clamp(value: int, low: int, high: int) -> int:
+    return max(low, min(high, value))
+
+def read_host_buffer_limits() -> Dict[str, int]:
+    """Socket buffer ceilings of this host (0 when unreadable)."""
+    limits = {}
+    for key in ("rmem_max", "wmem_max"):
+        try:
+            limits[key] = int(_read_proc_text(f"/proc/sys/net/core/{key}") or 0)
+        except ValueError:
+            limits[key] = 0
+    for key in ("tcp_rmem", "tcp_wmem"):
+        fields = _read_proc_text(f"/proc/sys/net/ipv4/{key}").split()
+        limits[key] = int(fields[2]) if len(fields) == 3 and fields[2].isdigit() else 0
+    return limits
+
+def compute_bdp_sizing(rtt_ms: float, bandwidth_mbps: float, profile: str = "balanced",
+                       kcp_mtu: Optional[int] = None, rawsocket_mtu: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Size smux windows, TCP/UDP socket buffers and KCP/rawsocket windows from the path's
+    bandwidth-delay product. Values are powers of two, like the built-in profiles.
+    """
+    rtt_ms = float(rtt_ms)
+    bandwidth_mbps = float(bandwidth_mbps)
+    if rtt_ms <= 0 or bandwidth_mbps <= 0:
+        raise ValueError("RTT and bandwidth must be positive")
+    bdp = int(bandwidth_mbps * 1_000_000 / 8 * rtt_ms / 1000.0)
+    wanted = bdp * SIZING_HEADROOM
+    buffer_bytes = _clamp(_round_pow2(wanted), SIZING_MIN_BUFFER, SIZING_MAX_BUFFER)
+    stream_bytes = max(SIZING_MIN_STREAM_BUFFER, buffer_bytes // 2)
+
+    kcp_mtu = int(kcp_mtu or get_default_kcp_config(profile)["mtu"])
+    rawsocket_mtu = int(rawsocket_mtu or get_default_rawsocket_config(profile)["mtu"])
+
+    def window(mtu: int) -> int:
+        segments = -(-wanted // max(1, mtu - KCP_SEGMENT_OVERHEAD))
+        return _clamp(_round_pow2(segments), SIZING_MIN_WINDOW, SIZING_MAX_WINDOW)
+
+    sizing = {
+        "rtt_ms": rtt_ms,
+        "bandwidth_mbps": bandwidth_mbps,
+        "bdp_bytes": bdp,
+        "buffer_bytes": buffer_bytes,
+        "smux": {"max_recv": buffer_bytes, "max_stream": stream_bytes},
+        "advanced": {
+            "tcp_read_buffer": buffer_bytes,
+            "tcp_write_buffer": buffer_bytes,
+            "udp_read_buffer": buffer_bytes,
+            "udp_write_buffer": buffer_bytes,
+        },
+        "kcp": {"sndwnd": window(kcp_mtu), "rcvwnd": window(kcp_mtu)},
+        "rawsocket": {"snd_wnd": window(rawsocket_mtu), "rcv_wnd": window(rawsocket_mtu), "sock_buf": buffer_bytes},
+        "warnings": [],
+    }
+    if wanted > SIZING_MAX_BUFFER:
+        sizing["warnings"].append(
+            f"2x BDP ({format_bytes(wanted)}) exceeds the {format_bytes(SIZING_MAX_BUFFER)} cap; throughput will be window-limited"
+        )
+    limits = read_host_buffer_limits()
+    sizing["host_limits"] = limits
+    for key, label in (("rmem_max", "receive"), ("wmem_max", "send")):
+        if limits.get(key) and limits[key] < buffer_bytes:
+            sizing["warnings"].append(
+                f"net.core.{key}={limits[key]} < {buffer_bytes}: the kernel clamps {label} buffers "
+                f"(raise it or run the System Optimizer)"
+            )
+    for key in ("tcp_rmem", "tcp_wmem"):
+        if limits.get(key) and limits[key] < buffer_bytes:
+            sizing["warnings"].append(f"net.ipv4.{key} max={limits[key]} < {buffer_bytes}: TCP autotuning stops below the BDP")
+    return sizing
+
+def sizing_to_cfg_overrides(sizing: Dict[str, Any]) -> dict:
+    """cfg keys consumed by create_*_config_file (applied only to blocks the transport writes)."""
+    return {
+        "smux_overrides": dict(sizing["smux"]),
+        "advanced_overrides": dict(sizing["advanced"]),
+        "kcp_overrides": dict(sizing["kcp"]),
+        "rawsocket_overrides": dict(sizing["rawsocket"]),
+    }
+
+def merge_cfg_overrides(cfg: dict, overrides: dict) -> dict:
+    """Merge <block>_overrides dicts into cfg without dropping keys set by an earlier step."""
+    for key, values in (overrides or {}).items():
+        cfg[key] = {**(cfg.get(key) or {}), **values}
+    return cfg
+
+def apply_cfg_overrides(yaml_data: dict, cfg: dict) -> None:
+    """Merge <block>_overrides from cfg into blocks that were already built from the profile defaults."""
+    for block in ("smux", "kcp", "rawsocket", "advanced", "tun", "l3"):
+        overrides = cfg.get(f"{block}_overrides") or {}
+        if overrides and isinstance(yaml_data.get(block), dict):
+            target = yaml_data[block]
+            if block == "advanced":
+                overrides = {k: v for k, v in overrides.items() if k in target}
+            target.update(overrides)
+
+def measure_rtt_ms(host: str, port: Optional[int] = None, count: int = 5, timeout: float = 2.0) -> Optional[float]:
+    """Median RTT to host: TCP connect time when a port is given, otherwise ICMP ping."""
+    samples = []
+    if port:
+        for _ in range(count):
+            t0 = time.perf_counter()
+            try:
+                with socket.create_connection((host, int(port)), timeout=timeout):
+                    samples.append((time.perf_counter() - t0) * 1000.0)
+            except OSError:
+                continue
+    if not samples and which("ping"):
+        try:
+            result = subprocess.run(
+                ["ping", "-n", "-q", "-c", str(count), "-W", str(max(1, int(timeout))), host],
+                capture_output=True, text=True, timeout=count * (timeout + 1) + 2,
+            )
+            m = re.search(r"= [\d.]+/([\d.]+)/", result.stdout)
+            if m:
+                return float(m.group(1))
+        except Exception:
+            return None
+    if not samples:
+        return None
+    samples.sort()
+    return samples[len(samples) // 2]
+
+def _split_host_port(addr: str) -> tuple[str, Optional[int]]:
+    addr = str(addr).strip()
+    if addr.startswith("["):
+        host, _, rest = addr[1:].partition("]")
+        port = rest.lstrip(":")
+    elif addr.count(":") == 1:
+        host, port = addr.split(":")
+    else:
+        host, port = addr, ""
+    return host, int(port) if port.isdigit() else None
+
+def cfg_peer_addrs(cfg: dict) -> List[str]:
+    """Remote addresses a tunnel dials (direct server connect, client paths)."""
+    addrs = []
+    if cfg.get("direct") and cfg.get("connect"):
+        addrs.append(cfg["connect"])
+    for p in cfg.get("paths") or []:
+        if isinstance(p, dict) and p.get("addr"):
+            addrs.append(p["addr"])
+    return addrs
+
+def measure_cfg_rtt_ms(cfg: dict) -> Optional[float]:
+    """Largest median RTT over the tunnel's peers; windows must cover the slowest path."""
+    rtts = []
+    for addr in cfg_peer_addrs(cfg):
+        host, port = _split_host_port(addr)
+        tcp_port = port if not str(cfg.get("transport", "")).startswith(("kcp", "raw")) else None
+        rtt = measure_rtt_ms(host, tcp_port)
+        if rtt is not None:
+            rtts.append(rtt)
+    return max(rtts) if rtts else None
+
+def quantize_rtt_ms(rtt_ms: float) -> float:
+    """
+    Measured RTT rounded up to a power of two (>= 1 ms) before it sizes anything that gets
+    written: jitter between measurements must not change windows and restart the tunnel.
+    """
+    return float(_round_pow2(max(1, int(-(-float(rtt_ms) // 1)))))
+
+def print_sizing(sizing: Dict[str, Any]):
+    print(f"  {FG_WHITE}RTT {sizing['rtt_ms']:.1f} ms × {sizing['bandwidth_mbps']:g} Mbps → BDP {format_bytes(sizing['bdp_bytes'])}, "
+          f"buffers {format_bytes(sizing['buffer_bytes'])}{RESET}")
+    print(f"  {FG_CYAN}smux:{RESET} max_recv={sizing['smux']['max_recv']} max_stream={sizing['smux']['max_stream']}")
+    print(f"  {FG_CYAN}kcp:{RESET} sndwnd/rcvwnd={sizing['kcp']['sndwnd']}  "
+          f"{FG_CYAN}rawsocket:{RESET} snd_wnd/rcv_wnd={sizing['rawsocket']['snd_wnd']} sock_buf={sizing['rawsocket']['sock_buf']}")
+    for warning in sizing["warnings"]:
+        c_warn(f"  {warning}")
+
+def configure_path_sizing(cfg: dict) -> dict:
+    """Wizard step: optionally size windows/buffers from RTT and target bandwidth. Returns cfg overrides."""
+    print(f"\n  {BOLD}{FG_CYAN}Path Sizing (BDP):{RESET}")
+    if not ask_yesno(f"  {BOLD}Size buffers/windows from RTT and bandwidth?{RESET} {FG_WHITE}(otherwise profile defaults){RESET}", default=False):
+        return {}
+    measured = measure_cfg_rtt_ms(cfg) if cfg_peer_addrs(cfg) else None
+    if measured is not None:
+        print(f"  {FG_GREEN}Measured RTT to peer: {measured:.1f} ms{RESET}")
+    rtt_ms = ask_int(f"  {BOLD}RTT (ms):{RESET}", min_=1, max_=5000, default=max(1, int(round(measured))) if measured else 100)
+    bandwidth = ask_int(f"  {BOLD}Target bandwidth (Mbps):{RESET}", min_=1, max_=100000, default=100)
+    sizing = compute_bdp_sizing(rtt_ms, bandwidth, cfg.get("profile", "balanced"))
+    print_sizing(sizing)
+    return sizing_to_cfg_overrides(sizing)
+
+# ========== Path Probing ==========
+PROBE_MAGIC = b"NXPR"
+PROBE_DEFAULT_COUNT = 500
+PROBE_DEFAULT_INTERVAL_MS = 10
+FEC_HEADER_BYTES = 8                # kcp-go FEC header (6) + size field (2)
+FEC_DEFAULT_TARGET_LOSS = 0.001     # residual loss left for ARQ after FEC
+FEC_MAX_DATA_SHARDS = 20
+FEC_MAX_PARITY_SHARDS = 10
+
+def run_udp_probe_train(host: str, port: int, count: int = PROBE_DEFAULT_COUNT,
+                        interval_ms: float = PROBE_DEFAULT_INTERVAL_MS, timeout: float = 1.5) -> List[bool]:
+    """Send `count` sequenced UDP probes to a `probe-echo` responder; returns per-probe echo received flags."""
+    import select, struct
+    family, _, _, _, addr = socket.getaddrinfo(host, int(port), 0, socket.SOCK_DGRAM)[0]
+    token = os.urandom(4)
+    received = [False] * count
+    with socket.socket(family, socket.SOCK_DGRAM) as sock:
+        sock.setblocking(False)
+        interval = interval_ms / 1000.0
+        next_send = time.perf_counter()
+        sent = 0
+        deadline = None
+        while True:
+            now = time.perf_counter()
+            if sent < count and now >= next_send:
+                try:
+                    sock.sendto(PROBE_MAGIC + token + struct.pack("!I", sent), addr)
+                except OSError:
+                    pass
+                sent += 1
+                next_send += interval
+                if sent == count:
+                    deadline = now + timeout
+            if deadline is not None and now >= deadline:
+                break
+            wait = (next_send - now) if sent < count else (deadline - now)
+            ready, _, _ = select.select([sock], [], [], max(0.0, min(wait, 0.05)))
+            while ready:
+                try:
+                    data = sock.recv(64)
+                except BlockingIOError:
+                    break
+                if len(data) >= 12 and data[:4] == PROBE_MAGIC and data[4:8] == token:
+                    seq = struct.unpack("!I", data[8:12])[0]
+                    if seq < count:
+                        received[seq] = True
+    return received
+
+def measure_udp_echo_rtt_ms(host: str, port: int, count: int = 5, timeout: float = 1.0) -> Optional[float]:
+    """Median round trip of single probes to a `probe-echo` responder; None when nothing echoes."""
+    import select, struct
+    family, _, _, _, addr = socket.getaddrinfo(host, int(port), 0, socket.SOCK_DGRAM)[0]
+    token = os.urandom(4)
+    samples = []
+    with socket.socket(family, socket.SOCK_DGRAM) as sock:
+        for seq in range(count):
+            t0 = time.perf_counter()
+            try:
+                sock.sendto(PROBE_MAGIC + token + struct.pack("!I", seq), addr)
+            except OSError:
+                continue
+            deadline = t0 + timeout
+            while True:
+                ready, _, _ = select.select([sock], [], [], max(0.0, deadline - time.perf_counter()))
+                if not ready:
+                    break
+                data = sock.recv(64)
+                if len(data) >= 12 and data[:8] == PROBE_MAGIC + token and struct.unpack("!I", data[8:12])[0] == seq:
+                    samples.append((time.perf_counter() - t0) * 1000.0)
+                    break
+    if not samples:
+        return None
+    samples.sort()
+    return samples[len(samples) // 2]
+
+def run_icmp_probe_train(host: str, count: int = PROBE_DEFAULT_COUNT,
+                         interval_ms: float = PROBE_DEFAULT_INTERVAL_MS) -> List[bool]:
+    """Probe train with ping (sub-200 ms intervals need root); returns per-probe reply flags."""
+    if not which("ping"):
+        raise RuntimeError("ping not found")
+    interval = max(interval_ms / 1000.0, 0.002 if os.geteuid() == 0 else 0.2)
+    result = subprocess.run(
+        ["ping", "-n", "-c", str(count), "-i", f"{interval:.3f}", "-W", "1", host],
+        capture_output=True, text=True, timeout=count * (interval + 0.05) + 15,
+    )
+    received = [False] * count
+    for m in re.finditer(r"icmp_seq=(\d+)", result.stdout):
+        seq = int(m.group(1)) - 1
+        if 0 <= seq < count:
+            received[seq] = True
+    if not any(received) and result.returncode not in (0, 1):
+        raise RuntimeError((result.stderr or result.stdout).strip() or "ping failed")
+    return received
+
+def estimate_gilbert_elliott(received: List[bool]) -> Dict[str, float]:
+    """
+    Fit a two-state Gilbert loss model to a probe trace.
+    p = P(good→bad), r = P(bad→good); loss rate = p/(p+r), mean burst length = 1/r.
+    """
+    losses = received.count(False)
+    total = len(received)
+    good_to_bad = sum(1 for a, b in zip(received, received[1:]) if a and not b)
+    bad_to_good = sum(1 for a, b in zip(received, received[1:]) if not a and b)
+    good = sum(1 for a in received[:-1] if a)
+    bad = sum(1 for a in received[:-1] if not a)
+    p = good_to_bad / good if good else 1.0
+    r = bad_to_good / bad if bad else 1.0
+    return {
+        "probes": total,
+        "lost": losses,
+        "loss_rate": losses / total if total else 0.0,
+        "p": p,
+        "r": r,
+        "mean_burst": (1.0 / r) if r > 0 else float(losses),
+    }
+
+def fec_residual_loss(data_shard: int, parity_shard: int, p: float, r: float) -> float:
+    """Expected fraction of packets still lost after RS(data, parity) recovery under a Gilbert channel."""
+    n = data_shard + parity_shard
+    if p <= 0:
+        return 0.0
+    r = max(r, 1e-9)
+    bad0 = p / (p + r)
+    # dist[state][losses]; state 0 = good (packet delivered), 1 = bad (packet lost)
+    dist = [[0.0] * (n + 1) for _ in range(2)]
+    dist[0][0], dist[1][0] = 1.0 - bad0, bad0
+    for _ in range(n):
+        nxt = [[0.0] * (n + 1) for _ in range(2)]
+        for lost in range(n):
+            g, b = dist[0][lost], dist[1][lost]
+            if g:
+                nxt[0][lost] += g * (1.0 - p)
+                nxt[1][lost] += g * p
+            if b:
+                nxt[1][lost + 1] += b * (1.0 - r)
+                nxt[0][lost + 1] += b * r
+        dist = nxt
+    # dist now holds the state *after* the n-th packet; the loss counts cover packets 1..n
+    return sum((dist[0][j] + dist[1][j]) * j for j in range(parity_shard + 1, n + 1)) / n
+
+def choose_fec_shards(model: Dict[str, float], target_loss: float = FEC_DEFAULT_TARGET_LOSS, mtu: int = RAWSOCKET_MTU,
+                      current: Optional[tuple[int, int]] = None) -> Dict[str, Any]:
+    """
+    Cheapest data/parity split (bandwidth overhead, then group size) whose residual loss meets the target.
+    With `current` (data, parity) shards, those are kept when FEC is not needed or the target is out of
+    reach, so a one-sided change never disables FEC or jumps to the maximum parity.
+    """
+    p, r = model["p"], model["r"]
+    kept = False
+    if model["lost"] == 0 or model["loss_rate"] <= target_loss:
+        best = (0.0, 0, RAWSOCKET_DATA_SHARD, 0, model["loss_rate"])
+    else:
+        best = None
+        fallback = None
+        for k in range(2, FEC_MAX_DATA_SHARDS + 1):
+            for m in range(1, min(k, FEC_MAX_PARITY_SHARDS) + 1):
+                residual = fec_residual_loss(k, m, p, r)
+                key = (m / k, k + m, k, m, residual)
+                if residual <= target_loss:
+                    if best is None or key < best:
+                        best = key
+                    break
+                if fallback is None or (residual, m / k) < (fallback[4], fallback[0]):
+                    fallback = key
+        best = best or fallback
+    if current and (best[3] == 0 or best[4] > target_loss):
+        k, m = current
+        residual = fec_residual_loss(k, m, p, r) if m else model["loss_rate"]
+        best = (m / k, k + m, k, m, residual)
+        kept = True
+    overhead, _, k, m, residual = best
+    header = FEC_HEADER_BYTES / mtu if m else 0.0
+    return {
+        "data_shard": k,
+        "parity_shard": m,
+        "residual_loss": residual,
+        "target_loss": target_loss,
+        "target_met": residual <= target_loss,
+        "parity_overhead": overhead,
+        "header_overhead": header,
+        "goodput_fraction": (k / (k + m)) * (1.0 - header) * (1.0 - residual),
+        "kept_current": kept,
+    }
+
+def probe_path_loss(host: str, udp_port: Optional[int] = None, count: int = PROBE_DEFAULT_COUNT,
+                    interval_ms: float = PROBE_DEFAULT_INTERVAL_MS) -> Dict[str, Any]:
+    """Loss/burst model of the round trip to host (UDP echo when a probe-echo port is given, else ICMP)."""
+    if udp_port:
+        trace = run_udp_probe_train(host, udp_port, count, interval_ms)
+        method = f"udp:{udp_port}"
+        if not any(trace):
+            raise RuntimeError(f"no echo from {host}:{udp_port} (is probe-echo running?); loss unknown")
+    else:
+        trace = run_icmp_probe_train(host, count, interval_ms)
+        method = "icmp"
+        if not any(trace):
+            raise RuntimeError(f"no ICMP replies from {host} (filtered or down); loss unknown")
+    model = estimate_gilbert_elliott(trace)
+    model.update(host=host, method=method, interval_ms=interval_ms)
+    return model
+
+def serve_probe_echo(port: int, bind: str = "0.0.0.0", duration: float = 0.0) -> int:
+    """UDP responder for run_udp_probe_train; echoes probe packets until Ctrl+C or `duration` seconds."""
+    family = socket.AF_INET6 if ":" in bind else socket.AF_INET
+    echoed = 0
+    with socket.socket(family, socket.SOCK_DGRAM) as sock:
+        sock.bind((bind, int(port)))
+        sock.settimeout(0.5)
+        end = time.monotonic() + duration if duration > 0 else None
+        while end is None or time.monotonic() < end:
+            try:
+                data, addr = sock.recvfrom(64)
+            except socket.timeout:
+                continue
+            if data[:4] == PROBE_MAGIC:
+                sock.sendto(data, addr)
+                echoed += 1
+    return echoed
+
+def cfg_fec_blocks(cfg: dict) -> List[str]:
+    """YAML blocks of a parsed config that carry data_shard/parity_shard."""
+    blocks = []
+    transports = {str(cfg.get("transport", ""))} | {str(p.get("transport", "")) for p in cfg.get("paths") or [] if isinstance(p, dict)}
+    if "kcp" in cfg or "kcpmux" in transports:
+        blocks.append("kcp")
+    if "rawsocket" in cfg or any(is_rawsocket_transport(t) for t in transports):
+        blocks.append("rawsocket")
+    return blocks
+
+def gilbert_model_from_rates(loss_rate: float, mean_burst: float = 1.0) -> Dict[str, float]:
+    """Gilbert model for an entered loss rate and mean burst length (no probing)."""
+    loss_rate = min(max(loss_rate, 0.0), 0.99)
+    r = 1.0 / max(mean_burst, 1.0)
+    p = loss_rate * r / (1.0 - loss_rate) if loss_rate else 0.0
+    return {"probes": 0, "lost": 1 if loss_rate else 0, "loss_rate": loss_rate, "p": p, "r": r,
+            "mean_burst": max(mean_burst, 1.0), "method": "entered"}
+
+def cfg_fec_shards(cfg: dict) -> Optional[tuple[int, int]]:
+    """(data_shard, parity_shard) of a parsed config's first FEC block, or None when it sets neither."""
+    for block in cfg_fec_blocks(cfg):
+        sec = cfg.get(block) or {}
+        if "data_shard" in sec or "parity_shard" in sec:
+            default = get_default_rawsocket_config(cfg.get("profile") or "balanced") if block == "rawsocket" else \
+                get_default_kcp_config(cfg.get("profile") or "balanced")
+            return (int(sec.get("data_shard", default["data_shard"])), int(sec.get("parity_shard", default["parity_shard"])))
+    return None
+
+def parse_fec_shards(text: str) -> tuple[int, int]:
+    """'10:3' -> (10, 3); both ends of a tunnel must use the same pair."""
+    m = re.fullmatch(r"\s*(\d+)\s*[:/]\s*(\d+)\s*", str(text))
+    if not m:
+        raise ValueError(f"FEC shards must be DATA:PARITY, got {text!r}")
+    k, par = int(m.group(1)), int(m.group(2))
+    if not (1 <= k <= FEC_MAX_DATA_SHARDS and 0 <= par <= FEC_MAX_PARITY_SHARDS):
+        raise ValueError(f"FEC shards out of range (data 1-{FEC_MAX_DATA_SHARDS}, parity 0-{FEC_MAX_PARITY_SHARDS}): {text!r}")
+    return k, par
+
+def fec_choice_writable(choice: Dict[str, Any]) -> bool:
+    """A new choice worth writing: FEC stays on and the target is met (otherwise keep what both sides have)."""
+    return not choice.get("kept_current") and choice["parity_shard"] > 0 and choice["target_met"]
+
+def fec_peer_command(choice: Dict[str, Any], peer: str = "PEER_TUNNEL") -> str:
+    """Command that puts the same shards on the other end (kcp-go FEC only decodes with matching shards)."""
+    return f"netrix-manager.py fec {peer} --shards {choice['data_shard']}:{choice['parity_shard']} --apply"
+
+def fec_to_cfg_overrides(choice: Dict[str, Any]) -> dict:
+    if not fec_choice_writable(choice):
+        return {}
+    shards = {"data_shard": choice["data_shard"], "parity_shard": choice["parity_shard"]}
+    return {"kcp_overrides": dict(shards), "rawsocket_overrides": dict(shards)}
+
+def configure_fec(cfg: dict) -> dict:
+    """
+    Wizard step for kcpmux/rawsocket: measure loss/burstiness to the peer and suggest FEC shards.
+    The probe is advisory (each end would measure something different); only shards the user
+    enters, the same on both wizards, are written.
+    """
+    transports = {cfg.get("transport", "")} | {p.get("transport", "") for p in cfg.get("paths") or []}
+    if not ({"kcpmux"} & transports or any(is_rawsocket_transport(t) for t in transports)):
+        return {}
+    print(f"\n  {BOLD}{FG_CYAN}FEC (loss-driven):{RESET}")
+    if not ask_yesno(f"  {BOLD}Choose FEC shards from measured packet loss?{RESET} {FG_WHITE}(otherwise profile defaults){RESET}", default=False):
+        return {}
+    peers = cfg_peer_addrs(cfg)
+    model = None
+    if peers:
+        host = _split_host_port(peers[0])[0]
+        print(f"  {FG_CYAN}Probing {host} ({PROBE_DEFAULT_COUNT} ICMP probes)...{RESET}")
+        try:
+            model = probe_path_loss(host)
+        except Exception as e:
+            c_warn(f"  Probe failed: {e}")
+    if model is None:
+        loss_pct = ask_int(f"  {BOLD}Expected loss (per mille, 10 = 1%):{RESET}", min_=0, max_=500, default=10) / 10.0
+        model = gilbert_model_from_rates(loss_pct / 100.0, 1.0)
+    choice = choose_fec_shards(model)
+    print_fec_choice(model, choice)
+    suggested = f"{choice['data_shard']}:{choice['parity_shard']}" if fec_choice_writable(choice) else "default"
+    while True:
+        answer = ask_nonempty(f"  {BOLD}Shards for both ends, DATA:PARITY or 'default' (enter the same on the peer):{RESET}",
+                              default=suggested).strip().lower()
+        if answer == "default":
+            print(f"  {FG_WHITE}Keeping the profile's default shards (same on both sides){RESET}")
+            return {}
+        try:
+            k, m = parse_fec_shards(answer)
+        except ValueError as e:
+            c_err(f"  {e}")
+            continue
+        shards = {"data_shard": k, "parity_shard": m}
+        return {"kcp_overrides": dict(shards), "rawsocket_overrides": dict(shards)}
+
+def print_fec_choice(model: Dict[str, Any], choice: Dict[str, Any]):
+    probes = f" probes={model['probes']} lost={model['lost']}" if model.get("probes") else ""
+    print(f"  {FG_WHITE}{model.get('method', '')}{probes} "
+          f"loss={model['loss_rate'] * 100:.2f}% mean burst={model['mean_burst']:.2f}{RESET}")
+    state = FG_GREEN if choice["target_met"] else FG_YELLOW
+    print(f"  {FG_CYAN}FEC:{RESET} data_shard={choice['data_shard']} parity_shard={choice['parity_shard']}  "
+          f"{state}residual={choice['residual_loss'] * 100:.4f}% (target {choice['target_loss'] * 100:.3f}%){RESET}")
+    print(f"  {FG_CYAN}Overhead:{RESET} parity {choice['parity_overhead'] * 100:.1f}% + header {choice['header_overhead'] * 100:.2f}%  "
+          f"→ goodput {choice['goodput_fraction'] * 100:.1f}% of link rate")
+    if choice.get("kept_current"):
+        print(f"  {FG_WHITE}Current shards kept: FEC parity only changes when both sides change together{RESET}")
+    if not choice["target_met"]:
+        c_warn("  Target residual loss not reachable within FEC limits; ARQ will carry the rest")
+
+# ========== Path MTU ==========
+IPV4_HEADER_BYTES = 20
+IPV6_HEADER_BYTES = 40
+UDP_HEADER_BYTES = 8
+TCP_HEADER_BYTES = 20
+ICMP_HEADER_BYTES = 8
+SMUX_HEADER_BYTES = 8
+AEAD_OVERHEAD_BYTES = 28            # 12-byte nonce + 16-byte tag per sealed frame
+NETRIX_FRAME_HEADER_BYTES = 4       # frame type + length ahead of padded payloads
+NL3X_HEADER_BYTES = 16              # conservative allowance for the L3 packet header
+L3_CARRIER_HEADER_BYTES = {"raw": 0, "icmp": ICMP_HEADER_BYTES, "udp": UDP_HEADER_BYTES, "pcap": UDP_HEADER_BYTES, "tcp": TCP_HEADER_BYTES}
+PMTU_MIN = {4: 576, 6: 1280}
+PMTU_AUTO_HYSTERESIS = 32           # bytes of extra headroom a re-probe must find before `pmtu: auto` raises MTUs
+# Linux socket option numbers (not all Python builds export them)
+IP_MTU_DISCOVER = getattr(socket, "IP_MTU_DISCOVER", 10)
+IP_PMTUDISC_DO = getattr(socket, "IP_PMTUDISC_DO", 2)
+IP_MTU = getattr(socket, "IP_MTU", 14)
+IPV6_MTU_DISCOVER = getattr(socket, "IPV6_MTU_DISCOVER", 23)
+IPV6_PMTUDISC_DO = getattr(socket, "IPV6_PMTUDISC_DO", 2)
+IPV6_MTU = getattr(socket, "IPV6_MTU", 24)
+
+def _ip_version(host: str) -> int:
+    try:
+        return ipaddress.ip_address(host).version
+    except ValueError:
+        try:
+            return 6 if socket.getaddrinfo(host, None)[0][0] == socket.AF_INET6 else 4
+        except OSError:
+            return 4
+
+def route_mtu(host: str) -> int:
+    """MTU of the interface the kernel routes `host` through (1500 if unknown)."""
+    try:
+        result = subprocess.run(["ip", "route", "get", host], capture_output=True, text=True, timeout=3)
+        m = re.search(r"\bdev (\S+)", result.stdout)
+        mtu_m = re.search(r"\bmtu (\d+)", result.stdout)
+        if mtu_m:
+            return int(mtu_m.group(1))
+        if m:
+            return int(_read_proc_text(f"/sys/class/net/{m.group(1)}/mtu") or 1500)
+    except Exception:
+        pass
+    return 1500
+
+def _binary_search_mtu(low: int, high: int, fits) -> int:
+    """Largest size in [low, high] for which fits(size) is True (low is assumed to fit)."""
+    while low < high:
+        mid = (low + high + 1) // 2
+        if fits(mid):
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+def _ping_df_fits(host: str, packet_size: int, version: int) -> bool:
+    payload = packet_size - (IPV6_HEADER_BYTES if version == 6 else IPV4_HEADER_BYTES) - ICMP_HEADER_BYTES
+    cmd = ["ping", "-6" if version == 6 else "-4", "-n", "-c", "1", "-W", "1", "-M", "do", "-s", str(payload), host]
+    for _ in range(2):
+        try:
+            if subprocess.run(cmd, capture_output=True, timeout=4).returncode == 0:
+                return True
+        except Exception:
+            return False
+    return False
+
+def _udp_df_socket(host: str, port: int, version: int):
+    family = socket.AF_INET6 if version == 6 else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    if version == 6:
+        sock.setsockopt(socket.IPPROTO_IPV6, IPV6_MTU_DISCOVER, IPV6_PMTUDISC_DO)
+    else:
+        sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+    sock.connect((host, int(port)))
+    return sock
+
+def _kernel_path_mtu(sock, version: int) -> Optional[int]:
+    try:
+        if version == 6:
+            return sock.getsockopt(socket.IPPROTO_IPV6, IPV6_MTU)
+        return sock.getsockopt(socket.IPPROTO_IP, IP_MTU)
+    except OSError:
+        return None
+
+def _udp_echo_fits(host: str, port: int, packet_size: int, version: int) -> bool:
+    """DF-set UDP datagram of packet_size bytes (IP total) echoed by probe-echo on the peer?"""
+    payload_len = packet_size - (IPV6_HEADER_BYTES if version == 6 else IPV4_HEADER_BYTES) - UDP_HEADER_BYTES
+    token = os.urandom(4)
+    try:
+        with _udp_df_socket(host, port, version) as sock:
+            sock.settimeout(0.8)
+            body = PROBE_MAGIC + token + b"\0\0\0\0"
+            for _ in range(2):
+                try:
+                    sock.send(body + b"\0" * max(0, payload_len - len(body)))
+                    while True:
+                        data = sock.recv(64)
+                        if data[:8] == PROBE_MAGIC + token:
+                            return True
+                except socket.timeout:
+                    continue
+                except OSError:
+                    return False
+    except OSError:
+        return False
+    return False
+
+def discover_path_mtu(host: str, method: str = "icmp", port: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Largest IP packet that reaches `host` unfragmented, by DF-set probes and binary search.
+    icmp: ping -M do; udp: DF datagrams echoed by probe-echo on `port`; tcp: kernel PMTU/MSS of a connection to `port`.
+    """
+    version = _ip_version(host)
+    high = route_mtu(host)
+    low = min(PMTU_MIN[version], high)
+    result = {"host": host, "method": method, "ip_version": version, "route_mtu": high}
+    if method == "icmp":
+        if not which("ping"):
+            raise RuntimeError("ping not found")
+        if not _ping_df_fits(host, low, version):
+            raise RuntimeError(f"{host} does not answer DF pings of {low} bytes (ICMP filtered?)")
+        result["path_mtu"] = _binary_search_mtu(low, high, lambda size: _ping_df_fits(host, size, version))
+    elif method == "udp":
+        if not port:
+            raise ValueError("udp PMTU probing needs the port of a probe-echo responder")
+        if not _udp_echo_fits(host, port, low, version):
+            raise RuntimeError(f"no echo from {host}:{port} (is probe-echo running?)")
+        result["path_mtu"] = _binary_search_mtu(low, high, lambda size: _udp_echo_fits(host, port, size, version))
+    elif method == "tcp":
+        if not port:
+            raise ValueError("tcp PMTU probing needs a listening TCP port on the peer")
+        family = socket.AF_INET6 if version == 6 else socket.AF_INET
+        with socket.socket(family, socket.SOCK_STREAM) as sock:
+            if version == 6:
+                sock.setsockopt(socket.IPPROTO_IPV6, IPV6_MTU_DISCOVER, IPV6_PMTUDISC_DO)
+            else:
+                sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+            sock.settimeout(5)
+            sock.connect((host, int(port)))
+            mss = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_MAXSEG)
+            kernel = _kernel_path_mtu(sock, version) or high
+        ip_header = IPV6_HEADER_BYTES if version == 6 else IPV4_HEADER_BYTES
+        result["mss"] = mss
+        result["path_mtu"] = min(kernel, mss + ip_header + TCP_HEADER_BYTES)
+    else:
+        raise ValueError(f"unknown PMTU method: {method}")
+    return result
+
+def compute_layer_mtus(path_mtu: int, cfg: Dict[str, Any], ip_version: int = 4) -> Dict[str, int]:
+    """
+    Consistent MTUs for every layer present in a parsed config, from the outer path MTU:
+    kcp.mtu / rawsocket.mtu = payload of one outer packet; tun.mtu = what still fits in one
+    segment after FEC, KCP, smux, AEAD, frame header and stealth padding; L3 fragment_size/tun.mtu
+    = outer packet minus carrier, NL3X header and AEAD.
+    """
+    ip_header = IPV6_HEADER_BYTES if ip_version == 6 else IPV4_HEADER_BYTES
+    transport = str(cfg.get("transport", ""))
+    transports = {transport} | {str(p.get("transport", "")) for p in cfg.get("paths") or [] if isinstance(p, dict)}
+    encryption = cfg.get("encryption") or {}
+    stealth = cfg.get("stealth") or {}
+    padding = int(stealth.get("padding_max", 0) or 0) if stealth.get("padding_enabled") else 0
+    inner_overhead = SMUX_HEADER_BYTES + NETRIX_FRAME_HEADER_BYTES + padding
+    if encryption.get("enabled"):
+        inner_overhead += AEAD_OVERHEAD_BYTES
+    mtus = {}
+
+    if transport == "l3":
+        l3 = cfg.get("l3") or {}
+        carrier = str(l3.get("carrier") or "raw").lower()
+        chunk = path_mtu - ip_header - L3_CARRIER_HEADER_BYTES.get(carrier, 0) - NL3X_HEADER_BYTES
+        if l3.get("enable_encryption", L3_KERNEL_DEFAULT_ENABLE_ENCRYPTION):
+            chunk -= AEAD_OVERHEAD_BYTES
+        chunk = max(256, chunk)
+        mtus["l3.fragment_size"] = chunk
+        mtus["tun.mtu"] = max(PMTU_MIN[4], chunk)
+        return mtus
+
+    segment_payloads = []
+    if "kcp" in cfg or "kcpmux" in transports:
+        kcp_mtu = path_mtu - ip_header - UDP_HEADER_BYTES
+        mtus["kcp.mtu"] = kcp_mtu
+        fec = FEC_HEADER_BYTES if int((cfg.get("kcp") or {}).get("parity_shard", 1) or 0) > 0 else 0
+        segment_payloads.append(kcp_mtu - fec - KCP_SEGMENT_OVERHEAD)
+    if "rawsocket" in cfg or any(is_rawsocket_transport(t) for t in transports):
+        raw_mtu = path_mtu - ip_header - TCP_HEADER_BYTES
+        mtus["rawsocket.mtu"] = raw_mtu
+        fec = FEC_HEADER_BYTES if int((cfg.get("rawsocket") or {}).get("parity_shard", RAWSOCKET_PARITY_SHARD) or 0) > 0 else 0
+        segment_payloads.append(raw_mtu - fec - KCP_SEGMENT_OVERHEAD)
+    tun = cfg.get("tun") or {}
+    if tun.get("enabled"):
+        if segment_payloads:
+            carried = min(segment_payloads)
+        else:
+            # stream transports: keep inner packets within one outer TCP segment
+            carried = path_mtu - ip_header - TCP_HEADER_BYTES
+        mtus["tun.mtu"] = max(PMTU_MIN[4], carried - inner_overhead)
+    return mtus
+
+def mtus_to_config_updates(mtus: Dict[str, int]) -> Dict[str, dict]:
+    updates: Dict[str, dict] = {}
+    for dotted, value in mtus.items():
+        block, key = dotted.split(".", 1)
+        updates.setdefault(block, {})[key] = value
+    return updates
+
+def cfg_pmtu_host(cfg: Dict[str, Any]) -> Optional[str]:
+    """Host to probe for a parsed config: l3.dst_ip for L3, otherwise the first peer address."""
+    if cfg.get("transport") == "l3":
+        return (cfg.get("l3") or {}).get("dst_ip") or None
+    peers = cfg_peer_addrs(cfg)
+    return _split_host_port(peers[0])[0] if peers else None
+
+def configure_path_mtu(config_path: Path) -> bool:
+    """Wizard step after a config is written: discover PMTU to the peer and rewrite MTUs of every layer."""
+    cfg = parse_yaml_config(config_path) or {}
+    host = cfg_pmtu_host(cfg)
+    if not host or not compute_layer_mtus(1500, cfg):
+        return False
+    print(f"\n  {BOLD}{FG_CYAN}Path MTU:{RESET}")
+    if not ask_yesno(f"  {BOLD}Discover path MTU to the peer and set MTUs?{RESET} {FG_WHITE}(DF ping probes){RESET}", default=False):
+        return False
+    try:
+        found = discover_path_mtu(host, "icmp")
+    except Exception as e:
+        c_warn(f"  PMTU discovery failed: {e}")
+        return False
+    mtus = compute_layer_mtus(found["path_mtu"], cfg, found["ip_version"])
+    print(f"  {FG_GREEN}Path MTU to {host}: {found['path_mtu']}{RESET}  " + "  ".join(f"{k}={v}" for k, v in mtus.items()))
+    return update_tunnel_config(config_path, mtus_to_config_updates(mtus))
+
+# ========== Path Evaluation ==========
+# Score each client path (handshake/RTT, loss, estimated goodput), then reorder paths and
+# split the connection pool so the best path carries the most connections.
+PATH_EVAL_PROBES = 100
+PATH_EVAL_MSS = 1400
+PATH_EVAL_MIN_LOSS = 1e-4           # Mathis bound needs a loss floor
+PATH_EVAL_HYSTERESIS = 0.15         # keep the current primary unless the best path beats it by 15%
+PATH_WATCH_INTERVAL = 300
+TLS_TRANSPORTS = ("tlsmux", "wssmux", "realitymux")
+
+def measure_tls_handshake_ms(host: str, port: int, sni: Optional[str] = None, count: int = 3,
+                             timeout: float = 3.0) -> Optional[float]:
+    """Median TCP connect + TLS handshake time (certificate not verified; only timing matters)."""
+    import ssl
+    ctx = ssl.create_default_context()
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+    samples = []
+    for _ in range(count):
+        t0 = time.perf_counter()
+        try:
+            with socket.create_connection((host, int(port)), timeout=timeout) as raw:
+                with ctx.wrap_socket(raw, server_hostname=sni or host):
+                    samples.append((time.perf_counter() - t0) * 1000.0)
+        except (OSError, ssl.SSLError):
+            continue
+    if not samples:
+        return None
+    samples.sort()
+    return samples[len(samples) // 2]
+
+def estimate_path_mbps(transport: str, rtt_ms: float, loss: float, cfg: dict) -> float:
+    """
+    Goodput ceiling for one path: window/RTT for kcpmux/rawsocket (ARQ with the configured window),
+    Mathis (MSS/RTT x 1.22/sqrt(loss)) capped by the smux receive window for TCP-based transports.
+    """
+    rtt = max(rtt_ms, 0.1) / 1000.0
+    profile = cfg.get("profile", "balanced")
+    if transport == "kcpmux":
+        kcp = {**get_default_kcp_config(profile), **(cfg.get("kcp") or {})}
+        return kcp["sndwnd"] * kcp["mtu"] * 8 / rtt * (1.0 - loss) / 1e6
+    if is_rawsocket_transport(transport):
+        raw = {**get_default_rawsocket_config(profile), **(cfg.get("rawsocket") or {})}
+        return raw["snd_wnd"] * raw["mtu"] * 8 / rtt * (1.0 - loss) / 1e6
+    mathis = PATH_EVAL_MSS * 8 / rtt * 1.22 / max(loss, PATH_EVAL_MIN_LOSS) ** 0.5
+    window = int((cfg.get("smux") or {}).get("max_recv") or get_default_smux_config(profile)["max_recv"]) * 8 / rtt
+    return min(mathis, window) / 1e6
+
+def evaluate_path(path: dict, cfg: dict, probes: int = PATH_EVAL_PROBES, udp_port: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Probe one path with its own transport where we can: TLS handshake for tlsmux/wssmux/realitymux,
+    TCP connect for tcpmux/wsmux. kcpmux/rawsocket use a probe-echo UDP port when given, else ICMP.
+    Loss comes from a probe train over the same method (ICMP for TCP-based paths). A path that only
+    failed ICMP/echo probes is marked `unknown`, not unreachable: that silence says nothing about the transport.
+    """
+    transport = str(path.get("transport") or cfg.get("transport") or "tcpmux")
+    host, port = _split_host_port(path.get("addr", ""))
+    target = str(path.get("edge_ip") or host)
+    result: Dict[str, Any] = {"addr": path.get("addr"), "transport": transport, "ok": False}
+    if transport in TLS_TRANSPORTS and port:
+        sni = ((path.get("reality") or {}).get("sni") if transport == "realitymux" else None) or host
+        handshake = measure_tls_handshake_ms(target, port, sni)
+        result.update(method="tls", handshake_ms=handshake)
+        rtt = handshake / 2.0 if handshake is not None else None      # TCP + TLS 1.3 = two round trips
+    elif transport in ("tcpmux", "wsmux") and port:
+        rtt = measure_rtt_ms(target, port)
+        result.update(method="tcp", handshake_ms=rtt)
+    elif udp_port:
+        try:
+            rtt = measure_udp_echo_rtt_ms(target, udp_port)
+        except OSError:
+            rtt = None
+        result.update(method=f"udp:{udp_port}", handshake_ms=None)
+    else:
+        rtt = measure_rtt_ms(target)
+        result.update(method="icmp", handshake_ms=None)
+    result["rtt_ms"] = round(rtt, 2) if rtt is not None else None
+    if result["handshake_ms"] is not None:
+        result["handshake_ms"] = round(result["handshake_ms"], 2)
+    try:
+        echo_port = udp_port if result["method"].startswith("udp") else None
+        loss = probe_path_loss(target, echo_port, count=probes)["loss_rate"]
+    except Exception:
+        loss = None
+    result["loss_pct"] = round(loss * 100.0, 2) if loss is not None else None
+    if rtt is None:
+        if result["method"] in ("tls", "tcp"):
+            result["error"] = "unreachable"
+        else:
+            result.update(unknown=True, error=f"no {result['method']} replies (filtered?); state unknown")
+        return result
+    result["est_mbps"] = round(estimate_path_mbps(transport, rtt, loss or 0.0, cfg), 1)
+    result["ok"] = True
+    return result
+
+def evaluate_paths(cfg: dict, probes: int = PATH_EVAL_PROBES, udp_port: Optional[int] = None) -> List[Dict[str, Any]]:
+    """evaluate_path() for every client path at once, so all paths see the same moment of the network."""
+    import threading
+    paths = [p for p in cfg.get("paths") or [] if isinstance(p, dict) and p.get("addr")]
+    results: List[Dict[str, Any]] = [{} for _ in paths]
+
+    def run(i, path):
+        results[i] = dict(evaluate_path(path, cfg, probes, udp_port), index=i,
+                          connection_pool=int(path.get("connection_pool") or 8))
+
+    threads = [threading.Thread(target=run, args=(i, p)) for i, p in enumerate(paths)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+def plan_path_weights(results: List[Dict[str, Any]], total_pool: Optional[int] = None,
+                      hysteresis: float = PATH_EVAL_HYSTERESIS) -> Dict[str, Any]:
+    """
+    New path order (best estimated goodput first, unreachable last) and connection_pool per path
+    in proportion to estimated goodput (largest remainder, at least 1 each). The current primary
+    stays first while it is within `hysteresis` of the best path. `unknown` paths keep their
+    position and pool; the others are ranked around them.
+    """
+    total_pool = max(total_pool or sum(r["connection_pool"] for r in results), len(results))
+    usable = sorted((r for r in results if r.get("ok")), key=lambda r: (-r["est_mbps"], r["rtt_ms"]))
+    if usable and results[0].get("ok") and usable[0] is not results[0] \
+            and results[0]["est_mbps"] >= usable[0]["est_mbps"] * (1.0 - hysteresis):
+        usable.remove(results[0])
+        usable.insert(0, results[0])
+    ranked = iter([r["index"] for r in usable] + [r["index"] for r in results if not r.get("ok") and not r.get("unknown")])
+    order = [r["index"] if r.get("unknown") else next(ranked) for r in results]
+    pools = {r["index"]: r["connection_pool"] if r.get("unknown") else 1 for r in results}
+    spare = total_pool - sum(pools.values())
+    total_mbps = sum(r["est_mbps"] for r in usable)
+    if usable and spare > 0 and total_mbps > 0:
+        shares = {r["index"]: spare * r["est_mbps"] / total_mbps for r in usable}
+        extra = {i: int(v) for i, v in shares.items()}
+        leftover = spare - sum(extra.values())
+        for i in sorted(shares, key=lambda i: shares[i] - extra[i], reverse=True)[:leftover]:
+            extra[i] += 1
+        for i, n in extra.items():
+            pools[i] += n
+    elif spare > 0:
+        for r in results:
+            pools[r["index"]] = r["connection_pool"]
+    return {"order": order, "pools": pools, "total_pool": total_pool}
+
+def path_plan_differs(results: List[Dict[str, Any]], plan: Dict[str, Any], min_pool_change: float = 0.25) -> bool:
+    """True when the order changes or some pool moves by >= 2 connections and >= min_pool_change."""
+    if plan["order"] != [r["index"] for r in results]:
+        return True
+    for r in results:
+        old, new = r["connection_pool"], plan["pools"][r["index"]]
+        if abs(new - old) >= 2 and abs(new - old) >= min_pool_change * old:
+            return True
+    return False
+
+# ========== CPU Capabilities ==========
+CPU_FEATURE_FLAGS = ("aes", "pclmulqdq", "avx", "avx2", "avx512f", "vaes", "vpclmulqdq", "sha_ni",
+                     "asimd", "neon", "pmull", "sha1", "sha2")
+CPU_BENCH_SECONDS = 0.05            # per candidate; the whole probe stays well under a second
+CPU_BENCH_PAYLOAD_BYTES = 16 * 1024
+COMPRESSION_SAVING_SHARE = 0.9      # prefer the fastest codec that keeps 90% of the best byte saving
+_CPU_PROFILE: Optional[Dict[str, Any]] = None
+
+def read_cpu_flags() -> Dict[str, Any]:
+    """Architecture and crypto/SIMD feature flags from /proc/cpuinfo (x86 'flags', arm64 'Features')."""
+    arch = platform.machine().lower()
+    flags: set = set()
+    model = ""
+    try:
+        with open("/proc/cpuinfo", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                key = key.strip().lower()
+                if key in ("flags", "features") and not flags:
+                    flags = set(value.split())
+                elif key in ("model name", "hardware", "cpu model") and not model:
+                    model = value.strip()
+    except OSError:
+        pass
+    arm = arch.startswith(("aarch64", "arm"))
+    return {
+        "arch": arch,
+        "model": model,
+        "cpus": os.cpu_count() or 1,
+        "flags": sorted(flags.intersection(CPU_FEATURE_FLAGS)),
+        # GCM is only fast (and constant-time) with hardware AES plus carry-less multiply
+        "aes_gcm_hw": "aes" in flags and ("pmull" in flags if arm else "pclmulqdq" in flags),
+        "simd": bool(flags & {"asimd", "neon"}) if arm else "avx2" in flags,
+    }
+
+def _bench_mbps(fn, size: int) -> float:
+    """MB/s of fn() processing `size` bytes, over roughly CPU_BENCH_SECONDS."""
+    fn()
+    rounds = 0
+    t0 = time.perf_counter()
+    deadline = t0 + CPU_BENCH_SECONDS
+    while True:
+        fn()
+        rounds += 1
+        now = time.perf_counter()
+        if now >= deadline:
+            break
+    return round(rounds * size / (now - t0) / 1e6, 1)
+
+def _bench_sample_payload(size: int = CPU_BENCH_PAYLOAD_BYTES) -> bytes:
+    """Deterministic HTTP/JSON-like payload, compressible the way plaintext API traffic is."""
+    import random
+    rng = random.Random(1)
+    lines = []
+    total = 0
+    while total < size:
+        line = (f'{{"id":{rng.randint(1, 10**9)},"user":"u{rng.randint(1, 5000)}","ts":{1700000000 + rng.randint(0, 10**6)},'
+                f'"path":"/api/v1/items/{rng.randint(1, 999)}","status":{rng.choice((200, 200, 204, 304, 404))},'
+                f'"token":"{rng.getrandbits(64):016x}"}}\n')
+        lines.append(line)
+        total += len(line)
+    return "".join(lines).encode()[:size]
+
+def bench_aead() -> Dict[str, float]:
+    """Encrypt throughput (MB/s) of both AEADs; empty when the cryptography package is missing."""
+    try:
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+    except ImportError:
+        return {}
+    payload = os.urandom(CPU_BENCH_PAYLOAD_BYTES)
+    nonce = bytes(12)   # throwaway key, so nonce reuse is harmless here
+    results = {}
+    for name, cls in (("chacha", ChaCha20Poly1305), ("aes-gcm", AESGCM)):
+        aead = cls(os.urandom(32))
+        results[name] = _bench_mbps(lambda: aead.encrypt(nonce, payload, None), len(payload))
+    return results
+
+def _compression_candidates() -> List[tuple]:
+    """(algorithm, level, compress_fn) for every codec whose Python binding is installed."""
+    candidates = []
+    try:
+        import lz4.block
+        candidates.append(("lz4", 0, lambda data: lz4.block.compress(data, store_size=False)))
+    except ImportError:
+        pass
+    try:
+        import snappy
+        candidates.append(("snappy", 0, snappy.compress))
+    except ImportError:
+        pass
+    try:
+        import zstandard
+        for level in (1, 3, 6):
+            candidates.append(("zstd", level, zstandard.ZstdCompressor(level=level).compress))
+    except ImportError:
+        pass
+    return candidates
+
+def bench_compression() -> List[Dict[str, Any]]:
+    """Compress throughput and ratio of each installed codec on the sample payload."""
+    payload = _bench_sample_payload()
+    results = []
+    for algorithm, level, compress in _compression_candidates():
+        try:
+            ratio = len(compress(payload)) / len(payload)
+            mbps = _bench_mbps(lambda: compress(payload), len(payload))
+        except Exception:
+            continue
+        results.append({"algorithm": algorithm, "level": level, "mbps": mbps, "ratio": round(ratio, 3)})
+    return results
+
+def recommend_encryption(cpu: Dict[str, Any], aead: Dict[str, float]) -> Dict[str, Any]:
+    if aead and cpu["aes_gcm_hw"]:
+        algorithm = max(aead, key=aead.get)
+        reason = f"benchmark: aes-gcm {aead['aes-gcm']} MB/s, chacha {aead['chacha']} MB/s"
+    elif cpu["aes_gcm_hw"]:
+        algorithm, reason = "aes-gcm", "hardware AES + carry-less multiply"
+    else:
+        algorithm, reason = "chacha", "no hardware AES-GCM; ChaCha20 is faster and constant-time in software"
+    return {"algorithm": algorithm, "reason": reason}
+
+def recommend_compression(cpu: Dict[str, Any], results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    if not results:
+        return {"algorithm": "lz4", "level": 0, "reason": "no codec bindings to benchmark; LZ4 is the cheapest codec on any CPU"}
+    if cpu["cpus"] <= 1:
+        best = max(results, key=lambda r: r["mbps"])
+        return {"algorithm": best["algorithm"], "level": best["level"], "reason": f"single core: fastest codec ({best['mbps']} MB/s)"}
+    best_saving = max(1.0 - r["ratio"] for r in results)
+    good = [r for r in results if 1.0 - r["ratio"] >= COMPRESSION_SAVING_SHARE * best_saving] or results
+    best = max(good, key=lambda r: r["mbps"])
+    return {"algorithm": best["algorithm"], "level": best["level"],
+            "reason": f"fastest codec within {int(COMPRESSION_SAVING_SHARE * 100)}% of best saving "
+                      f"({best['mbps']} MB/s, ratio {best['ratio']})"}
+
+def cpu_capability_profile(refresh: bool = False) -> Dict[str, Any]:
+    """CPU flags, AEAD/compression microbenchmarks and the resulting recommendations (cached per run)."""
+    global _CPU_PROFILE
+    if _CPU_PROFILE is None or refresh:
+        cpu = read_cpu_flags()
+        aead = bench_aead()
+        compression = bench_compression()
+        _CPU_PROFILE = {
+            "cpu": cpu,
+            "aead": aead,
+            "compression": compression,
+            "recommended_encryption": recommend_encryption(cpu, aead),
+            "recommended_compression": recommend_compression(cpu, compression),
+        }
+    return _CPU_PROFILE
+
+def print_cpu_profile(profile: Dict[str, Any]) -> None:
+    cpu = profile["cpu"]
+    print(f"  {BOLD}CPU:{RESET} {FG_WHITE}{cpu['model'] or cpu['arch']}{RESET} ({cpu['arch']}, {cpu['cpus']} cores)")
+    print(f"  {BOLD}Flags:{RESET} {FG_WHITE}{' '.join(cpu['flags']) or '-'}{RESET}")
+    for name, mbps in profile["aead"].items():
+        print(f"    {name:<8} {mbps:>8} MB/s")
+    for r in profile["compression"]:
+        label = f"{r['algorithm']}" + (f"-{r['level']}" if r["level"] else "")
+        print(f"    {label:<8} {r['mbps']:>8} MB/s  ratio {r['ratio']}")
+    enc, comp = profile["recommended_encryption"], profile["recommended_compression"]
+    print(f"  {FG_GREEN}Encryption:{RESET} {enc['algorithm']}  {FG_WHITE}({enc['reason']}){RESET}")
+    level = f" level {comp['level']}" if comp["level"] else ""
+    print(f"  {FG_GREEN}Compression:{RESET} {comp['algorithm']}{level}  {FG_WHITE}({comp['reason']}){RESET}")
+
+# ========== Compressibility Sampling ==========
+SAMPLE_DEFAULT_SECONDS = 10
+SAMPLE_MAX_PACKETS = 20000
+SAMPLE_MAX_KEPT_BYTES = 8 * 1024 * 1024     # payloads kept for codec trials
+SAMPLE_MIN_PACKETS = 50
+SAMPLE_HIGH_ENTROPY_BITS = 7.5              # bits/byte; TLS, media and already-compressed data sit above this
+SAMPLE_MIN_BUCKET_SAVING = 0.10             # a size bucket is worth compressing above 10% saving
+SAMPLE_MIN_TOTAL_SAVING = 0.05              # below 5% of all bytes, compression only burns CPU
+SAMPLE_SIZE_BUCKETS = ((0, 256), (256, 512), (512, 1024), (1024, 4096), (4096, 16384), (16384, 65536), (65536, 0))
+ETH_P_ALL = 0x0003
+PACKET_OUTGOING = 4
+
+def byte_entropy(data: bytes) -> float:
+    """Shannon entropy in bits per byte."""
+    if not data:
+        return 0.0
+    import math
+    from collections import Counter
+    n = len(data)
+    return -sum(c / n * math.log2(c / n) for c in Counter(data).values())
+
+def _packet_l4_payload(frame: bytes, hatype: int) -> Optional[tuple]:
+    """(proto, sport, dport, payload) of a TCP/UDP frame captured on AF_PACKET, else None."""
+    offset = 0
+    if hatype in (1, 772):          # ARPHRD_ETHER, ARPHRD_LOOPBACK
+        if len(frame) < 14:
+            return None
+        ethertype = int.from_bytes(frame[12:14], "big")
+        offset = 14
+        if ethertype == 0x8100 and len(frame) >= 18:
+            ethertype = int.from_bytes(frame[16:18], "big")
+            offset = 18
+        if ethertype not in (0x0800, 0x86DD):
+            return None
+    if len(frame) <= offset:
+        return None
+    version = frame[offset] >> 4
+    if version == 4:
+        ihl = (frame[offset] & 0x0F) * 4
+        if int.from_bytes(frame[offset + 6:offset + 8], "big") & 0x1FFF:
+            return None             # non-first fragment, no L4 header
+        proto = frame[offset + 9]
+        end = offset + int.from_bytes(frame[offset + 2:offset + 4], "big")
+        l4 = offset + ihl
+    elif version == 6:
+        proto = frame[offset + 6]
+        end = offset + 40 + int.from_bytes(frame[offset + 4:offset + 6], "big")
+        l4 = offset + 40
+    else:
+        return None
+    if proto == 6 and len(frame) >= l4 + 20:
+        data_start = l4 + (frame[l4 + 12] >> 4) * 4
+    elif proto == 17 and len(frame) >= l4 + 8:
+        data_start = l4 + 8
+    else:
+        return None
+    sport = int.from_bytes(frame[l4:l4 + 2], "big")
+    dport = int.from_bytes(frame[l4 + 2:l4 + 4], "big")
+    return ("tcp" if proto == 6 else "udp", sport, dport, frame[data_start:min(end, len(frame))])
+
+def capture_port_payloads(ports: Dict[str, set], seconds: float = SAMPLE_DEFAULT_SECONDS,
+                          interface: Optional[str] = None, max_packets: int = SAMPLE_MAX_PACKETS) -> List[bytes]:
+    """Payloads of TCP/UDP packets to or from the given ports, captured locally with AF_PACKET."""
+    if not hasattr(socket, "AF_PACKET"):
+        raise RuntimeError("AF_PACKET capture needs Linux")
+    try:
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+    except PermissionError:
+        raise RuntimeError("packet capture needs root (CAP_NET_RAW)")
+    payloads: List[bytes] = []
+    kept = 0
+    with sock:
+        if interface:
+            sock.bind((interface, 0))
+        sock.settimeout(0.5)
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline and len(payloads) < max_packets and kept < SAMPLE_MAX_KEPT_BYTES:
+            try:
+                frame, addr = sock.recvfrom(262144)
+            except socket.timeout:
+                continue
+            if addr[0] == "lo" and addr[2] == PACKET_OUTGOING:
+                continue            # loopback frames are seen twice
+            parsed = _packet_l4_payload(frame, addr[3])
+            if not parsed or not parsed[3]:
+                continue
+            proto, sport, dport, payload = parsed
+            if sport in ports.get(proto, ()) or dport in ports.get(proto, ()):
+                payloads.append(payload)
+                kept += len(payload)
+    return payloads
+
+def _size_bucket(size: int) -> tuple:
+    for low, high in SAMPLE_SIZE_BUCKETS:
+        if size >= low and (not high or size < high):
+            return low, high
+    return SAMPLE_SIZE_BUCKETS[-1]
+
+def analyze_payloads(payloads: List[bytes]) -> Dict[str, Any]:
+    """Size/entropy statistics and per-codec, per-size-bucket compression ratio of captured payloads."""
+    import zlib
+    sizes = sorted(len(p) for p in payloads)
+    total = sum(sizes)
+    stats: Dict[str, Any] = {"packets": len(sizes), "bytes": total}
+    if not sizes:
+        return stats
+    entropies = [byte_entropy(p) for p in payloads]
+    stats["size_p50"] = sizes[len(sizes) // 2]
+    stats["size_p90"] = sizes[int(len(sizes) * 0.9)]
+    stats["size_max"] = sizes[-1]
+    stats["entropy_bits"] = round(sum(e * len(p) for e, p in zip(entropies, payloads)) / total, 2)
+    stats["high_entropy_share"] = round(sum(len(p) for e, p in zip(entropies, payloads) if e >= SAMPLE_HIGH_ENTROPY_BITS) / total, 3)
+    codecs = [(f"{a}-{lvl}" if lvl else a, fn) for a, lvl, fn in _compression_candidates()]
+    codecs.append(("deflate-1", lambda data: zlib.compress(data, 1)))   # stdlib proxy, always available
+    stats["codecs"] = {}
+    for name, compress in codecs:
+        buckets: Dict[tuple, list] = {}
+        for p in payloads:
+            entry = buckets.setdefault(_size_bucket(len(p)), [0, 0])
+            entry[0] += len(p)
+            entry[1] += min(len(p), len(compress(p)))   # incompressible frames are sent raw
+        stats["codecs"][name] = {
+            "ratio": round(sum(c for _, c in buckets.values()) / total, 3),
+            "buckets": [{"min": lo, "max": hi, "bytes": b, "ratio": round(c / b, 3)} for (lo, hi), (b, c) in sorted(buckets.items())],
+        }
+    return stats
+
+def recommend_compression_from_sample(stats: Dict[str, Any]) -> Dict[str, Any]:
+    """compression block (enabled/algorithm/level/min_size/max_size) justified by a traffic sample."""
+    if stats.get("packets", 0) < SAMPLE_MIN_PACKETS:
+        return {"reason": f"only {stats.get('packets', 0)} payload packets captured; generate traffic and sample again"}
+    codec_rec = cpu_capability_profile()["recommended_compression"]
+    name = f"{codec_rec['algorithm']}-{codec_rec['level']}" if codec_rec["level"] else codec_rec["algorithm"]
+    estimator = name if name in stats["codecs"] else "deflate-1"
+    buckets = stats["codecs"][estimator]["buckets"]
+    useful = [b for b in buckets if 1.0 - b["ratio"] >= SAMPLE_MIN_BUCKET_SAVING]
+    saved = sum(b["bytes"] * (1.0 - b["ratio"]) for b in useful)
+    if saved < SAMPLE_MIN_TOTAL_SAVING * stats["bytes"]:
+        return {"enabled": False, "algorithm": "none", "level": 0, "min_size": 0, "max_size": 0,
+                "reason": f"{estimator} would save {saved / stats['bytes']:.1%} of bytes "
+                          f"({stats['high_entropy_share']:.0%} high-entropy)"}
+    high = max(b["max"] for b in useful) if all(b["max"] for b in useful) else 65536
+    return {
+        "enabled": True,
+        "algorithm": codec_rec["algorithm"],
+        "level": codec_rec["level"],
+        "min_size": max(128, min(b["min"] for b in useful)),
+        "max_size": _clamp(high, 1024, 131072),
+        "reason": f"{estimator} saves {saved / stats['bytes']:.1%} of bytes in {len(useful)}/{len(buckets)} size buckets",
+    }
+
+def print_compressibility(stats: Dict[str, Any], rec: Dict[str, Any]) -> None:
+    if stats.get("packets"):
+        print(f"  {FG_WHITE}{stats['packets']} packets, {format_bytes(stats['bytes'])}, size p50/p90/max "
+              f"{stats['size_p50']}/{stats['size_p90']}/{stats['size_max']}, entropy {stats['entropy_bits']} bits/byte, "
+              f"{stats['high_entropy_share']:.0%} high-entropy{RESET}")
+        for name, codec in stats["codecs"].items():
+            print(f"    {name:<10} ratio {codec['ratio']}")
+    if "enabled" not in rec:
+        c_warn(f"  {rec['reason']}")
+    elif rec["enabled"]:
+        level = f" level {rec['level']}" if rec["level"] else ""
+        print(f"  {FG_GREEN}compression:{RESET} {rec['algorithm']}{level} min_size={rec['min_size']} max_size={rec['max_size']}  "
+              f"{FG_WHITE}({rec['reason']}){RESET}")
+    else:
+        print(f"  {FG_YELLOW}compression: disable{RESET}  {FG_WHITE}({rec['reason']}){RESET}")
+
+# ========== Memory Budget ==========
+MEM_BASE_BYTES = 24 * 1024 * 1024       # Go runtime, binary and goroutine stacks of an idle tunnel
+MEM_STREAM_BYTES = 16 * 1024            # per open stream: goroutines + smux stream state
+MEM_L3_SLOT_BYTES = 2048                # one MTU-sized packet buffer per queued L3 packet
+MEM_L3_DEFAULT_CHANNEL = 15000          # engine default when l3.channel_size is 0
+MEM_L3_DEFAULT_BATCH = 64
+MEM_TYPICAL_FILL = 0.25                 # share of worst-case buffers a busy tunnel usually holds
+MEM_DEFAULT_STREAMS = 1000              # concurrent streams assumed per tunnel
+MEM_BUDGET_SHARE = 0.8                  # leave 20% of the budget to the kernel and the rest of the box
+MEM_DEFAULT_POOL = 8                    # peer connection_pool assumed for server-side sessions
+
+def _cfg_int(block: dict, key: str, default: int) -> int:
+    try:
+        value = int(block.get(key, default) or 0)
+    except (TypeError, ValueError):
+        return default
+    return value if value > 0 else default
+
+def estimate_tunnel_memory(cfg: Dict[str, Any], streams: int = MEM_DEFAULT_STREAMS) -> Dict[str, Any]:
+    """
+    Worst-case and typical RSS of one tunnel from its parsed YAML, by component.
+    kernel = socket buffers the tunnel may pin (counted against MemAvailable, not RSS).
+    """
+    transport = str(cfg.get("transport", "tcpmux"))
+    adv = cfg.get("advanced") or {}
+    components: Dict[str, int] = {}
+    kernel = 0
+    if transport == "l3":
+        l3 = cfg.get("l3") or {}
+        channel = _cfg_int(l3, "channel_size", MEM_L3_DEFAULT_CHANNEL)
+        batch = _cfg_int(l3, "batch_size", MEM_L3_DEFAULT_BATCH)
+        components["l3.channel_size"] = 2 * channel * MEM_L3_SLOT_BYTES
+        components["l3.batch_size"] = 2 * (os.cpu_count() or 1) * batch * MEM_L3_SLOT_BYTES
+        kernel = _cfg_int(l3, "so_sndbuf", 0) + _cfg_int(l3, "so_rcvbuf", 0)
+    else:
+        smux = cfg.get("smux") or {}
+        mux_con = _cfg_int(smux, "mux_con", 8)
+        pools = [_cfg_int(p, "connection_pool", MEM_DEFAULT_POOL) for p in cfg.get("paths") or [] if isinstance(p, dict)]
+        if cfg.get("direct") and cfg.get("connect"):
+            pools.append(_cfg_int(cfg, "connection_pool", MEM_DEFAULT_POOL))
+        sessions = sum(pools) * mux_con if pools else _cfg_int(cfg, "max_sessions", MEM_DEFAULT_POOL * mux_con)
+        components["smux.max_recv"] = sessions * _cfg_int(smux, "max_recv", 4194304)
+        components["streams"] = streams * MEM_STREAM_BYTES
+        # both pool sizes are bytes per pooled buffer: each stream copies through one large buffer per direction,
+        # each session reads frames through one regular buffer per direction (not suggested: sizes, not counts)
+        components["buffer pools"] = (streams * 2 * _cfg_int(adv, "large_buffer_pool_size", DEFAULT_LARGE_BUFFER_POOL_SIZE)
+                                      + sessions * 2 * _cfg_int(adv, "buffer_pool_size", DEFAULT_BUFFER_POOL_SIZE))
+        if cfg.get("udp_ports") or cfg.get("paths") or cfg.get("mode") == "client":
+            components["advanced.max_udp_flows"] = _cfg_int(adv, "max_udp_flows", 5000) * _cfg_int(adv, "udp_frame_pool_size", DEFAULT_UDP_FRAME_POOL_SIZE)
+        for block_name in ("kcp", "rawsocket"):
+            block = cfg.get(block_name) or {}
+            if block and (block_name in transport or (block_name == "rawsocket" and is_rawsocket_transport(transport))):
+                wnd = _cfg_int(block, "sndwnd", _cfg_int(block, "snd_wnd", 1024)) + _cfg_int(block, "rcvwnd", _cfg_int(block, "rcv_wnd", 1024))
+                components[f"{block_name} windows"] = sessions * wnd * _cfg_int(block, "mtu", 1350)
+        limits = read_host_buffer_limits()
+        rmem, wmem = limits.get("rmem_max") or 1 << 62, limits.get("wmem_max") or 1 << 62
+        if transport.startswith(("kcp", "raw")):
+            kernel = len(pools or [1]) * (min(_cfg_int(adv, "udp_read_buffer", 4194304), rmem) + min(_cfg_int(adv, "udp_write_buffer", 4194304), wmem))
+        else:
+            kernel = sessions * (min(_cfg_int(adv, "tcp_read_buffer", 8388608), rmem) + min(_cfg_int(adv, "tcp_write_buffer", 8388608), wmem))
+    worst = MEM_BASE_BYTES + sum(components.values())
+    return {
+        "worst": worst,
+        "typical": MEM_BASE_BYTES + int(sum(components.values()) * MEM_TYPICAL_FILL),
+        "kernel": kernel,
+        "components": components,
+    }
+
+def read_memory_budget() -> Dict[str, int]:
+    """MemTotal/MemAvailable and the cgroup memory limit (0 when unlimited), in bytes."""
+    info = {}
+    for line in _read_proc_text("/proc/meminfo").splitlines():
+        key, _, value = line.partition(":")
+        if key in ("MemTotal", "MemAvailable") and value.split():
+            info[key] = int(value.split()[0]) * 1024
+    limit = 0
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        text = _read_proc_text(path)
+        if text.isdigit():
+            limit = int(text)
+            if limit >= info.get("MemTotal", 1 << 62):
+                limit = 0       # v1 reports "unlimited" as a huge number
+            break
+    return {"total": info.get("MemTotal", 0), "available": info.get("MemAvailable", 0), "cgroup_limit": limit}
+
+def process_rss(pid: Optional[int]) -> Dict[str, int]:
+    """Current and peak RSS of a process from /proc/PID/status, in bytes."""
+    out = {}
+    if pid:
+        for line in _read_proc_text(f"/proc/{pid}/status").splitlines():
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "VmHWM") and value.split():
+                out["rss" if key == "VmRSS" else "peak"] = int(value.split()[0]) * 1024
+    return out
+
+def _scale_suggestion(key: str, value: int, factor: float) -> int:
+    floors = {"smux.max_recv": 1048576, "advanced.max_udp_flows": 256, "l3.channel_size": 1024, "l3.batch_size": 8}
+    scaled = int(value * factor)
+    return max(floors.get(key, 1), 1 << max(0, scaled.bit_length() - 1))   # round down to a power of two
+
+def memory_suggestions(cfg: Dict[str, Any], estimate: Dict[str, Any], target_bytes: int) -> Dict[str, dict]:
+    """update_tunnel_config() updates that bring the worst case under target_bytes, largest safe values first."""
+    tunable = {k: v for k, v in estimate["components"].items() if "." in k}
+    excess = estimate["worst"] - target_bytes
+    if excess <= 0 or not tunable:
+        return {}
+    shrinkable = sum(tunable.values())
+    factor = max(0.0, 1.0 - excess / shrinkable) if shrinkable else 0.0
+    updates: Dict[str, dict] = {}
+    defaults = {"l3.channel_size": MEM_L3_DEFAULT_CHANNEL, "l3.batch_size": MEM_L3_DEFAULT_BATCH,
+                "smux.max_recv": 4194304, "advanced.max_udp_flows": 5000}
+    for dotted in tunable:
+        block, key = dotted.split(".", 1)
+        current = _cfg_int(cfg.get(block) or {}, key, defaults.get(dotted, 0))
+        suggested = _scale_suggestion(dotted, current, factor)
+        if suggested < current:
+            updates.setdefault(block, {})[key] = suggested
+    return updates
+
+def check_memory_budget(config_paths: List[Path], streams: int = MEM_DEFAULT_STREAMS) -> Dict[str, Any]:
+    """Estimate every tunnel, compare the fleet total with the memory budget and attach measured RSS and suggestions."""
+    budget = read_memory_budget()
+    states = get_services_state(config_paths)
+    tunnels = []
+    for path in config_paths:
+        cfg = parse_yaml_config(path) or {}
+        est = estimate_tunnel_memory(cfg, streams)
+        est["stem"] = path.stem
+        est["measured"] = process_rss((states.get(path.stem) or (None, None))[1])
+        tunnels.append((path, cfg, est))
+    running_rss = sum(est["measured"].get("rss", 0) for _, _, est in tunnels)
+    # running tunnels already hold their RSS, so it is part of what they may use
+    limit = budget["available"] + running_rss
+    if budget["cgroup_limit"]:
+        limit = min(limit, budget["cgroup_limit"])
+    usable = int(limit * MEM_BUDGET_SHARE)
+    worst_total = sum(est["worst"] + est["kernel"] for _, _, est in tunnels)
+    for path, cfg, est in tunnels:
+        share = usable * (est["worst"] + est["kernel"]) // worst_total if worst_total else usable
+        est["suggest"] = memory_suggestions(cfg, est, share - est["kernel"]) if worst_total > usable else {}
+        measured = est["measured"].get("peak", 0)
+        est["model_low"] = bool(measured and measured > est["worst"])
+    return {
+        "budget": budget,
+        "usable": usable,
+        "worst_total": worst_total,
+        "typical_total": sum(est["typical"] + est["kernel"] for _, _, est in tunnels),
+        "over_budget": worst_total > usable,
+        "tunnels": [est for _, _, est in tunnels],
+    }
+
+def print_memory_report(report: Dict[str, Any]) -> None:
+    for est in report["tunnels"]:
+        measured = est["measured"]
+        rss = f"  rss {format_bytes(measured['rss'])} (peak {format_bytes(measured.get('peak', 0))})" if measured.get("rss") else ""
+        print(f"  {BOLD}{est['stem']}{RESET}: worst {format_bytes(est['worst'])}, typical {format_bytes(est['typical'])}, "
+              f"kernel {format_bytes(est['kernel'])}{rss}" + (" (config updated)" if est.get("config_changed") else ""))
+        for key, value in sorted(est["components"].items(), key=lambda kv: -kv[1]):
+            print(f"    {key:<24} {format_bytes(value)}")
+        if est["model_low"]:
+            c_warn(f"    peak RSS exceeds the modelled worst case")
+        for block, values in est["suggest"].items():
+            print(f"    {FG_YELLOW}suggest{RESET} " + "  ".join(f"{block}.{k}={v}" for k, v in values.items()))
+    budget = report["budget"]
+    cgroup = f", cgroup limit {format_bytes(budget['cgroup_limit'])}" if budget["cgroup_limit"] else ""
+    line = (f"  fleet worst {format_bytes(report['worst_total'])}, typical {format_bytes(report['typical_total'])} / "
+            f"usable {format_bytes(report['usable'])} (MemAvailable {format_bytes(budget['available'])}{cgroup})")
+    if report["over_budget"]:
+        c_err(line + " - over budget")
+    else:
+        c_ok(line)
+
+def warn_memory_budget(config_path: Path) -> None:
+    """Wizard check after a config is written: warn when the fleet's worst case no longer fits in RAM."""
+    try:
+        paths = sorted({it["config_path"] for it in list_tunnels()} | {config_path}, key=lambda p: p.stem)
+        report = check_memory_budget(paths)
+    except Exception:
+        return
+    if not report["over_budget"]:
+        return
+    c_warn(f"  ⚠️ Worst-case memory of all tunnels ({format_bytes(report['worst_total'])}) exceeds "
+           f"the usable budget ({format_bytes(report['usable'])}).")
+    for est in report["tunnels"]:
+        if est["stem"] == config_path.stem and est["suggest"]:
+            print(f"  {FG_YELLOW}Suggested for {est['stem']}:{RESET} " + "  ".join(
+                f"{b}.{k}={v}" for b, vals in est["suggest"].items() for k, v in vals.items()))
+            print(f"  {FG_WHITE}Apply with: netrix-manager.py memory {est['stem']} --apply{RESET}")
+
 def parse_yaml_config(config_path: Path) -> Optional[Dict[str, Any]]:
     """خواندن فایل کانفیگ YAML"""
     if not config_path.exists():
         return None
     try:
         with open(config_path, 'r', encoding='utf-8') as f:
-            return yaml.safe_load(f)
+            return yaml_safe_load(f)
     except Exception:
         return None
 
@@ -1679,8 +3299,61 @@ def get_certificate_with_acme(domain: str, email: str, port: int) -> tuple[Optio
     
     return str(cert_file), str(key_file)
 
-def write_yaml_with_comments(file_path: Path, data: dict, comments: dict = None):
-    """نوشتن YAML با comment های default values"""
+# path -> whether the last write_file_atomic() in this process changed the file
+FILE_WRITE_RESULTS: Dict[str, bool] = {}
+
+def write_file_atomic(file_path: Path, text: str, mode: int = 0o600) -> bool:
+    """
+    نوشتن اتمیک فایل: temp file + fsync + rename، فقط اگر محتوا تغییر کرده باشد.
+    Keeps the mode of an existing file. New files get `mode`, which defaults to 0o600 because most
+    callers write tunnel configs and state holding PSKs/keys; pass 0o644 for files other tools must
+    read (systemd units, modprobe.d, exported reports). Returns True if the file changed.
+    """
+    file_path = Path(file_path)
+    data = text.encode("utf-8")
+    try:
+        current = file_path.read_bytes()
+    except OSError:
+        current = None
+    if current is not None and hashlib.sha256(current).digest() == hashlib.sha256(data).digest():
+        FILE_WRITE_RESULTS.setdefault(str(file_path), False)
+        return False
+    try:
+        mode = stat.S_IMODE(file_path.stat().st_mode)
+    except OSError:
+        pass
+    tmp_path = file_path.with_name(f".{file_path.name}.{os.getpid()}.tmp")
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        try:
+            tmp_path.unlink()
+        except OSError:
+            pass
+        raise
+    try:
+        dir_fd = os.open(file_path.parent, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass
+    FILE_WRITE_RESULTS[str(file_path)] = True
+    return True
+
+def file_write_changed(file_path: Path) -> bool:
+    """Whether any write of this path in the current run changed it (False if not written)."""
+    return FILE_WRITE_RESULTS.get(str(file_path), False)
+
+def render_yaml_with_comments(data: dict, comments: dict = None) -> str:
+    """رندر YAML با comment های default values"""
     if comments is None:
         comments = {}
     
@@ -1759,22 +3432,103 @@ def write_yaml_with_comments(file_path: Path, data: dict, comments: dict = None)
     
     write_dict(data)
     
-    with open(file_path, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(lines))
-        f.write('\n')
+    return '\n'.join(lines) + '\n'
+
+def write_yaml_with_comments(file_path: Path, data: dict, comments: dict = None) -> bool:
+    """نوشتن YAML با comment ها؛ فقط در صورت تغییر و به صورت اتمیک. Returns True if the file changed."""
+    return write_file_atomic(file_path, render_yaml_with_comments(data, comments))
+
+def _format_yaml_scalar(value) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if value is None:
+        return '""'
+    text = str(value)
+    if isinstance(value, str) and (text == "" or text[0] in "[{*&/" or ":" in text or "#" in text):
+        return f'"{text}"'
+    return text
+
+def update_tunnel_config(config_path: Path, updates: Dict[str, dict]) -> bool:
+    """
+    ویرایش درجای کلیدهای یک کانفیگ موجود (comment ها و ترتیب حفظ می‌شوند)
+    `updates` maps a top-level block (smux, kcp, rawsocket, advanced, ...) to {key: value};
+    a non-dict value sets an existing top-level scalar (e.g. connection_pool).
+    Blocks/keys missing from the file are skipped. Returns True if the file changed.
+    """
+    lines = Path(config_path).read_text(encoding="utf-8").splitlines()
+    for block, values in updates.items():
+        if not isinstance(values, dict):
+            for i, line in enumerate(lines):
+                m = re.match(rf"^{re.escape(block)}:(?: ([^#]*?))?(\s+#.*)?$", line)
+                if m and m.group(1) is not None:
+                    lines[i] = f"{block}: {_format_yaml_scalar(values)}{m.group(2) or ''}"
+                    break
+            continue
+        start = next((i for i, line in enumerate(lines) if re.match(rf"^{re.escape(block)}:(\s|$)", line)), None)
+        if start is None or not values:
+            continue
+        end = start + 1
+        while end < len(lines) and (lines[end].startswith("  ") or not lines[end].strip()):
+            end += 1
+        pending = dict(values)
+        for i in range(start + 1, end):
+            m = re.match(r"^  ([A-Za-z0-9_]+):(?: ([^#]*?))?(\s+#.*)?$", lines[i])
+            if m and m.group(1) in pending:
+                lines[i] = f"  {m.group(1)}: {_format_yaml_scalar(pending.pop(m.group(1)))}{m.group(3) or ''}"
+        insert_at = end
+        while insert_at > start + 1 and not lines[insert_at - 1].strip():
+            insert_at -= 1
+        for offset, (key, value) in enumerate(pending.items()):
+            lines.insert(insert_at + offset, f"  {key}: {_format_yaml_scalar(value)}")
+    return write_file_atomic(Path(config_path), "\n".join(lines) + "\n")
+
+def update_tunnel_paths(config_path: Path, order: List[int], pools: Dict[int, int]) -> bool:
+    """
+    Reorder the items of a client's paths: list in place and set each item's connection_pool
+    (indices refer to the current order; comments kept). Returns True if the file changed.
+    """
+    lines = Path(config_path).read_text(encoding="utf-8").splitlines()
+    start = next((i for i, line in enumerate(lines) if re.match(r"^paths:(\s|$)", line)), None)
+    if start is None:
+        return False
+    end = start + 1
+    while end < len(lines) and (lines[end].startswith("  ") or not lines[end].strip()):
+        end += 1
+    while end > start + 1 and not lines[end - 1].strip():
+        end -= 1
+    items: List[List[str]] = []
+    for line in lines[start + 1:end]:
+        if re.match(r"^  -(\s|$)", line) or not items:
+            items.append([])
+        items[-1].append(line)
+    if sorted(order) != list(range(len(items))):
+        raise ValueError(f"path order {order} does not match the {len(items)} paths in {config_path.name}")
+    for i, item in enumerate(items):
+        if i not in pools:
+            continue
+        for j, line in enumerate(item):
+            m = re.match(r"^(  -)?(\s*)connection_pool:\s*[^#]*?(\s+#.*)?$", line)
+            if m:
+                item[j] = f"{m.group(1) or ''}{m.group(2)}connection_pool: {int(pools[i])}{m.group(3) or ''}"
+                break
+        else:
+            item.append(f"    connection_pool: {int(pools[i])}")
+    lines[start + 1:end] = [line for i in order for line in items[i]]
+    return write_file_atomic(Path(config_path), "\n".join(lines) + "\n")
 
-def create_server_config_file(tport: int, cfg: dict) -> Path:
-    """ساخت فایل کانفیگ YAML برای سرور"""
+def create_server_config_file(tport: int, cfg: dict, config_dir: Optional[Path] = None) -> Path:
+    """ساخت فایل کانفیگ YAML برای سرور (config_dir: default NETRIX_CONFIG_DIR)"""
     if cfg.get("transport") == "l3":
-        return create_l3_server_config_file(cfg)
-    NETRIX_CONFIG_DIR.mkdir(parents=True, exist_ok=True)
+        return create_l3_server_config_file(cfg, config_dir)
+    config_dir = config_dir or NETRIX_CONFIG_DIR
+    config_dir.mkdir(parents=True, exist_ok=True)
     
     direct_mode = cfg.get('direct', False)
     
     if direct_mode:
-        config_path = NETRIX_CONFIG_DIR / f"server_direct_{tport}.yaml"
+        config_path = config_dir / f"server_direct_{tport}.yaml"
     else:
-        config_path = NETRIX_CONFIG_DIR / f"server_{tport}.yaml"
+        config_path = config_dir / f"server_{tport}.yaml"
     
     transport = cfg.get('transport', 'tcpmux')
     profile = cfg.get('profile', 'balanced')
@@ -1814,7 +3568,7 @@ def create_server_config_file(tport: int, cfg: dict) -> Path:
             yaml_data["reality"]["public_key"] = cfg.get("reality_public_key")
         print(f"  {FG_GREEN}✅ REALITY config will be written to YAML: SNI={cfg.get('reality_sni')}, Fingerprint={cfg.get('reality_fingerprint')}{RESET}")
     
-    yaml_data["profile"] = profile
+    yaml_data["profile"] = builtin_profile_name(profile)
     
     smux_default = get_default_smux_config(profile)
     yaml_data["smux"] = {
@@ -1844,7 +3598,7 @@ def create_server_config_file(tport: int, cfg: dict) -> Path:
             raise ValueError("rawsocket YAML block could not be built")
         print(f"  {FG_GREEN}✅ rawsocket config will be written to YAML (KCP+FEC){RESET}")
     
-    advanced_default = get_default_advanced_config(transport)
+    advanced_default = get_default_advanced_config(transport, profile)
     advanced_default.pop("stream_queue_size", None)
     yaml_data["advanced"] = {}
     for key, value in advanced_default.items():
@@ -1969,7 +3723,7 @@ def create_server_config_file(tport: int, cfg: dict) -> Path:
         yaml_data["proxy_protocol"] = proxy_config
 
     comments = {
-        "profile": f"Performance profile (default: balanced)",
+        "profile": profile_comment(profile),
         "smux.keepalive": f"Keepalive interval in seconds (default: {smux_default['keepalive']})",
         "smux.max_recv": f"Max receive buffer in bytes (default: {smux_default['max_recv']} = 4MB)",
         "smux.max_stream": f"Max stream buffer in bytes (default: {smux_default['max_stream']} = 1MB)",
@@ -2046,6 +3800,7 @@ def create_server_config_file(tport: int, cfg: dict) -> Path:
             "rawsocket.sock_buf": f"UDP buffer in bytes (default: {rs_default.get('sock_buf', RAWSOCKET_SOCK_BUF)})",
         })
     
+    apply_cfg_overrides(yaml_data, cfg)
     write_yaml_with_comments(config_path, yaml_data, comments)
     
     try:
@@ -2055,11 +3810,12 @@ def create_server_config_file(tport: int, cfg: dict) -> Path:
     
     return config_path
 
-def create_client_config_file(cfg: dict) -> Path:
-    """ساخت فایل کانفیگ YAML برای کلاینت"""
+def create_client_config_file(cfg: dict, config_dir: Optional[Path] = None) -> Path:
+    """ساخت فایل کانفیگ YAML برای کلاینت (config_dir: default NETRIX_CONFIG_DIR)"""
     if cfg.get("transport") == "l3":
-        return create_l3_client_config_file(cfg)
-    NETRIX_CONFIG_DIR.mkdir(parents=True, exist_ok=True)
+        return create_l3_client_config_file(cfg, config_dir)
+    config_dir = config_dir or NETRIX_CONFIG_DIR
+    config_dir.mkdir(parents=True, exist_ok=True)
     
     tport = 0
     direct_mode = cfg.get('direct', False)
@@ -2075,11 +3831,11 @@ def create_client_config_file(cfg: dict) -> Path:
             tport = addr.split(':')[-1] if ':' in addr else '0'
     
     if direct_mode and tport:
-        config_path = NETRIX_CONFIG_DIR / f"client_direct_{tport}.yaml"
+        config_path = config_dir / f"client_direct_{tport}.yaml"
     elif tport and str(tport) != '0':
-        config_path = NETRIX_CONFIG_DIR / f"client_{tport}.yaml"
+        config_path = config_dir / f"client_{tport}.yaml"
     else:
-        config_path = NETRIX_CONFIG_DIR / "client.yaml"
+        config_path = config_dir / "client.yaml"
     
     profile = cfg.get('profile', 'balanced')
     paths = cfg.get('paths', [])
@@ -2110,7 +3866,7 @@ def create_client_config_file(cfg: dict) -> Path:
             yaml_data["cert_file"] = cfg["cert_file"]
             yaml_data["key_file"] = cfg["key_file"]
     
-    yaml_data["profile"] = profile
+    yaml_data["profile"] = builtin_profile_name(profile)
     
     if paths and not direct_mode:
         yaml_data["paths"] = []
@@ -2180,7 +3936,7 @@ def create_client_config_file(cfg: dict) -> Path:
         if not merge_rawsocket_yaml(yaml_data, cfg, profile, paths=paths, direct_mode=direct_mode):
             raise ValueError("rawsocket YAML block could not be built")
 
-    advanced_default = get_default_advanced_config(main_transport)
+    advanced_default = get_default_advanced_config(main_transport, profile)
     advanced_default.pop("stream_queue_size", None)
     yaml_data["advanced"] = {}
     for key, value in advanced_default.items():
@@ -2261,7 +4017,7 @@ def create_client_config_file(cfg: dict) -> Path:
         yaml_data["proxy_protocol"] = proxy_config
 
     comments = {
-        "profile": f"Performance profile (default: balanced)",
+        "profile": profile_comment(profile),
         "smux.keepalive": f"Keepalive interval in seconds (default: {smux_default['keepalive']})",
         "smux.max_recv": f"Max receive buffer in bytes (default: {smux_default['max_recv']} = 4MB)",
         "smux.max_stream": f"Max stream buffer in bytes (default: {smux_default['max_stream']} = 2MB)",
@@ -2323,6 +4079,7 @@ def create_client_config_file(cfg: dict) -> Path:
             "kcp.mtu": f"KCP MTU (default: {kcp_default['mtu']})",
         })
     
+    apply_cfg_overrides(yaml_data, cfg)
     write_yaml_with_comments(config_path, yaml_data, comments)
     
     try:
@@ -2332,20 +4089,356 @@ def create_client_config_file(cfg: dict) -> Path:
     
     return config_path
 
-# ========== Tunnel Management ==========
-def ensure_netrix_available():
-    """بررسی وجود باینری netrix"""
-    if os.path.exists(NETRIX_BINARY):
-        return NETRIX_BINARY
-    netrix_path = which("netrix")
-    if netrix_path:
-        return netrix_path
-    c_err("netrix binary not found!")
-    c_warn(f"Please install netrix to {NETRIX_BINARY} or add to PATH")
-    return None
+# ========== Tunnel Specs ==========
+TUNNEL_TRANSPORTS = ("tcpmux", "tlsmux", "realitymux", "kcpmux", "wsmux", "wssmux", "rawsocket", "l3")
+TUNNEL_SPEC_META_KEYS = ("side", "start", "name")
 
-def get_service_status(config_path: Path) -> Optional[str]:
-    """دریافت وضعیت systemd service"""
+def _spec_port_strings(value) -> str:
+    """
+    Accept the wizard port syntax as a string or a YAML list and return one comma-joined string.
+    List items may be `{ports: ..., priority: ...}` maps (see spec_port_priorities).
+    """
+    if value is None:
+        return ""
+    if isinstance(value, (list, tuple)):
+        items = [v.get("ports", "") if isinstance(v, dict) else v for v in value]
+        return ",".join(str(v).strip() for v in items if str(v).strip())
+    return str(value).strip()
+
+def _spec_host_port(host: str, port: int) -> str:
+    host = str(host).strip()
+    if ':' in host and not host.startswith('['):
+        return f"[{host}]:{port}"
+    return f"{host}:{port}"
+
+def tunnel_cfg_from_spec(spec: Dict[str, Any]) -> tuple[str, dict]:
+    """
+    Build the cfg dict the wizards pass to create_server_config_file/create_client_config_file.
+    Spec keys mirror the wizard answers; nested encryption/stealth/compression/buffer_pools/tun/l3
+    maps are flattened the same way the wizards do. Raises ValueError on an invalid spec.
+    """
+    if not isinstance(spec, dict):
+        raise ValueError("tunnel spec must be a mapping")
+    side = str(spec.get("side", "")).strip().lower()
+    side = {"iran": "server", "kharej": "client"}.get(side, side)
+    if side not in ("server", "client"):
+        raise ValueError("spec 'side' must be server|client (or iran|kharej)")
+    transport = str(spec.get("transport", "tcpmux")).strip().lower()
+    if transport not in TUNNEL_TRANSPORTS:
+        raise ValueError(f"unknown transport '{transport}' (expected one of: {', '.join(TUNNEL_TRANSPORTS)})")
+
+    nested = ("encryption", "stealth", "compression", "buffer_pools", "tun", "l3", "tcp_ports", "udp_ports", "sizing", "pmtu",
+              "rate_limit", "burst", "notrack")
+    cfg = {k: v for k, v in spec.items() if k not in TUNNEL_SPEC_META_KEYS and k not in nested}
+    cfg["transport"] = transport
+    cfg["verbose"] = bool(spec.get("verbose", False))
+
+    tcp_ports = _spec_port_strings(spec.get("tcp_ports"))
+    udp_ports = _spec_port_strings(spec.get("udp_ports"))
+
+    if transport == "l3":
+        tun = dict(spec.get("tun") or {})
+        tun.setdefault("health_port", 1234)
+        _resolve_tun_streams(tun)
+        l3 = dict(spec.get("l3") or {})
+        if not l3.get("dst_ip"):
+            raise ValueError("l3 spec requires l3.dst_ip (peer endpoint IP)")
+        if l3.get("enable_encryption", L3_KERNEL_DEFAULT_ENABLE_ENCRYPTION) and not l3.get("psk"):
+            raise ValueError("l3 spec requires l3.psk when encryption is enabled")
+        if spec.get("profile"):
+            l3.setdefault("profile", str(spec["profile"]).strip().lower())
+        if l3.get("profile") and l3["profile"] not in available_profiles():
+            raise ValueError(f"unknown profile '{l3['profile']}' (available: {', '.join(available_profiles())})")
+        cfg["tun_config"] = tun
+        cfg["l3_config"] = l3
+        cfg["direct"] = False
+        if side == "server":
+            cfg["tcp_ports"] = _maps_to_port_strings(parse_advanced_ports(tcp_ports, "tcp")) if tcp_ports else []
+            cfg["udp_ports"] = _maps_to_port_strings(parse_advanced_ports(udp_ports, "udp")) if udp_ports else []
+        if spec.get("pmtu"):
+            merge_cfg_overrides(cfg, spec_pmtu_overrides(side, cfg, spec["pmtu"]))
+        return side, cfg
+
+    if not str(spec.get("psk", "")).strip():
+        raise ValueError("spec requires a non-empty psk")
+    direct_mode = bool(spec.get("direct", False))
+    cfg["direct"] = direct_mode
+    profile = str(spec.get("profile", "balanced")).strip().lower()
+    if profile not in available_profiles():
+        raise ValueError(f"unknown profile '{profile}' (available: {', '.join(available_profiles())})")
+    cfg["profile"] = profile
+    smux_default = get_default_smux_config(profile)
+    cfg.setdefault("mux_con", smux_default.get("mux_con", 8))
+    cfg.setdefault("heartbeat", DEFAULT_HEARTBEAT)
+
+    tport = spec.get("tport")
+    try:
+        tport = int(tport) if tport is not None else 0
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid tport: {spec.get('tport')!r}")
+    if tport and not 1 <= tport <= 65535:
+        raise ValueError(f"tport out of range: {tport}")
+    cfg["tport"] = tport
+    bind_host = "[::]" if spec.get("ipv6") else "0.0.0.0"
+
+    if side == "server":
+        if not tport:
+            raise ValueError("server spec requires tport")
+        if direct_mode:
+            if not cfg.get("connect"):
+                peer = str(spec.get("peer", "")).strip()
+                if not peer:
+                    raise ValueError("direct server spec requires connect or peer")
+                cfg["connect"] = _spec_host_port(peer, tport)
+            cfg.setdefault("connection_pool", 8)
+            cfg.setdefault("retry_interval", 3)
+            cfg.setdefault("dial_timeout", 10)
+            cfg.setdefault("aggressive_pool", False)
+        else:
+            cfg.setdefault("listen", f"{bind_host}:{tport}")
+            cfg.setdefault("stream_queue_size", 2048)
+        if "maps" not in cfg:
+            maps = []
+            if tcp_ports:
+                maps.extend(parse_advanced_ports(tcp_ports, "tcp"))
+            if udp_ports:
+                maps.extend(parse_advanced_ports(udp_ports, "udp"))
+            cfg["maps"] = compact_maps(maps)
+    else:
+        if direct_mode:
+            if not tport:
+                raise ValueError("direct client spec requires tport")
+            cfg.setdefault("listen", f"{bind_host}:{tport}")
+            cfg.setdefault("paths", [])
+        elif not cfg.get("paths"):
+            peer = str(spec.get("peer", "")).strip()
+            if not peer or not tport:
+                raise ValueError("reverse client spec requires paths or peer + tport")
+            path = {
+                "addr": _spec_host_port(peer, tport),
+                "transport": transport,
+                "connection_pool": int(spec.get("connection_pool", 8)),
+                "retry_interval": int(spec.get("retry_interval", 3)),
+                "dial_timeout": int(spec.get("dial_timeout", 10)),
+                "aggressive_pool": bool(spec.get("aggressive_pool", False)),
+            }
+            for key in ("edge_ip", "reality_sni", "reality_fingerprint", "reality_short_id", "reality_public_key"):
+                if spec.get(key):
+                    path[key] = spec[key]
+            cfg["paths"] = [path]
+        else:
+            for p in cfg["paths"]:
+                if not isinstance(p, dict) or not p.get("addr"):
+                    raise ValueError("every client path needs an addr")
+                p.setdefault("transport", transport)
+
+    encryption = spec.get("encryption") or {}
+    cfg["encryption_enabled"] = bool(encryption.get("enabled", cfg.get("encryption_enabled", False)))
+    cfg["encryption_algorithm"] = encryption.get("algorithm", cfg.get("encryption_algorithm", "chacha"))
+    auto_keys = []
+    if str(cfg["encryption_algorithm"]).strip().lower() == "auto":
+        # both ends must agree, so only the server resolves auto; the client copies the result
+        if side != "server":
+            raise ValueError("encryption.algorithm auto is resolved on the server only; "
+                             "set the client to the server's encryption.algorithm")
+        auto_keys.append("encryption")
+    cfg["encryption_key"] = encryption.get("key", cfg.get("encryption_key", ""))
+
+    stealth = spec.get("stealth") or {}
+    cfg["stealth_padding"] = bool(stealth.get("padding_enabled", cfg.get("stealth_padding", False)))
+    cfg["stealth_padding_min"] = int(stealth.get("padding_min", cfg.get("stealth_padding_min", 0)))
+    cfg["stealth_padding_max"] = int(stealth.get("padding_max", cfg.get("stealth_padding_max", 128 if cfg["stealth_padding"] else 0)))
+    cfg["stealth_jitter"] = bool(stealth.get("jitter_enabled", cfg.get("stealth_jitter", False)))
+    cfg["stealth_jitter_min"] = int(stealth.get("jitter_min_ms", cfg.get("stealth_jitter_min", 5)))
+    cfg["stealth_jitter_max"] = int(stealth.get("jitter_max_ms", cfg.get("stealth_jitter_max", 20)))
+
+    compression = {
+        "enabled": True,
+        "algorithm": "lz4",
+        "level": 0,
+        "min_size": 1024,
+        "max_size": 65536,
+    }
+    compression.update(spec.get("compression") or {})
+    if str(compression.get("algorithm", "")).strip().lower() == "auto":
+        if side != "server":
+            raise ValueError("compression.algorithm auto is resolved on the server only; "
+                             "set the client to the server's compression.algorithm")
+        auto_keys.append("compression")
+    cfg["compression_config"] = compression
+
+    buffer_pools = {
+        "buffer_pool_size": DEFAULT_BUFFER_POOL_SIZE,
+        "large_buffer_pool_size": DEFAULT_LARGE_BUFFER_POOL_SIZE,
+        "udp_frame_pool_size": DEFAULT_UDP_FRAME_POOL_SIZE,
+        "udp_data_slice_size": DEFAULT_UDP_SLICE_SIZE,
+    }
+    buffer_pools.update(spec.get("buffer_pools") or {})
+    cfg["buffer_pool_config"] = buffer_pools
+
+    if spec.get("tun"):
+        tun = dict(spec["tun"])
+        tun.setdefault("enabled", True)
+        _resolve_tun_streams(tun)
+        cfg["tun_config"] = tun
+
+    if is_rawsocket_transport(transport):
+        explicit = {k: v for k, v in cfg.items() if k.startswith("rawsocket_") and v}
+        apply_rawsocket_detected_to_cfg(cfg, transport)
+        cfg.update(explicit)        # spec values win over host auto-detection
+
+    sizing = spec.get("sizing")
+    if sizing:
+        if not isinstance(sizing, dict) or not sizing.get("bandwidth_mbps"):
+            raise ValueError("sizing needs bandwidth_mbps and rtt_ms (a number or 'auto')")
+        rtt_ms = sizing.get("rtt_ms", "auto")
+        if str(rtt_ms).strip().lower() == "auto":
+            rtt_ms = measure_cfg_rtt_ms(cfg)
+            if rtt_ms is None:
+                raise ValueError("sizing.rtt_ms=auto: could not measure RTT to the peer")
+            rtt_ms = quantize_rtt_ms(rtt_ms)
+        merge_cfg_overrides(cfg, sizing_to_cfg_overrides(compute_bdp_sizing(rtt_ms, sizing["bandwidth_mbps"], profile)))
+
+    fec = spec.get("fec")
+    if fec:
+        if not isinstance(fec, dict):
+            raise ValueError("fec needs shards: DATA:PARITY or loss_pct [burst_len, target_loss] (probe: true only advises)")
+        if not cfg_fec_blocks(cfg):
+            raise ValueError(f"fec: transport '{transport}' has no FEC settings (only kcpmux and rawsocket tunnels carry shards)")
+        if fec.get("shards") is not None:
+            k, m = parse_fec_shards(fec["shards"])
+            shards = {"data_shard": k, "parity_shard": m}
+            merge_cfg_overrides(cfg, {"kcp_overrides": dict(shards), "rawsocket_overrides": dict(shards)})
+        elif fec.get("loss_pct") is not None:
+            # deterministic, so both specs with the same fec: keys end up with the same shards
+            loss = float(fec["loss_pct"]) / 100.0
+            burst = max(1.0, float(fec.get("burst_len", 1.0)))
+            choice = choose_fec_shards(gilbert_model_from_rates(loss, burst), float(fec.get("target_loss", FEC_DEFAULT_TARGET_LOSS)))
+            merge_cfg_overrides(cfg, fec_to_cfg_overrides(choice))
+        elif fec.get("probe"):
+            # each end measures its own loss, so a probe only advises; the shards stay the profile's
+            peers = cfg_peer_addrs(cfg)
+            if not peers:
+                raise ValueError("fec.probe: tunnel has no peer address to probe")
+            model = probe_path_loss(_split_host_port(peers[0])[0], fec.get("udp_port"))
+            choice = choose_fec_shards(model, float(fec.get("target_loss", FEC_DEFAULT_TARGET_LOSS)))
+            if fec_choice_writable(choice):
+                c_warn(f"fec.probe: {model['loss_rate'] * 100:.2f}% loss suggests shards "
+                       f"{choice['data_shard']}:{choice['parity_shard']}; not written. Put "
+                       f"fec: {{shards: \"{choice['data_shard']}:{choice['parity_shard']}\"}} in both specs "
+                       f"or run: {fec_peer_command(choice)}")
+        else:
+            raise ValueError("fec needs shards: DATA:PARITY or loss_pct [burst_len, target_loss] (probe: true only advises)")
+
+    if auto_keys:
+        resolve_spec_auto_algorithms(side, cfg, auto_keys)
+
+    pmtu = spec.get("pmtu")
+    if pmtu:
+        # last, so the MTUs see the FEC shards; the file is then rendered once with them
+        merge_cfg_overrides(cfg, spec_pmtu_overrides(side, cfg, pmtu))
+    return side, cfg
+
+def resolve_spec_auto_algorithms(side: str, cfg: dict, keys: List[str]) -> None:
+    """
+    Resolve a server spec's `algorithm: auto` for encryption and/or compression. A tunnel that
+    already has a config keeps the algorithm written there: the recommendation comes from noisy
+    benchmarks, and a flip would rewrite the config and restart the tunnel.
+    """
+    target = tunnel_config_path(side, cfg)
+    current = (parse_yaml_config(target) or {}) if target.is_file() else {}
+    if "encryption" in keys:
+        written = (current.get("encryption") or {}).get("algorithm")
+        cfg["encryption_algorithm"] = written or cpu_capability_profile()["recommended_encryption"]["algorithm"]
+    if "compression" in keys:
+        written = current.get("compression") or {}
+        if written.get("algorithm"):
+            cfg["compression_config"].update(algorithm=written["algorithm"], level=written.get("level", 0))
+        else:
+            rec = cpu_capability_profile()["recommended_compression"]
+            cfg["compression_config"].update(algorithm=rec["algorithm"], level=rec["level"])
+
+def spec_pmtu_overrides(side: str, cfg: dict, pmtu: Any) -> dict:
+    """
+    <block>_overrides for a spec `pmtu:` (a path MTU, `auto` or {host, method, port}), computed
+    from the config as it will be rendered. `auto` keeps the MTUs already on disk unless they no
+    longer fit or the probe finds more than PMTU_AUTO_HYSTERESIS bytes of headroom, so re-applying
+    does not flap between probe results.
+    """
+    target, rendered = render_tunnel_cfg(side, cfg)
+    auto = isinstance(pmtu, dict) or str(pmtu).strip().lower() == "auto"
+    if auto:
+        opts = pmtu if isinstance(pmtu, dict) else {}
+        host = opts.get("host") or cfg_pmtu_host(rendered)
+        if not host:
+            raise ValueError("spec 'pmtu: auto' needs a peer address (or pmtu.host)")
+        found = discover_path_mtu(host, opts.get("method", "icmp"), opts.get("port"))
+        path_mtu, version = found["path_mtu"], found["ip_version"]
+    else:
+        path_mtu, version = int(pmtu), 4
+    mtus = compute_layer_mtus(path_mtu, rendered, version)
+    if auto and target.is_file():
+        current = parse_yaml_config(target) or {}
+        kept = {k: (current.get(k.split(".", 1)[0]) or {}).get(k.split(".", 1)[1]) for k in mtus}
+        if all(isinstance(v, int) and 0 <= mtus[k] - v <= PMTU_AUTO_HYSTERESIS for k, v in kept.items()):
+            mtus = kept
+    return {f"{block}_overrides": values for block, values in mtus_to_config_updates(mtus).items()}
+
+def write_tunnel_config(side: str, cfg: dict, spec: Dict[str, Any]) -> Path:
+    """Write a cfg from tunnel_cfg_from_spec, then record the spec keys kept outside the tunnel config (priorities, limits, notrack)."""
+    priorities = spec_port_priorities(spec)
+    limits = spec_limits(spec)
+    notrack = _notrack_mode(spec.get("notrack"))
+    if side == "server":
+        config_path = create_server_config_file(cfg.get("tport", 0), cfg)
+    else:
+        config_path = create_client_config_file(cfg)
+    save_qos_priorities(config_path.stem, priorities)
+    save_limits(config_path.stem, limits)
+    save_notrack(config_path.stem, notrack)
+    return config_path
+
+def render_tunnel_cfg(side: str, cfg: dict) -> tuple[Path, dict]:
+    """
+    (path write_tunnel_config() would use, parsed config it would write), found by rendering
+    the cfg into a scratch dir; nothing under NETRIX_CONFIG_DIR is touched.
+    """
+    import contextlib
+    import copy
+    import io
+    import tempfile
+    with tempfile.TemporaryDirectory(prefix="netrix-render-") as scratch, contextlib.redirect_stdout(io.StringIO()):
+        cfg = copy.deepcopy(cfg)
+        if side == "server":
+            rendered = create_server_config_file(cfg.get("tport", 0), cfg, Path(scratch))
+        else:
+            rendered = create_client_config_file(cfg, Path(scratch))
+        parsed = parse_yaml_config(rendered) or {}
+    return NETRIX_CONFIG_DIR / rendered.name, parsed
+
+def tunnel_config_path(side: str, cfg: dict) -> Path:
+    """Where write_tunnel_config() would put a cfg."""
+    return render_tunnel_cfg(side, cfg)[0]
+
+def write_tunnel_config_from_spec(spec: Dict[str, Any]) -> Path:
+    """Render one tunnel spec through the same config builders the wizards use."""
+    side, cfg = tunnel_cfg_from_spec(spec)
+    return write_tunnel_config(side, cfg, spec)
+
+# ========== Tunnel Management ==========
+def ensure_netrix_available():
+    """بررسی وجود باینری netrix"""
+    if os.path.exists(NETRIX_BINARY):
+        return NETRIX_BINARY
+    netrix_path = which("netrix")
+    if netrix_path:
+        return netrix_path
+    c_err("netrix binary not found!")
+    c_warn(f"Please install netrix to {NETRIX_BINARY} or add to PATH")
+    return None
+
+def get_service_status(config_path: Path) -> Optional[str]:
+    """دریافت وضعیت systemd service"""
     service_name = f"netrix-{config_path.stem}"
     try:
         result = subprocess.run(
@@ -2386,12 +4479,42 @@ def get_service_pid(config_path: Path) -> Optional[int]:
         pass
     return None
 
+def get_services_state(config_paths: List[Path]) -> Dict[str, tuple]:
+    """
+    وضعیت چند سرویس با یک فراخوانی systemctl show
+    Returns {config stem: (ActiveState, MainPID or None)}; empty if systemctl is unavailable.
+    """
+    if not config_paths:
+        return {}
+    units = [f"netrix-{p.stem}.service" for p in config_paths]
+    try:
+        result = subprocess.run(
+            ["systemctl", "show", "--property=Id,ActiveState,MainPID", *units],
+            capture_output=True,
+            text=True,
+            timeout=5
+        )
+    except KeyboardInterrupt:
+        exit_script()
+    except Exception:
+        return {}
+    states = {}
+    for block in result.stdout.split("\n\n"):
+        props = dict(line.split("=", 1) for line in block.splitlines() if "=" in line)
+        unit = props.get("Id", "")
+        if not unit.startswith("netrix-") or not unit.endswith(".service"):
+            continue
+        try:
+            pid = int(props.get("MainPID", "0"))
+        except ValueError:
+            pid = 0
+        states[unit[len("netrix-"):-len(".service")]] = (props.get("ActiveState", "unknown"), pid if pid > 0 else None)
+    return states
+
 def list_tunnels() -> List[Dict[str,Any]]:
     """لیست تمام تانل‌ها از فایل‌های YAML"""
     items = []
     
-    NETRIX_CONFIG_DIR.mkdir(parents=True, exist_ok=True)
-    
     config_files_new = list(NETRIX_CONFIG_DIR.glob("server_*.yaml"))
     config_files_old = list(ROOT_DIR.glob("server*.yaml"))
     all_config_files = list(set(config_files_new + config_files_old))
@@ -2442,10 +4565,6 @@ def list_tunnels() -> List[Dict[str,Any]]:
                 tport = listen.split(':')[-1] if ':' in listen else ''
                 summary = f"server port={tport} transport={transport}"
             
-            status = get_service_status(config_file)
-            alive = (status == "active")
-            pid = get_service_pid(config_file) if alive else None
-            
             items.append({
                 "config_path": config_file,
                 "mode": "server",
@@ -2453,8 +4572,8 @@ def list_tunnels() -> List[Dict[str,Any]]:
                 "transport": transport,
                 "direct": direct_mode,
                 "summary": summary,
-                "pid": pid,
-                "alive": alive,
+                "pid": None,
+                "alive": False,
                 "cfg": cfg
             })
         except KeyboardInterrupt:
@@ -2516,17 +4635,13 @@ def list_tunnels() -> List[Dict[str,Any]]:
                 else:
                     summary = "client (unknown)"
             
-            status = get_service_status(config_file)
-            alive = (status == "active")
-            pid = get_service_pid(config_file) if alive else None
-            
             items.append({
                 "config_path": config_file,
                 "mode": "client",
                 "direct": direct_mode,
                 "summary": summary,
-                "pid": pid,
-                "alive": alive,
+                "pid": None,
+                "alive": False,
                 "cfg": cfg
             })
         except KeyboardInterrupt:
@@ -2534,13 +4649,134 @@ def list_tunnels() -> List[Dict[str,Any]]:
         except Exception:
             continue
     
+    states = get_services_state([it["config_path"] for it in items])
+    for it in items:
+        status, pid = states.get(it["config_path"].stem, (None, None))
+        it["status"] = status
+        it["alive"] = (status == "active")
+        it["pid"] = pid if it["alive"] else None
+    
     return items
 
-def run_tunnel(config_path: Path):
-    """اجرای تانل از طریق systemd service"""
+READY_CONDITIONS = ("auto", "active", "ready", "peer_transport_up", "peer_data_verified")
+READY_DEFAULT_CONDITION = "auto"    # listening side (which may have no peer yet): active; dialling side: ready
+READY_DEFAULT_TIMEOUT = 20.0
+READY_BACKOFF_START = 0.05
+READY_BACKOFF_MAX = 1.0
+
+def _service_active_state(service_name: str) -> str:
+    """`systemctl is-active` text (active/activating/failed/...); 'unknown' on error."""
+    try:
+        result = subprocess.run(["systemctl", "is-active", service_name],
+                                capture_output=True, text=True, timeout=3)
+        return result.stdout.strip() or "unknown"
+    except Exception:
+        return "unknown"
+
+def _readiness_holds(condition: str, code: Optional[int], body: Any) -> bool:
+    """Evaluate a readiness condition against one /health answer."""
+    if code != 200:
+        return False
+    health = body if isinstance(body, dict) else {}
+    if health.get("ready") is False:
+        return False
+    if condition == "ready":
+        return True
+    # cores without peer flags only report `ready`; fall back to it instead of waiting forever
+    return bool(health.get(condition, True))
+
+def wait_ready(stem, timeout: float = READY_DEFAULT_TIMEOUT, condition: str = READY_DEFAULT_CONDITION) -> Dict[str, Any]:
+    """
+    Poll a tunnel with exponential backoff until `condition` holds or `timeout` elapses.
+    'active' only waits for systemd; the others need the health port to answer 200 and
+    the matching flag (ready, peer_transport_up, peer_data_verified) to be true.
+    A unit that ends up failed/inactive stops the wait early. 'auto' is 'active' for the
+    listening side (reverse server, direct client) and 'ready' for the side that dials.
+    """
+    if condition not in READY_CONDITIONS:
+        raise ValueError(f"unknown readiness condition '{condition}' (use {', '.join(READY_CONDITIONS)})")
+    config_path = stem if isinstance(stem, Path) else find_tunnel_config(stem)
+    if config_path is None:
+        raise ValueError(f"tunnel not found: {stem}")
+    service_name = f"netrix-{config_path.stem}"
+    cfg = parse_yaml_config(config_path) or {}
+    if condition == "auto":
+        condition = "active" if (cfg.get("mode") == "server") != bool(cfg.get("direct")) else "ready"
+    health_port = get_tunnel_health_port(cfg)
+    result = {"stem": config_path.stem, "condition": condition, "ready": False,
+              "elapsed_ms": 0.0, "polls": 0, "state": None, "health": None, "error": None}
+    started = time.monotonic()
+    deadline = started + max(0.0, float(timeout))
+    delay = READY_BACKOFF_START
+    while True:
+        result["polls"] += 1
+        state = _service_active_state(service_name)
+        result["state"] = state
+        if state == "active":
+            if condition == "active":
+                result["ready"] = True
+            else:
+                remaining = max(0.2, min(READY_BACKOFF_MAX, deadline - time.monotonic()))
+                try:
+                    code, body = _fetch_health_json(f"http://localhost:{health_port}/health", remaining)
+                    result["health"] = body
+                    result["ready"] = _readiness_holds(condition, code, body)
+                    result["error"] = None if code == 200 else f"/health returned HTTP {code}"
+                except urllib.error.URLError as e:
+                    result["error"] = f"health server unreachable on port {health_port}: {e.reason}"
+                except Exception as e:
+                    result["error"] = str(e)
+        elif state in ("failed", "inactive") and time.monotonic() - started > READY_BACKOFF_MAX:
+            result["error"] = f"service is {state}"
+            break
+        if result["ready"]:
+            result["error"] = None
+            break
+        now = time.monotonic()
+        if now >= deadline:
+            result["error"] = result["error"] or f"service is {state}"
+            break
+        time.sleep(min(delay, deadline - now))
+        delay = min(delay * 2, READY_BACKOFF_MAX)
+    result["elapsed_ms"] = round((time.monotonic() - started) * 1000, 1)
+    return result
+
+def _report_wait(wait: Optional[str], config_path: Path, timeout: float) -> bool:
+    """wait_ready() for lifecycle helpers: True when no wait is requested or the tunnel got ready."""
+    if not wait:
+        return True
+    res = wait_ready(config_path, timeout, wait)
+    if not res["ready"]:
+        c_warn(f"{config_path.stem} not {res['condition']} after {res['elapsed_ms'] / 1000:.1f}s: {res['error']}")
+    return res["ready"]
+
+def run_tunnel(config_path: Path, wait: Optional[str] = READY_DEFAULT_CONDITION,
+               timeout: float = READY_DEFAULT_TIMEOUT):
+    """اجرای تانل از طریق systemd service (اگر در حال اجراست و کانفیگ/unit تغییر کرده، ریستارت)"""
+    unit_path = Path(f"/etc/systemd/system/netrix-{config_path.stem}.service")
+    if wait == "auto" and not unit_path.exists():
+        wait = "active"     # first start: the peer side may not exist yet
     if not create_systemd_service_for_tunnel(config_path):
         return False
-    
+    changed = file_write_changed(config_path) or file_write_changed(unit_path)
+    _, ok = converge_tunnel_service(config_path, changed, wait, timeout)
+    return ok
+
+def converge_tunnel_service(config_path: Path, changed: bool, wait: Optional[str] = READY_DEFAULT_CONDITION,
+                            timeout: float = READY_DEFAULT_TIMEOUT) -> tuple[str, bool]:
+    """
+    Bring a tunnel to running state: start it if stopped, restart it only if it runs
+    with a config/unit that changed. Returns (action, ok).
+    """
+    if get_service_status(config_path) == "active":
+        if not changed:
+            return "unchanged", True
+        return "restarted", restart_tunnel(config_path, reload=False, wait=wait, timeout=timeout)
+    return "started", start_tunnel_service(config_path, wait, timeout)
+
+def start_tunnel_service(config_path: Path, wait: Optional[str] = READY_DEFAULT_CONDITION,
+                         timeout: float = READY_DEFAULT_TIMEOUT) -> bool:
+    """enable + start سرویس موجود تانل (بدون بازنویسی unit)، سپس صبر تا آماده‌شدن"""
     service_name = f"netrix-{config_path.stem}"
     try:
         subprocess.run(["systemctl", "enable", service_name], check=False, timeout=5)
@@ -2552,7 +4788,7 @@ def run_tunnel(config_path: Path):
                 timeout=30 
             )
             if result.returncode == 0:
-                return True
+                return _report_wait(wait, config_path, timeout)
             else:
                 c_err(f"Failed to start service: {result.stderr}")
                 return False
@@ -2597,33 +4833,27 @@ def stop_tunnel(config_path: Path) -> bool:
     except Exception:
         return False
 
-def restart_tunnel(config_path: Path) -> bool:
-    """ریستارت تانل از طریق systemd service - با stop/start جداگانه برای cleanup کامل"""
+def restart_tunnel(config_path: Path, reload: bool = True, wait: Optional[str] = READY_DEFAULT_CONDITION,
+                   timeout: float = READY_DEFAULT_TIMEOUT) -> bool:
+    """ریستارت تانل از طریق systemd service - با stop/start جداگانه برای cleanup کامل، سپس صبر تا آماده‌شدن"""
     service_name = f"netrix-{config_path.stem}"
     try:
-        subprocess.run(
-            ["systemctl", "daemon-reload"],
-            capture_output=True,
-            text=True,
-            timeout=5
-        )
+        if reload:
+            subprocess.run(
+                ["systemctl", "daemon-reload"],
+                capture_output=True,
+                text=True,
+                timeout=5
+            )
         
-        stop_result = subprocess.run(
+        # systemctl stop returns once the unit is down; no settle delay is needed
+        subprocess.run(
             ["systemctl", "stop", service_name],
             capture_output=True,
             text=True,
             timeout=10
         )
         
-        time.sleep(1)
-        
-        check_result = subprocess.run(
-            ["systemctl", "is-active", service_name],
-            capture_output=True,
-            text=True,
-            timeout=3
-        )
-        
         start_result = subprocess.run(
             ["systemctl", "start", service_name],
             capture_output=True,
@@ -2632,17 +4862,7 @@ def restart_tunnel(config_path: Path) -> bool:
         )
         
         if start_result.returncode == 0:
-            time.sleep(0.5)
-            verify_result = subprocess.run(
-                ["systemctl", "is-active", service_name],
-                capture_output=True,
-                text=True,
-                timeout=3
-            )
-            if verify_result.returncode == 0 and verify_result.stdout.strip() == "active":
-                return True
-            else:
-                return False
+            return _report_wait(wait or "active", config_path, timeout)
         else:
             try:
                 check_result = subprocess.run(
@@ -2726,20 +4946,10 @@ def _rawsocket_dial_peer_from_config(config_path: Path) -> Optional[tuple]:
                 return (host, port_s)
     return None
 
-# ========== System Service ==========
-def create_systemd_service_for_tunnel(config_path: Path) -> bool:
-    """ساخت systemd service برای یک تانل خاص"""
-    netrix_bin = ensure_netrix_available()
-    if not netrix_bin:
-        return False
-    
-    service_name = f"netrix-{config_path.stem}"
-    service_path = Path(f"/etc/systemd/system/{service_name}.service")
-    
+def rawsocket_iptables_commands(config_path: Path) -> tuple[list, list]:
+    """Shell commands (start, stop) that keep conntrack and kernel RSTs away from a rawsocket tunnel's port."""
     rawsocket_port = _rawsocket_listen_port_from_config(config_path)
     dial_peer = _rawsocket_dial_peer_from_config(config_path)
-    exec_start_pre = ""
-    exec_stop_post = ""
     pre_cmds = []
     post_cmds = []
     if rawsocket_port:
@@ -2755,8 +4965,28 @@ def create_systemd_service_for_tunnel(config_path: Path) -> bool:
         pre_cmds.append(f"iptables -t mangle -D OUTPUT -p tcp -d {peer_ip} --dport {peer_port} --tcp-flags RST RST -j DROP 2>/dev/null; iptables -t mangle -A OUTPUT -p tcp -d {peer_ip} --dport {peer_port} --tcp-flags RST RST -j DROP")
         pre_cmds.append(f"iptables -t mangle -D PREROUTING -p tcp -s {peer_ip} --sport {peer_port} --tcp-flags RST RST -j DROP 2>/dev/null; iptables -t mangle -A PREROUTING -p tcp -s {peer_ip} --sport {peer_port} --tcp-flags RST RST -j DROP")
         post_cmds.append(f"iptables -t raw -D OUTPUT -p tcp -d {peer_ip} --dport {peer_port} -j NOTRACK 2>/dev/null; iptables -t raw -D PREROUTING -p tcp -s {peer_ip} --sport {peer_port} -j NOTRACK 2>/dev/null; iptables -t mangle -D OUTPUT -p tcp -d {peer_ip} --dport {peer_port} --tcp-flags RST RST -j DROP 2>/dev/null; iptables -t mangle -D PREROUTING -p tcp -s {peer_ip} --sport {peer_port} --tcp-flags RST RST -j DROP 2>/dev/null")
+    return pre_cmds, post_cmds
+
+# ========== System Service ==========
+def create_systemd_service_for_tunnel(config_path: Path, reload: bool = True) -> bool:
+    """ساخت systemd service برای یک تانل خاص (reload=False: daemon-reload به عهده‌ی caller)"""
+    netrix_bin = ensure_netrix_available()
+    if not netrix_bin:
+        return False
+    
+    service_name = f"netrix-{config_path.stem}"
+    service_path = Path(f"/etc/systemd/system/{service_name}.service")
+    
+    pre_cmds, post_cmds = rawsocket_iptables_commands(config_path)
+    pre_cmds += limits_unit_commands(config_path) + notrack_unit_commands(config_path)
+    start_post_cmds = tun_unit_commands(config_path)
+    exec_start_pre = ""
+    exec_start_post = ""
+    exec_stop_post = ""
     if pre_cmds:
         exec_start_pre = "ExecStartPre=-/bin/sh -c '" + "; ".join(pre_cmds) + "'\n"
+    if start_post_cmds:
+        exec_start_post = "ExecStartPost=-/bin/sh -c '" + "; ".join(start_post_cmds) + "'\n"
     if post_cmds:
         exec_stop_post = "ExecStopPost=-/bin/sh -c '" + "; ".join(post_cmds) + "'\n"
     
@@ -2766,7 +4996,7 @@ After=network.target
 
 [Service]
 Type=simple
-{exec_start_pre}{exec_stop_post}ExecStart={netrix_bin} -config {config_path}
+{exec_start_pre}{exec_start_post}{exec_stop_post}ExecStart={netrix_bin} -config {config_path}
 Restart=always
 RestartSec=2
 TimeoutStartSec=10
@@ -2786,24 +5016,30 @@ WantedBy=multi-user.target
 """
     
     try:
-        with open(service_path, "w") as f:
-            f.write(service_content)
-        os.chmod(service_path, 0o644)
-        try:
-            subprocess.run(
-                ["systemctl", "daemon-reload"],
-                check=False,
-                timeout=5,
-                capture_output=True
-            )
-        except subprocess.TimeoutExpired:
-            c_warn("  ⚠️  daemon-reload timeout (continuing anyway)")
+        changed = write_file_atomic(service_path, service_content, mode=0o644)
+        if changed and reload:
+            systemd_daemon_reload()
         
         return True
     except Exception as e:
         c_err(f"Failed to create service: {e}")
         return False
 
+def systemd_daemon_reload() -> bool:
+    try:
+        subprocess.run(
+            ["systemctl", "daemon-reload"],
+            check=False,
+            timeout=5,
+            capture_output=True
+        )
+        return True
+    except subprocess.TimeoutExpired:
+        c_warn("  ⚠️  daemon-reload timeout (continuing anyway)")
+    except Exception:
+        pass
+    return False
+
 def enable_service_for_tunnel(config_path: Path) -> bool:
     """فعال کردن systemd service برای تانل"""
     service_name = f"netrix-{config_path.stem}"
@@ -2863,6 +5099,8 @@ def cleanup_iptables_rules(config_path: Path) -> bool:
                 except Exception:
                     pass
 
+        remove_accounting(config_path)
+
         tun_cfg = cfg.get("tun", {})
         if not tun_cfg.get("enabled", False):
             return True 
@@ -3006,19 +5244,2938 @@ def delete_service_for_tunnel(config_path: Path) -> bool:
             service_path.unlink()
         
         try:
-            subprocess.run(
-                ["systemctl", "daemon-reload"],
-                check=False,
-                timeout=5,
-                capture_output=True
-            )
-        except subprocess.TimeoutExpired:
-            pass  
-        
+            subprocess.run(
+                ["systemctl", "daemon-reload"],
+                check=False,
+                timeout=5,
+                capture_output=True
+            )
+        except subprocess.TimeoutExpired:
+            pass  
+        
+        return True
+    except Exception:
+        return False
+
+# ========== Fleet ==========
+FLEET_MAX_PARALLEL_STARTS = 8
+
+def _deep_merge(base: dict, override: dict) -> dict:
+    merged = dict(base)
+    for key, value in (override or {}).items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _deep_merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+def load_fleet_spec(spec_path: Path) -> List[Dict[str, Any]]:
+    """
+    Read a fleet spec: `defaults:` shared by every entry of `tunnels:`, each entry overriding them.
+    Returns the merged per-tunnel specs; raises ValueError on an invalid file.
+    """
+    if not spec_path.is_file():
+        raise ValueError(f"fleet spec not found: {spec_path}")
+    try:
+        doc = yaml_safe_load(spec_path.read_text(encoding="utf-8"))
+    except yaml.YAMLError as e:
+        raise ValueError(f"invalid YAML in {spec_path}: {e}")
+    if not isinstance(doc, dict) or not isinstance(doc.get("tunnels"), list) or not doc["tunnels"]:
+        raise ValueError("fleet spec needs a non-empty 'tunnels:' list")
+    defaults = doc.get("defaults") or {}
+    if not isinstance(defaults, dict):
+        raise ValueError("fleet 'defaults:' must be a mapping")
+    specs = []
+    for i, entry in enumerate(doc["tunnels"], 1):
+        if not isinstance(entry, dict):
+            raise ValueError(f"tunnel #{i} must be a mapping")
+        specs.append(_deep_merge(defaults, entry))
+    return specs
+
+def _fleet_converge(config_path: Path, changed: bool, start: bool, wait: Optional[str] = READY_DEFAULT_CONDITION,
+                    timeout: float = READY_DEFAULT_TIMEOUT) -> tuple[str, bool, Optional[Dict[str, Any]]]:
+    """Bring one tunnel service to the desired state; returns (action, ok, readiness)."""
+    if not start:
+        return "written" if changed else "unchanged", True, None
+    action, ok = converge_tunnel_service(config_path, changed, wait=None)
+    if not ok or not wait or action == "unchanged":
+        return action, ok, None
+    readiness = wait_ready(config_path, timeout, wait)
+    return action, readiness["ready"], readiness
+
+def apply_fleet(specs: List[Dict[str, Any]], start: bool = True, wait: Optional[str] = READY_DEFAULT_CONDITION,
+                timeout: float = READY_DEFAULT_TIMEOUT) -> List[Dict[str, Any]]:
+    """
+    Render every tunnel of a fleet, write only the units that differ, do one daemon-reload
+    and then start/restart (in parallel) just the tunnels whose config or unit changed.
+    Each started tunnel counts as ok only once wait_ready() sees `wait` hold.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    parsed = [tunnel_cfg_from_spec(spec) for spec in specs]
+    # reject clashing targets before anything is written, so a bad fleet leaves the host untouched
+    labels = {}
+    for spec, (side, cfg) in zip(specs, parsed):
+        label = spec.get("name") or f"{side}:{cfg.get('tport') or cfg.get('transport')}"
+        target = tunnel_config_path(side, cfg)
+        if target in labels:
+            raise ValueError(f"tunnels '{labels[target]}' and '{label}' render to the same config {target.name}")
+        labels[target] = label
+    if not ensure_netrix_available():
+        raise RuntimeError("netrix binary not found")
+
+    results = []
+    for spec, (side, cfg), label in zip(specs, parsed, labels.values()):
+        config_path = write_tunnel_config(side, cfg, spec)
+        config_changed = file_write_changed(config_path)
+
+        unit_path = Path(f"/etc/systemd/system/netrix-{config_path.stem}.service")
+        first_start = not unit_path.exists()
+        unit_ok = create_systemd_service_for_tunnel(config_path, reload=False)
+        unit_changed = unit_ok and file_write_changed(unit_path)
+        results.append({
+            "name": label,
+            "stem": config_path.stem,
+            "config": str(config_path),
+            "config_changed": config_changed,
+            "unit_changed": unit_changed,
+            "start": bool(spec.get("start", start)) and start,
+            "wait": "active" if wait == "auto" and first_start else wait,
+            "action": "failed" if not unit_ok else None,
+            "ok": unit_ok,
+        })
+
+    if any(r["unit_changed"] for r in results):
+        systemd_daemon_reload()
+
+    todo = [r for r in results if r["ok"]]
+    if todo:
+        with ThreadPoolExecutor(max_workers=min(FLEET_MAX_PARALLEL_STARTS, len(todo))) as pool:
+            futures = {
+                pool.submit(_fleet_converge, Path(r["config"]), r["config_changed"] or r["unit_changed"],
+                            r["start"], r["wait"], timeout): r
+                for r in todo
+            }
+            for future, r in futures.items():
+                try:
+                    r["action"], r["ok"], readiness = future.result()
+                    if readiness:
+                        r["ready_ms"] = readiness["elapsed_ms"]
+                        if not readiness["ready"]:
+                            r["error"] = f"not {readiness['condition']}: {readiness['error']}"
+                except Exception as e:
+                    r["action"], r["ok"] = "failed", False
+                    r["error"] = str(e)
+    for r in results:
+        r.pop("wait")
+    return results
+
+# ========== Bench Harness ==========
+# A netrix server/client pair in two network namespaces joined by a veth pair, with optional
+# tc netem on both ends. Traffic comes from 'bench-gen' in the server namespace (through the
+# server's mapped port) and ends at 'bench-sink' in the client namespace.
+BENCH_NS = ("nxb-srv", "nxb-cli")
+BENCH_VETH = ("nxb-s", "nxb-c")
+BENCH_ADDRS = ("10.213.0.1", "10.213.0.2")
+BENCH_TUNNEL_PORT = 47100
+BENCH_MAP_PORT = 47101
+BENCH_SINK_PORT = 47102
+BENCH_HEALTH_PORTS = (47103, 47104)
+BENCH_ECHO_BYTES = 64
+BENCH_CHUNK_BYTES = 64 * 1024
+BENCH_ECHO_INTERVAL = 0.01
+BENCH_DEFAULT_SECONDS = 5
+BENCH_DEFAULT_STREAMS = 4
+BENCH_SETUP_TIMEOUT = 20
+
+def _ns_run(ns: Optional[str], *argv: str, check: bool = True, timeout: float = 10) -> subprocess.CompletedProcess:
+    cmd = (["ip", "netns", "exec", ns] if ns else []) + [str(a) for a in argv]
+    result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+    if check and result.returncode != 0:
+        raise RuntimeError(f"{' '.join(cmd)}: {(result.stderr or result.stdout).strip()}")
+    return result
+
+def bench_netns_down() -> None:
+    for ns in BENCH_NS:
+        subprocess.run(["ip", "netns", "del", ns], capture_output=True)
+
+def bench_netns_up() -> None:
+    """Create both namespaces and the veth link between them (replacing leftovers from an aborted run)."""
+    if not which("ip"):
+        raise RuntimeError("iproute2 (ip) not found")
+    bench_netns_down()
+    for ns in BENCH_NS:
+        _ns_run(None, "ip", "netns", "add", ns)
+    _ns_run(None, "ip", "link", "add", BENCH_VETH[0], "type", "veth", "peer", "name", BENCH_VETH[1])
+    for ns, dev, addr in zip(BENCH_NS, BENCH_VETH, BENCH_ADDRS):
+        _ns_run(None, "ip", "link", "set", dev, "netns", ns)
+        _ns_run(ns, "ip", "addr", "add", f"{addr}/30", "dev", dev)
+        _ns_run(ns, "ip", "link", "set", dev, "up")
+        _ns_run(ns, "ip", "link", "set", "lo", "up")
+
+def set_bench_netem(rtt_ms: float = 0.0, loss_pct: float = 0.0, rate_mbps: Optional[float] = None,
+                    jitter_ms: float = 0.0, reorder_pct: float = 0.0) -> None:
+    """Emulate the path on both veth ends: each direction gets half the RTT and jitter, and the full loss/reorder rate."""
+    for ns, dev in zip(BENCH_NS, BENCH_VETH):
+        if not rtt_ms and not loss_pct and not rate_mbps and not jitter_ms and not reorder_pct:
+            _ns_run(ns, "tc", "qdisc", "del", "dev", dev, "root", check=False)
+            continue
+        args = ["tc", "qdisc", "replace", "dev", dev, "root", "netem", "limit", "100000", "delay", f"{rtt_ms / 2:.3f}ms"]
+        if jitter_ms:
+            args += [f"{jitter_ms / 2:.3f}ms", "distribution", "normal"]
+        if reorder_pct:
+            args += ["reorder", f"{reorder_pct}%", "50%"]
+        if loss_pct:
+            args += ["loss", f"{loss_pct}%"]
+        if rate_mbps:
+            args += ["rate", f"{rate_mbps}mbit"]
+        try:
+            _ns_run(ns, *args)
+        except RuntimeError as e:
+            raise RuntimeError(f"tc netem unavailable (modprobe sch_netem?): {e}")
+
+def bench_scenario_label(rtt_ms: float = 0.0, loss_pct: float = 0.0, rate_mbps: Optional[float] = None,
+                         jitter_ms: float = 0.0, reorder_pct: float = 0.0) -> str:
+    """Short name of a netem setting; results are stored and compared per label ('veth' = no emulation)."""
+    if not rtt_ms and not loss_pct and not rate_mbps and not jitter_ms and not reorder_pct:
+        return "veth"
+    label = f"rtt {rtt_ms:g}±{jitter_ms:g}ms loss {loss_pct:g}%"
+    if reorder_pct:
+        label += f" reorder {reorder_pct:g}%"
+    if rate_mbps:
+        label += f" {rate_mbps:g}Mbit"
+    return label
+
+def _bench_ns_mac(ns: str, dev: str) -> str:
+    return _ns_run(ns, "cat", f"/sys/class/net/{dev}/address").stdout.strip()
+
+def serve_bench_sink(port: int = BENCH_SINK_PORT, bind: str = "0.0.0.0") -> None:
+    """Traffic sink: 'B' connections are drained and answered with the byte count, 'E' connections and UDP datagrams echo."""
+    import socketserver
+    import threading
+
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            sock = self.request
+            mode = sock.recv(1)
+            if mode == b"B":
+                total = 0
+                while True:
+                    data = sock.recv(BENCH_CHUNK_BYTES)
+                    if not data:
+                        break
+                    total += len(data)
+                sock.sendall(total.to_bytes(8, "big"))
+            elif mode == b"E":
+                buf = b""
+                while True:
+                    data = sock.recv(BENCH_ECHO_BYTES)
+                    if not data:
+                        break
+                    buf += data
+                    while len(buf) >= BENCH_ECHO_BYTES:
+                        sock.sendall(buf[:BENCH_ECHO_BYTES])
+                        buf = buf[BENCH_ECHO_BYTES:]
+
+    class Server(socketserver.ThreadingTCPServer):
+        allow_reuse_address = True
+        daemon_threads = True
+
+    class UDPHandler(socketserver.BaseRequestHandler):
+        def handle(self):
+            data, sock = self.request
+            sock.sendto(data, self.client_address)
+
+    udp = socketserver.UDPServer((bind, port), UDPHandler)
+    threading.Thread(target=udp.serve_forever, daemon=True).start()
+    with Server((bind, port), Handler) as server:
+        server.serve_forever()
+
+def _bench_echo(sock: socket.socket) -> float:
+    """One 64-byte round trip on an echo connection, in ms."""
+    t0 = time.perf_counter()
+    sock.sendall(b"\0" * BENCH_ECHO_BYTES)
+    got = 0
+    while got < BENCH_ECHO_BYTES:
+        data = sock.recv(BENCH_ECHO_BYTES - got)
+        if not data:
+            raise ConnectionError("echo connection closed")
+        got += len(data)
+    return (time.perf_counter() - t0) * 1000.0
+
+def wait_bench_path(host: str, port: int, timeout: float = BENCH_SETUP_TIMEOUT) -> Optional[float]:
+    """Poll until an echo makes it through the tunnel; returns the epoch time it first did, or None."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1) as sock:
+                sock.settimeout(1)
+                sock.sendall(b"E")
+                _bench_echo(sock)
+                return time.time()
+        except OSError:
+            time.sleep(0.05)
+    return None
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def run_bench_traffic(host: str, port: int, streams: int = BENCH_DEFAULT_STREAMS,
+                      seconds: float = BENCH_DEFAULT_SECONDS, udp_port: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Bulk streams plus one echo connection for the same window: goodput and round-trip latency under load.
+    With udp_port, a UDP echo probe runs alongside (udp_p50/p99 and loss through a mapped UDP port).
+    """
+    import threading
+    deadline = time.monotonic() + seconds
+    received: List[int] = []
+    rtts: List[float] = []
+    udp_rtts: List[float] = []
+    udp_sent = [0]
+    errors: List[str] = []
+    chunk = os.urandom(BENCH_CHUNK_BYTES)
+
+    def bulk():
+        try:
+            with socket.create_connection((host, port), timeout=5) as sock:
+                sock.sendall(b"B")
+                while time.monotonic() < deadline:
+                    sock.sendall(chunk)
+                sock.shutdown(socket.SHUT_WR)
+                sock.settimeout(30)
+                reply = b""
+                while len(reply) < 8:
+                    data = sock.recv(8 - len(reply))
+                    if not data:
+                        raise ConnectionError("sink closed before reporting")
+                    reply += data
+                received.append(int.from_bytes(reply, "big"))
+        except OSError as e:
+            errors.append(str(e))
+
+    def echo():
+        try:
+            with socket.create_connection((host, port), timeout=5) as sock:
+                sock.settimeout(5)
+                sock.sendall(b"E")
+                while time.monotonic() < deadline:
+                    rtts.append(_bench_echo(sock))
+                    time.sleep(BENCH_ECHO_INTERVAL)
+        except OSError as e:
+            errors.append(str(e))
+
+    def udp_echo():
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(1)
+            sock.connect((host, udp_port))
+            while time.monotonic() < deadline:
+                udp_sent[0] += 1
+                seq = udp_sent[0].to_bytes(8, "big")
+                t0 = time.perf_counter()
+                try:
+                    sock.send(seq + b"\0" * (BENCH_ECHO_BYTES - 8))
+                    while sock.recv(BENCH_ECHO_BYTES)[:8] != seq:
+                        pass
+                    udp_rtts.append((time.perf_counter() - t0) * 1000.0)
+                except OSError:
+                    pass        # timeout or ICMP unreachable: counted as lost
+                time.sleep(BENCH_ECHO_INTERVAL)
+
+    t0 = time.monotonic()
+    threads = [threading.Thread(target=bulk) for _ in range(streams)] + [threading.Thread(target=echo)]
+    if udp_port:
+        threads.append(threading.Thread(target=udp_echo))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - t0
+    total = sum(received)
+    result = {
+        "bytes": total,
+        "seconds": round(elapsed, 3),
+        "mbps": round(total * 8 / elapsed / 1e6, 2) if elapsed > 0 else 0.0,
+        "p50_ms": round(_percentile(rtts, 0.5), 3) if rtts else None,
+        "p99_ms": round(_percentile(rtts, 0.99), 3) if rtts else None,
+        "samples": len(rtts),
+        "errors": errors,
+    }
+    if udp_port:
+        result.update({
+            "udp_p50_ms": round(_percentile(udp_rtts, 0.5), 3) if udp_rtts else None,
+            "udp_p99_ms": round(_percentile(udp_rtts, 0.99), 3) if udp_rtts else None,
+            "udp_loss_pct": round(100.0 * (1 - len(udp_rtts) / udp_sent[0]), 2) if udp_sent[0] else None,
+        })
+    return result
+
+def _process_cpu_seconds(pid: int) -> float:
+    """utime + stime of a process, in seconds (0 once it has exited)."""
+    fields = _read_proc_text(f"/proc/{pid}/stat").rpartition(")")[2].split()
+    if len(fields) < 13:
+        return 0.0
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+def bench_pair_configs(cfg: Dict[str, Any]) -> tuple:
+    """
+    Server/client YAML dicts for the harness, derived from a parsed tunnel config of either side.
+    Transport, smux/kcp/rawsocket/advanced, compression and encryption are kept; addresses, ports
+    and mappings are rewritten for the veth pair. Direct-mode tunnels are benched in reverse mode.
+    """
+    import copy
+    transport = str(cfg.get("transport") or "")
+    if cfg.get("mode") == "client" and cfg.get("paths"):
+        transport = str(cfg["paths"][0].get("transport") or transport)
+    if transport == "l3" or not transport:
+        raise ValueError("the bench harness covers mux transports (not L3)")
+    pool = 8
+    for p in cfg.get("paths") or []:
+        if isinstance(p, dict) and p.get("connection_pool"):
+            pool = int(p["connection_pool"])
+            break
+    else:
+        pool = int(cfg.get("connection_pool") or pool)
+    drop = ("direct", "connect", "edge_ip", "connection_pool", "retry_interval", "dial_timeout", "aggressive_pool",
+            "listen", "paths", "tcp_ports", "udp_ports", "maps", "tun", "health_port", "max_sessions")
+    base = {k: copy.deepcopy(v) for k, v in cfg.items() if k not in drop}
+    base["transport"] = transport
+    base["verbose"] = False
+    server = dict(copy.deepcopy(base), mode="server", listen=f"{BENCH_ADDRS[0]}:{BENCH_TUNNEL_PORT}",
+                  tcp_ports=[f"{BENCH_MAP_PORT}={BENCH_SINK_PORT}"], udp_ports=[], health_port=BENCH_HEALTH_PORTS[0])
+    client = dict(copy.deepcopy(base), mode="client", health_port=BENCH_HEALTH_PORTS[1])
+    path = {"addr": f"{BENCH_ADDRS[0]}:{BENCH_TUNNEL_PORT}", "transport": transport, "connection_pool": pool,
+            "retry_interval": 1, "dial_timeout": 5, "aggressive_pool": False}
+    for p in cfg.get("paths") or []:
+        if isinstance(p, dict):
+            path.update({k: v for k, v in p.items() if k.startswith("reality") or k == "reality"})
+            break
+    client["paths"] = [path]
+    smux = server.get("smux") or {}
+    client["smux"] = dict(smux, mux_con=int(smux.get("mux_con") or get_default_smux_config(cfg.get("profile", "balanced")).get("mux_con", 8)))
+    server["smux"] = {k: v for k, v in smux.items() if k != "mux_con"}
+    if is_rawsocket_transport(transport):
+        for side_cfg, i in ((server, 0), (client, 1)):
+            block = dict(side_cfg.get("rawsocket") or {})
+            block.update(interface=BENCH_VETH[i], local_ip=BENCH_ADDRS[i], peer_ip=BENCH_ADDRS[1 - i])
+            block.pop("router_mac", None)
+            side_cfg["rawsocket"] = block
+    return server, client
+
+def apply_bench_params(server: Dict[str, Any], client: Dict[str, Any], params: Dict[str, Any]) -> None:
+    """Set dotted block.key values on both sides (smux.mux_con and paths.* only exist on the dialling client)."""
+    for dotted, value in params.items():
+        block, key = dotted.split(".", 1)
+        if block == "paths":
+            for path in client["paths"]:
+                path[key] = value
+            continue
+        sides = (client,) if dotted == "smux.mux_con" else (server, client)
+        for side_cfg in sides:
+            side_cfg.setdefault(block, {})[key] = value
+        if dotted == "smux.max_recv":
+            for side_cfg in (server, client):
+                side_cfg["smux"]["max_stream"] = max(65536, value // 2)
+        elif dotted in ("kcp.sndwnd", "rawsocket.snd_wnd"):
+            other = "rcvwnd" if block == "kcp" else "rcv_wnd"
+            for side_cfg in (server, client):
+                side_cfg[block][other] = value
+
+def run_bench_files(server_path: Path, client_path: Path, seconds: float = BENCH_DEFAULT_SECONDS,
+                    streams: int = BENCH_DEFAULT_STREAMS, udp: bool = False, host: str = "127.0.0.1",
+                    port: int = BENCH_MAP_PORT) -> Dict[str, Any]:
+    """
+    Start netrix on two rendered configs in the namespaces (bench_netns_up first), drive traffic
+    from the server namespace to host:port (the mapped port by default) once, stop it.
+    Logs land next to the configs. Never raises for tunnel failures.
+    """
+    netrix_bin = ensure_netrix_available()
+    if not netrix_bin:
+        raise RuntimeError("netrix binary not found")
+    result: Dict[str, Any] = {"ok": False}
+    procs = []
+    sides = ((server_path, BENCH_NS[0]), (client_path, BENCH_NS[1]))
+    try:
+        for path, ns in sides:
+            pre_cmds, _ = rawsocket_iptables_commands(path)
+            if pre_cmds:
+                _ns_run(ns, "sh", "-c", "; ".join(pre_cmds), check=False)
+        started = time.time()
+        for path, ns in sides:
+            log = open(path.with_suffix(".log"), "wb")
+            procs.append(subprocess.Popen(["ip", "netns", "exec", ns, netrix_bin, "-config", str(path)],
+                                          stdout=log, stderr=subprocess.STDOUT))
+            log.close()
+        gen_args = ["--host", host, "--port", port, "--streams", streams, "--seconds", seconds, "--wait", BENCH_SETUP_TIMEOUT]
+        if udp:
+            gen_args += ["--udp-port", port]
+        gen = _ns_run(BENCH_NS[0], *manager_command(), "bench-gen", *gen_args, "--json",
+                      check=False, timeout=BENCH_SETUP_TIMEOUT + seconds + 60)
+        cpu = sum(_process_cpu_seconds(p.pid) for p in procs)
+        try:
+            traffic = json.loads(gen.stdout)
+        except ValueError:
+            traffic = {"error": (gen.stderr or "bench-gen failed").strip().splitlines()[-1:]}
+        result.update(traffic)
+        if traffic.get("ready_at"):
+            result["setup_ms"] = round((traffic["ready_at"] - started) * 1000.0, 1)
+        result["cpu_seconds"] = round(cpu, 3)
+        if result.get("bytes"):
+            result["cpu_ms_per_mb"] = round(cpu * 1000.0 / (result["bytes"] / 1e6), 3)
+            result["ok"] = True
+        elif not result.get("error"):
+            tail = server_path.with_suffix(".log").read_text(errors="replace").strip().splitlines()[-3:]
+            result["error"] = "no traffic through the tunnel" + (f": {' | '.join(tail)}" if tail else "")
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+    return result
+
+def run_bench_trial(server: Dict[str, Any], client: Dict[str, Any], seconds: float = BENCH_DEFAULT_SECONDS,
+                    streams: int = BENCH_DEFAULT_STREAMS) -> Dict[str, Any]:
+    """Write a bench_pair_configs() pair to a temp dir and run it with run_bench_files()."""
+    import tempfile
+    workdir = Path(tempfile.mkdtemp(prefix="netrix-bench-"))
+    try:
+        if is_rawsocket_transport(str(server.get("transport"))):
+            server["rawsocket"]["router_mac"] = _bench_ns_mac(BENCH_NS[1], BENCH_VETH[1])
+            client["rawsocket"]["router_mac"] = _bench_ns_mac(BENCH_NS[0], BENCH_VETH[0])
+        paths = []
+        for name, side_cfg in (("server", server), ("client", client)):
+            path = workdir / f"{name}_{BENCH_TUNNEL_PORT}.yaml"
+            write_file_atomic(path, yaml.safe_dump(side_cfg, sort_keys=False))
+            paths.append(path)
+        return run_bench_files(paths[0], paths[1], seconds, streams)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def start_bench_sink() -> subprocess.Popen:
+    return subprocess.Popen(["ip", "netns", "exec", BENCH_NS[1], *manager_command(),
+                             "bench-sink", "--port", str(BENCH_SINK_PORT)],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+# ========== Autotune ==========
+AUTOTUNE_SPACE = {
+    "smux.mux_con": [2, 4, 8, 16, 32],
+    "smux.frame_size": [8192, 16384, 32768, 65535],
+    "smux.max_recv": [1 << 20, 2 << 20, 4 << 20, 8 << 20, 16 << 20, 32 << 20],
+    "kcp.interval": [5, 10, 20, 40],
+    "kcp.nodelay": [0, 1],
+    "kcp.sndwnd": [256, 512, 1024, 2048, 4096],
+    "rawsocket.snd_wnd": [512, 1024, 2048, 4096, 8192],
+}
+AUTOTUNE_WEIGHTS = {"throughput": 1.0, "p99": 0.5, "cpu": 0.25}
+AUTOTUNE_MIN_GAIN = 0.02            # a candidate must beat the incumbent by 2% to replace it
+AUTOTUNE_DEFAULT_ROUNDS = 2
+
+def autotune_score(trial: Dict[str, Any], baseline: Dict[str, Any]) -> float:
+    """Throughput gain minus weighted p99 and CPU/MB regressions, all relative to the baseline run."""
+    if not trial.get("ok"):
+        return float("-inf")
+    score = AUTOTUNE_WEIGHTS["throughput"] * trial["mbps"] / max(baseline["mbps"], 1e-9)
+    if trial.get("p99_ms") and baseline.get("p99_ms"):
+        score -= AUTOTUNE_WEIGHTS["p99"] * (trial["p99_ms"] / baseline["p99_ms"] - 1.0)
+    if trial.get("cpu_ms_per_mb") and baseline.get("cpu_ms_per_mb"):
+        score -= AUTOTUNE_WEIGHTS["cpu"] * (trial["cpu_ms_per_mb"] / baseline["cpu_ms_per_mb"] - 1.0)
+    return round(score, 4)
+
+def autotune_params(cfg: Dict[str, Any], server: Dict[str, Any], client: Dict[str, Any]) -> Dict[str, Any]:
+    """Searchable parameters present in this tunnel, with their current values as the starting point."""
+    current = {}
+    for dotted in AUTOTUNE_SPACE:
+        block, key = dotted.split(".", 1)
+        source = client if dotted == "smux.mux_con" else server
+        if block in source and key in (source[block] or {}):
+            current[dotted] = source[block][key]
+    return current
+
+def autotune_tunnel(cfg: Dict[str, Any], rtt_ms: float = 0.0, loss_pct: float = 0.0, rate_mbps: Optional[float] = None,
+                    seconds: float = BENCH_DEFAULT_SECONDS, streams: int = BENCH_DEFAULT_STREAMS,
+                    rounds: int = AUTOTUNE_DEFAULT_ROUNDS, progress=None) -> Dict[str, Any]:
+    """Coordinate descent over AUTOTUNE_SPACE on the bench harness under netem conditions mirroring the path."""
+    server, client = bench_pair_configs(cfg)
+    best = autotune_params(cfg, server, client)
+    bench_netns_up()
+    sink = None
+    try:
+        set_bench_netem(rtt_ms, loss_pct, rate_mbps)
+        sink = start_bench_sink()
+
+        def trial(params):
+            s, c = bench_pair_configs(cfg)
+            apply_bench_params(s, c, params)
+            return run_bench_trial(s, c, seconds, streams)
+
+        baseline = trial(best)
+        if not baseline.get("ok"):
+            raise RuntimeError(f"baseline run failed: {baseline.get('error')}")
+        best_score = autotune_score(baseline, baseline)
+        history = [{"params": dict(best), "result": baseline, "score": best_score}]
+        if progress:
+            progress(f"baseline: {baseline['mbps']} Mbps, p99 {baseline.get('p99_ms')} ms, score {best_score}")
+        for _ in range(rounds):
+            improved = False
+            for dotted in list(best):
+                for value in AUTOTUNE_SPACE[dotted]:
+                    if value == best[dotted]:
+                        continue
+                    candidate = dict(best, **{dotted: value})
+                    result = trial(candidate)
+                    score = autotune_score(result, baseline)
+                    history.append({"params": candidate, "result": result, "score": score})
+                    if progress:
+                        progress(f"{dotted}={value}: {result.get('mbps', 0)} Mbps, p99 {result.get('p99_ms')} ms, score {score}")
+                    if score > best_score * (1.0 + AUTOTUNE_MIN_GAIN):
+                        best, best_score, improved = candidate, score, True
+            if not improved:
+                break
+    finally:
+        if sink:
+            sink.terminate()
+        bench_netns_down()
+    return {"conditions": {"rtt_ms": rtt_ms, "loss_pct": loss_pct, "rate_mbps": rate_mbps},
+            "baseline": baseline, "best": best, "score": best_score, "trials": len(history), "history": history}
+
+def autotune_to_updates(best: Dict[str, Any]) -> Dict[str, dict]:
+    """update_tunnel_config() updates for tuned values, including the paired window/stream keys."""
+    server, client = {}, {}
+    apply_bench_params(server, client, best)
+    updates: Dict[str, dict] = {}
+    for side_cfg in (client, server):
+        for block, values in side_cfg.items():
+            updates.setdefault(block, {}).update(values)
+    return updates
+
+def save_tuned_profile(name: str, base_profile: str, updates: Dict[str, dict], note: str = "") -> Path:
+    """Store tuned values as profiles/<name>.yaml next to the tunnel configs."""
+    if not re.fullmatch(r"[a-z0-9][a-z0-9_.-]*", name or "") or name in BUILTIN_PROFILES:
+        raise ValueError(f"invalid profile name: {name!r} (lowercase, not a built-in name)")
+    resolve_netrix_config_dir(create=True)
+    path = profiles_dir() / f"{name}.yaml"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    data = {"base": builtin_profile_name(base_profile), "description": note}
+    data.update({k: v for k, v in updates.items() if k in PROFILE_SECTIONS})
+    write_file_atomic(path, yaml.safe_dump(data, sort_keys=False))
+    load_custom_profiles(refresh=True)
+    return path
+
+# ========== Transport Bench ==========
+# Every transport on the bench harness, with configs rendered by the same builders the wizards use.
+BENCH_PSK = "netrix-bench"
+BENCH_TUN_ADDRS = ("10.214.0.1/30", "10.214.0.2/30")
+BENCH_L3_PORT = 47105
+
+def bench_transport_specs(transport: str, profile: str = "balanced", tun_streams: Optional[int] = None) -> tuple:
+    """
+    Server/client tunnel specs (tunnel_cfg_from_spec() shape) for one transport on the veth pair;
+    with tun_streams, non-L3 transports run in TUN mode on BENCH_TUN_ADDRS as well.
+    """
+    maps = [f"{BENCH_MAP_PORT}={BENCH_SINK_PORT}"]
+    if transport == "l3":
+        l3 = {"carrier": "udp", "psk": BENCH_PSK, "listen_port": BENCH_L3_PORT, "dst_port": BENCH_L3_PORT}
+        server = {"side": "server", "transport": "l3", "profile": profile, "tcp_ports": maps, "udp_ports": maps,
+                  "tun": {"name": "nxb0", "local": BENCH_TUN_ADDRS[0], "remote": BENCH_TUN_ADDRS[1],
+                          "health_port": BENCH_HEALTH_PORTS[0]},
+                  "l3": dict(l3, listen_ip=BENCH_ADDRS[0], dst_ip=BENCH_ADDRS[1], interface=BENCH_VETH[0])}
+        client = {"side": "client", "transport": "l3", "profile": profile,
+                  "tun": {"name": "nxb0", "local": BENCH_TUN_ADDRS[1], "remote": BENCH_TUN_ADDRS[0],
+                          "health_port": BENCH_HEALTH_PORTS[1]},
+                  "l3": dict(l3, listen_ip=BENCH_ADDRS[1], dst_ip=BENCH_ADDRS[0], interface=BENCH_VETH[1])}
+        if tun_streams:
+            server["tun"]["streams"] = client["tun"]["streams"] = tun_streams
+        return server, client
+    common = {"transport": transport, "profile": profile, "psk": BENCH_PSK, "tport": BENCH_TUNNEL_PORT}
+    server = dict(common, side="server", listen=f"{BENCH_ADDRS[0]}:{BENCH_TUNNEL_PORT}", tcp_ports=maps, udp_ports=maps,
+                  health_port=BENCH_HEALTH_PORTS[0])
+    client = dict(common, side="client", peer=BENCH_ADDRS[0], retry_interval=1, dial_timeout=5,
+                  health_port=BENCH_HEALTH_PORTS[1])
+    if transport in ("tlsmux", "wssmux", "realitymux"):
+        # no cert files: the core generates a self-signed pair, which both ends accept here
+        server["tls_insecure_skip_verify"] = client["tls_insecure_skip_verify"] = True
+    if transport == "realitymux":
+        for spec in (server, client):
+            spec.update(reality_sni="cloudflare.com", reality_fingerprint="chrome")
+    if is_rawsocket_transport(transport):
+        for spec, i in ((server, 0), (client, 1)):
+            spec.update(rawsocket_interface=BENCH_VETH[i], rawsocket_local_ip=BENCH_ADDRS[i],
+                        rawsocket_peer_ip=BENCH_ADDRS[1 - i],
+                        rawsocket_router_mac=_bench_ns_mac(BENCH_NS[1 - i], BENCH_VETH[1 - i]))
+    if tun_streams:
+        for spec, i in ((server, 0), (client, 1)):
+            spec["tun"] = {"name": "nxb0", "local": BENCH_TUN_ADDRS[i], "routes": [], "streams": tun_streams}
+    return server, client
+
+def render_bench_pair(transport: str, profile: str, workdir: Path, tun_streams: Optional[int] = None) -> tuple:
+    """Render the bench specs with create_server/client_config_file into workdir (namespaces must be up)."""
+    import contextlib
+    import io
+    server_spec, client_spec = bench_transport_specs(transport, profile, tun_streams)
+    with contextlib.redirect_stdout(io.StringIO()):        # the builders narrate for the wizards
+        _, server_cfg = tunnel_cfg_from_spec(server_spec)
+        server_path = create_server_config_file(BENCH_TUNNEL_PORT, server_cfg, workdir)
+        _, client_cfg = tunnel_cfg_from_spec(client_spec)
+        client_path = create_client_config_file(client_cfg, workdir)
+    return server_path, client_path
+
+def bench_transports(transports: List[str], profile: str = "balanced", seconds: float = BENCH_DEFAULT_SECONDS,
+                     streams: int = BENCH_DEFAULT_STREAMS, rtt_ms: float = 0.0, loss_pct: float = 0.0,
+                     rate_mbps: Optional[float] = None, progress=None, repeat: int = 1) -> List[Dict[str, Any]]:
+    """`repeat` runs per transport: throughput, setup time, TCP/UDP echo p50/p99 and CPU per MB."""
+    if not ensure_netrix_available():
+        raise RuntimeError("netrix binary not found")
+    bench_netns_up()
+    sink = None
+    try:
+        set_bench_netem(rtt_ms, loss_pct, rate_mbps)
+        sink = start_bench_sink()
+        scenario = bench_scenario_label(rtt_ms, loss_pct, rate_mbps)
+        return [dict(_bench_transport_run(transport, profile, seconds, streams, progress), scenario=scenario)
+                for _ in range(max(1, repeat)) for transport in transports]
+    finally:
+        if sink:
+            sink.terminate()
+        bench_netns_down()
+
+def _bench_transport_run(transport: str, profile: str, seconds: float, streams: int, progress=None) -> Dict[str, Any]:
+    """One transport/profile run on namespaces that are already up with the sink running."""
+    import tempfile
+    workdir = Path(tempfile.mkdtemp(prefix="netrix-bench-"))
+    try:
+        server_path, client_path = render_bench_pair(transport, profile, workdir)
+        result = run_bench_files(server_path, client_path, seconds, streams, udp=True)
+    except (ValueError, RuntimeError) as e:
+        result = {"ok": False, "error": str(e)}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    result = dict(transport=transport, profile=profile, **result)
+    if progress:
+        progress(f"{transport}/{profile}: " + (f"{result['mbps']} Mbps, p99 {result.get('p99_ms')} ms" if result["ok"]
+                                               else f"failed ({result.get('error')})"))
+    return result
+
+# ========== WAN Matrix ==========
+# transport x profile over a netem grid of the paths we actually run on (80-200 ms, 0.5-5% loss, jitter)
+WAN_GRID_DEFAULTS = {
+    "rtt_ms": [80.0, 200.0],
+    "jitter_ms": [10.0],
+    "loss_pct": [0.5, 3.0],
+    "reorder_pct": [0.0],
+    "rate_mbps": [0.0],
+}
+
+def wan_scenarios(grid: Dict[str, List[float]]) -> List[Dict[str, Any]]:
+    """Cartesian product of the grid axes (rate 0 = unlimited), each with a short label."""
+    import itertools
+    axes = list(WAN_GRID_DEFAULTS)
+    scenarios = []
+    for values in itertools.product(*(grid.get(axis) or WAN_GRID_DEFAULTS[axis] for axis in axes)):
+        scenario = dict(zip(axes, values))
+        scenario["label"] = bench_scenario_label(scenario["rtt_ms"], scenario["loss_pct"], scenario["rate_mbps"],
+                                                 scenario["jitter_ms"], scenario["reorder_pct"])
+        scenarios.append(scenario)
+    return scenarios
+
+def rank_wan_matrix(runs: List[Dict[str, Any]]) -> tuple:
+    """
+    Score each run against the best values seen in its scenario (autotune_score weights), then rank
+    transport/profile pairs by mean score over all scenarios. A failed run scores 1 below the
+    scenario's worst working run (autotune_score goes negative), so it never outranks one.
+    Returns (ranking rows, per-scenario winners).
+    """
+    by_scenario: Dict[str, List[Dict[str, Any]]] = {}
+    for run in runs:
+        by_scenario.setdefault(run["scenario"], []).append(run)
+    winners = []
+    for label, group in by_scenario.items():
+        ok = [r for r in group if r.get("ok")]
+        if not ok:
+            winners.append({"scenario": label, "winner": None})
+            continue
+        reference = {"mbps": max(r["mbps"] for r in ok)}
+        for key in ("p99_ms", "cpu_ms_per_mb"):
+            values = [r[key] for r in ok if r.get(key)]
+            if values:
+                reference[key] = min(values)
+        for run in ok:
+            run["score"] = autotune_score(run, reference)
+        floor = min(r["score"] for r in ok) - 1.0
+        for run in group:
+            if not run.get("ok"):
+                run["score"] = floor
+        best = max(ok, key=lambda r: r["score"])
+        winners.append({"scenario": label, "winner": f"{best['transport']}/{best['profile']}", "score": best["score"]})
+    pairs: Dict[tuple, List[Dict[str, Any]]] = {}
+    for run in runs:
+        pairs.setdefault((run["transport"], run["profile"]), []).append(run)
+    won = {}
+    for w in winners:
+        if w["winner"]:
+            won[w["winner"]] = won.get(w["winner"], 0) + 1
+    ranking = []
+    for (transport, profile), group in pairs.items():
+        ok = [r for r in group if r.get("ok")]
+        p99s = [r["p99_ms"] for r in ok if r.get("p99_ms") is not None]
+        ranking.append({
+            "transport": transport,
+            "profile": profile,
+            "score": round(sum(r.get("score", 0.0) for r in group) / len(group), 4),
+            "mean_mbps": round(sum(r["mbps"] for r in ok) / len(ok), 2) if ok else None,
+            "worst_p99_ms": max(p99s) if p99s else None,
+            "wins": won.get(f"{transport}/{profile}", 0),
+            "failures": len(group) - len(ok),
+        })
+    ranking.sort(key=lambda row: row["score"], reverse=True)
+    for i, row in enumerate(ranking, 1):
+        row["rank"] = i
+    return ranking, winners
+
+def bench_wan_matrix(transports: List[str], profiles: List[str], scenarios: List[Dict[str, Any]],
+                     seconds: float = BENCH_DEFAULT_SECONDS, streams: int = BENCH_DEFAULT_STREAMS,
+                     progress=None) -> Dict[str, Any]:
+    """Every transport x profile under every netem scenario, ranked with rank_wan_matrix()."""
+    if not ensure_netrix_available():
+        raise RuntimeError("netrix binary not found")
+    runs = []
+    bench_netns_up()
+    sink = None
+    try:
+        sink = start_bench_sink()
+        for scenario in scenarios:
+            set_bench_netem(scenario["rtt_ms"], scenario["loss_pct"], scenario["rate_mbps"] or None,
+                            scenario["jitter_ms"], scenario["reorder_pct"])
+            if progress:
+                progress(f"-- {scenario['label']}")
+            for profile in profiles:
+                for transport in transports:
+                    runs.append(dict(_bench_transport_run(transport, profile, seconds, streams, progress),
+                                     scenario=scenario["label"]))
+    finally:
+        if sink:
+            sink.terminate()
+        bench_netns_down()
+    ranking, winners = rank_wan_matrix(runs)
+    return {"scenarios": scenarios, "seconds": seconds, "streams": streams,
+            "ranking": ranking, "winners": winners, "runs": runs}
+
+# ========== Bench Results ==========
+# Every bench run is appended to a JSON-lines store keyed by core version, host fingerprint,
+# transport, profile and scenario, so a core update can be compared against the previous one.
+BENCH_RESULT_METRICS = {"mbps": "higher", "p50_ms": "lower", "p99_ms": "lower", "cpu_ms_per_mb": "lower"}
+BENCH_SIGNIFICANCE = 0.05
+BENCH_MIN_CHANGE = 0.05             # ignore significant but tiny (<5%) shifts
+BENCH_PERMUTATIONS = 5000
+CANARY_TRANSPORTS = ("tcpmux", "kcpmux")
+CANARY_SECONDS = 3
+CANARY_REPEAT = 5                   # 5 vs 5 samples is the smallest set that can reach p < 0.01
+
+def bench_results_path() -> Path:
+    return NETRIX_CONFIG_DIR / "bench" / "results.jsonl"
+
+def netrix_core_version(binary: Optional[str] = None) -> str:
+    """Version reported by `netrix -version` (the first x.y[.z] token, else the first line)."""
+    binary = binary or (NETRIX_BINARY if os.path.exists(NETRIX_BINARY) else which("netrix"))
+    if not binary:
+        return "unknown"
+    try:
+        out = subprocess.run([binary, "-version"], capture_output=True, text=True, timeout=5).stdout.strip()
+    except Exception:
+        return "unknown"
+    match = re.search(r"v?\d+\.\d+(?:\.\d+)?(?:[-+][\w.]+)?", out)
+    if match:
+        return match.group(0)
+    return out.splitlines()[0].strip() if out else "unknown"
+
+def host_fingerprint() -> Dict[str, Any]:
+    """CPU model, cores, memory and kernel, plus a short id over them; results only compare within one id."""
+    import hashlib
+    cpu = ""
+    for line in _read_proc_text("/proc/cpuinfo").splitlines():
+        if line.startswith(("model name", "Model")):
+            cpu = line.split(":", 1)[1].strip()
+            break
+    mem_kb = 0
+    for line in _read_proc_text("/proc/meminfo").splitlines():
+        if line.startswith("MemTotal:"):
+            mem_kb = int(line.split()[1])
+            break
+    info = {"cpu": cpu, "cores": os.cpu_count() or 1, "mem_gb": round(mem_kb / 1048576, 1), "kernel": os.uname().release}
+    info["id"] = hashlib.sha1(json.dumps(info, sort_keys=True).encode()).hexdigest()[:12]
+    return info
+
+def save_bench_results(runs: List[Dict[str, Any]], seconds: float, streams: int,
+                       core_version: Optional[str] = None) -> int:
+    """Append runs (from bench/bench-matrix/canary) to the results store; returns how many were written."""
+    core_version = core_version or netrix_core_version()
+    host = host_fingerprint()
+    ts = int(time.time())
+    path = bench_results_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    keys = ("ok", "mbps", "p50_ms", "p99_ms", "udp_p99_ms", "udp_loss_pct", "cpu_ms_per_mb", "setup_ms", "error")
+    with open(path, "a") as f:
+        for run in runs:
+            record = {"ts": ts, "core_version": core_version, "host": host["id"], "host_info": host,
+                      "transport": run.get("transport"), "profile": run.get("profile"),
+                      "scenario": run.get("scenario", "veth"), "seconds": seconds, "streams": streams}
+            record.update({k: run[k] for k in keys if run.get(k) is not None})
+            f.write(json.dumps(record) + "\n")
+    return len(runs)
+
+def load_bench_results(host: Optional[str] = None) -> List[Dict[str, Any]]:
+    path = bench_results_path()
+    if not path.exists():
+        return []
+    records = []
+    for line in path.read_text(errors="replace").splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if host in (None, "any") or record.get("host") == host:
+            records.append(record)
+    return records
+
+def resolve_core_version(name: str, records: List[Dict[str, Any]]) -> str:
+    """'current' = installed core, 'previous' = most recently benched other version; anything else as given."""
+    if name == "current":
+        return netrix_core_version()
+    if name == "previous":
+        current = netrix_core_version()
+        for record in sorted(records, key=lambda r: r.get("ts", 0), reverse=True):
+            if record.get("core_version") != current:
+                return record["core_version"]
+        raise ValueError("no stored results for a core version other than the current one")
+    return name
+
+def permutation_p_value(a: List[float], b: List[float]) -> Optional[float]:
+    """Two-sided permutation test on the difference of means (exhaustive when small). None below 2 samples a side."""
+    import itertools
+    import math
+    import random
+    if len(a) < 2 or len(b) < 2:
+        return None
+    pooled = a + b
+    n = len(a)
+    observed = abs(sum(a) / n - sum(b) / len(b))
+    total = sum(pooled)
+
+    def diff(idx):
+        part = sum(pooled[i] for i in idx)
+        return abs(part / n - (total - part) / len(b))
+
+    if math.comb(len(pooled), n) <= BENCH_PERMUTATIONS:
+        splits = list(itertools.combinations(range(len(pooled)), n))
+    else:
+        rng = random.Random(0)
+        splits = [rng.sample(range(len(pooled)), n) for _ in range(BENCH_PERMUTATIONS)]
+    hits = sum(1 for idx in splits if diff(idx) >= observed - 1e-12)
+    return hits / len(splits)
+
+def compare_bench_results(old: str, new: str, host: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Per transport/profile/scenario/run length/streams/metric: means, relative change and permutation
+    p-value between two core versions (runs of different length or stream count are never pooled).
+    verdict is regression/improvement only when p < BENCH_SIGNIFICANCE and the change is at least
+    BENCH_MIN_CHANGE.
+    """
+    groups: Dict[tuple, Dict[str, List[Dict[str, Any]]]] = {}
+    for record in load_bench_results(host):
+        if record.get("ok") and record.get("core_version") in (old, new):
+            key = (record["transport"], record["profile"], record["scenario"],
+                   float(record.get("seconds") or 0), int(record.get("streams") or 0))
+            groups.setdefault(key, {old: [], new: []})[record["core_version"]].append(record)
+    rows = []
+    for (transport, profile, scenario, seconds, streams), by_version in sorted(groups.items()):
+        if not by_version[old] or not by_version[new]:
+            continue
+        for metric, better in BENCH_RESULT_METRICS.items():
+            a = [r[metric] for r in by_version[old] if r.get(metric) is not None]
+            b = [r[metric] for r in by_version[new] if r.get(metric) is not None]
+            if not a or not b:
+                continue
+            mean_a, mean_b = sum(a) / len(a), sum(b) / len(b)
+            change = (mean_b - mean_a) / mean_a if mean_a else 0.0
+            p_value = permutation_p_value(a, b)
+            worse = change < 0 if better == "higher" else change > 0
+            if abs(change) < BENCH_MIN_CHANGE:
+                verdict = "no change"
+            elif p_value is None:
+                verdict = "insufficient data"
+            elif p_value < BENCH_SIGNIFICANCE:
+                verdict = "regression" if worse else "improvement"
+            else:
+                verdict = "not significant"
+            rows.append({"transport": transport, "profile": profile, "scenario": scenario,
+                         "seconds": seconds, "streams": streams, "metric": metric,
+                         "old": round(mean_a, 3), "new": round(mean_b, 3), "samples": f"{len(a)}/{len(b)}",
+                         "change_pct": round(change * 100, 1),
+                         "p_value": round(p_value, 4) if p_value is not None else None, "verdict": verdict})
+    return rows
+
+def run_canary_bench(progress=None) -> str:
+    """CANARY_REPEAT runs of CANARY_TRANSPORTS on the plain veth pair with the installed core, stored; returns its version."""
+    version = netrix_core_version()
+    runs = bench_transports(list(CANARY_TRANSPORTS), "balanced", CANARY_SECONDS, BENCH_DEFAULT_STREAMS,
+                            progress=progress, repeat=CANARY_REPEAT)
+    save_bench_results(runs, CANARY_SECONDS, BENCH_DEFAULT_STREAMS, version)
+    return version
+
+def canary_regressions(old: str, new: str) -> List[Dict[str, Any]]:
+    host = host_fingerprint()["id"]
+    return [row for row in compare_bench_results(old, new, host)
+            if row["verdict"] == "regression" and row["transport"] in CANARY_TRANSPORTS
+            and row["profile"] == "balanced" and row["scenario"] == "veth"
+            and row["seconds"] == CANARY_SECONDS and row["streams"] == BENCH_DEFAULT_STREAMS]
+
+# ========== Pool Sizing ==========
+# connection_pool x mux_con for the dialling side (direct server, reverse client).
+POOL_MIN = 2
+POOL_MAX = 64
+POOL_CPU_CAP = 16                   # beyond this, more connections stop spreading crypto/IO over cores
+MUX_CON_MAX = 32
+POOL_DEFAULT_CONCURRENCY = 64
+POOL_DEFAULT_BANDWIDTH = 100
+
+def cfg_main_transport(cfg: dict) -> str:
+    """Transport of a parsed config (client configs keep it on their first path)."""
+    for p in cfg.get("paths") or []:
+        if isinstance(p, dict) and p.get("transport"):
+            return str(p["transport"])
+    return str(cfg.get("transport") or "tcpmux")
+
+def compute_pool_sizing(rtt_ms: float, bandwidth_mbps: float, cfg: dict,
+                        concurrency: int = POOL_DEFAULT_CONCURRENCY, cores: Optional[int] = None) -> Dict[str, Any]:
+    """
+    connection_pool: enough transport connections that their per-connection windows (TCP buffer,
+    or KCP/rawsocket send window x MTU) cover the BDP, and at least one per core (capped).
+    mux_con: enough smux sessions over the pool that each active stream keeps a full max_stream
+    window inside its session's max_recv, and that the sessions' windows also cover the BDP.
+    """
+    if rtt_ms <= 0 or bandwidth_mbps <= 0 or concurrency < 1:
+        raise ValueError("RTT, bandwidth and concurrency must be positive")
+    profile = cfg.get("profile", "balanced")
+    transport = cfg_main_transport(cfg)
+    cores = cores or os.cpu_count() or 1
+    smux = {**get_default_smux_config(profile), **(cfg.get("smux") or {})}
+    bdp = int(bandwidth_mbps * 1_000_000 / 8 * rtt_ms / 1000.0)
+    if transport == "kcpmux":
+        kcp = {**get_default_kcp_config(profile), **(cfg.get("kcp") or {})}
+        conn_window = int(kcp["sndwnd"]) * int(kcp["mtu"])
+    elif is_rawsocket_transport(transport):
+        raw = {**get_default_rawsocket_config(profile), **(cfg.get("rawsocket") or {})}
+        conn_window = int(raw["snd_wnd"]) * int(raw["mtu"])
+    else:
+        advanced = {**get_default_advanced_config(transport, profile), **(cfg.get("advanced") or {})}
+        conn_window = int(advanced["tcp_read_buffer"])
+    max_recv, max_stream = int(smux["max_recv"]), int(smux["max_stream"])
+    pool_bdp = -(-bdp // max(1, conn_window))
+    pool_cpu = min(cores, POOL_CPU_CAP)
+    pool = _clamp(max(pool_bdp, pool_cpu, POOL_MIN), POOL_MIN, POOL_MAX)
+    streams_per_session = max(1, max_recv // max(1, max_stream))
+    sessions = max(-(-concurrency // streams_per_session), -(-bdp // max(1, max_recv)), pool)
+    mux_con = _clamp(-(-sessions // pool), 1, MUX_CON_MAX)
+    warnings = []
+    if pool_bdp > POOL_MAX:
+        warnings.append(f"BDP {format_bytes(bdp)} needs {pool_bdp} connections of {format_bytes(conn_window)}; "
+                        f"capped at {POOL_MAX} (raise the transport window: see 'size')")
+    if -(-sessions // pool) > MUX_CON_MAX:
+        warnings.append(f"{concurrency} streams need {sessions} sessions; mux_con capped at {MUX_CON_MAX} "
+                        f"(raise smux max_recv or lower max_stream)")
+    return {
+        "transport": transport,
+        "rtt_ms": rtt_ms,
+        "bandwidth_mbps": bandwidth_mbps,
+        "bdp_bytes": bdp,
+        "cores": cores,
+        "concurrency": concurrency,
+        "conn_window": conn_window,
+        "connection_pool": pool,
+        "mux_con": mux_con,
+        "sessions": pool * mux_con,
+        "limits": {"bdp": pool_bdp, "cpu": pool_cpu, "streams": -(-concurrency // streams_per_session)},
+        "warnings": warnings,
+    }
+
+def validate_pool_sizing(cfg: dict, sizing: Dict[str, Any], seconds: float = BENCH_DEFAULT_SECONDS,
+                         streams: int = BENCH_DEFAULT_STREAMS) -> Dict[str, Any]:
+    """Current vs sized pool/mux_con on the bench harness under the sizing's RTT; accepted unless it scores worse."""
+    server, client = bench_pair_configs(cfg)
+    # the bench pair has one path, so the current side gets the sum over the config's paths
+    current_pool = sum(int(p.get("connection_pool") or 0) for p in cfg.get("paths") or [] if isinstance(p, dict))
+    current = {"paths.connection_pool": current_pool or client["paths"][0]["connection_pool"],
+               "smux.mux_con": client["smux"]["mux_con"]}
+    sized = {"paths.connection_pool": sizing["connection_pool"], "smux.mux_con": sizing["mux_con"]}
+    if not ensure_netrix_available():
+        raise RuntimeError("netrix binary not found")
+    bench_netns_up()
+    sink = None
+    try:
+        set_bench_netem(sizing["rtt_ms"], 0.0, sizing["bandwidth_mbps"])
+        sink = start_bench_sink()
+        runs = {}
+        for name, params in (("current", current), ("sized", sized)):
+            s, c = bench_pair_configs(cfg)
+            apply_bench_params(s, c, params)
+            runs[name] = run_bench_trial(s, c, seconds, streams)
+    finally:
+        if sink:
+            sink.terminate()
+        bench_netns_down()
+    if not runs["current"].get("ok"):
+        raise RuntimeError(f"baseline run failed: {runs['current'].get('error')}")
+    score = autotune_score(runs["sized"], runs["current"])
+    return {"current": runs["current"], "sized": runs["sized"], "score": score,
+            "accepted": score >= 1.0 - AUTOTUNE_MIN_GAIN}
+
+def pool_sizing_updates(config_path: Path, cfg: dict, sizing: Dict[str, Any]) -> bool:
+    """
+    Write connection_pool and smux.mux_con. The sized pool is the tunnel's total, so with several
+    paths it is split in proportion to their current pools (largest remainder, at least 1 each).
+    """
+    if cfg.get("paths"):
+        paths = [p for p in cfg["paths"] if isinstance(p, dict)]
+        total = max(int(sizing["connection_pool"]), len(paths))
+        weights = [max(int(p.get("connection_pool") or 1), 1) for p in paths]
+        shares = [(total - len(paths)) * w / sum(weights) for w in weights]
+        pools = {i: 1 + int(v) for i, v in enumerate(shares)}
+        leftover = total - sum(pools.values())
+        for i in sorted(range(len(paths)), key=lambda i: shares[i] - int(shares[i]), reverse=True)[:leftover]:
+            pools[i] += 1
+        changed = update_tunnel_paths(config_path, list(range(len(paths))), pools)
+    else:
+        changed = update_tunnel_config(config_path, {"connection_pool": sizing["connection_pool"]})
+    return update_tunnel_config(config_path, {"smux": {"mux_con": sizing["mux_con"]}}) or changed
+
+# ========== TUN Sizing ==========
+# tun.streams = TUN queues (IFF_MULTI_QUEUE); the kernel spreads flows over them by hash, so more
+# streams only help with enough cores, packets per second and parallel flows to fill them
+TUN_GETFEATURES = 0x800454CF     # TUNGETFEATURES ioctl
+IFF_MULTI_QUEUE = 0x0100
+TUN_STREAMS_MAX = 64
+TUN_QUEUE_PPS = 150_000          # packets/s one queue (reader + writer, with crypto) keeps up with
+TUN_PPS_HEADROOM = 1.5
+TUN_STREAMS_UNMEASURED = 4       # cap without a pps measurement
+TUN_TXQUEUELEN_RANGE = (1000, 10000)
+TUN_TXQUEUE_BURST_S = 0.01       # each queue's ring absorbs 10 ms of its share of the packets
+TUN_CORE_MARKERS = (b"IFF_MULTI_QUEUE", b"MultiQueue", b"multi_queue")
+TUN_BENCH_FLOWS = 32
+
+def tun_settings_path() -> Path:
+    return NETRIX_CONFIG_DIR / "tun.yaml"
+
+def kernel_tun_multiqueue() -> Optional[bool]:
+    """Whether the kernel's TUN driver offers IFF_MULTI_QUEUE (None when /dev/net/tun can't be opened)."""
+    import fcntl
+    import struct
+    try:
+        with open("/dev/net/tun", "rb") as tun:
+            features = struct.unpack("I", fcntl.ioctl(tun, TUN_GETFEATURES, struct.pack("I", 0)))[0]
+    except OSError:
+        return None
+    return bool(features & IFF_MULTI_QUEUE)
+
+def core_tun_multiqueue(binary: Optional[str] = None) -> Optional[bool]:
+    """
+    True when the netrix binary visibly mentions multi-queue TUN, else None (unknown): Go compiles
+    the flag to a number, so a missing marker proves nothing.
+    """
+    import mmap
+    binary = binary or (NETRIX_BINARY if os.path.exists(NETRIX_BINARY) else None)
+    if not binary:
+        return None
+    try:
+        with open(binary, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return True if any(data.find(marker) != -1 for marker in TUN_CORE_MARKERS) else None
+    except (OSError, ValueError):
+        return None
+
+def tun_device_info(dev: str) -> Dict[str, Any]:
+    """Live TUN device: multi-queue flag, queue count and txqueuelen from sysfs."""
+    base = Path("/sys/class/net") / dev
+    if not base.exists():
+        return {"exists": False}
+    flags = _read_proc_text(str(base / "tun_flags"))
+    queues = len(list((base / "queues").glob("tx-*"))) if (base / "queues").is_dir() else None
+    txqueuelen = _read_proc_text(str(base / "tx_queue_len"))
+    return {"exists": True, "multi_queue": bool(int(flags, 16) & IFF_MULTI_QUEUE) if flags else None,
+            "queues": queues, "txqueuelen": int(txqueuelen) if txqueuelen.isdigit() else None}
+
+def measure_tun_pps(dev: str, seconds: float = 1.0) -> Optional[float]:
+    """Packets per second through a TUN device (both directions) over `seconds`; None if it doesn't exist."""
+    stats = Path("/sys/class/net") / dev / "statistics"
+
+    def packets():
+        values = [_read_proc_text(str(stats / name)) for name in ("rx_packets", "tx_packets")]
+        return sum(int(v) for v in values if v.isdigit())
+
+    if not stats.is_dir():
+        return None
+    first, started = packets(), time.monotonic()
+    time.sleep(seconds)
+    return round((packets() - first) / max(1e-6, time.monotonic() - started), 1)
+
+def compute_tun_streams(cores: Optional[int] = None, pps: Optional[float] = None, multi_queue: Optional[bool] = True,
+                        flows: Optional[int] = None) -> Dict[str, Any]:
+    """
+    streams: enough queues for the packet rate (TUN_QUEUE_PPS each, with headroom), never more than
+    cores or parallel flows; 1 without multi-queue support. txqueuelen: TUN_TXQUEUE_BURST_S of one
+    queue's share of the rate (the ring is per queue).
+    """
+    cores = cores or os.cpu_count() or 1
+    if multi_queue is False:
+        streams, reason = 1, "no multi-queue TUN support"
+    elif pps is None:
+        streams, reason = min(cores, TUN_STREAMS_UNMEASURED), "no pps measured; sized from cores"
+    elif pps < TUN_QUEUE_PPS:
+        # an idle or lightly loaded sample says nothing about peak load
+        streams, reason = min(cores, TUN_STREAMS_UNMEASURED), f"{pps:.0f} pps is below one queue; sized from cores"
+    else:
+        streams = max(1, -(-int(pps * TUN_PPS_HEADROOM) // TUN_QUEUE_PPS))
+        reason = f"{pps:.0f} pps over {TUN_QUEUE_PPS} pps per queue"
+    for cap, what in ((cores, "cores"), (flows, "flows"), (TUN_STREAMS_MAX, "max")):
+        if cap and streams > cap:
+            streams, reason = cap, f"{reason}, capped by {cap} {what}"
+    per_queue = pps / streams if pps and pps >= TUN_QUEUE_PPS else TUN_QUEUE_PPS
+    txqueuelen = _clamp(int(per_queue * TUN_TXQUEUE_BURST_S), *TUN_TXQUEUELEN_RANGE)
+    return {"streams": streams, "txqueuelen": txqueuelen, "cores": cores, "pps": pps,
+            "multi_queue": multi_queue, "reason": reason}
+
+def _resolve_tun_streams(tun: Dict[str, Any]) -> None:
+    """Spec `tun.streams: auto` -> compute_tun_streams() for this host."""
+    if str(tun.get("streams", "")).strip().lower() == "auto":
+        tun["streams"] = compute_tun_streams(multi_queue=kernel_tun_multiqueue())["streams"]
+
+def load_tun_settings() -> Dict[str, Dict[str, Any]]:
+    """tun.yaml `tunnels: {stem: {txqueuelen: N}}`."""
+    path = tun_settings_path()
+    if not path.is_file():
+        return {}
+    try:
+        doc = yaml_safe_load(path.read_text(encoding="utf-8")) or {}
+    except yaml.YAMLError as e:
+        raise ValueError(f"invalid YAML in {path}: {e}")
+    tunnels = doc.get("tunnels") if isinstance(doc, dict) else None
+    return tunnels if isinstance(tunnels, dict) else {}
+
+def save_tun_txqueuelen(stem: str, txqueuelen: Optional[int]) -> bool:
+    path = tun_settings_path()
+    tunnels = load_tun_settings()
+    if txqueuelen:
+        tunnels[stem] = {"txqueuelen": int(txqueuelen)}
+    elif stem in tunnels:
+        del tunnels[stem]
+    else:
+        return False
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return write_file_atomic(path, yaml.safe_dump({"tunnels": tunnels}, sort_keys=False))
+
+def cfg_tun_device(cfg: dict) -> Optional[str]:
+    """TUN device name of an L3 or TUN-mode config, else None."""
+    tun = cfg.get("tun") or {}
+    if cfg.get("transport") == "l3" or tun.get("enabled"):
+        return str(tun.get("name") or ("netrix" if cfg.get("transport") == "l3" else "netrix0")).strip()
+    return None
+
+def tun_unit_commands(config_path: Path) -> List[str]:
+    """ExecStartPost shell commands: set the stored txqueuelen once the core has created the TUN."""
+    dev = cfg_tun_device(parse_yaml_config(config_path) or {})
+    try:
+        txqueuelen = (load_tun_settings().get(config_path.stem) or {}).get("txqueuelen")
+    except ValueError as e:
+        c_warn(f"txqueuelen not set by the unit: {e}")
+        return []
+    if not dev or not txqueuelen:
+        return []
+    # well inside TimeoutStartSec: the unit is not active until ExecStartPost returns
+    tries = " ".join(str(i) for i in range(15))
+    return [f"for i in {tries}; do ip link set dev {dev} txqueuelen {int(txqueuelen)} 2>/dev/null && exit 0; sleep 0.5; done"]
+
+def tun_sizing_report(config_paths: Optional[List[Path]] = None, sample_s: float = 1.0,
+                      pps: Optional[float] = None, flows: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Per L3/TUN tunnel: current streams and device state, measured pps and the recommended streams/txqueuelen."""
+    if config_paths is None:
+        config_paths = sorted((it["config_path"] for it in list_tunnels()), key=lambda p: p.stem)
+    kernel, core = kernel_tun_multiqueue(), core_tun_multiqueue()
+    multi_queue = kernel is not False
+    rows = []
+    for config_path in config_paths:
+        cfg = parse_yaml_config(config_path) or {}
+        dev = cfg_tun_device(cfg)
+        if not dev:
+            continue
+        device = tun_device_info(dev)
+        measured = pps if pps is not None else (measure_tun_pps(dev, sample_s) if device["exists"] and sample_s else None)
+        sizing = compute_tun_streams(pps=measured, multi_queue=multi_queue, flows=flows)
+        current = (cfg.get("tun") or {}).get("streams")
+        if pps is None and multi_queue and isinstance(current, int) and sizing["streams"] < current:
+            sizing.update(streams=current, reason=f"{sizing['reason']}; not lowered from a {sample_s:g}s sample (pass --pps)")
+        rows.append(dict(sizing, stem=config_path.stem, device=dev, current_streams=(cfg.get("tun") or {}).get("streams"),
+                         kernel_multi_queue=kernel, core_multi_queue=core, live=device))
+    return rows
+
+def apply_tun_sizing(config_path: Path, sizing: Dict[str, Any]) -> Dict[str, Any]:
+    """Write tun.streams, store txqueuelen for the unit's ExecStartPost, set it live and restart a running tunnel."""
+    result = {"config_changed": update_tunnel_config(config_path, {"tun": {"streams": sizing["streams"]}})}
+    unit_changed = save_tun_txqueuelen(config_path.stem, sizing["txqueuelen"])
+    if unit_changed:
+        create_systemd_service_for_tunnel(config_path)
+    dev = sizing.get("device") or cfg_tun_device(parse_yaml_config(config_path) or {})
+    if dev and os.path.exists(f"/sys/class/net/{dev}"):
+        result["txqueuelen_set"] = subprocess.run(["ip", "link", "set", "dev", dev, "txqueuelen", str(sizing["txqueuelen"])],
+                                                  capture_output=True, timeout=5).returncode == 0
+    if result["config_changed"] and get_service_status(config_path) == "active":
+        result["restarted"] = restart_tunnel(config_path)
+    return result
+
+def bench_tun(streams_list: List[int], transport: str = "l3", flows: int = TUN_BENCH_FLOWS,
+              seconds: float = BENCH_DEFAULT_SECONDS, profile: str = "balanced", progress=None) -> Dict[str, Any]:
+    """
+    TUN-mode scaling on the netns harness: `flows` parallel TCP flows (plus the UDP echo probe)
+    go straight to the client's TUN address, once per tun.streams value. speedup is against the
+    first value in the list.
+    """
+    if not ensure_netrix_available():
+        raise RuntimeError("netrix binary not found")
+    import tempfile
+    target = BENCH_TUN_ADDRS[1].split("/")[0]
+    runs = []
+    bench_netns_up()
+    sink = None
+    try:
+        sink = start_bench_sink()
+        for streams in streams_list:
+            workdir = Path(tempfile.mkdtemp(prefix="netrix-bench-"))
+            try:
+                server_path, client_path = render_bench_pair(transport, profile, workdir, tun_streams=streams)
+                run = run_bench_files(server_path, client_path, seconds, flows, udp=True,
+                                      host=target, port=BENCH_SINK_PORT)
+            except (ValueError, RuntimeError) as e:
+                run = {"ok": False, "error": str(e)}
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+            run = dict(run, streams=streams)
+            runs.append(run)
+            if progress:
+                progress(f"streams={streams}: " + (f"{run['mbps']} Mbps, p99 {run.get('p99_ms')} ms" if run["ok"]
+                                                   else f"failed ({run.get('error')})"))
+    finally:
+        if sink:
+            sink.terminate()
+        bench_netns_down()
+    base = runs[0].get("mbps") if runs and runs[0].get("ok") else None
+    for run in runs:
+        run["speedup"] = round(run["mbps"] / base, 2) if base and run.get("ok") else None
+    ok = [r for r in runs if r.get("ok")]
+    best = max(ok, key=lambda r: r["mbps"]) if ok else None
+    return {"transport": transport, "flows": flows, "seconds": seconds, "runs": runs,
+            "best_streams": best["streams"] if best else None, "kernel_multi_queue": kernel_tun_multiqueue()}
+
+# ========== Watchdog ==========
+# systemd Restart=always only covers a dead process; the watchdog restarts tunnels that are alive but stuck
+WATCHDOG_DEFAULT_POLICY = {
+    "enabled": True,
+    "not_ready_s": 60,          # /health says ready=false this long (0 = off)
+    "unreachable_s": 60,        # service active but the health server does not answer
+    "disconnected_s": 60,       # /health/detailed status == disconnected (0 = off)
+    "no_streams_s": 0,          # zero streams while the peer transport is up (0 = off)
+    "rtt_max_ms": 0,            # RTT above this ... (0 = off)
+    "rtt_s": 120,               # ... for this long
+    "collapse_ratio": 0.1,      # throughput below ratio x its moving baseline ...
+    "collapse_min_mbps": 5,     # ... once the baseline is at least this ...
+    "collapse_s": 0,            # ... for this long while peers are up (0 = off)
+    "restart_failed": True,     # also start units systemd gave up on (failed)
+    "backoff_s": 30,            # wait after a restart, doubled per consecutive restart ...
+    "backoff_max_s": 900,       # ... up to this
+    "stable_s": 300,            # healthy this long resets the backoff
+    "budget": 5,                # at most this many restarts ...
+    "budget_window_s": 3600,    # ... per window; then only events are logged
+    "ready_timeout_s": 30,      # wait_ready() after a restart
+}
+# the listening side (reverse server, direct client) is not ready/disconnected whenever its peer
+# is down, and restarting it does not bring the peer back
+WATCHDOG_LISTENER_POLICY = {"not_ready_s": 0, "disconnected_s": 0}
+WATCHDOG_DEFAULT_INTERVAL = 10.0
+WATCHDOG_LOG_MAX_BYTES = 5 * 1024 * 1024
+WATCHDOG_BASELINE_ALPHA = 0.2
+WATCHDOG_SERVICE = "netrix-watchdog"
+
+def watchdog_policy_path() -> Path:
+    return NETRIX_CONFIG_DIR / "watchdog.yaml"
+
+def watchdog_events_path() -> Path:
+    return NETRIX_CONFIG_DIR / "watchdog" / "events.jsonl"
+
+def load_watchdog_policies(path: Optional[Path] = None) -> tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+    """
+    Read watchdog.yaml: `defaults:` over WATCHDOG_DEFAULT_POLICY and `tunnels: {stem: {...}}` overrides.
+    A missing file means built-in defaults; unknown keys raise ValueError.
+    """
+    path = path or watchdog_policy_path()
+    if not path.is_file():
+        return dict(WATCHDOG_DEFAULT_POLICY), {}
+    try:
+        doc = yaml_safe_load(path.read_text(encoding="utf-8")) or {}
+    except yaml.YAMLError as e:
+        raise ValueError(f"invalid YAML in {path}: {e}")
+    if not isinstance(doc, dict):
+        raise ValueError(f"{path} must be a mapping with defaults: and tunnels:")
+
+    def check(section: Any, where: str) -> Dict[str, Any]:
+        if section is None:
+            return {}
+        if not isinstance(section, dict):
+            raise ValueError(f"watchdog {where} must be a mapping")
+        unknown = sorted(set(section) - set(WATCHDOG_DEFAULT_POLICY))
+        if unknown:
+            raise ValueError(f"unknown watchdog policy key(s) in {where}: {', '.join(map(str, unknown))}")
+        return section
+
+    defaults = dict(WATCHDOG_DEFAULT_POLICY, **check(doc.get("defaults"), "defaults"))
+    tunnels = doc.get("tunnels") or {}
+    if not isinstance(tunnels, dict):
+        raise ValueError("watchdog 'tunnels:' must map tunnel stems to policies")
+    return defaults, {str(stem): check(policy, f"tunnels.{stem}") for stem, policy in tunnels.items()}
+
+def log_watchdog_event(stem: str, event: str, **fields) -> Dict[str, Any]:
+    """Append one structured event to the watchdog log (rotated once at WATCHDOG_LOG_MAX_BYTES) and echo it to stderr."""
+    record = {"ts": int(time.time()), "stem": stem, "event": event}
+    record.update({k: v for k, v in fields.items() if v is not None})
+    path = watchdog_events_path()
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.exists() and path.stat().st_size > WATCHDOG_LOG_MAX_BYTES:
+            path.replace(path.with_suffix(".jsonl.1"))
+        with open(path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+    except OSError as e:
+        c_warn(f"watchdog: cannot write {path}: {e}")
+    reason = f" ({record['reason']})" if record.get("reason") else ""
+    print(f"{time.strftime('%H:%M:%S')} {stem}: {event}{reason}", file=sys.stderr)
+    return record
+
+def load_watchdog_events(stems: Optional[List[str]] = None, since: Optional[float] = None) -> List[Dict[str, Any]]:
+    path = watchdog_events_path()
+    if not path.exists():
+        return []
+    events = []
+    for line in path.read_text(errors="replace").splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if stems and record.get("stem") not in stems:
+            continue
+        if since and record.get("ts", 0) < since:
+            continue
+        events.append(record)
+    return events
+
+def watchdog_sample(config_path: Path, service_state: Optional[str], timeout: float = 3.0) -> Dict[str, Any]:
+    """One observation of a tunnel: systemd state plus the /health/detailed fields the policies use."""
+    sample = {"state": service_state or "unknown", "reachable": False, "ready": None, "status": None,
+              "peer_transport_up": None, "streams": None, "rtt_ms": None, "bytes": None, "t": time.monotonic()}
+    if service_state != "active":
+        return sample
+    port = get_tunnel_health_port(parse_yaml_config(config_path))
+    try:
+        code, data = _fetch_health_json(f"http://localhost:{port}/health/detailed", timeout)
+    except Exception:
+        return sample
+    sample["reachable"] = True
+    if not isinstance(data, dict):
+        sample["ready"] = code == 200
+        return sample
+    stats = data.get("stats") or {}
+    sample["ready"] = code == 200 and data.get("ready") is not False
+    sample["status"] = data.get("status")
+    if "peer_transport_up" in data:
+        sample["peer_transport_up"] = bool(data["peer_transport_up"])
+    streams = data.get("streams", data.get("streams_data", stats.get("streams_active")))
+    sample["streams"] = int(streams) if isinstance(streams, (int, float)) else None
+    rtt = stats.get("rtt_current_ms", data.get("rtt_ms"))
+    sample["rtt_ms"] = float(rtt) if isinstance(rtt, (int, float)) else None
+    counters = [stats.get(k) for k in ("tcp_bytes_in", "tcp_bytes_out", "udp_bytes_in", "udp_bytes_out")]
+    if any(isinstance(c, (int, float)) for c in counters):
+        sample["bytes"] = sum(c for c in counters if isinstance(c, (int, float)))
+    return sample
+
+def watchdog_evaluate(track: Dict[str, Any], sample: Dict[str, Any], policy: Dict[str, Any]) -> Optional[str]:
+    """
+    Update a tunnel's tracking state with a sample and return the reason to restart, if any.
+    Each condition must hold continuously for its policy duration.
+    """
+    now = sample["t"]
+    prev = track.get("last")
+    track["last"] = sample
+    rate = None
+    if prev and sample["bytes"] is not None and prev.get("bytes") is not None and now > prev["t"]:
+        delta = sample["bytes"] - prev["bytes"]
+        if delta >= 0:
+            rate = delta * 8 / 1e6 / (now - prev["t"])
+    baseline = track.get("baseline_mbps")
+    peers_up = sample["peer_transport_up"] is not False and sample["ready"]
+
+    conditions = {
+        "failed": (sample["state"] == "failed" and policy["restart_failed"], 0),
+        "unreachable": (sample["state"] == "active" and not sample["reachable"], policy["unreachable_s"]),
+        "not ready": (bool(policy["not_ready_s"]) and sample["reachable"] and sample["ready"] is False, policy["not_ready_s"]),
+        "disconnected": (bool(policy["disconnected_s"]) and sample["status"] == "disconnected", policy["disconnected_s"]),
+        "no streams": (bool(policy["no_streams_s"]) and sample["peer_transport_up"] is True
+                       and sample["streams"] == 0, policy["no_streams_s"]),
+        "rtt spike": (bool(policy["rtt_max_ms"]) and (sample["rtt_ms"] or 0) > policy["rtt_max_ms"], policy["rtt_s"]),
+        "throughput collapse": (bool(policy["collapse_s"]) and peers_up and rate is not None and baseline is not None
+                                and baseline >= policy["collapse_min_mbps"]
+                                and rate < baseline * policy["collapse_ratio"], policy["collapse_s"]),
+    }
+    if rate is not None and not conditions["throughput collapse"][0]:
+        track["baseline_mbps"] = rate if baseline is None else \
+            baseline + WATCHDOG_BASELINE_ALPHA * (rate - baseline)
+
+    since = track.setdefault("since", {})
+    reason = None
+    for name, (holds, duration) in conditions.items():
+        if not holds:
+            since.pop(name, None)
+            continue
+        since.setdefault(name, now)
+        if reason is None and now - since[name] >= float(duration):
+            reason = f"{name} for {now - since[name]:.0f}s" if duration else name
+    if any(holds for holds, _ in conditions.values()):
+        track.pop("healthy_since", None)
+    else:
+        track.setdefault("healthy_since", now)
+    return reason
+
+def watchdog_tick(tracks: Dict[str, Dict[str, Any]], defaults: Dict[str, Any],
+                  overrides: Dict[str, Dict[str, Any]], stems: Optional[List[str]] = None,
+                  dry_run: bool = False) -> List[Dict[str, Any]]:
+    """Sample every tunnel once, apply its policy and restart within backoff and budget; returns the events."""
+    events = []
+    items = [it for it in list_tunnels() if not stems or it["config_path"].stem in stems]
+    for it in items:
+        config_path = it["config_path"]
+        stem = config_path.stem
+        policy = dict(defaults)
+        if (it.get("mode") == "server") != bool(it.get("direct")):
+            # listener defaults, unless watchdog.yaml changed those keys in defaults:
+            policy.update({k: v for k, v in WATCHDOG_LISTENER_POLICY.items() if defaults[k] == WATCHDOG_DEFAULT_POLICY[k]})
+        policy.update(overrides.get(stem, {}))
+        track = tracks.setdefault(stem, {"attempt": 0, "restarts": [], "next_allowed": 0.0})
+        if not policy["enabled"] or it.get("status") == "inactive":
+            # stopped on purpose: forget timers so a later start is judged afresh
+            tracks[stem] = {"attempt": 0, "restarts": track["restarts"], "next_allowed": 0.0}
+            continue
+        sample = watchdog_sample(config_path, it.get("status"))
+        reason = watchdog_evaluate(track, sample, policy)
+        now = sample["t"]
+        if reason is None:
+            healthy = track.get("healthy_since")
+            if track["attempt"] and healthy is not None and now - healthy >= policy["stable_s"]:
+                events.append(log_watchdog_event(stem, "recovered", attempts=track["attempt"]))
+                track["attempt"] = 0
+            continue
+        metrics = {k: sample[k] for k in ("state", "ready", "status", "streams", "rtt_ms") if sample[k] is not None}
+        if track.get("baseline_mbps") is not None:
+            metrics["baseline_mbps"] = round(track["baseline_mbps"], 2)
+        if now < track["next_allowed"]:
+            if track.get("held") != "backoff":
+                events.append(log_watchdog_event(stem, "backoff", reason=reason,
+                                                 retry_in_s=round(track["next_allowed"] - now)))
+                track["held"] = "backoff"
+            continue
+        track["restarts"] = [t for t in track["restarts"] if now - t < policy["budget_window_s"]]
+        if len(track["restarts"]) >= policy["budget"]:
+            if track.get("held") != "budget":
+                events.append(log_watchdog_event(stem, "budget_exhausted", reason=reason, metrics=metrics,
+                                                 restarts=len(track["restarts"]), window_s=policy["budget_window_s"]))
+                track["held"] = "budget"
+            continue
+        track["held"] = None
+        if dry_run:
+            events.append(log_watchdog_event(stem, "would_restart", reason=reason, metrics=metrics))
+            track["since"] = {}
+            continue
+        track["attempt"] += 1
+        track["restarts"].append(now)
+        backoff = min(policy["backoff_max_s"], policy["backoff_s"] * 2 ** (track["attempt"] - 1))
+        # auto: a listener without its peer only has to come back active
+        ok = restart_tunnel(config_path, wait="auto", timeout=policy["ready_timeout_s"])
+        track["next_allowed"] = time.monotonic() + backoff
+        track["since"], track["last"] = {}, None
+        track.pop("healthy_since", None)
+        events.append(log_watchdog_event(stem, "restart" if ok else "restart_failed", reason=reason, metrics=metrics,
+                                         attempt=track["attempt"], backoff_s=backoff))
+    return events
+
+def run_watchdog(interval: float = WATCHDOG_DEFAULT_INTERVAL, stems: Optional[List[str]] = None,
+                 dry_run: bool = False, once: bool = False, policy_path: Optional[Path] = None) -> List[Dict[str, Any]]:
+    """Watchdog loop; policies are re-read every tick so edits to watchdog.yaml apply without a restart."""
+    tracks: Dict[str, Dict[str, Any]] = {}
+    defaults, overrides = load_watchdog_policies(policy_path)
+    events: List[Dict[str, Any]] = []
+    try:
+        while True:
+            try:
+                defaults, overrides = load_watchdog_policies(policy_path)
+            except ValueError as e:
+                c_warn(f"watchdog: keeping previous policies: {e}")
+            events = watchdog_tick(tracks, defaults, overrides, stems, dry_run)
+            if once:
+                return events
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        return events
+
+def install_watchdog_service(interval: float = WATCHDOG_DEFAULT_INTERVAL) -> bool:
+    """Run the watchdog as its own systemd service (enabled and started)."""
+    service_path = Path(f"/etc/systemd/system/{WATCHDOG_SERVICE}.service")
+    content = f"""[Unit]
+Description=Netrix Tunnel Watchdog
+After=network.target
+
+[Service]
+Type=simple
+ExecStart={' '.join(manager_command())} watchdog run --interval {interval:g}
+Restart=always
+RestartSec=5
+User=root
+
+[Install]
+WantedBy=multi-user.target
+"""
+    try:
+        if write_file_atomic(service_path, content, mode=0o644):
+            systemd_daemon_reload()
+        subprocess.run(["systemctl", "enable", WATCHDOG_SERVICE], check=False, timeout=5, capture_output=True)
+        result = subprocess.run(["systemctl", "restart", WATCHDOG_SERVICE], capture_output=True, text=True, timeout=15)
+        return result.returncode == 0
+    except Exception as e:
+        c_err(f"Failed to install watchdog service: {e}")
+        return False
+
+def uninstall_watchdog_service() -> bool:
+    service_path = Path(f"/etc/systemd/system/{WATCHDOG_SERVICE}.service")
+    try:
+        subprocess.run(["systemctl", "disable", "--now", WATCHDOG_SERVICE], check=False, timeout=15, capture_output=True)
+        if service_path.exists():
+            service_path.unlink()
+            systemd_daemon_reload()
+        return True
+    except Exception as e:
+        c_err(f"Failed to remove watchdog service: {e}")
+        return False
+
+# ========== Log Index ==========
+# journald is read incrementally (one cursor per unit) and folded into hourly counters per tunnel
+LOG_EVENT_PATTERNS = (
+    ("handshake_failure", re.compile(r"handshake\W.*(fail|error|timeout)|tls: |bad certificate|"
+                                     r"authenticat\w* fail|invalid (psk|key)", re.I)),
+    ("dial_timeout", re.compile(r"dial\w*\W.*(timeout|timed out|deadline)|i/o timeout|"
+                                r"connection refused|no route to host", re.I)),
+    ("session_closed", re.compile(r"session\W.*(closed|ended|terminated)|closed session|broken pipe|"
+                                  r"connection reset|\bEOF\b", re.I)),
+    ("reconnect", re.compile(r"reconnect|re-?dial|retrying|redial", re.I)),
+)
+LOG_OTHER_ERROR = "other_error"
+LOG_ERROR_WORDS = re.compile(r"\b(error|failed|panic|fatal)\b", re.I)
+LOG_INDEX_RETENTION_HOURS = 24 * 14
+LOG_FIRST_SINCE = "-24h"       # a unit without a cursor starts this far back
+LOG_INGEST_PARALLEL = 8
+LOG_DASHBOARD_INGEST_TIMEOUT = 3.0    # per unit; the dashboard ingests in the background and never waits on a cron run
+
+def log_index_dir() -> Path:
+    return NETRIX_CONFIG_DIR / "logs"
+
+def _load_json_file(path: Path, default: Any) -> Any:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return default
+
+def classify_log_message(message: str, priority: Optional[int] = None) -> Optional[str]:
+    """Event type of one journal line, or None when it is not worth counting."""
+    for event, pattern in LOG_EVENT_PATTERNS:
+        if pattern.search(message):
+            return event
+    if (priority is not None and priority <= 3) or LOG_ERROR_WORDS.search(message):
+        return LOG_OTHER_ERROR
+    return None
+
+def _journal_message(entry: Dict[str, Any]) -> str:
+    message = entry.get("MESSAGE", "")
+    if isinstance(message, list):    # journald exports non-UTF-8 messages as byte arrays
+        message = bytes(b for b in message if isinstance(b, int) and 0 <= b < 256).decode("utf-8", errors="replace")
+    return str(message or "")
+
+def read_journal_unit(unit: str, cursor: Optional[str], timeout: float = 60.0) -> tuple[List[tuple], Optional[str]]:
+    """
+    Stream `journalctl -o json` for one unit after its cursor.
+    Returns ([(ts_seconds, event, message), ...] for classified lines, new cursor).
+    """
+    cmd = ["journalctl", "-o", "json", "--no-pager", "-u", unit]
+    cmd += ["--after-cursor", cursor] if cursor else ["--since", LOG_FIRST_SINCE]
+    events, last_cursor = [], cursor
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, errors="replace")
+    deadline = time.monotonic() + timeout
+    try:
+        for line in proc.stdout:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            last_cursor = entry.get("__CURSOR", last_cursor)
+            message = _journal_message(entry)
+            try:
+                priority = int(entry.get("PRIORITY"))
+            except (TypeError, ValueError):
+                priority = None
+            event = classify_log_message(message, priority)
+            if event:
+                try:
+                    ts = int(entry.get("__REALTIME_TIMESTAMP", 0)) / 1e6
+                except (TypeError, ValueError):
+                    ts = time.time()
+                events.append((ts, event, message[:300]))
+            if time.monotonic() > deadline:
+                break    # the cursor keeps the rest for the next run
+    finally:
+        proc.kill()
+        proc.wait()
+    return events, last_cursor
+
+def ingest_journal(stems: Optional[List[str]] = None, timeout: float = 60.0, wait_lock: bool = True) -> Dict[str, int]:
+    """
+    Read new journal entries of every netrix-<stem> unit into the hourly index.
+    The whole read/ingest/write cycle holds an flock on ingest.lock, so a cron
+    `logs ingest` and the dashboard never double-count or drop cursor updates;
+    with wait_lock=False a held lock skips this run. `timeout` bounds each unit's read.
+    Returns {stem: classified lines added}.
+    """
+    import fcntl
+    from concurrent.futures import ThreadPoolExecutor
+
+    if not which("journalctl"):
+        raise RuntimeError("journalctl not found")
+    if stems is None:
+        stems = sorted(it["config_path"].stem for it in list_tunnels())
+    added: Dict[str, int] = {}
+    if not stems:
+        return added
+    folder = log_index_dir()
+    folder.mkdir(parents=True, exist_ok=True)
+    with open(folder / "ingest.lock", "a") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | (0 if wait_lock else fcntl.LOCK_NB))
+        except BlockingIOError:
+            return added    # another ingest is running; its results land in the same index
+        cursors = _load_json_file(folder / "cursors.json", {})
+        index = _load_json_file(folder / "index.json", {})
+        with ThreadPoolExecutor(max_workers=min(LOG_INGEST_PARALLEL, len(stems))) as pool:
+            reads = dict(zip(stems, pool.map(
+                lambda s: read_journal_unit(f"netrix-{s}.service", cursors.get(s), timeout), stems)))
+        for stem, (events, cursor) in reads.items():
+            if cursor:
+                cursors[stem] = cursor
+            tunnel = index.setdefault(stem, {"hours": {}, "last": {}})
+            for ts, event, message in events:
+                hour = str(int(ts) // 3600 * 3600)
+                counts = tunnel["hours"].setdefault(hour, {})
+                counts[event] = counts.get(event, 0) + 1
+                tunnel["last"][event] = {"ts": int(ts), "message": message}
+            added[stem] = len(events)
+        oldest = (int(time.time()) // 3600 - LOG_INDEX_RETENTION_HOURS) * 3600
+        for tunnel in index.values():
+            tunnel["hours"] = {h: c for h, c in tunnel["hours"].items() if int(h) >= oldest}
+        write_file_atomic(folder / "cursors.json", json.dumps(cursors))
+        write_file_atomic(folder / "index.json", json.dumps(index, separators=(",", ":")))
+    return added
+
+def query_log_index(stems: Optional[List[str]] = None, hours: float = 24, hourly: bool = False) -> List[Dict[str, Any]]:
+    """
+    Event counts from the index over the last `hours`: one row per tunnel (totals and the
+    most frequent event), or with hourly=True one row per tunnel and hour.
+    """
+    index = _load_json_file(log_index_dir() / "index.json", {})
+    since = time.time() - hours * 3600
+    rows = []
+    for stem in sorted(index):
+        if stems and stem not in stems:
+            continue
+        tunnel = index[stem]
+        totals: Dict[str, int] = {}
+        for hour, counts in sorted(tunnel.get("hours", {}).items()):
+            if int(hour) + 3600 <= since:
+                continue
+            if hourly:
+                rows.append({"stem": stem, "hour": int(hour), **counts, "total": sum(counts.values())})
+            for event, n in counts.items():
+                totals[event] = totals.get(event, 0) + n
+        if not hourly:
+            top = max(totals, key=totals.get) if totals else None
+            rows.append({"stem": stem, **totals, "total": sum(totals.values()), "top": top,
+                         "top_message": (tunnel.get("last", {}).get(top) or {}).get("message") if top else None})
+    return rows
+
+def log_event_types() -> List[str]:
+    return [event for event, _ in LOG_EVENT_PATTERNS] + [LOG_OTHER_ERROR]
+
+def format_log_counts(row: Optional[Dict[str, Any]]) -> str:
+    """`3 reconnect, 1 dial_timeout` view of one query_log_index() row, most frequent first."""
+    counts = {k: v for k, v in (row or {}).items() if k in log_event_types() and v}
+    return ", ".join(f"{n} {event}" for event, n in sorted(counts.items(), key=lambda kv: -kv[1]))
+
+# ========== Traffic Accounting ==========
+# one kernel table/chain per tunnel with a named counter per mapping, listen port and dialled peer;
+# counters are matched on ports only, so the per-packet cost is one lookup per rule
+ACCT_NFT_PREFIX = "netrix_acct_"
+ACCT_IPT_PREFIX = "NXA_"
+ACCT_IPT_MULTIPORT_MAX = 15
+
+def accounting_dir() -> Path:
+    return NETRIX_CONFIG_DIR / "accounting"
+
+def accounting_backend() -> Optional[str]:
+    """nftables when available, else iptables; None when neither is installed."""
+    if which("nft"):
+        return "nft"
+    if which("iptables"):
+        return "iptables"
+    return None
+
+def _acct_name(stem: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_]", "_", stem)
+
+def _acct_ipt_chain(stem: str, direction: str, prefix: str = ACCT_IPT_PREFIX) -> str:
+    base = prefix + _acct_name(stem)
+    if len(base) > 26:    # iptables chain names stop at 28 characters
+        base = prefix + hashlib.sha1(stem.encode()).hexdigest()[:12]
+    return f"{base}_{direction[0].upper()}"
+
+def _port_ranges(ports: List[int]) -> List[tuple]:
+    """Collapse ports into sorted (lo, hi) ranges."""
+    ranges: List[list] = []
+    for port in sorted(set(ports)):
+        if ranges and port == ranges[-1][1] + 1:
+            ranges[-1][1] = port
+        else:
+            ranges.append([port, port])
+    return [tuple(r) for r in ranges]
+
+def _acct_endpoint(value: str) -> Optional[tuple]:
+    """(host, port) of a host:port string, or None."""
+    host, _, port = str(value or "").strip().rpartition(":")
+    host = host.strip("[]")
+    if not port.isdigit() or not 1 <= int(port) <= 65535:
+        return None
+    return host, int(port)
+
+def _transport_l4(transport: str, cfg: dict) -> Optional[str]:
+    transport = (transport or "tcpmux").lower()
+    if transport in ("kcpmux", "kcp"):
+        return "udp"
+    if transport == "l3":
+        carrier = str((cfg.get("l3") or {}).get("carrier") or L3_KERNEL_DEFAULT_CARRIER).lower()
+        return carrier if carrier in ("udp", "tcp") else None
+    return "tcp"
+
+def accounting_targets(cfg: dict) -> List[Dict[str, Any]]:
+    """
+    What to count for one tunnel config: every tcp_ports/udp_ports entry (by its bind ports),
+    the tunnel listen port and each dialled peer. `in` is traffic towards the local port
+    (or from the peer), `out` the reverse.
+    """
+    targets = []
+    for proto in ("tcp", "udp"):
+        for i, entry in enumerate(e for e in cfg.get(f"{proto}_ports") or [] if str(e).strip()):
+            try:
+                maps = parse_advanced_ports(str(entry), proto)
+            except Exception:
+                continue
+            ports = [int(m["bind"].rpartition(":")[2]) for m in maps if m.get("bind", "").rpartition(":")[2].isdigit()]
+            if ports:
+                targets.append({"id": f"map_{proto}_{i}", "kind": "mapping", "proto": proto,
+                                "ports": _port_ranges(ports), "addr": None, "label": str(entry)})
+    transport = str(cfg.get("transport") or "tcpmux")
+    l4 = _transport_l4(transport, cfg)
+    listen = _acct_endpoint(cfg.get("listen_addr") or cfg.get("listen") or "")
+    if transport == "l3" and l4:
+        l3 = cfg.get("l3") or {}
+        port = int(l3.get("listen_port") or L3_KERNEL_DEFAULT_LISTEN_PORT)
+        listen = (l3.get("listen_ip") or "", port)
+    if listen and l4:
+        targets.append({"id": f"listen_{l4}", "kind": "listen", "proto": l4, "ports": [(listen[1], listen[1])],
+                        "addr": None, "label": f"{transport} :{listen[1]}"})
+    peers = []
+    if cfg.get("mode") == "client":
+        peers = [(p.get("addr"), p.get("transport") or transport) for p in cfg.get("paths") or [] if isinstance(p, dict)]
+    elif cfg.get("direct") and cfg.get("connect"):
+        peers = [(cfg.get("connect"), transport)]
+    for i, (addr, path_transport) in enumerate(peers):
+        endpoint, l4 = _acct_endpoint(addr), _transport_l4(path_transport, cfg)
+        if not endpoint or not l4:
+            continue
+        host = endpoint[0]
+        try:
+            ipaddress.ip_address(host)
+        except ValueError:
+            host = None    # hostnames are matched by port only (a resolved address would go stale in the ruleset)
+        targets.append({"id": f"peer_{i}", "kind": "peer", "proto": l4, "ports": [(endpoint[1], endpoint[1])],
+                        "addr": host, "label": f"{path_transport} {addr}"})
+    return targets
+
+def _target_nft_match(t: Dict[str, Any], direction: str) -> str:
+    """nft match for one accounting target and direction."""
+    ports = ", ".join(f"{lo}-{hi}" if lo != hi else str(lo) for lo, hi in t["ports"])
+    if t["kind"] == "peer":
+        # peer traffic arrives from its port and leaves towards it
+        family = "ip6" if t["addr"] and ":" in t["addr"] else "ip"
+        addr = f"{family} {'saddr' if direction == 'in' else 'daddr'} {t['addr']} " if t["addr"] else ""
+        return f"{addr}{t['proto']} {'sport' if direction == 'in' else 'dport'} {{ {ports} }}"
+    return f"{t['proto']} {'dport' if direction == 'in' else 'sport'} {{ {ports} }}"
+
+def render_accounting_nft(stem: str, targets: List[Dict[str, Any]]) -> str:
+    """nft script that (re)creates the tunnel's accounting table atomically."""
+    table = ACCT_NFT_PREFIX + _acct_name(stem)
+    counters, rules = [], {"in": [], "out": []}
+    for t in targets:
+        for direction in ("in", "out"):
+            name = f"{t['id']}_{direction}"
+            counters.append(f"    counter {name} {{ }}")
+            rules[direction].append(f"        {_target_nft_match(t, direction)} counter name {name}")
+    chains = []
+    for chain, hook in (("in", "input"), ("out", "output")):
+        chains.append(f"    chain {hook} {{\n        type filter hook {hook} priority -150; policy accept;\n"
+                      + "".join(r + "\n" for r in rules[chain]) + "    }")
+    return (f"table inet {table}\ndelete table inet {table}\ntable inet {table} {{\n"
+            + "\n".join(counters + chains) + "\n}\n")
+
+def render_accounting_iptables(stem: str, targets: List[Dict[str, Any]], prefix: str = ACCT_IPT_PREFIX,
+                               jump: Optional[str] = None) -> List[List[str]]:
+    """iptables rules for the tunnel's _I/_O chains; without `jump` they only count."""
+    rules = []
+    for t in targets:
+        specs = [f"{lo}:{hi}" if lo != hi else str(lo) for lo, hi in t["ports"]]
+        for direction in ("in", "out"):
+            chain = _acct_ipt_chain(stem, direction, prefix)
+            local = "--dports" if direction == "in" else "--sports"
+            if t["kind"] == "peer":
+                local = "--sports" if direction == "in" else "--dports"
+            addr = ["-s" if direction == "in" else "-d", t["addr"]] if t["addr"] and ":" not in t["addr"] else []
+            for i in range(0, len(specs), ACCT_IPT_MULTIPORT_MAX):
+                rules.append(["-A", chain, "-p", t["proto"], *addr, "-m", "multiport", local,
+                              ",".join(specs[i:i + ACCT_IPT_MULTIPORT_MAX]),
+                              "-m", "comment", "--comment", f"{t['id']}_{direction}"] + (["-j", jump] if jump else []))
+    return rules
+
+def _installed_accounting(backend: str) -> set:
+    """Tables/chains currently in the kernel (one call)."""
+    if backend == "nft":
+        result = subprocess.run(["nft", "list", "tables"], capture_output=True, text=True, timeout=5)
+        return {line.split()[-1] for line in result.stdout.splitlines() if "netrix_" in line}
+    result = subprocess.run(["iptables-save", "-t", "filter"], capture_output=True, text=True, timeout=5)
+    return {line[1:].split()[0] for line in result.stdout.splitlines() if line.startswith(":" + ACCT_IPT_PREFIX)}
+
+def _install_accounting(backend: str, stem: str, rendered: Any):
+    if backend == "nft":
+        result = subprocess.run(["nft", "-f", "-"], input=rendered, capture_output=True, text=True, timeout=10)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip() or "nft failed")
+        return
+    for direction, hook in (("in", "INPUT"), ("out", "OUTPUT")):
+        chain = _acct_ipt_chain(stem, direction)
+        subprocess.run(["iptables", "-N", chain], capture_output=True, timeout=5)
+        subprocess.run(["iptables", "-F", chain], capture_output=True, timeout=5)
+        if subprocess.run(["iptables", "-C", hook, "-j", chain], capture_output=True, timeout=5).returncode != 0:
+            subprocess.run(["iptables", "-I", hook, "1", "-j", chain], capture_output=True, timeout=5)
+    for rule in rendered:
+        result = subprocess.run(["iptables", *rule], capture_output=True, text=True, timeout=5)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip() or "iptables failed")
+
+def sync_accounting(config_paths: Optional[List[Path]] = None) -> Dict[str, str]:
+    """
+    Make the kernel counters match the tunnel configs. A tunnel is only reloaded (which resets
+    its counters) when its rendered rules changed or its table/chain is missing, e.g. after a reboot.
+    Returns {stem: installed|unchanged|none|error text}.
+    """
+    backend = accounting_backend()
+    if not backend:
+        raise RuntimeError("neither nft nor iptables is installed")
+    if config_paths is None:
+        config_paths = sorted((it["config_path"] for it in list_tunnels()), key=lambda p: p.stem)
+    installed = _installed_accounting(backend)
+    folder = accounting_dir()
+    folder.mkdir(parents=True, exist_ok=True)
+    status = {}
+    for config_path in config_paths:
+        stem = config_path.stem
+        targets = accounting_targets(parse_yaml_config(config_path) or {})
+        if not targets:
+            remove_accounting(config_path)
+            status[stem] = "none"
+            continue
+        if backend == "nft":
+            rendered = render_accounting_nft(stem, targets)
+            present = ACCT_NFT_PREFIX + _acct_name(stem) in installed
+            text = rendered
+        else:
+            rendered = render_accounting_iptables(stem, targets)
+            present = _acct_ipt_chain(stem, "in") in installed
+            text = "\n".join(" ".join(rule) for rule in rendered) + "\n"
+        changed = write_file_atomic(folder / f"{stem}.{backend}", text)
+        if present and not changed:
+            status[stem] = "unchanged"
+            continue
+        try:
+            _install_accounting(backend, stem, rendered)
+            status[stem] = "installed"
+        except Exception as e:
+            (folder / f"{stem}.{backend}").unlink(missing_ok=True)
+            status[stem] = f"error: {e}"
+    return status
+
+def remove_accounting(config_path: Path) -> bool:
+    """Drop a tunnel's accounting table/chains (both backends, missing ones are ignored)."""
+    stem = config_path.stem
+    try:
+        if which("nft"):
+            subprocess.run(["nft", "delete", "table", "inet", ACCT_NFT_PREFIX + _acct_name(stem)],
+                           capture_output=True, timeout=5)
+        if which("iptables"):
+            for direction, hook in (("in", "INPUT"), ("out", "OUTPUT")):
+                chain = _acct_ipt_chain(stem, direction)
+                subprocess.run(["iptables", "-D", hook, "-j", chain], capture_output=True, timeout=5)
+                subprocess.run(["iptables", "-F", chain], capture_output=True, timeout=5)
+                subprocess.run(["iptables", "-X", chain], capture_output=True, timeout=5)
+        for suffix in ("nft", "iptables"):
+            (accounting_dir() / f"{stem}.{suffix}").unlink(missing_ok=True)
+        return True
+    except Exception:
+        return False
+
+def nft_named_counters(tables: Dict[str, str]) -> Dict[str, Dict[str, tuple]]:
+    """Named counters of the given nft tables ({table: key}) in one `nft -j list counters` call: {key: {name: (packets, bytes)}}."""
+    counters: Dict[str, Dict[str, tuple]] = {}
+    result = subprocess.run(["nft", "-j", "list", "counters"], capture_output=True, text=True, timeout=10)
+    try:
+        items = json.loads(result.stdout or "{}").get("nftables", [])
+    except ValueError:
+        items = []
+    for item in items:
+        c = item.get("counter") if isinstance(item, dict) else None
+        if c and c.get("table") in tables:
+            counters.setdefault(tables[c["table"]], {})[c["name"]] = (int(c.get("packets", 0)), int(c.get("bytes", 0)))
+    return counters
+
+def read_accounting_counters(backend: str, stems: List[str]) -> Dict[str, Dict[str, tuple]]:
+    """All counters in one kernel call: {stem: {counter name: (packets, bytes)}}."""
+    if backend == "nft":
+        return nft_named_counters({ACCT_NFT_PREFIX + _acct_name(s): s for s in stems})
+    counters: Dict[str, Dict[str, tuple]] = {}
+    chains = {_acct_ipt_chain(s, d): s for s in stems for d in ("in", "out")}
+    result = subprocess.run(["iptables-save", "-c", "-t", "filter"], capture_output=True, text=True, timeout=10)
+    rule_re = re.compile(r'^\[(\d+):(\d+)\] -A (\S+) .*--comment "?([\w]+)"?')
+    for line in result.stdout.splitlines():
+        m = rule_re.match(line)
+        if m and m.group(3) in chains:
+            per = counters.setdefault(chains[m.group(3)], {})
+            packets, nbytes = per.get(m.group(4), (0, 0))
+            per[m.group(4)] = (packets + int(m.group(1)), nbytes + int(m.group(2)))
+    return counters
+
+def accounting_report(config_paths: Optional[List[Path]] = None, sync: bool = True) -> List[Dict[str, Any]]:
+    """
+    Bytes/packets per mapping and direction with rates since the previous report of the same
+    tunnel (the last reading and its time are kept per tunnel in accounting/last.json).
+    """
+    backend = accounting_backend()
+    if not backend:
+        raise RuntimeError("neither nft nor iptables is installed")
+    if config_paths is None:
+        config_paths = sorted((it["config_path"] for it in list_tunnels()), key=lambda p: p.stem)
+    status = sync_accounting(config_paths) if sync else {}
+    now = time.time()
+    counters = read_accounting_counters(backend, [p.stem for p in config_paths])
+    last_path = accounting_dir() / "last.json"
+    last = {}
+    try:
+        last = json.loads(last_path.read_text())
+    except (OSError, ValueError):
+        pass
+    if not isinstance(last.get("ts"), dict):
+        # older files had one ts for the whole snapshot
+        last["ts"] = {stem: last.get("ts") or 0 for stem in last.get("counters") or {}}
+    rows = []
+    snapshot: Dict[str, Dict[str, list]] = {}
+    for config_path in config_paths:
+        stem = config_path.stem
+        per = counters.get(stem, {})
+        prev_ts = float(last["ts"].get(stem) or 0)
+        elapsed = now - prev_ts if prev_ts else 0.0
+        for t in accounting_targets(parse_yaml_config(config_path) or {}):
+            mapping = t["label"] + (" (hostname: by port only)" if t["kind"] == "peer" and not t["addr"] else "")
+            row = {"stem": stem, "id": t["id"], "kind": t["kind"], "proto": t["proto"], "mapping": mapping,
+                   "backend": backend, "sync": status.get(stem)}
+            for direction in ("in", "out"):
+                name = f"{t['id']}_{direction}"
+                packets, nbytes = per.get(name, (None, None))
+                row[f"packets_{direction}"], row[f"bytes_{direction}"] = packets, nbytes
+                prev = (last.get("counters", {}).get(stem) or {}).get(name)
+                rate = None
+                if nbytes is not None and prev and 0 < elapsed and nbytes >= prev[1]:
+                    rate = round((nbytes - prev[1]) * 8 / elapsed / 1e6, 3)
+                row[f"mbps_{direction}"] = rate
+                if nbytes is not None:
+                    snapshot.setdefault(stem, {})[name] = [packets, nbytes]
+            rows.append(row)
+    # merge into the other tunnels' readings so a report for some tunnels keeps the rest
+    known = {it["config_path"].stem for it in list_tunnels()} | set(snapshot)
+    merged = {stem: c for stem, c in (last.get("counters") or {}).items() if stem in known}
+    merged.update(snapshot)
+    stamps = {stem: ts for stem, ts in last["ts"].items() if stem in merged}
+    stamps.update({stem: now for stem in snapshot})
+    try:
+        last_path.parent.mkdir(parents=True, exist_ok=True)
+        write_file_atomic(last_path, json.dumps({"ts": stamps, "counters": merged}))
+    except OSError:
+        pass
+    return rows
+
+def format_prometheus_accounting(rows: List[Dict[str, Any]]) -> str:
+    """Prometheus text exposition of accounting_report() rows (for node_exporter's textfile collector)."""
+    def esc(value: Any) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"')
+    lines = ["# HELP netrix_mapping_bytes_total Bytes counted by the kernel per tunnel mapping.",
+             "# TYPE netrix_mapping_bytes_total counter",
+             "# HELP netrix_mapping_packets_total Packets counted by the kernel per tunnel mapping.",
+             "# TYPE netrix_mapping_packets_total counter"]
+    for r in rows:
+        for direction in ("in", "out"):
+            labels = (f'tunnel="{esc(r["stem"])}",kind="{r["kind"]}",proto="{r["proto"]}",'
+                      f'mapping="{esc(r["mapping"])}",direction="{direction}"')
+            if r[f"bytes_{direction}"] is not None:
+                lines.append(f"netrix_mapping_bytes_total{{{labels}}} {r[f'bytes_{direction}']}")
+                lines.append(f"netrix_mapping_packets_total{{{labels}}} {r[f'packets_{direction}']}")
+    return "\n".join(lines) + "\n"
+
+# ========== QoS ==========
+# mapped ports get a priority (latency | normal | bulk); nftables marks their packets (fwmark + DSCP)
+# and a tc hierarchy on the egress interface and TUN devices serves the latency tier first
+QOS_PRIORITIES = ("latency", "normal", "bulk")
+QOS_MARKS = {"latency": 0x1, "bulk": 0x3}       # low byte of the fwmark; normal stays unmarked
+QOS_DSCP = {"latency": "ef", "bulk": "cs1"}
+QOS_QDISCS = ("auto", "cake", "prio", "htb")
+QOS_NFT_TABLE = "netrix_qos"
+QOS_DEFAULTS = {"interface": "auto", "bandwidth_mbps": 0, "qdisc": "auto", "tun": True}
+QOS_HTB_SHARES = {"latency": 0.3, "normal": 0.5, "bulk": 0.2}    # guaranteed rates; every class may borrow up to the link
+
+def qos_config_path() -> Path:
+    return NETRIX_CONFIG_DIR / "qos.yaml"
+
+def load_qos_config(path: Optional[Path] = None) -> Dict[str, Any]:
+    """
+    qos.yaml: interface/bandwidth_mbps/qdisc/tun plus `tunnels: {stem: {latency: {tcp: [...], udp: [...]}, bulk: ...}}`.
+    Missing file = defaults and no classes; raises ValueError on invalid content.
+    """
+    path = path or qos_config_path()
+    doc: Dict[str, Any] = {}
+    if path.is_file():
+        try:
+            doc = yaml_safe_load(path.read_text(encoding="utf-8")) or {}
+        except yaml.YAMLError as e:
+            raise ValueError(f"invalid YAML in {path}: {e}")
+        if not isinstance(doc, dict):
+            raise ValueError(f"{path} must be a mapping")
+    config = dict(QOS_DEFAULTS, **{k: v for k, v in doc.items() if k in QOS_DEFAULTS})
+    if config["qdisc"] not in QOS_QDISCS:
+        raise ValueError(f"qos qdisc must be one of {', '.join(QOS_QDISCS)}")
+    tunnels = doc.get("tunnels") or {}
+    if not isinstance(tunnels, dict):
+        raise ValueError("qos 'tunnels:' must map tunnel stems to priorities")
+    for stem, tiers in tunnels.items():
+        if not isinstance(tiers or {}, dict):
+            raise ValueError(f"qos tunnels.{stem} must map priorities to protocols")
+        for tier, protos in (tiers or {}).items():
+            if tier not in QOS_PRIORITIES:
+                raise ValueError(f"qos tunnels.{stem}: unknown priority '{tier}' (use {', '.join(QOS_PRIORITIES)})")
+            if not isinstance(protos or {}, dict):
+                raise ValueError(f"qos tunnels.{stem}.{tier} must map tcp/udp to ports")
+            for proto, ports in (protos or {}).items():
+                if proto not in ("tcp", "udp"):
+                    raise ValueError(f"qos tunnels.{stem}.{tier}: protocol must be tcp or udp")
+                _qos_port_ranges(ports)
+    config["tunnels"] = tunnels
+    return config
+
+def _qos_port_ranges(ports: Any) -> List[tuple]:
+    """'27015', '500-567' or lists of them -> [(lo, hi)]; raises ValueError."""
+    ranges = []
+    for item in ports if isinstance(ports, (list, tuple)) else str(ports).split(","):
+        lo, _, hi = str(item).strip().partition("-")
+        if not lo.isdigit() or (hi and not hi.isdigit()):
+            raise ValueError(f"invalid qos port '{item}'")
+        lo_i, hi_i = int(lo), int(hi or lo)
+        if not 1 <= lo_i <= hi_i <= 65535:
+            raise ValueError(f"qos port out of range: '{item}'")
+        ranges.append((lo_i, hi_i))
+    return ranges
+
+def spec_port_priorities(spec: Dict[str, Any]) -> Dict[str, Dict[str, List[str]]]:
+    """
+    Priorities of spec mapping entries written as `{ports: "27015", priority: latency}`,
+    keyed by tier and protocol with the entries' bind ports.
+    """
+    tiers: Dict[str, Dict[str, List[str]]] = {}
+    for proto in ("tcp", "udp"):
+        value = spec.get(f"{proto}_ports")
+        for entry in value if isinstance(value, (list, tuple)) else []:
+            if not isinstance(entry, dict) or not entry.get("priority"):
+                continue
+            tier = str(entry["priority"]).strip().lower()
+            if tier not in QOS_PRIORITIES:
+                raise ValueError(f"unknown mapping priority '{tier}' (use {', '.join(QOS_PRIORITIES)})")
+            if tier == "normal":
+                continue
+            ports = [int(m["bind"].rpartition(":")[2]) for m in parse_advanced_ports(str(entry.get("ports", "")), proto)]
+            tiers.setdefault(tier, {}).setdefault(proto, []).extend(
+                f"{lo}-{hi}" if lo != hi else str(lo) for lo, hi in _port_ranges(ports))
+    return tiers
+
+def save_qos_priorities(stem: str, tiers: Dict[str, Dict[str, List[str]]]) -> bool:
+    """Replace one tunnel's entry in qos.yaml (dropping it when it has no marked mappings); True if the file changed."""
+    path = qos_config_path()
+    doc: Dict[str, Any] = {}
+    if path.is_file():
+        doc = yaml_safe_load(path.read_text(encoding="utf-8")) or {}
+    tunnels = doc.setdefault("tunnels", {}) or {}
+    doc["tunnels"] = tunnels
+    if tiers:
+        tunnels[stem] = tiers
+    elif stem in tunnels:
+        del tunnels[stem]
+    else:
+        return False
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return write_file_atomic(path, yaml.safe_dump(doc, sort_keys=False))
+
+def remove_qos_tunnel(stem: str) -> bool:
+    """Drop a deleted tunnel from qos.yaml and, when QoS is loaded, from the live marking table."""
+    if not save_qos_priorities(stem, {}):
+        return False
+    loaded = which("nft") and subprocess.run(["nft", "list", "table", "inet", QOS_NFT_TABLE],
+                                             capture_output=True, timeout=10).returncode == 0
+    if loaded:
+        classes = qos_port_classes(load_qos_config())
+        if classes:
+            _qos_run(None, ["nft", "-f"], render_qos_nft(classes))
+        else:
+            _ns_run(None, "nft", "delete", "table", "inet", QOS_NFT_TABLE, check=False)
+    return True
+
+def qos_port_classes(config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Flatten qos.yaml tunnels into [{stem, priority, proto, ports}] (latency first)."""
+    classes = []
+    for tier in ("latency", "bulk"):
+        for stem, tiers in sorted(config.get("tunnels", {}).items()):
+            for proto, ports in sorted(((tiers or {}).get(tier) or {}).items()):
+                classes.append({"stem": stem, "priority": tier, "proto": proto, "ports": _qos_port_ranges(ports)})
+    return classes
+
+def render_qos_nft(classes: List[Dict[str, Any]]) -> str:
+    """
+    Mark packets from or to prioritised ports in postrouting (after routing, before the qdisc):
+    fwmark for tc, DSCP so cake and the next hops see the tier too.
+    """
+    rules = []
+    for c in classes:
+        ports = ", ".join(f"{lo}-{hi}" if lo != hi else str(lo) for lo, hi in c["ports"])
+        mark = QOS_MARKS[c["priority"]]
+        for side in ("sport", "dport"):
+            rules.append(f"        meta l4proto {c['proto']} th {side} {{ {ports} }} "
+                         f"meta mark set meta mark and 0xffffff00 or {mark:#x}")
+    for tier, mark in QOS_MARKS.items():
+        rules.append(f"        meta mark and 0xff == {mark:#x} ip dscp set {QOS_DSCP[tier]}")
+        rules.append(f"        meta mark and 0xff == {mark:#x} ip6 dscp set {QOS_DSCP[tier]}")
+    return (f"table inet {QOS_NFT_TABLE}\ndelete table inet {QOS_NFT_TABLE}\ntable inet {QOS_NFT_TABLE} {{\n"
+            f"    chain postrouting {{\n        type filter hook postrouting priority -150; policy accept;\n"
+            + "".join(r + "\n" for r in rules) + "    }\n}\n")
+
+def render_qos_tc(dev: str, qdisc: str, bandwidth_mbps: float = 0) -> List[List[str]]:
+    """
+    tc commands for one device:
+    - cake: diffserv4 tins driven by the DSCP marks (shaped when a bandwidth is given)
+    - prio: three strict-priority bands with fq_codel leaves, classified by fwmark
+    - htb: shaped to the bandwidth with latency/normal/bulk classes (prio 0/1/2) and fq_codel leaves
+    """
+    base = ["tc", "qdisc", "replace", "dev", dev, "root"]
+    if qdisc == "cake":
+        return [base + ["cake", "diffserv4"] + (["bandwidth", f"{bandwidth_mbps:g}mbit"] if bandwidth_mbps else ["unlimited"])]
+    if qdisc == "prio":
+        band = {"latency": "1:1", "normal": "1:2", "bulk": "1:3"}
+        cmds = [base + ["handle", "1:", "prio", "bands", "3", "priomap"] + ["1"] * 16]
+        for i, tier in enumerate(("latency", "normal", "bulk"), 1):
+            cmds.append(["tc", "qdisc", "replace", "dev", dev, "parent", f"1:{i}", "handle", f"{i}0:", "fq_codel"])
+    elif qdisc == "htb":
+        if not bandwidth_mbps:
+            raise ValueError("htb needs bandwidth_mbps (the link rate to shape to)")
+        band = {"latency": "1:10", "normal": "1:20", "bulk": "1:30"}
+        total = f"{bandwidth_mbps:g}mbit"
+        cmds = [base + ["handle", "1:", "htb", "default", "20"],
+                ["tc", "class", "replace", "dev", dev, "parent", "1:", "classid", "1:1", "htb", "rate", total, "ceil", total]]
+        for prio, tier in enumerate(("latency", "normal", "bulk")):
+            rate = f"{max(1.0, bandwidth_mbps * QOS_HTB_SHARES[tier]):g}mbit"
+            cmds.append(["tc", "class", "replace", "dev", dev, "parent", "1:1", "classid", band[tier],
+                         "htb", "rate", rate, "ceil", total, "prio", str(prio)])
+            cmds.append(["tc", "qdisc", "replace", "dev", dev, "parent", band[tier], "handle", f"{prio + 1}0:", "fq_codel"])
+    else:
+        raise ValueError(f"unknown qdisc '{qdisc}'")
+    for tier, mark in QOS_MARKS.items():
+        cmds.append(["tc", "filter", "replace", "dev", dev, "parent", "1:", "protocol", "all", "prio", str(mark),
+                     "handle", f"{mark:#x}/0xff", "fw", "flowid", band[tier]])
+    return cmds
+
+def qos_devices(config: Dict[str, Any]) -> List[str]:
+    """Egress interface plus the TUN devices of configured tunnels that currently exist."""
+    devices = [detect_default_interface() if config["interface"] in (None, "", "auto") else str(config["interface"])]
+    if config.get("tun"):
+        for it in list_tunnels():
+            cfg = it.get("cfg") or {}
+            tun = cfg.get("tun") or {}
+            if tun.get("enabled") or cfg.get("transport") == "l3":
+                name = str(tun.get("name") or "netrix0").strip()
+                if name not in devices and os.path.exists(f"/sys/class/net/{name}"):
+                    devices.append(name)
+    return devices
+
+def _qos_run(ns: Optional[str], cmd: List[str], script: Optional[str] = None) -> None:
+    """Run a tc/nft command (optionally in a netns); nft scripts go through a temp file."""
+    import tempfile
+    if script is None:
+        _ns_run(ns, *cmd)
+        return
+    with tempfile.NamedTemporaryFile("w", suffix=".nft", delete=False) as f:
+        f.write(script)
+    try:
+        _ns_run(ns, *cmd, f.name)
+    finally:
+        os.unlink(f.name)
+
+def install_qos(classes: List[Dict[str, Any]], devices: List[str], qdisc: str, bandwidth_mbps: float = 0,
+                ns: Optional[str] = None, dry_run: bool = False) -> Dict[str, Any]:
+    """Load the marking table and the tc hierarchy on each device; auto = cake when shaping, else prio."""
+    if qdisc == "auto":
+        qdisc = "cake" if bandwidth_mbps else "prio"
+    report = {"qdisc": qdisc, "bandwidth_mbps": bandwidth_mbps or None, "devices": devices,
+              "classes": [dict(c, ports=[f"{lo}-{hi}" if lo != hi else str(lo) for lo, hi in c["ports"]]) for c in classes],
+              "nft": render_qos_nft(classes), "tc": {dev: render_qos_tc(dev, qdisc, bandwidth_mbps) for dev in devices},
+              "dry_run": dry_run, "errors": []}
+    if dry_run:
+        return report
+    if not which("nft") or not which("tc"):
+        raise RuntimeError("QoS needs nft and tc (nftables, iproute2)")
+    _qos_run(ns, ["nft", "-f"], report["nft"])
+    for dev, cmds in report["tc"].items():
+        try:
+            for cmd in cmds:
+                _qos_run(ns, cmd)
+        except RuntimeError as e:
+            if qdisc != "cake":
+                report["errors"].append(f"{dev}: {e}")
+                continue
+            # sch_cake missing: the same tiers with HTB (shaping) or prio
+            fallback = "htb" if bandwidth_mbps else "prio"
+            try:
+                for cmd in render_qos_tc(dev, fallback, bandwidth_mbps):
+                    _qos_run(ns, cmd)
+                report["qdisc"] = fallback
+            except RuntimeError as e2:
+                report["errors"].append(f"{dev}: {e2}")
+    return report
+
+def clear_qos(devices: List[str], ns: Optional[str] = None) -> None:
+    _ns_run(ns, "nft", "delete", "table", "inet", QOS_NFT_TABLE, check=False)
+    for dev in devices:
+        _ns_run(ns, "tc", "qdisc", "del", "dev", dev, "root", check=False)
+
+def apply_qos(dry_run: bool = False, **overrides) -> Dict[str, Any]:
+    """Install QoS from qos.yaml (interface/bandwidth_mbps/qdisc may be overridden)."""
+    config = load_qos_config()
+    config.update({k: v for k, v in overrides.items() if v is not None})
+    classes = qos_port_classes(config)
+    if not classes:
+        raise ValueError(f"no prioritised mappings in {qos_config_path()} (mark spec ports with priority: latency)")
+    return install_qos(classes, qos_devices(config), config["qdisc"], float(config["bandwidth_mbps"] or 0),
+                       dry_run=dry_run)
+
+def bench_qos(bandwidth_mbps: float = 50, seconds: float = BENCH_DEFAULT_SECONDS, streams: int = BENCH_DEFAULT_STREAMS,
+              qdisc: str = "htb", progress=None) -> Dict[str, Any]:
+    """
+    Effect of the QoS stage on the netns harness: bulk TCP streams saturate a `bandwidth_mbps`
+    bottleneck on the client veth while a UDP echo probes a port marked latency. The same run
+    happens with a plain shaper and with the QoS tiers; udp_p99_ms is the number to compare.
+    """
+    if qdisc in ("auto", "cake"):
+        qdisc = "htb"    # the harness shapes either way; HTB needs no extra module
+    probe = {"stem": "bench", "priority": "latency", "proto": "udp", "ports": [(BENCH_MAP_PORT, BENCH_MAP_PORT)]}
+    ns, dev = BENCH_NS[0], BENCH_VETH[0]
+    runs = {}
+    sinks = []
+    bench_netns_up()
+    try:
+        for port in (BENCH_SINK_PORT, BENCH_MAP_PORT):
+            sinks.append(subprocess.Popen(["ip", "netns", "exec", BENCH_NS[1], *manager_command(),
+                                           "bench-sink", "--port", str(port)],
+                                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        for label, classes in (("baseline", []), ("qos", [probe])):
+            clear_qos([dev], ns)
+            if classes:
+                install_qos(classes, [dev], qdisc, bandwidth_mbps, ns=ns)
+            else:
+                # same bottleneck, one class: what the box does without the QoS stage
+                total = f"{bandwidth_mbps:g}mbit"
+                _qos_run(ns, ["tc", "qdisc", "replace", "dev", dev, "root", "handle", "1:", "htb", "default", "1"])
+                _qos_run(ns, ["tc", "class", "replace", "dev", dev, "parent", "1:", "classid", "1:1", "htb", "rate", total])
+                _qos_run(ns, ["tc", "qdisc", "replace", "dev", dev, "parent", "1:1", "handle", "10:", "fq_codel"])
+            if progress:
+                progress(f"{label}: {streams} bulk streams over {bandwidth_mbps:g} Mbit/s with a UDP probe...")
+            gen = _ns_run(ns, *manager_command(), "bench-gen", "--host", BENCH_ADDRS[1],
+                          "--port", str(BENCH_SINK_PORT), "--udp-port", str(BENCH_MAP_PORT), "--wait", "10",
+                          "--seconds", str(seconds), "--streams", str(streams), "--json",
+                          check=False, timeout=seconds + 60)
+            try:
+                runs[label] = json.loads(gen.stdout)
+            except ValueError:
+                runs[label] = {"error": (gen.stderr or gen.stdout).strip()[-300:]}
+    finally:
+        for sink in sinks:
+            sink.kill()
+            sink.wait()
+        bench_netns_down()
+    base, qos = runs.get("baseline", {}), runs.get("qos", {})
+    delta = None
+    if base.get("udp_p99_ms") is not None and qos.get("udp_p99_ms") is not None:
+        delta = round(qos["udp_p99_ms"] - base["udp_p99_ms"], 2)
+    return {"bandwidth_mbps": bandwidth_mbps, "qdisc": qdisc, "streams": streams, "seconds": seconds,
+            "runs": runs, "udp_p99_delta_ms": delta}
+
+# ========== Rate Limits ==========
+# rate_limit/burst on mappings and whole tunnels, enforced by named nftables limits (one token bucket
+# per limit and direction) so the tunnel process never sees the policing; drops are counted per limit
+LIMIT_NFT_PREFIX = "netrix_limit_"
+LIMIT_DEFAULT_BURST_S = 0.1      # burst default: 100 ms of the rate ...
+LIMIT_MIN_BURST = 64 * 1024      # ... but at least 64 KiB
+
+def limits_config_path() -> Path:
+    return NETRIX_CONFIG_DIR / "limits.yaml"
+
+def parse_rate_bits(value: Any) -> int:
+    """
+    '50mbit', '1.5gbit', '800kbit', 50 (= Mbit/s) -> bits per second; raises ValueError.
+    kbps/mbps are rejected: tc reads them as bytes per second, most people as bits.
+    """
+    m = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*(?:([kmg]?)bit)?\s*", str(value).lower())
+    if not m:
+        raise ValueError(f"invalid rate '{value}' (use kbit/mbit/gbit, e.g. 50mbit; a bare number is Mbit/s)")
+    scale = {None: 1e6, "": 1, "k": 1e3, "m": 1e6, "g": 1e9}[m.group(2)]
+    bits = int(float(m.group(1)) * scale)
+    if bits <= 0:
+        raise ValueError(f"rate must be positive: '{value}'")
+    return bits
+
+def parse_size_bytes(value: Any) -> int:
+    """'512kb', '2mb', '65536' -> bytes (k/m = 1024-based); raises ValueError."""
+    m = re.fullmatch(r"\s*(\d+)\s*([kmg]?)i?b?\s*", str(value).lower())
+    if not m:
+        raise ValueError(f"invalid size '{value}' (e.g. 512kb, 2mb)")
+    return int(m.group(1)) * {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}[m.group(2)]
+
+def _limit_entry(rate: Any, burst: Any, where: str) -> Dict[str, Any]:
+    try:
+        bits = parse_rate_bits(rate)
+        burst_bytes = parse_size_bytes(burst) if burst not in (None, "") else \
+            max(LIMIT_MIN_BURST, int(bits / 8 * LIMIT_DEFAULT_BURST_S))
+    except ValueError as e:
+        raise ValueError(f"{where}: {e}")
+    return {"rate_limit": str(rate), "rate_bits": bits, "burst_bytes": burst_bytes}
+
+def spec_limits(spec: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    rate_limit/burst of a tunnel spec: top-level ones cap the whole tunnel, ones on
+    `{ports: ..., rate_limit: ..., burst: ...}` mapping entries cap that mapping.
+    """
+    limits: Dict[str, Any] = {}
+    if spec.get("rate_limit"):
+        _limit_entry(spec["rate_limit"], spec.get("burst"), "rate_limit")
+        limits["rate_limit"] = str(spec["rate_limit"])
+        if spec.get("burst"):
+            limits["burst"] = str(spec["burst"])
+    mappings = []
+    for proto in ("tcp", "udp"):
+        value = spec.get(f"{proto}_ports")
+        for entry in value if isinstance(value, (list, tuple)) else []:
+            if isinstance(entry, dict) and entry.get("rate_limit"):
+                ports = str(entry.get("ports", "")).strip()
+                parse_advanced_ports(ports, proto)
+                _limit_entry(entry["rate_limit"], entry.get("burst"), f"{proto}_ports {ports}")
+                mapping = {"proto": proto, "ports": ports, "rate_limit": str(entry["rate_limit"])}
+                if entry.get("burst"):
+                    mapping["burst"] = str(entry["burst"])
+                mappings.append(mapping)
+    if mappings:
+        limits["mappings"] = mappings
+    return limits
+
+def load_limits(path: Optional[Path] = None) -> Dict[str, Dict[str, Any]]:
+    """limits.yaml `tunnels: {stem: {rate_limit, burst, mappings: [{proto, ports, rate_limit, burst}]}}`."""
+    path = path or limits_config_path()
+    if not path.is_file():
+        return {}
+    try:
+        doc = yaml_safe_load(path.read_text(encoding="utf-8")) or {}
+    except yaml.YAMLError as e:
+        raise ValueError(f"invalid YAML in {path}: {e}")
+    tunnels = doc.get("tunnels") if isinstance(doc, dict) else None
+    if not isinstance(tunnels or {}, dict):
+        raise ValueError(f"{path}: 'tunnels:' must map tunnel stems to limits")
+    return tunnels or {}
+
+def save_limits(stem: str, limits: Dict[str, Any]) -> bool:
+    """Replace one tunnel's entry in limits.yaml (dropping it when empty); True if the file changed."""
+    path = limits_config_path()
+    doc = {"tunnels": load_limits(path)}
+    if limits:
+        doc["tunnels"][stem] = limits
+    elif stem in doc["tunnels"]:
+        del doc["tunnels"][stem]
+    else:
+        return False
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return write_file_atomic(path, yaml.safe_dump(doc, sort_keys=False))
+
+def limit_rules(cfg: dict, limits: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    One entry per limit and direction: {name, label, rate_bits, burst_bytes, matches: [nft match, ...]}.
+    Mapping limits match the bind ports; the tunnel limit matches its listen port and dialled
+    peers (the carrier all its mappings share), through a single bucket per direction.
+    Hostname peers are left out of the tunnel limit (listed under `skipped`): a port-only
+    match would throttle every flow on the host to that port.
+    """
+    rules = []
+    for i, m in enumerate(limits.get("mappings") or []):
+        entry = _limit_entry(m.get("rate_limit"), m.get("burst"), f"mapping {m.get('ports')}")
+        ports = [int(x["bind"].rpartition(":")[2]) for x in parse_advanced_ports(str(m["ports"]), m["proto"])]
+        spec = ", ".join(f"{lo}-{hi}" if lo != hi else str(lo) for lo, hi in _port_ranges(ports))
+        for direction in ("in", "out"):
+            side = "dport" if direction == "in" else "sport"
+            rules.append(dict(entry, name=f"map_{i}_{direction}", label=f"{m['proto']} {m['ports']}",
+                              direction=direction, matches=[f"{m['proto']} {side} {{ {spec} }}"]))
+    if limits.get("rate_limit"):
+        entry = _limit_entry(limits["rate_limit"], limits.get("burst"), "tunnel rate_limit")
+        carriers, skipped = [], []
+        for t in accounting_targets(cfg):
+            if t["kind"] == "peer" and not t["addr"]:
+                skipped.append(f"{t['label']} (hostname peer)")
+            elif t["kind"] in ("listen", "peer"):
+                carriers.append(t)
+        if not carriers:
+            if skipped:
+                raise ValueError(f"tunnel rate_limit has no address to match: {'; '.join(skipped)}")
+            raise ValueError("tunnel rate_limit needs a listen port or a dialled peer to match")
+        for direction in ("in", "out"):
+            matches = [_target_nft_match(t, direction) for t in carriers]
+            rules.append(dict(entry, name=f"tunnel_{direction}", label="tunnel", direction=direction,
+                              matches=matches, skipped=skipped))
+    return rules
+
+def render_limits_nft(stem: str, rules: List[Dict[str, Any]]) -> str:
+    """nft script for the tunnel's limit table: named limits (shared buckets), hit counters, drop rules."""
+    table = LIMIT_NFT_PREFIX + _acct_name(stem)
+    objects, chains = [], {"in": [], "out": []}
+    for r in rules:
+        objects.append(f"    limit lim_{r['name']} {{ rate over {r['rate_bits'] // 8} bytes/second "
+                       f"burst {r['burst_bytes']} bytes }}")
+        objects.append(f"    counter hit_{r['name']} {{ }}")
+        for match in r["matches"]:
+            chains[r["direction"]].append(f"        {match} limit name lim_{r['name']} counter name hit_{r['name']} drop")
+    body = []
+    for direction, hook in (("in", "input"), ("out", "output")):
+        body.append(f"    chain {hook} {{\n        type filter hook {hook} priority -140; policy accept;\n"
+                    + "".join(line + "\n" for line in chains[direction]) + "    }")
+    return (f"table inet {table}\ndelete table inet {table}\ntable inet {table} {{\n"
+            + "\n".join(objects + body) + "\n}\n")
+
+def sync_limits(config_paths: Optional[List[Path]] = None) -> Dict[str, str]:
+    """
+    Install limits.yaml into the kernel; a tunnel's table is only reloaded (resetting its
+    buckets and hit counters) when its rules changed or it is missing. Returns {stem: status}.
+    """
+    if not which("nft"):
+        raise RuntimeError("rate limits need nftables (nft)")
+    if config_paths is None:
+        config_paths = sorted((it["config_path"] for it in list_tunnels()), key=lambda p: p.stem)
+    limits = load_limits()
+    installed = _installed_accounting("nft")
+    folder = accounting_dir()
+    folder.mkdir(parents=True, exist_ok=True)
+    status = {}
+    for config_path in config_paths:
+        stem = config_path.stem
+        table = LIMIT_NFT_PREFIX + _acct_name(stem)
+        saved = folder / f"{stem}.limits.nft"
+        if not limits.get(stem):
+            if table in installed:
+                remove_limits(config_path)
+            saved.unlink(missing_ok=True)
+            continue
+        try:
+            script = render_limits_nft(stem, limit_rules(parse_yaml_config(config_path) or {}, limits[stem]))
+        except ValueError as e:
+            status[stem] = f"error: {e}"
+            continue
+        if not write_file_atomic(saved, script) and table in installed:
+            status[stem] = "unchanged"
+            continue
+        result = subprocess.run(["nft", "-f", "-"], input=script, capture_output=True, text=True, timeout=10)
+        if result.returncode == 0:
+            status[stem] = "installed"
+        else:
+            saved.unlink(missing_ok=True)
+            status[stem] = f"error: {result.stderr.strip() or 'nft failed'}"
+    return status
+
+def remove_limits(config_path: Path) -> bool:
+    if not which("nft"):
+        return True
+    subprocess.run(["nft", "delete", "table", "inet", LIMIT_NFT_PREFIX + _acct_name(config_path.stem)],
+                   capture_output=True, timeout=5)
+    (accounting_dir() / f"{config_path.stem}.limits.nft").unlink(missing_ok=True)
+    return True
+
+def limits_unit_commands(config_path: Path) -> List[str]:
+    """ExecStartPre shell command that reloads the saved limit table, so limits survive stop/start and reboots."""
+    saved = accounting_dir() / f"{config_path.stem}.limits.nft"
+    return [f"test -f {saved} && nft -f {saved} || true"]
+
+def limits_report(config_paths: Optional[List[Path]] = None) -> List[Dict[str, Any]]:
+    """Configured limits with how often each was hit (dropped packets/bytes since it was installed)."""
+    if config_paths is None:
+        config_paths = sorted((it["config_path"] for it in list_tunnels()), key=lambda p: p.stem)
+    limits = load_limits()
+    stems = [p.stem for p in config_paths if limits.get(p.stem)]
+    hits = nft_named_counters({LIMIT_NFT_PREFIX + _acct_name(s): s for s in stems}) if stems and which("nft") else {}
+    rows = []
+    for config_path in config_paths:
+        stem = config_path.stem
+        if not limits.get(stem):
+            continue
+        try:
+            rules = limit_rules(parse_yaml_config(config_path) or {}, limits[stem])
+        except ValueError as e:
+            rows.append({"stem": stem, "limit": "-", "error": str(e)})
+            continue
+        for r in rules:
+            packets, nbytes = hits.get(stem, {}).get(f"hit_{r['name']}", (None, None))
+            rows.append({"stem": stem, "limit": r["label"], "direction": r["direction"],
+                         "rate_limit": r["rate_limit"], "burst_bytes": r["burst_bytes"],
+                         "installed": packets is not None, "hit_packets": packets, "hit_bytes": nbytes,
+                         "skipped": r.get("skipped") or []})
+    return rows
+
+# ========== Conntrack ==========
+# tunnel carriers (and, when nothing on the host depends on connection state, mapped ports) can skip
+# conntrack entirely via NOTRACK in the raw hook; whatever is still tracked gets a table sized from RAM
+NOTRACK_MODES = ("off", "transport", "all")
+NOTRACK_NFT_PREFIX = "netrix_notrack_"
+NOTRACK_IPT_PREFIX = "NXN_"
+CT_ENTRY_BYTES = 384             # nf_conn plus the usual extensions, per tracked flow
+CT_RAM_SHARE = 1 / 16            # share of RAM the conntrack table may take at nf_conntrack_max
+CT_MAX_RANGE = (65536, 4194304)
+
+def conntrack_config_path() -> Path:
+    return NETRIX_CONFIG_DIR / "conntrack.yaml"
+
+def _notrack_mode(value: Any) -> str:
+    """Spec `notrack:` value -> one of NOTRACK_MODES; true means transport; raises ValueError."""
+    if value is True:
+        return "transport"
+    if value in (None, False, ""):
+        return "off"
+    mode = str(value).strip().lower()
+    if mode not in NOTRACK_MODES:
+        raise ValueError(f"notrack must be one of {', '.join(NOTRACK_MODES)} (or true/false), got '{value}'")
+    return mode
+
+def load_notrack(path: Optional[Path] = None) -> Dict[str, str]:
+    """conntrack.yaml `tunnels: {stem: transport|all}`."""
+    path = path or conntrack_config_path()
+    if not path.is_file():
+        return {}
+    try:
+        doc = yaml_safe_load(path.read_text(encoding="utf-8")) or {}
+    except yaml.YAMLError as e:
+        raise ValueError(f"invalid YAML in {path}: {e}")
+    tunnels = doc.get("tunnels") if isinstance(doc, dict) else None
+    if not isinstance(tunnels or {}, dict):
+        raise ValueError(f"{path}: 'tunnels:' must map tunnel stems to a notrack mode")
+    return {stem: _notrack_mode(mode) for stem, mode in (tunnels or {}).items()}
+
+def save_notrack(stem: str, mode: str) -> bool:
+    """Set one tunnel's notrack mode ('off' drops it); True if conntrack.yaml changed."""
+    path = conntrack_config_path()
+    tunnels = load_notrack(path)
+    if mode != "off":
+        tunnels[stem] = mode
+    elif stem in tunnels:
+        del tunnels[stem]
+    else:
+        return False
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return write_file_atomic(path, yaml.safe_dump({"tunnels": tunnels}, sort_keys=False))
+
+def conntrack_dependents() -> List[str]:
+    """
+    Why untracked mapped ports could break this host: stateful filter rules (they drop
+    untracked packets that only an 'established' rule would accept) and NAT, which needs
+    conntrack. Empty when mapped ports can safely skip conntrack too.
+    """
+    reasons = []
+    if which("iptables-save"):
+        result = subprocess.run(["iptables-save"], capture_output=True, text=True, timeout=10)
+        table = ""
+        for line in result.stdout.splitlines():
+            if line.startswith("*"):
+                table = line[1:]
+            elif line.startswith("-A") and not line.split()[1].startswith(NOTRACK_IPT_PREFIX):
+                if table == "nat" and "iptables NAT rules" not in reasons:
+                    reasons.append("iptables NAT rules")
+                elif re.search(r"-m (conntrack|state)\b", line) and "stateful iptables rules" not in reasons:
+                    reasons.append("stateful iptables rules")
+    if which("nft"):
+        result = subprocess.run(["nft", "list", "ruleset"], capture_output=True, text=True, timeout=10)
+        for line in result.stdout.splitlines():
+            line = line.strip()
+            if re.search(r"\b(masquerade|dnat|snat|redirect)\b", line) and "nftables NAT rules" not in reasons:
+                reasons.append("nftables NAT rules")
+            elif re.search(r"\bct (state|status)\b", line) and "stateful nftables rules" not in reasons:
+                reasons.append("stateful nftables rules")
+    return reasons
+
+def notrack_targets(cfg: dict, mode: str, dependents: List[str]) -> tuple[List[Dict[str, Any]], List[str]]:
+    """
+    (targets to NOTRACK, "label (reason)" of ports kept tracked) for one tunnel and mode.
+    With NAT or stateful rules on the host nothing is untracked: a stateful input policy
+    drops the peer's untracked replies. Hostname peers stay tracked too, since a
+    port-only match would also catch the host's other flows to that port.
+    """
+    if mode == "off":
+        return [], []
+    targets, kept = [], []
+    for t in accounting_targets(cfg):
+        if t["kind"] == "mapping" and mode != "all":
+            continue
+        if dependents:
+            kept.append(f"{t['label']} ({', '.join(dependents)})")
+        elif t["kind"] == "peer" and not t["addr"]:
+            kept.append(f"{t['label']} (hostname peer)")
+        else:
+            targets.append(t)
+    return targets, kept
+
+def render_notrack_nft(stem: str, targets: List[Dict[str, Any]]) -> str:
+    """nft script for the tunnel's notrack table (raw priority, before conntrack sees the packet)."""
+    table = NOTRACK_NFT_PREFIX + _acct_name(stem)
+    chains = []
+    for direction, hook in (("in", "prerouting"), ("out", "output")):
+        rules = "".join(f"        {_target_nft_match(t, direction)} notrack\n" for t in targets)
+        chains.append(f"    chain {hook} {{\n        type filter hook {hook} priority -300; policy accept;\n{rules}    }}")
+    return f"table inet {table}\ndelete table inet {table}\ntable inet {table} {{\n" + "\n".join(chains) + "\n}\n"
+
+def _installed_notrack(backend: str) -> set:
+    if backend == "nft":
+        return _installed_accounting("nft")
+    result = subprocess.run(["iptables-save", "-t", "raw"], capture_output=True, text=True, timeout=5)
+    return {line[1:].split()[0] for line in result.stdout.splitlines() if line.startswith(":" + NOTRACK_IPT_PREFIX)}
+
+def _install_notrack_iptables(stem: str, rules: List[List[str]]):
+    for direction, hook in (("in", "PREROUTING"), ("out", "OUTPUT")):
+        chain = _acct_ipt_chain(stem, direction, NOTRACK_IPT_PREFIX)
+        subprocess.run(["iptables", "-t", "raw", "-N", chain], capture_output=True, timeout=5)
+        subprocess.run(["iptables", "-t", "raw", "-F", chain], capture_output=True, timeout=5)
+        if subprocess.run(["iptables", "-t", "raw", "-C", hook, "-j", chain], capture_output=True, timeout=5).returncode != 0:
+            subprocess.run(["iptables", "-t", "raw", "-I", hook, "1", "-j", chain], capture_output=True, timeout=5)
+    for rule in rules:
+        result = subprocess.run(["iptables", "-t", "raw", *rule], capture_output=True, text=True, timeout=5)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip() or "iptables failed")
+
+def sync_notrack(config_paths: Optional[List[Path]] = None) -> Dict[str, str]:
+    """
+    Install conntrack.yaml into the raw hook (nftables, else iptables raw chains); a tunnel
+    is only reloaded when its rules changed or are missing. Returns {stem: status}.
+    """
+    backend = accounting_backend()
+    if not backend:
+        raise RuntimeError("neither nft nor iptables is installed")
+    if config_paths is None:
+        config_paths = sorted((it["config_path"] for it in list_tunnels()), key=lambda p: p.stem)
+    modes = load_notrack()
+    dependents = conntrack_dependents() if modes else []
+    installed = _installed_notrack(backend)
+    folder = accounting_dir()
+    folder.mkdir(parents=True, exist_ok=True)
+    status = {}
+    for config_path in config_paths:
+        stem = config_path.stem
+        targets, kept = notrack_targets(parse_yaml_config(config_path) or {}, modes.get(stem, "off"), dependents)
+        present = (NOTRACK_NFT_PREFIX + _acct_name(stem) if backend == "nft" else
+                   _acct_ipt_chain(stem, "in", NOTRACK_IPT_PREFIX)) in installed
+        saved = folder / f"{stem}.notrack.{backend}"
+        if not targets:
+            if present or saved.exists():
+                remove_notrack(config_path)
+            if kept:
+                status[stem] = f"skipped: {'; '.join(kept)}"
+            continue
+        if backend == "nft":
+            rendered = render_notrack_nft(stem, targets)
+            text = rendered
+        else:
+            rendered = render_accounting_iptables(stem, targets, NOTRACK_IPT_PREFIX, "NOTRACK")
+            text = "\n".join(" ".join(rule) for rule in rendered) + "\n"
+        if write_file_atomic(saved, text) or not present:
+            try:
+                if backend == "nft":
+                    _install_accounting("nft", stem, rendered)
+                else:
+                    _install_notrack_iptables(stem, rendered)
+                status[stem] = "installed"
+            except Exception as e:
+                saved.unlink(missing_ok=True)
+                status[stem] = f"error: {e}"
+                continue
+        else:
+            status[stem] = "unchanged"
+        if kept:
+            status[stem] += f" (still tracked: {'; '.join(kept)})"
+    return status
+
+def remove_notrack(config_path: Path) -> bool:
+    """Drop a tunnel's notrack table/raw chains (both backends, missing ones are ignored)."""
+    stem = config_path.stem
+    try:
+        if which("nft"):
+            subprocess.run(["nft", "delete", "table", "inet", NOTRACK_NFT_PREFIX + _acct_name(stem)],
+                           capture_output=True, timeout=5)
+        if which("iptables"):
+            for direction, hook in (("in", "PREROUTING"), ("out", "OUTPUT")):
+                chain = _acct_ipt_chain(stem, direction, NOTRACK_IPT_PREFIX)
+                subprocess.run(["iptables", "-t", "raw", "-D", hook, "-j", chain], capture_output=True, timeout=5)
+                subprocess.run(["iptables", "-t", "raw", "-F", chain], capture_output=True, timeout=5)
+                subprocess.run(["iptables", "-t", "raw", "-X", chain], capture_output=True, timeout=5)
+        for suffix in ("nft", "iptables"):
+            (accounting_dir() / f"{stem}.notrack.{suffix}").unlink(missing_ok=True)
         return True
     except Exception:
         return False
 
+def notrack_unit_commands(config_path: Path) -> List[str]:
+    """ExecStartPre shell commands that reload the saved notrack rules (either backend) on every start."""
+    folder = accounting_dir()
+    saved_nft, saved_ipt = folder / f"{config_path.stem}.notrack.nft", folder / f"{config_path.stem}.notrack.iptables"
+    ipt = []
+    for direction, hook in (("in", "PREROUTING"), ("out", "OUTPUT")):
+        chain = _acct_ipt_chain(config_path.stem, direction, NOTRACK_IPT_PREFIX)
+        ipt += [f"iptables -t raw -N {chain} 2>/dev/null", f"iptables -t raw -F {chain}",
+                f"iptables -t raw -C {hook} -j {chain} 2>/dev/null || iptables -t raw -I {hook} 1 -j {chain}"]
+    # $$ is systemd's escape for a literal $
+    ipt.append(f"while read -r rule; do iptables -t raw $$rule; done < {saved_ipt}")
+    return [f"test -f {saved_nft} && nft -f {saved_nft} || true",
+            f"if test -f {saved_ipt}; then {'; '.join(ipt)}; fi"]
+
+def conntrack_stats() -> Dict[str, Any]:
+    """
+    Table usage and the per-CPU counters of /proc/net/stat/nf_conntrack summed up
+    (insert_failed/drop/early_drop mean the table or a hash chain was full).
+    """
+    max_text = _read_proc_text("/proc/sys/net/netfilter/nf_conntrack_max")
+    if not max_text.isdigit():
+        return {"loaded": False}
+    count = int(_read_proc_text("/proc/sys/net/netfilter/nf_conntrack_count") or 0)
+    buckets = _read_proc_text("/proc/sys/net/netfilter/nf_conntrack_buckets")
+    stats = {"loaded": True, "count": count, "max": int(max_text),
+             "usage_pct": round(100.0 * count / max(1, int(max_text)), 1),
+             "buckets": int(buckets) if buckets.isdigit() else None}
+    lines = _read_proc_text("/proc/net/stat/nf_conntrack").splitlines()
+    if lines:
+        names = lines[0].split()
+        totals = dict.fromkeys(names, 0)
+        for line in lines[1:]:
+            for name, value in zip(names, line.split()):
+                if name != "entries":        # global, repeated on every CPU row
+                    totals[name] += int(value, 16)
+        for name in ("insert_failed", "drop", "early_drop", "search_restart", "invalid"):
+            if name in totals:
+                stats[name] = totals[name]
+    return stats
+
+def conntrack_sizing(mem_total: Optional[int] = None) -> Dict[str, int]:
+    """nf_conntrack_max (and an equal hash size, one entry per bucket) sized from RAM; never below the current values."""
+    mem_total = mem_total or read_memory_budget()["total"]
+    lo, hi = CT_MAX_RANGE
+    entries = max(lo, min(hi, int(mem_total * CT_RAM_SHARE / CT_ENTRY_BYTES)))
+    entries = 1 << (entries.bit_length() - 1)
+    current = _read_proc_text("/proc/sys/net/netfilter/nf_conntrack_max")
+    current_buckets = _read_proc_text("/sys/module/nf_conntrack/parameters/hashsize")
+    entries = max(entries, int(current) if current.isdigit() else 0)
+    return {"max": entries, "hashsize": max(entries, int(current_buckets) if current_buckets.isdigit() else 0),
+            "memory_bytes": entries * CT_ENTRY_BYTES}
+
+def apply_conntrack_sizing() -> Dict[str, Any]:
+    """Set nf_conntrack_max/hashsize now and persist the hash size for the next module load."""
+    sizing = conntrack_sizing()
+    if not conntrack_stats()["loaded"]:
+        return dict(sizing, applied=False, reason="nf_conntrack is not loaded (nothing is tracked)")
+    errors = []
+    try:
+        Path("/sys/module/nf_conntrack/parameters/hashsize").write_text(str(sizing["hashsize"]))
+    except OSError as e:
+        errors.append(f"hashsize: {e} (not persisted)")
+    else:
+        # only persist a hash size the running kernel accepted
+        NETRIX_CONNTRACK_MODPROBE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        write_file_atomic(NETRIX_CONNTRACK_MODPROBE_FILE,
+                          f"# Netrix conntrack hash size - managed by net.py\noptions nf_conntrack hashsize={sizing['hashsize']}\n",
+                          mode=0o644)
+    result = subprocess.run(["sysctl", "-w", f"net.netfilter.nf_conntrack_max={sizing['max']}"],
+                            capture_output=True, text=True, timeout=5)
+    if result.returncode != 0:
+        errors.append(f"nf_conntrack_max: {(result.stderr or result.stdout).strip()}")
+    return dict(sizing, applied=not errors, errors=errors)
+
+def notrack_report(config_paths: Optional[List[Path]] = None) -> List[Dict[str, Any]]:
+    """Per tunnel: notrack mode, the ports that skip conntrack, mappings kept tracked and whether rules are loaded."""
+    if config_paths is None:
+        config_paths = sorted((it["config_path"] for it in list_tunnels()), key=lambda p: p.stem)
+    modes = load_notrack()
+    dependents = conntrack_dependents() if modes else []
+    backend = accounting_backend()
+    installed = _installed_notrack(backend) if backend else set()
+    rows = []
+    for config_path in config_paths:
+        stem = config_path.stem
+        mode = modes.get(stem, "off")
+        targets, kept = notrack_targets(parse_yaml_config(config_path) or {}, mode, dependents)
+        name = NOTRACK_NFT_PREFIX + _acct_name(stem) if backend == "nft" else \
+            _acct_ipt_chain(stem, "in", NOTRACK_IPT_PREFIX)
+        rows.append({"stem": stem, "notrack": mode, "untracked": [t["label"] for t in targets],
+                     "tracked": kept, "installed": bool(targets) and name in installed})
+    return rows
+
 # ========== Menus ==========
 def start_configure_menu():
     """Create/configure a new tunnel."""
@@ -3187,13 +8344,7 @@ def create_server_tunnel():
         anti_dpi_delay_ms = configure_anti_dpi()
         
         print(f"\n  {BOLD}{FG_CYAN}Performance Profiles:{RESET}")
-        print(f"  {FG_CYAN}[1]{RESET} {FG_WHITE}balanced{RESET}")
-        print(f"  {FG_CYAN}[2]{RESET} {FG_WHITE}aggressive{RESET}")
-        print(f"  {FG_CYAN}[3]{RESET} {FG_WHITE}latency{RESET}")
-        print(f"  {FG_CYAN}[4]{RESET} {FG_WHITE}cpu-efficient{RESET}")
-        profile_choice = ask_int(f"\n  {BOLD}Select profile:{RESET}", min_=1, max_=4, default=1)
-        profiles = {1: "balanced", 2: "aggressive", 3: "latency", 4: "cpu-efficient"}
-        profile = profiles[profile_choice]
+        profile = ask_profile()
         
         stream_queue_size = None
         if direct_mode:
@@ -3425,7 +8576,7 @@ def create_server_tunnel():
                     break
                 tun_routes.append(route)
                 c_ok(f"Route added: {route}")
-            tun_streams = ask_int(f"  {BOLD}TUN Streams:{RESET}", min_=1, max_=64, default=4)
+            tun_streams = ask_tun_streams()
             forward_l2tp = ask_yesno(f"  {BOLD}Auto-forward L2TP/IPsec ports{RESET}", default=True)
             l2tp_dest_ip = ""
             if forward_l2tp:
@@ -3523,12 +8674,18 @@ def create_server_tunnel():
             apply_rawsocket_detected_to_cfg(cfg, transport)
             print_rawsocket_detect_summary(cfg)
         
+        merge_cfg_overrides(cfg, configure_path_sizing(cfg))
+        merge_cfg_overrides(cfg, configure_fec(cfg))
         config_path = create_server_config_file(tport, cfg)
+        configure_path_mtu(config_path)
+        warn_memory_budget(config_path)
         
         print()
         print(f"  {BOLD}{FG_CYAN}{'═' * 60}{RESET}")
         c_ok(f"  ✅ Configuration saved: {FG_WHITE}{config_path}{RESET}")
         print(f"  {BOLD}{FG_CYAN}{'═' * 60}{RESET}")
+        if encryption_enabled:
+            print(f"  {FG_WHITE}Client must use encryption algorithm: {FG_GREEN}{encryption_algorithm}{RESET}")
         
         print()
         if ask_yesno(f"  {BOLD}{FG_CYAN}Start tunnel now?{RESET}", default=True):
@@ -3789,7 +8946,7 @@ def create_client_tunnel():
         pass
         psk = ask_nonempty(f"  {BOLD}Pre-shared Key (PSK):{RESET}")
         
-        encryption_config = configure_encryption()
+        encryption_config = configure_encryption("client")
         encryption_enabled = encryption_config["enabled"]
         encryption_algorithm = encryption_config["algorithm"]
         encryption_key = encryption_config["key"]
@@ -3805,13 +8962,7 @@ def create_client_tunnel():
         anti_dpi_delay_ms = configure_anti_dpi()
         
         print(f"\n  {BOLD}{FG_CYAN}Performance Profiles:{RESET}")
-        print(f"  {FG_CYAN}[1]{RESET} {FG_WHITE}balanced{RESET}")
-        print(f"  {FG_CYAN}[2]{RESET} {FG_WHITE}aggressive{RESET}")
-        print(f"  {FG_CYAN}[3]{RESET} {FG_WHITE}latency{RESET}")
-        print(f"  {FG_CYAN}[4]{RESET} {FG_WHITE}cpu-efficient{RESET}")
-        profile_choice = ask_int(f"\n  {BOLD}Select profile:{RESET}", min_=1, max_=4, default=1)
-        profiles = {1: "balanced", 2: "aggressive", 3: "latency", 4: "cpu-efficient"}
-        profile = profiles[profile_choice]
+        profile = ask_profile()
 
         paths = []
         connection_pool = 8
@@ -3973,7 +9124,7 @@ def create_client_tunnel():
 
         _section("PERFORMANCE")
         if ask_yesno(f"  {BOLD}Custom compression{RESET}", default=False):
-            compression_config = configure_compression()
+            compression_config = configure_compression("client")
         else:
             compression_config = {
                 "enabled": True,
@@ -4011,7 +9162,7 @@ def create_client_tunnel():
                     break
                 tun_routes.append(route)
                 c_ok(f"Route added: {route}")
-            tun_streams = ask_int(f"  {BOLD}TUN Streams:{RESET}", min_=1, max_=64, default=4)
+            tun_streams = ask_tun_streams()
             tun_config = {
                 "enabled": True,
                 "name": tun_name,
@@ -4075,7 +9226,11 @@ def create_client_tunnel():
             apply_rawsocket_detected_to_cfg(cfg, transport)
             print_rawsocket_detect_summary(cfg)
         
+        merge_cfg_overrides(cfg, configure_path_sizing(cfg))
+        merge_cfg_overrides(cfg, configure_fec(cfg))
         config_path = create_client_config_file(cfg)
+        configure_path_mtu(config_path)
+        warn_memory_budget(config_path)
         
         print()
         print(f"  {BOLD}{FG_CYAN}{'═' * 60}{RESET}")
@@ -4096,8 +9251,17 @@ def create_client_tunnel():
     except Exception:
         pause()
 
+def _ingest_journal_quietly():
+    try:
+        ingest_journal(timeout=LOG_DASHBOARD_INGEST_TIMEOUT, wait_lock=False)
+    except Exception:
+        pass
+
 def status_menu():
-    """Tunnel status dashboard."""
+    """Tunnel status dashboard; log counts come from the last index while a short ingest runs in the background."""
+    import threading
+
+    threading.Thread(target=_ingest_journal_quietly, daemon=True).start()
     while True:
         clear()
         try:
@@ -4110,6 +9274,11 @@ def status_menu():
             f"{FG_WHITE}Active services:{RESET} {FG_GREEN}{sum(1 for it in items if it.get('alive'))}{RESET}",
             f"{FG_WHITE}Stopped services:{RESET} {FG_RED}{sum(1 for it in items if not it.get('alive'))}{RESET}",
         ]
+        ct = conntrack_stats()
+        if ct["loaded"]:
+            dropped = ct.get("insert_failed", 0) + ct.get("drop", 0) + ct.get("early_drop", 0)
+            summary_lines.append(f"{FG_WHITE}Conntrack:{RESET} {FG_CYAN}{ct['count']}/{ct['max']} ({ct['usage_pct']}%){RESET}"
+                                 + (f" {FG_YELLOW}{dropped} insert failures/drops{RESET}" if dropped else ""))
         _brand_box("Tunnel Status", "", summary_lines, accent=FG_BLUE)
         print()
 
@@ -4118,12 +9287,24 @@ def status_menu():
             pause()
             return
 
+        log_rows = {row["stem"]: row for row in query_log_index()}
+        try:
+            limit_hits: Dict[str, int] = {}
+            for row in limits_report([it["config_path"] for it in items]):
+                limit_hits[row["stem"]] = limit_hits.get(row["stem"], 0) + (row.get("hit_packets") or 0)
+        except Exception:
+            limit_hits = {}
         for i, it in enumerate(items, 1):
             alive = it.get("alive")
             icon = f"{FG_GREEN}●{RESET}" if alive else f"{FG_RED}●{RESET}"
             state = f"{FG_GREEN}ACTIVE{RESET}" if alive else f"{FG_RED}STOPPED{RESET}"
             print(f"  {BOLD}{FG_CYAN}[{i}]{RESET} {icon} {BOLD}{state}{RESET}  {FG_WHITE}{it['summary']}{RESET}")
             print(f"      {DIM}{FG_WHITE}Config:{RESET} {FG_CYAN}{it['config_path'].name}{RESET}")
+            counts = format_log_counts(log_rows.get(it['config_path'].stem))
+            if counts:
+                print(f"      {DIM}{FG_WHITE}Log events 24h:{RESET} {FG_YELLOW}{counts}{RESET}")
+            if limit_hits.get(it['config_path'].stem):
+                print(f"      {DIM}{FG_WHITE}Rate limit hits:{RESET} {FG_YELLOW}{limit_hits[it['config_path'].stem]} packets dropped{RESET}")
 
         print()
         _menu_line("0", "Back", "Return to the previous menu", accent=FG_WHITE)
@@ -4174,6 +9355,30 @@ def view_tunnel_details(config_path: Path, tunnel: Dict[str,Any]):
             paths = cfg.get('paths', [])
             if paths:
                 print(f"  {FG_WHITE}Configured paths:{RESET} {FG_GREEN}{len(paths)}{RESET}")
+        try:
+            traffic = accounting_report([config_path]) if alive and accounting_backend() else []
+        except Exception:
+            traffic = []
+        if traffic:
+            print(f"\n  {BOLD}{FG_CYAN}Traffic (kernel counters):{RESET}")
+            for r in traffic:
+                rates = "" if r["mbps_in"] is None else f"  {FG_GREEN}{r['mbps_in']:.2f}↓ {r['mbps_out'] or 0:.2f}↑ Mbps{RESET}"
+                print(f"    {FG_WHITE}{r['mapping']:<28}{RESET} {FG_CYAN}in {format_bytes(r['bytes_in'] or 0)} / "
+                      f"out {format_bytes(r['bytes_out'] or 0)}{RESET}{rates}")
+        try:
+            limit_rows = limits_report([config_path])
+        except Exception:
+            limit_rows = []
+        if limit_rows:
+            print(f"\n  {BOLD}{FG_CYAN}Rate limits:{RESET}")
+            for r in limit_rows:
+                if r.get("error"):
+                    print(f"    {FG_RED}{r['error']}{RESET}")
+                    continue
+                hits = "not installed" if not r["installed"] else f"{r['hit_packets']} hits ({format_bytes(r['hit_bytes'])} dropped)"
+                print(f"    {FG_WHITE}{r['limit']:<20} {r['direction']:<3}{RESET} {FG_CYAN}{r['rate_limit']}{RESET}  {FG_YELLOW}{hits}{RESET}")
+                if r["skipped"] and r["direction"] == "in":
+                    print(f"    {FG_YELLOW}not limited: {'; '.join(r['skipped'])}{RESET}")
         print()
         _menu_line("1", "Service Logs", "Read the persistent systemd journal entries", accent=FG_BLUE)
         _menu_line("2", "Live Logs", "Attach to the live log stream", accent=FG_MAGENTA)
@@ -4581,6 +9786,14 @@ def delete_tunnel_menu():
                 else:
                     print(f" {FG_YELLOW}⚠️{RESET}")
             print(f"  {FG_CYAN}Cleaning rules...{RESET}", end='', flush=True)
+            remove_limits(config_path)
+            save_limits(config_path.stem, {})
+            remove_notrack(config_path)
+            save_notrack(config_path.stem, "off")
+            try:
+                remove_qos_tunnel(config_path.stem)
+            except (ValueError, RuntimeError, OSError, subprocess.SubprocessError, yaml.YAMLError) as e:
+                c_warn(f"  QoS entry not removed: {e}")
             if cleanup_iptables_rules(config_path):
                 print(f" {FG_GREEN}✅{RESET}")
             else:
@@ -4966,6 +10179,19 @@ def update_netrix_core():
         print(f"  {FG_YELLOW}⚠️  All active tunnels will be temporarily stopped.{RESET}")
         if not ask_yesno(f"  {BOLD}Continue with update?{RESET}", default=False):
             return
+        canary = ask_yesno(
+            f"  {BOLD}Canary benchmark?{RESET} {FG_WHITE}(bench old and new core on a netns pair, roll back on regression; ~2 min){RESET}",
+            default=False,
+        )
+        
+        # baseline runs before the stop so tunnels are only down for the install itself
+        old_version = None
+        if canary:
+            print(f"\n  {FG_CYAN}Canary baseline with the current core...{RESET}")
+            try:
+                old_version = run_canary_bench(progress=lambda line: print(f"    {line}"))
+            except RuntimeError as e:
+                c_warn(f"  ⚠️  Canary skipped: {e}")
         
         print(f"\n  {FG_CYAN}Stopping all active tunnels...{RESET}")
         items = list_tunnels()
@@ -4989,7 +10215,10 @@ def update_netrix_core():
             print(f"  {FG_WHITE}No active tunnels to stop.{RESET}")
         
         print(f"\n  {FG_CYAN}Installing updated core...{RESET}")
-        install_netrix_core_auto()
+        installed = install_netrix_core_auto()
+        
+        if installed and old_version:
+            canary_gate_core_update(old_version)
         
         if stopped_count > 0:
             print(f"\n  {FG_CYAN}Restarting previously active tunnels...{RESET}")
@@ -5029,6 +10258,36 @@ def update_netrix_core():
     except UserCancelled:
         exit_script()
 
+def canary_gate_core_update(old_version: str) -> None:
+    """Bench the freshly installed core and offer to restore the .backup binary when it regresses."""
+    print(f"\n  {FG_CYAN}Canary run with the new core...{RESET}")
+    try:
+        new_version = run_canary_bench(progress=lambda line: print(f"    {line}"))
+    except RuntimeError as e:
+        c_warn(f"  ⚠️  Canary run failed: {e}")
+        return
+    if new_version == old_version:
+        c_warn(f"  ⚠️  Core version unchanged ({new_version}); nothing to compare.")
+        return
+    regressions = canary_regressions(old_version, new_version)
+    if not regressions:
+        c_ok(f"  ✅ Canary passed: no significant regression {old_version} → {new_version}")
+        return
+    c_warn(f"  ⚠️  Canary regressions {old_version} → {new_version}:")
+    for row in regressions:
+        print(f"    {row['transport']} {row['metric']}: {row['old']} → {row['new']} ({row['change_pct']:+}%, p={row['p_value']})")
+    backup = Path(f"{NETRIX_BINARY}.backup")
+    if not backup.exists():
+        c_warn("  ⚠️  No backup binary to roll back to.")
+        return
+    if ask_yesno(f"  {BOLD}Roll back to {old_version}?{RESET}", default=True):
+        try:
+            shutil.copy(backup, NETRIX_BINARY)
+            os.chmod(NETRIX_BINARY, 0o755)
+            c_ok(f"  ✅ Restored {old_version} from {backup}")
+        except Exception as e:
+            c_err(f"  ❌ Rollback failed: {e}")
+
 def delete_netrix_core():
     """حذف هسته Netrix"""
     try:
@@ -5098,7 +10357,7 @@ def system_optimizer_menu():
     try:
         clear()
         _brand_box("System Optimizer", "", [
-            f"{FG_WHITE}Includes:{RESET} sysctl tuning, limits tuning, memory and socket tuning",
+            f"{FG_WHITE}Includes:{RESET} sysctl tuning, limits tuning, memory and socket tuning, conntrack sizing",
             f"{FG_WHITE}Recommended for:{RESET} busy servers, rawsocket/KCP setups, and high traffic workloads",
             f"{FG_WHITE}Caution:{RESET} {FG_YELLOW}This modifies kernel and shell limit settings{RESET}",
         ], accent=FG_GREEN)
@@ -5107,12 +10366,15 @@ def system_optimizer_menu():
             return
 
         print(f"\n  {FG_CYAN}Starting optimization workflow...{RESET}\n")
-        print(f"  {FG_CYAN}1/2:{RESET} {BOLD}Applying sysctl profile{RESET}")
+        print(f"  {FG_CYAN}1/3:{RESET} {BOLD}Applying sysctl profile{RESET}")
         sysctl_optimizations()
 
-        print(f"\n  {FG_CYAN}2/2:{RESET} {BOLD}Applying limits profile{RESET}")
+        print(f"\n  {FG_CYAN}2/3:{RESET} {BOLD}Applying limits profile{RESET}")
         limits_optimizations()
 
+        print(f"\n  {FG_CYAN}3/3:{RESET} {BOLD}Checking conntrack{RESET}")
+        conntrack_optimizations()
+
         print(f"\n  {FG_GREEN}✅ System optimization completed successfully.{RESET}")
         print(f"  {FG_YELLOW}Note:{RESET} A reboot may still be required for every change to take full effect.")
         print()
@@ -5120,85 +10382,110 @@ def system_optimizer_menu():
     except UserCancelled:
         exit_script()
 
+def get_sysctl_profile_settings() -> list:
+    """Netrix sysctl profile as (key, value) rows; '#' keys are comments and '' keys are blank lines."""
+    available_cc = _read_proc_text("/proc/sys/net/ipv4/tcp_available_congestion_control").split()
+    tcp_cc = "bbr" if "bbr" in available_cc else "cubic"
+    settings = [
+        ("# Netrix performance profile - managed by net.py", ""),
+        ("# Core RX/TX queues for L3 raw/UDP/ICMP, rawsocket and high traffic TCP", ""),
+        ("net.core.netdev_max_backlog", "250000"),
+        ("net.core.netdev_budget", "1200"),
+        ("net.core.netdev_budget_usecs", "8000"),
+        ("net.core.somaxconn", "65535"),
+        ("net.core.rmem_default", "16777216"),
+        ("net.core.rmem_max", "134217728"),
+        ("net.core.wmem_default", "16777216"),
+        ("net.core.wmem_max", "134217728"),
+        ("net.core.optmem_max", "4194304"),
+        ("net.core.default_qdisc", "fq"),
+        ("net.core.rps_sock_flow_entries", "262144"),
+        ("", ""),
+        ("# TCP: high BDP paths, speedtest-like parallel flows and stable MSS/PMTU behavior", ""),
+        ("net.ipv4.tcp_congestion_control", tcp_cc),
+        ("net.ipv4.tcp_moderate_rcvbuf", "1"),
+        ("net.ipv4.tcp_mtu_probing", "1"),
+        ("net.ipv4.tcp_sack", "1"),
+        ("net.ipv4.tcp_dsack", "1"),
+        ("net.ipv4.tcp_ecn", "0"),
+        ("net.ipv4.tcp_ecn_fallback", "1"),
+        ("net.ipv4.tcp_rmem", "4096 87380 134217728"),
+        ("net.ipv4.tcp_wmem", "4096 65536 134217728"),
+        ("net.ipv4.tcp_slow_start_after_idle", "0"),
+        ("net.ipv4.tcp_window_scaling", "1"),
+        ("net.ipv4.tcp_no_metrics_save", "1"),
+        ("net.ipv4.tcp_syncookies", "1"),
+        ("net.ipv4.tcp_tw_reuse", "1"),
+        ("net.ipv4.tcp_max_syn_backlog", "65535"),
+        ("net.ipv4.tcp_max_tw_buckets", "2000000"),
+        ("net.ipv4.tcp_fin_timeout", "15"),
+        ("net.ipv4.tcp_keepalive_time", "900"),
+        ("net.ipv4.tcp_keepalive_intvl", "30"),
+        ("net.ipv4.tcp_keepalive_probes", "5"),
+        ("", ""),
+        ("# UDP/raw capture: reduce burst drops for L3 UDP/ICMP and iperf-like loads", ""),
+        ("net.ipv4.udp_mem", "262144 1048576 33554432"),
+        ("net.ipv4.udp_rmem_min", "262144"),
+        ("net.ipv4.udp_wmem_min", "262144"),
+        ("net.ipv4.udp_l3mdev_accept", "1"),
+        ("", ""),
+        ("# Routing/TUN: exit-node forwarding and asymmetric paths", ""),
+        ("net.ipv4.ip_forward", "1"),
+        ("net.ipv4.conf.all.forwarding", "1"),
+        ("net.ipv4.conf.default.forwarding", "1"),
+        ("net.ipv4.ip_local_port_range", "10240 65535"),
+        ("net.ipv4.ip_nonlocal_bind", "1"),
+        ("net.ipv4.conf.all.rp_filter", "0"),
+        ("net.ipv4.conf.default.rp_filter", "0"),
+        ("net.ipv4.conf.all.accept_redirects", "0"),
+        ("net.ipv4.conf.default.accept_redirects", "0"),
+        ("net.ipv4.conf.all.send_redirects", "0"),
+        ("net.ipv4.conf.default.send_redirects", "0"),
+        ("net.ipv4.conf.all.accept_source_route", "0"),
+        ("net.ipv4.conf.default.accept_source_route", "0"),
+        ("net.ipv4.conf.all.log_martians", "0"),
+        ("net.ipv4.conf.default.log_martians", "0"),
+        ("", ""),
+        ("# Neighbor and file limits for many flows", ""),
+        ("net.ipv4.neigh.default.gc_thresh1", "1024"),
+        ("net.ipv4.neigh.default.gc_thresh2", "4096"),
+        ("net.ipv4.neigh.default.gc_thresh3", "32768"),
+        ("net.unix.max_dgram_qlen", "512"),
+        ("fs.file-max", "67108864"),
+        ("fs.nr_open", "4194304"),
+        ("", ""),
+        ("# VM: keep swapping low without starving packet buffers", ""),
+        ("vm.swappiness", "10"),
+        ("vm.min_free_kbytes", "65536"),
+        ("vm.vfs_cache_pressure", "100"),
+        ("vm.max_map_count", "262144"),
+    ]
+    if conntrack_stats()["loaded"]:
+        settings += [
+            ("", ""),
+            ("# Conntrack: table sized from RAM for flows that are still tracked (see NOTRACK per tunnel)", ""),
+            ("net.netfilter.nf_conntrack_max", str(conntrack_sizing()["max"])),
+        ]
+    return settings
+
+def render_sysctl_profile(settings: list) -> tuple[str, list]:
+    """Return (file text, [(key, value) to apply]) for a sysctl profile."""
+    lines = []
+    apply_items = []
+    for key, value in settings:
+        if key.startswith("#"):
+            lines.append(key)
+        elif key == "":
+            lines.append("")
+        else:
+            lines.append(f"{key} = {value}")
+            apply_items.append((key, value))
+    return "\n".join(lines).rstrip() + "\n", apply_items
+
 def sysctl_optimizations():
     """Apply production-oriented sysctl tuning for Netrix tunnels."""
     try:
-        available_cc = _read_proc_text("/proc/sys/net/ipv4/tcp_available_congestion_control").split()
-        tcp_cc = "bbr" if "bbr" in available_cc else "cubic"
-        settings = [
-            ("# Netrix performance profile - managed by net.py", ""),
-            ("# Core RX/TX queues for L3 raw/UDP/ICMP, rawsocket and high traffic TCP", ""),
-            ("net.core.netdev_max_backlog", "250000"),
-            ("net.core.netdev_budget", "1200"),
-            ("net.core.netdev_budget_usecs", "8000"),
-            ("net.core.somaxconn", "65535"),
-            ("net.core.rmem_default", "16777216"),
-            ("net.core.rmem_max", "134217728"),
-            ("net.core.wmem_default", "16777216"),
-            ("net.core.wmem_max", "134217728"),
-            ("net.core.optmem_max", "4194304"),
-            ("net.core.default_qdisc", "fq"),
-            ("net.core.rps_sock_flow_entries", "262144"),
-            ("", ""),
-            ("# TCP: high BDP paths, speedtest-like parallel flows and stable MSS/PMTU behavior", ""),
-            ("net.ipv4.tcp_congestion_control", tcp_cc),
-            ("net.ipv4.tcp_moderate_rcvbuf", "1"),
-            ("net.ipv4.tcp_mtu_probing", "1"),
-            ("net.ipv4.tcp_sack", "1"),
-            ("net.ipv4.tcp_dsack", "1"),
-            ("net.ipv4.tcp_ecn", "0"),
-            ("net.ipv4.tcp_ecn_fallback", "1"),
-            ("net.ipv4.tcp_rmem", "4096 87380 134217728"),
-            ("net.ipv4.tcp_wmem", "4096 65536 134217728"),
-            ("net.ipv4.tcp_slow_start_after_idle", "0"),
-            ("net.ipv4.tcp_window_scaling", "1"),
-            ("net.ipv4.tcp_no_metrics_save", "1"),
-            ("net.ipv4.tcp_syncookies", "1"),
-            ("net.ipv4.tcp_tw_reuse", "1"),
-            ("net.ipv4.tcp_max_syn_backlog", "65535"),
-            ("net.ipv4.tcp_max_tw_buckets", "2000000"),
-            ("net.ipv4.tcp_fin_timeout", "15"),
-            ("net.ipv4.tcp_keepalive_time", "900"),
-            ("net.ipv4.tcp_keepalive_intvl", "30"),
-            ("net.ipv4.tcp_keepalive_probes", "5"),
-            ("", ""),
-            ("# UDP/raw capture: reduce burst drops for L3 UDP/ICMP and iperf-like loads", ""),
-            ("net.ipv4.udp_mem", "262144 1048576 33554432"),
-            ("net.ipv4.udp_rmem_min", "262144"),
-            ("net.ipv4.udp_wmem_min", "262144"),
-            ("net.ipv4.udp_l3mdev_accept", "1"),
-            ("", ""),
-            ("# Routing/TUN: exit-node forwarding and asymmetric paths", ""),
-            ("net.ipv4.ip_forward", "1"),
-            ("net.ipv4.conf.all.forwarding", "1"),
-            ("net.ipv4.conf.default.forwarding", "1"),
-            ("net.ipv4.ip_local_port_range", "10240 65535"),
-            ("net.ipv4.ip_nonlocal_bind", "1"),
-            ("net.ipv4.conf.all.rp_filter", "0"),
-            ("net.ipv4.conf.default.rp_filter", "0"),
-            ("net.ipv4.conf.all.accept_redirects", "0"),
-            ("net.ipv4.conf.default.accept_redirects", "0"),
-            ("net.ipv4.conf.all.send_redirects", "0"),
-            ("net.ipv4.conf.default.send_redirects", "0"),
-            ("net.ipv4.conf.all.accept_source_route", "0"),
-            ("net.ipv4.conf.default.accept_source_route", "0"),
-            ("net.ipv4.conf.all.log_martians", "0"),
-            ("net.ipv4.conf.default.log_martians", "0"),
-            ("", ""),
-            ("# Neighbor and file limits for many flows", ""),
-            ("net.ipv4.neigh.default.gc_thresh1", "1024"),
-            ("net.ipv4.neigh.default.gc_thresh2", "4096"),
-            ("net.ipv4.neigh.default.gc_thresh3", "32768"),
-            ("net.unix.max_dgram_qlen", "512"),
-            ("fs.file-max", "67108864"),
-            ("fs.nr_open", "4194304"),
-            ("", ""),
-            ("# VM: keep swapping low without starving packet buffers", ""),
-            ("vm.swappiness", "10"),
-            ("vm.min_free_kbytes", "65536"),
-            ("vm.vfs_cache_pressure", "100"),
-            ("vm.max_map_count", "262144"),
-        ]
+        sysctl_text, apply_items = render_sysctl_profile(get_sysctl_profile_settings())
 
         sysctl_file = NETRIX_SYSCTL_FILE
         sysctl_file.parent.mkdir(parents=True, exist_ok=True)
@@ -5207,17 +10494,7 @@ def sysctl_optimizations():
             shutil.copy(sysctl_file, backup_file)
             c_ok(f"  ✅ Backup created: {backup_file}")
 
-        lines = []
-        apply_items = []
-        for key, value in settings:
-            if key.startswith("#"):
-                lines.append(key)
-            elif key == "":
-                lines.append("")
-            else:
-                lines.append(f"{key} = {value}")
-                apply_items.append((key, value))
-        sysctl_file.write_text("\n".join(lines).rstrip() + "\n", encoding="utf-8")
+        sysctl_file.write_text(sysctl_text, encoding="utf-8")
         c_ok(f"  ✅ Sysctl profile written: {sysctl_file}")
 
         print(f"  {FG_CYAN}Applying sysctl settings one by one...{RESET}")
@@ -5243,18 +10520,7 @@ def sysctl_optimizations():
         c_err(f"  ❌ Failed to optimize sysctl: {FG_RED}{str(e)}{RESET}")
         raise
 
-def limits_optimizations():
-    """Apply file/process limits without rewriting the user's shell profile."""
-    try:
-        print(f"  {FG_CYAN}Writing limits.d profile...{RESET}")
-        limits_file = NETRIX_LIMITS_FILE
-        limits_file.parent.mkdir(parents=True, exist_ok=True)
-        if limits_file.exists():
-            backup_file = limits_file.with_suffix(limits_file.suffix + ".bak")
-            shutil.copy(limits_file, backup_file)
-            c_ok(f"  ✅ Backup created: {backup_file}")
-
-        limits_text = """# Netrix limits profile - managed by net.py
+NETRIX_LIMITS_TEXT = """# Netrix limits profile - managed by net.py
 # Allows many simultaneous sockets/flows without touching unrelated /etc/profile lines.
 * soft nofile 1048576
 * hard nofile 1048576
@@ -5269,19 +10535,32 @@ root hard nproc 1048576
 root soft memlock unlimited
 root hard memlock unlimited
 """
-        limits_file.write_text(limits_text, encoding="utf-8")
-        c_ok(f"  ✅ Limits profile written: {limits_file}")
 
-        print(f"  {FG_CYAN}Writing shell ulimit helper...{RESET}")
-        profile_limits_file = NETRIX_PROFILE_LIMITS_FILE
-        profile_limits_file.parent.mkdir(parents=True, exist_ok=True)
-        profile_text = """# Netrix shell limits - managed by net.py
+NETRIX_PROFILE_LIMITS_TEXT = """# Netrix shell limits - managed by net.py
 # Best-effort only; systemd services should use their unit LimitNOFILE too.
 ulimit -n 1048576 2>/dev/null || true
 ulimit -u 1048576 2>/dev/null || true
 ulimit -l unlimited 2>/dev/null || true
 """
-        profile_limits_file.write_text(profile_text, encoding="utf-8")
+
+def limits_optimizations():
+    """Apply file/process limits without rewriting the user's shell profile."""
+    try:
+        print(f"  {FG_CYAN}Writing limits.d profile...{RESET}")
+        limits_file = NETRIX_LIMITS_FILE
+        limits_file.parent.mkdir(parents=True, exist_ok=True)
+        if limits_file.exists():
+            backup_file = limits_file.with_suffix(limits_file.suffix + ".bak")
+            shutil.copy(limits_file, backup_file)
+            c_ok(f"  ✅ Backup created: {backup_file}")
+
+        limits_file.write_text(NETRIX_LIMITS_TEXT, encoding="utf-8")
+        c_ok(f"  ✅ Limits profile written: {limits_file}")
+
+        print(f"  {FG_CYAN}Writing shell ulimit helper...{RESET}")
+        profile_limits_file = NETRIX_PROFILE_LIMITS_FILE
+        profile_limits_file.parent.mkdir(parents=True, exist_ok=True)
+        profile_limits_file.write_text(NETRIX_PROFILE_LIMITS_TEXT, encoding="utf-8")
         try:
             profile_limits_file.chmod(0o644)
         except Exception:
@@ -5292,6 +10571,40 @@ ulimit -l unlimited 2>/dev/null || true
         c_err(f"  ❌ Failed to optimize limits: {FG_RED}{str(e)}{RESET}")
         raise
 
+def conntrack_optimizations():
+    """Report conntrack pressure, size its hash table from RAM and offer NOTRACK for tunnel carriers."""
+    try:
+        stats = conntrack_stats()
+        if not stats["loaded"]:
+            c_ok("  ✅ nf_conntrack is not loaded; nothing is tracked")
+            return
+        print(f"  {FG_WHITE}Entries:{RESET} {stats['count']}/{stats['max']} ({stats['usage_pct']}%)"
+              f"  {FG_WHITE}buckets:{RESET} {stats['buckets'] or '?'}")
+        failed = stats.get("insert_failed", 0) + stats.get("drop", 0) + stats.get("early_drop", 0)
+        (c_warn if failed else c_ok)(f"  {'⚠️ ' if failed else '✅'} insert_failed={stats.get('insert_failed', 0)} "
+                                     f"drop={stats.get('drop', 0)} early_drop={stats.get('early_drop', 0)}")
+        sizing = apply_conntrack_sizing()
+        if sizing.get("errors"):
+            for err in sizing["errors"]:
+                c_warn(f"  ⚠️  {err}")
+        else:
+            c_ok(f"  ✅ nf_conntrack_max={sizing['max']} hashsize={sizing['hashsize']} "
+                 f"(up to {format_bytes(sizing['memory_bytes'])})")
+        modes = load_notrack()
+        off = [it["config_path"] for it in list_tunnels() if modes.get(it["config_path"].stem, "off") == "off"]
+        dependents = conntrack_dependents() if off else []
+        if dependents:
+            c_warn(f"  ⚠️  NOTRACK not offered: this host has {', '.join(dependents)} that need tracked tunnel traffic")
+        elif off and ask_yesno(f"  {BOLD}Bypass conntrack for the transport ports of {len(off)} tunnel(s)?{RESET}", default=False):
+            for path in off:
+                save_notrack(path.stem, "transport")
+            for stem, status in sync_notrack(off).items():
+                (c_warn if status.startswith("error") else c_ok)(f"  {stem}: {status}")
+    except UserCancelled:
+        raise
+    except Exception as e:
+        c_err(f"  ❌ Failed to tune conntrack: {FG_RED}{str(e)}{RESET}")
+
 def ask_reboot():
     """سوال برای reboot"""
     try:
@@ -5361,7 +10674,1467 @@ def main_menu():
             c_err("Invalid choice.")
             pause()
 
-def main():
+# ========== Command Line ==========
+CLI_EXIT_OK = 0
+CLI_EXIT_FAILURE = 1
+CLI_EXIT_USAGE = 2
+
+def is_tunnel_config(path: Path) -> bool:
+    """
+    Whether a YAML file is a tunnel config as list_tunnels() finds them: server*/client* named,
+    with the matching mode. Keeps the manager's own state files (qos.yaml, limits.yaml, ...) out.
+    """
+    side = "server" if path.name.startswith("server") else "client" if path.name.startswith("client") else None
+    if side is None or not path.is_file():
+        return False
+    cfg = parse_yaml_config(path)
+    return isinstance(cfg, dict) and cfg.get("mode") == side
+
+def find_tunnel_config(name: str) -> Optional[Path]:
+    """Resolve a tunnel by config stem, file name, `netrix-<stem>[.service]` unit name or path."""
+    name = str(name).strip()
+    if not name:
+        return None
+    candidate = Path(name)
+    if candidate.suffix in (".yaml", ".yml") and candidate.is_file():
+        return candidate if is_tunnel_config(candidate) else None
+    stem = name
+    if stem.endswith(".service"):
+        stem = stem[:-len(".service")]
+    if stem.startswith("netrix-"):
+        stem = stem[len("netrix-"):]
+    if stem.endswith(".yaml"):
+        stem = stem[:-len(".yaml")]
+    for base in (NETRIX_CONFIG_DIR, ROOT_DIR):
+        path = base / f"{stem}.yaml"
+        if is_tunnel_config(path):
+            return path
+    return None
+
+def tunnel_record(item: Dict[str, Any]) -> Dict[str, Any]:
+    """JSON-safe view of a list_tunnels() item."""
+    cfg = item.get("cfg") or {}
+    config_path = item["config_path"]
+    transport = cfg.get("transport", "tcpmux")
+    paths = cfg.get("paths") or []
+    if item.get("mode") == "client" and transport != "l3" and paths and isinstance(paths[0], dict):
+        transport = paths[0].get("transport", transport)
+    return {
+        "stem": config_path.stem,
+        "config": str(config_path),
+        "service": f"netrix-{config_path.stem}",
+        "mode": item.get("mode"),
+        "transport": transport,
+        "direct": bool(item.get("direct")),
+        "summary": item.get("summary", ""),
+        "status": item.get("status") or "unknown",
+        "alive": bool(item.get("alive")),
+        "pid": item.get("pid"),
+        "health_port": get_tunnel_health_port(cfg),
+    }
+
+def _fetch_health_json(url: str, timeout: float) -> tuple[Optional[int], Any]:
+    """GET a health endpoint; returns (http status, parsed JSON or raw text). Error bodies are kept."""
+    req = urllib.request.Request(url)
+    req.add_header("User-Agent", "Netrix-Script/1.0")
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            code, body = response.getcode(), response.read().decode("utf-8", errors="replace")
+    except urllib.error.HTTPError as e:
+        code = e.code
+        try:
+            body = e.read().decode("utf-8", errors="replace")
+        except Exception:
+            body = ""
+    try:
+        return code, json.loads(body)
+    except ValueError:
+        return code, body.strip()
+
+def fetch_tunnel_health(config_path: Path, timeout: float = 3.0) -> Dict[str, Any]:
+    """Non-interactive counterpart of check_tunnel_health(): query /health and /health/detailed."""
+    cfg = parse_yaml_config(config_path)
+    health_port = get_tunnel_health_port(cfg)
+    pid = get_service_pid(config_path)
+    result = {
+        "stem": config_path.stem,
+        "health_port": health_port,
+        "pid": pid,
+        "reachable": False,
+        "healthy": False,
+        "health": None,
+        "detailed": None,
+        "error": None,
+    }
+    if not pid:
+        result["error"] = "tunnel is not running"
+        return result
+    base = f"http://localhost:{health_port}"
+    try:
+        code, body = _fetch_health_json(f"{base}/health", timeout)
+        result["reachable"] = True
+        result["health"] = body
+        ready = body.get("ready") if isinstance(body, dict) else None
+        result["healthy"] = code == 200 and ready is not False
+        if code != 200:
+            result["error"] = f"/health returned HTTP {code}"
+        _, detailed = _fetch_health_json(f"{base}/health/detailed", timeout)
+        result["detailed"] = detailed
+    except urllib.error.URLError as e:
+        result["error"] = f"health server unreachable on port {health_port}: {e.reason}"
+    except Exception as e:
+        result["error"] = str(e)
+    return result
+
+def _cli_select_configs(names: List[str], all_: bool) -> List[Path]:
+    """Resolve CLI tunnel arguments; raises ValueError for unknown names."""
+    if all_:
+        return sorted((it["config_path"] for it in list_tunnels()), key=lambda p: p.stem)
+    if not names:
+        raise ValueError("give one or more tunnel names or --all")
+    paths = []
+    for name in names:
+        path = find_tunnel_config(name)
+        if not path:
+            raise ValueError(f"tunnel not found: {name}")
+        paths.append(path)
+    return paths
+
+def _cli_list(args) -> tuple[int, Any]:
+    items = sorted((tunnel_record(it) for it in list_tunnels()), key=lambda r: r["stem"])
+    return CLI_EXIT_OK, items
+
+def _cli_status(args) -> tuple[int, Any]:
+    records = {r["stem"]: r for r in (tunnel_record(it) for it in list_tunnels())}
+    if args.tunnels:
+        stems = [p.stem for p in _cli_select_configs(args.tunnels, False)]
+        selected = [records[s] for s in stems if s in records]
+    else:
+        selected = sorted(records.values(), key=lambda r: r["stem"])
+    code = CLI_EXIT_OK if all(r["alive"] for r in selected) else CLI_EXIT_FAILURE
+    return code, selected
+
+def _cli_health(args) -> tuple[int, Any]:
+    if args.tunnels or args.all:
+        configs = _cli_select_configs(args.tunnels, args.all)
+    else:
+        configs = sorted((it["config_path"] for it in list_tunnels() if it.get("alive")), key=lambda p: p.stem)
+    results = [fetch_tunnel_health(p, timeout=args.timeout) for p in configs]
+    code = CLI_EXIT_OK if all(r["healthy"] for r in results) else CLI_EXIT_FAILURE
+    return code, results
+
+def _cli_wait_condition(args) -> Optional[str]:
+    """--wait value of start/restart/apply; 'none' disables the readiness wait."""
+    wait = getattr(args, "wait", READY_DEFAULT_CONDITION)
+    return None if wait == "none" else wait
+
+def _cli_wait(args) -> tuple[int, Any]:
+    configs = _cli_select_configs(args.tunnels, args.all)
+    if args.timeout < 0:
+        raise ValueError("--timeout must be >= 0")
+    from concurrent.futures import ThreadPoolExecutor
+    if not configs:
+        return CLI_EXIT_OK, []
+    with ThreadPoolExecutor(max_workers=min(FLEET_MAX_PARALLEL_STARTS, len(configs))) as pool:
+        results = list(pool.map(lambda path: wait_ready(path, args.timeout, args.condition), configs))
+    code = CLI_EXIT_OK if all(r["ready"] for r in results) else CLI_EXIT_FAILURE
+    return code, results
+
+def _cli_lifecycle(args) -> tuple[int, Any]:
+    require_root()
+    configs = _cli_select_configs(args.tunnels, args.all)
+    wait = _cli_wait_condition(args)
+    results = []
+    for config_path in configs:
+        if args.command == "start":
+            ok = bool(run_tunnel(config_path, wait, args.timeout))
+        elif args.command == "stop":
+            ok = stop_tunnel(config_path)
+            if ok:
+                cleanup_iptables_rules(config_path)
+        else:
+            ok = restart_tunnel(config_path, wait=wait, timeout=args.timeout)
+        results.append({"stem": config_path.stem, "action": args.command, "ok": ok})
+    code = CLI_EXIT_OK if all(r["ok"] for r in results) else CLI_EXIT_FAILURE
+    return code, results
+
+def _cli_create(args) -> tuple[int, Any]:
+    require_root()
+    spec_path = Path(args.spec)
+    if not spec_path.is_file():
+        raise ValueError(f"spec file not found: {spec_path}")
+    try:
+        spec = yaml_safe_load(spec_path.read_text(encoding="utf-8"))
+    except yaml.YAMLError as e:
+        raise ValueError(f"invalid YAML in {spec_path}: {e}")
+    if args.start or (isinstance(spec, dict) and spec.get("start")):
+        result = apply_fleet([spec])[0]
+        _cli_sync_kernel_rules([Path(result["config"])])
+        return (CLI_EXIT_OK if result["ok"] else CLI_EXIT_FAILURE), result
+    config_path = write_tunnel_config_from_spec(spec)
+    _cli_sync_kernel_rules([config_path])
+    result = {"stem": config_path.stem, "config": str(config_path), "config_changed": file_write_changed(config_path), "action": "written", "ok": True}
+    return CLI_EXIT_OK, result
+
+def _cli_sync_kernel_rules(config_paths: List[Path]):
+    """Bring the kernel rate limits and notrack rules in line after tunnels were (re)written; problems only warn."""
+    folder = accounting_dir()
+    for what, configured, pattern, sync in (("rate limits", load_limits(), "{}.limits.nft", sync_limits),
+                                            ("notrack rules", load_notrack(), "{}.notrack.*", sync_notrack)):
+        if not any(p.stem in configured for p in config_paths) and not any(
+                any(folder.glob(pattern.format(p.stem))) for p in config_paths):
+            continue
+        try:
+            for stem, status in sync(config_paths).items():
+                if status.startswith(("error", "skipped")):
+                    c_warn(f"{stem}: {what} not installed: {status}")
+        except RuntimeError as e:
+            c_warn(f"{what} not installed: {e}")
+
+def _cli_apply(args) -> tuple[int, Any]:
+    require_root()
+    results = apply_fleet(load_fleet_spec(Path(args.spec)), start=not args.no_start,
+                          wait=_cli_wait_condition(args), timeout=args.timeout)
+    _cli_sync_kernel_rules([Path(r["config"]) for r in results])
+    report = check_memory_budget(sorted((it["config_path"] for it in list_tunnels()), key=lambda p: p.stem))
+    if report["over_budget"]:
+        c_warn(f"fleet worst-case memory {format_bytes(report['worst_total'])} exceeds the usable "
+               f"{format_bytes(report['usable'])}; see 'netrix-manager.py memory'")
+    code = CLI_EXIT_OK if all(r["ok"] for r in results) else CLI_EXIT_FAILURE
+    return code, results
+
+def _cli_memory(args) -> tuple[int, Any]:
+    # the budget is shared, so the whole fleet is always estimated; TUNNEL only narrows output and --apply
+    paths = sorted((it["config_path"] for it in list_tunnels()), key=lambda p: p.stem)
+    selected = {p.stem for p in _cli_select_configs(args.tunnels, False)} if args.tunnels else {p.stem for p in paths}
+    if args.apply:
+        require_root()
+    report = check_memory_budget(paths, args.streams)
+    report["tunnels"] = [est for est in report["tunnels"] if est["stem"] in selected]
+    if args.apply:
+        by_stem = {p.stem: p for p in paths}
+        for est in report["tunnels"]:
+            if est["suggest"]:
+                est.update(_cli_update_config(by_stem[est["stem"]], est["suggest"]))
+    return (CLI_EXIT_FAILURE if report["over_budget"] and not args.apply else CLI_EXIT_OK), report
+
+def _cli_size(args) -> tuple[int, Any]:
+    if args.profile and args.profile not in available_profiles():
+        raise ValueError(f"unknown profile '{args.profile}' (available: {', '.join(available_profiles())})")
+    if not args.tunnels:
+        if args.rtt == "auto":
+            raise ValueError("--rtt auto needs a tunnel to measure; give --rtt MS or a tunnel name")
+        return CLI_EXIT_OK, [dict(compute_bdp_sizing(float(args.rtt), args.bandwidth, args.profile or "balanced"), stem=None)]
+    if args.apply:
+        require_root()
+    results = []
+    code = CLI_EXIT_OK
+    for config_path in _cli_select_configs(args.tunnels, False):
+        cfg = parse_yaml_config(config_path) or {}
+        rtt = measure_cfg_rtt_ms(cfg) if args.rtt == "auto" else float(args.rtt)
+        if rtt is None:
+            results.append({"stem": config_path.stem, "error": "could not measure RTT (no reachable peer); pass --rtt MS"})
+            code = CLI_EXIT_FAILURE
+            continue
+        if args.rtt == "auto":
+            rtt = quantize_rtt_ms(rtt)
+        sizing = compute_bdp_sizing(
+            rtt, args.bandwidth, args.profile or cfg.get("profile", "balanced"),
+            kcp_mtu=(cfg.get("kcp") or {}).get("mtu"),
+            rawsocket_mtu=(cfg.get("rawsocket") or {}).get("mtu"),
+        )
+        sizing["stem"] = config_path.stem
+        if args.apply:
+            advanced = {k: v for k, v in sizing["advanced"].items() if k in (cfg.get("advanced") or {})}
+            sizing.update(_cli_update_config(config_path, {
+                "smux": sizing["smux"], "kcp": sizing["kcp"], "rawsocket": sizing["rawsocket"], "advanced": advanced,
+            }))
+            if sizing.get("restarted") is False:
+                code = CLI_EXIT_FAILURE
+        results.append(sizing)
+    return code, results
+
+def _cli_pool(args) -> tuple[int, Any]:
+    if not args.tunnels:
+        if args.rtt == "auto":
+            raise ValueError("--rtt auto needs a tunnel to measure; give --rtt MS or a tunnel name")
+        return CLI_EXIT_OK, [dict(compute_pool_sizing(float(args.rtt), args.bandwidth, {"transport": args.transport},
+                                                      args.concurrency), stem=None)]
+    if args.apply or args.validate:
+        require_root()
+    results = []
+    code = CLI_EXIT_OK
+    for config_path in _cli_select_configs(args.tunnels, False):
+        cfg = parse_yaml_config(config_path) or {}
+        if not cfg.get("paths") and not (cfg.get("direct") and cfg.get("mode") == "server"):
+            results.append({"stem": config_path.stem, "error": "not a dialling side (reverse client or direct server)"})
+            code = CLI_EXIT_FAILURE
+            continue
+        rtt = measure_cfg_rtt_ms(cfg) if args.rtt == "auto" else float(args.rtt)
+        if rtt is None:
+            results.append({"stem": config_path.stem, "error": "could not measure RTT (no reachable peer); pass --rtt MS"})
+            code = CLI_EXIT_FAILURE
+            continue
+        if args.rtt == "auto":
+            rtt = quantize_rtt_ms(rtt)
+        sizing = dict(compute_pool_sizing(rtt, args.bandwidth, cfg, args.concurrency), stem=config_path.stem)
+        if args.validate:
+            sizing["validation"] = validate_pool_sizing(cfg, sizing, args.seconds, min(args.concurrency, 16))
+        if args.apply and sizing.get("validation", {}).get("accepted", True):
+            sizing["config_changed"] = pool_sizing_updates(config_path, cfg, sizing)
+            if sizing["config_changed"] and get_service_status(config_path) == "active":
+                sizing["restarted"] = restart_tunnel(config_path)
+                if not sizing["restarted"]:
+                    code = CLI_EXIT_FAILURE
+        elif args.apply:
+            code = CLI_EXIT_FAILURE
+        results.append(sizing)
+    return code, results
+
+def _cli_update_config(config_path: Path, updates: Dict[str, dict]) -> Dict[str, Any]:
+    """Edit a config in place and restart its tunnel only if it runs and the file changed."""
+    result = {"config_changed": update_tunnel_config(config_path, updates)}
+    if result["config_changed"] and get_service_status(config_path) == "active":
+        result["restarted"] = restart_tunnel(config_path)
+    return result
+
+def _cli_fec(args) -> tuple[int, Any]:
+    shards = parse_fec_shards(args.shards) if args.shards else None
+    if args.tunnels:
+        targets = [(p, parse_yaml_config(p) or {}) for p in _cli_select_configs(args.tunnels, False)]
+    elif args.host or args.loss is not None:
+        targets = [(None, {})]
+    else:
+        raise ValueError("give tunnel names, --host HOST or --loss PCT")
+    if shards and not args.tunnels:
+        raise ValueError("--shards needs tunnel names")
+    if args.apply and not shards and args.loss is None:
+        # each end would probe its own loss and could write different shards, which FEC cannot decode
+        raise ValueError("probed shards are advisory; --apply needs --shards DATA:PARITY (the same on both ends) or --loss PCT")
+    if shards or args.apply:
+        for config_path, cfg in targets:
+            if config_path and not cfg_fec_blocks(cfg):
+                raise ValueError(f"{config_path.stem}: transport '{cfg.get('transport', 'tcpmux')}' has no FEC settings "
+                                 "(only kcpmux and rawsocket tunnels carry shards)")
+    if args.apply:
+        require_root()
+    results = []
+    code = CLI_EXIT_OK
+    for config_path, cfg in targets:
+        stem = config_path.stem if config_path else None
+        if shards:
+            entry = {"stem": stem, "shards": {"data_shard": shards[0], "parity_shard": shards[1]}}
+            if args.apply:
+                entry.update(_cli_update_config(config_path, {block: dict(entry["shards"]) for block in cfg_fec_blocks(cfg)}))
+                if entry.get("restarted") is False:
+                    code = CLI_EXIT_FAILURE
+            results.append(entry)
+            continue
+        if args.loss is not None:
+            model = gilbert_model_from_rates(args.loss / 100.0, args.burst)
+        else:
+            peers = cfg_peer_addrs(cfg) if cfg else []
+            host = args.host or (_split_host_port(peers[0])[0] if peers else None)
+            if not host:
+                results.append({"stem": stem, "error": "no peer address in config; pass --host"})
+                code = CLI_EXIT_FAILURE
+                continue
+            try:
+                model = probe_path_loss(host, args.udp_port, args.count, args.interval)
+            except Exception as e:
+                results.append({"stem": stem, "error": f"probe failed: {e}"})
+                code = CLI_EXIT_FAILURE
+                continue
+        kcp_mtu = (cfg.get("rawsocket") or cfg.get("kcp") or {}).get("mtu") if cfg else None
+        choice = choose_fec_shards(model, args.target / 100.0, int(kcp_mtu or RAWSOCKET_MTU),
+                                   current=cfg_fec_shards(cfg) if cfg else None)
+        entry = {"stem": stem, "model": model, "fec": choice}
+        if fec_choice_writable(choice):
+            entry["peer_command"] = fec_peer_command(choice)
+            if stem and not args.apply:
+                entry["apply_command"] = fec_peer_command(choice, stem)
+            if args.apply and config_path:
+                new = {"data_shard": choice["data_shard"], "parity_shard": choice["parity_shard"]}
+                entry.update(_cli_update_config(config_path, {block: dict(new) for block in cfg_fec_blocks(cfg)}))
+                if entry.get("restarted") is False:
+                    code = CLI_EXIT_FAILURE
+        results.append(entry)
+    return code, results
+
+def _cli_compressibility(args) -> tuple[int, Any]:
+    extra = {"tcp": set(args.tcp_port or []), "udp": set(args.udp_port or [])}
+    if args.tunnels:
+        targets = [(p, cfg_mapped_ports(parse_yaml_config(p) or {})) for p in _cli_select_configs(args.tunnels, False)]
+    elif extra["tcp"] or extra["udp"]:
+        targets = [(None, {"tcp": set(), "udp": set()})]
+    else:
+        raise ValueError("give tunnel names or --tcp-port/--udp-port")
+    require_root()
+    results = []
+    code = CLI_EXIT_OK
+    for config_path, ports in targets:
+        ports = {proto: ports[proto] | extra[proto] for proto in ports}
+        stem = config_path.stem if config_path else None
+        if not ports["tcp"] and not ports["udp"]:
+            results.append({"stem": stem, "error": "no mapped ports in config; pass --tcp-port/--udp-port"})
+            code = CLI_EXIT_FAILURE
+            continue
+        print(f"sampling {stem or 'ports'} for {args.seconds}s...", file=sys.stderr)
+        stats = analyze_payloads(capture_port_payloads(ports, args.seconds, args.interface))
+        rec = recommend_compression_from_sample(stats)
+        entry = {"stem": stem, "ports": {k: sorted(v) for k, v in ports.items()}, "stats": stats, "recommendation": rec}
+        if args.apply and config_path and "enabled" in rec:
+            entry.update(_cli_update_config(config_path, {"compression": {k: rec[k] for k in ("enabled", "algorithm", "level", "min_size", "max_size")}}))
+            if entry.get("restarted") is False:
+                code = CLI_EXIT_FAILURE
+        results.append(entry)
+    return code, results
+
+def _cli_autotune(args) -> tuple[int, Any]:
+    require_root()
+    config_path = _cli_select_configs([args.tunnel], False)[0]
+    cfg = parse_yaml_config(config_path) or {}
+    if args.rtt == "auto":
+        rtt = measure_cfg_rtt_ms(cfg)
+        if rtt is None:
+            raise ValueError("--rtt auto: could not measure RTT to the peer; pass --rtt MS")
+    else:
+        rtt = float(args.rtt)
+    if args.loss == "auto":
+        peers = cfg_peer_addrs(cfg)
+        if not peers:
+            raise ValueError("--loss auto needs a peer address in the config; pass --loss PCT")
+        round_trip = probe_path_loss(_split_host_port(peers[0])[0])["loss_rate"]
+        loss = (1.0 - (1.0 - round_trip) ** 0.5) * 100.0     # netem drops in each direction
+    else:
+        loss = float(args.loss)
+    report = autotune_tunnel(cfg, rtt, loss, args.bandwidth, args.seconds, args.streams, args.rounds,
+                             progress=lambda line: print(line, file=sys.stderr))
+    updates = autotune_to_updates(report["best"])
+    report["stem"] = config_path.stem
+    report["updates"] = updates
+    name = (args.name or f"tuned-{config_path.stem}").lower()
+    report["profile"] = str(save_tuned_profile(
+        name, str(cfg.get("profile") or "balanced"), updates,
+        f"autotuned for {config_path.stem}: rtt {rtt:.1f} ms, loss {loss:.2f}%, score {report['score']}"))
+    if args.apply:
+        report.update(_cli_update_config(config_path, updates))
+    return CLI_EXIT_OK, report
+
+def _cli_bench(args) -> tuple[int, Any]:
+    if args.action == "compare":
+        if len(args.versions) != 2:
+            raise ValueError("bench compare needs OLD NEW core versions")
+        host = args.host or host_fingerprint()["id"]
+        records = load_bench_results(host)
+        old, new = (resolve_core_version(v, records) for v in args.versions)
+        rows = compare_bench_results(old, new, host)
+        if not rows:
+            raise ValueError(f"no comparable results for {old} and {new} on host {host} (see {bench_results_path()})")
+        regressions = [r for r in rows if r["verdict"] == "regression"]
+        return (CLI_EXIT_FAILURE if regressions else CLI_EXIT_OK), {"old": old, "new": new, "host": host,
+                                                                   "rows": rows, "regressions": len(regressions)}
+    if args.versions:
+        raise ValueError("versions are only used with 'bench compare'")
+    transports = args.transport or list(TUNNEL_TRANSPORTS)
+    profile = args.profile.lower()
+    if profile not in available_profiles():
+        raise ValueError(f"unknown profile '{profile}' (available: {', '.join(available_profiles())})")
+    if args.streams < 1 or args.seconds <= 0 or args.repeat < 1:
+        raise ValueError("--streams, --seconds and --repeat must be positive")
+    require_root()
+    results = bench_transports(transports, profile, args.seconds, args.streams, args.rtt, args.loss, args.bandwidth,
+                               progress=lambda line: print(line, file=sys.stderr), repeat=args.repeat)
+    if not args.no_save:
+        save_bench_results(results, args.seconds, args.streams)
+        print(f"results stored in {bench_results_path()}", file=sys.stderr)
+    return (CLI_EXIT_OK if all(r["ok"] for r in results) else CLI_EXIT_FAILURE), results
+
+def _float_list(text: str) -> List[float]:
+    import argparse
+    try:
+        return [float(v) for v in str(text).split(",") if v.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected comma-separated numbers, got {text!r}")
+
+def _int_list(text: str) -> List[int]:
+    import argparse
+    try:
+        return [int(v) for v in str(text).split(",") if v.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected comma-separated integers, got {text!r}")
+
+def _cli_tun(args) -> tuple[int, Any]:
+    if args.pps is not None and args.pps < 0:
+        raise ValueError("--pps must be >= 0")
+    if args.flows is not None and args.flows < 1:
+        raise ValueError("--flows must be >= 1")
+    if args.action == "bench":
+        streams_list = list(args.streams or [])
+        if not streams_list:
+            cap = max(2, min(os.cpu_count() or 1, 8))
+            streams_list = [n for n in (1, 2, 4, 8) if n <= cap]
+        if any(not 1 <= n <= TUN_STREAMS_MAX for n in streams_list):
+            raise ValueError(f"--streams values must be 1-{TUN_STREAMS_MAX}")
+        require_root()
+        result = bench_tun(streams_list, args.transport, args.flows or TUN_BENCH_FLOWS, args.seconds,
+                           progress=lambda line: print(line, file=sys.stderr))
+        return (CLI_EXIT_OK if result["best_streams"] else CLI_EXIT_FAILURE), result
+    configs = _cli_select_configs(args.tunnels, False) if args.tunnels else None
+    rows = tun_sizing_report(configs, args.sample, args.pps, args.flows)
+    if args.action == "show":
+        if not rows:
+            kernel, core = kernel_tun_multiqueue(), core_tun_multiqueue()
+            rows = [dict(compute_tun_streams(pps=args.pps, multi_queue=kernel is not False,
+                                             flows=args.flows), stem=None, kernel_multi_queue=kernel, core_multi_queue=core)]
+        return CLI_EXIT_OK, rows
+    if not rows:
+        raise ValueError("no L3/TUN tunnels to size")
+    require_root()
+    code = CLI_EXIT_OK
+    for row in rows:
+        row.update(apply_tun_sizing(find_tunnel_config(row["stem"]), row))
+        if row.get("restarted") is False or row.get("txqueuelen_set") is False:
+            code = CLI_EXIT_FAILURE
+    return code, rows
+
+def _cli_bench_matrix(args) -> tuple[int, Any]:
+    transports = args.transport or list(TUNNEL_TRANSPORTS)
+    profiles = [p.lower() for p in (args.profile or BUILTIN_PROFILES)]
+    unknown = [p for p in profiles if p not in available_profiles()]
+    if unknown:
+        raise ValueError(f"unknown profile(s) {', '.join(unknown)} (available: {', '.join(available_profiles())})")
+    if args.streams < 1 or args.seconds <= 0:
+        raise ValueError("--streams and --seconds must be positive")
+    grid = {"rtt_ms": args.rtt, "jitter_ms": args.jitter, "loss_pct": args.loss,
+            "reorder_pct": args.reorder, "rate_mbps": args.rate}
+    scenarios = wan_scenarios(grid)
+    require_root()
+    total = len(scenarios) * len(profiles) * len(transports)
+    print(f"{total} runs ({len(scenarios)} scenarios x {len(profiles)} profiles x {len(transports)} transports), "
+          f"about {total * (args.seconds + 3) / 60:.0f} min", file=sys.stderr)
+    report = bench_wan_matrix(transports, profiles, scenarios, args.seconds, args.streams,
+                              progress=lambda line: print(line, file=sys.stderr))
+    if not args.no_save:
+        save_bench_results(report["runs"], args.seconds, args.streams)
+    if args.output:
+        write_file_atomic(Path(args.output), json.dumps(report, indent=2) + "\n", mode=0o644)
+        report["output"] = args.output
+    ok = any(r.get("ok") for r in report["runs"])
+    return (CLI_EXIT_OK if ok else CLI_EXIT_FAILURE), report
+
+def _cli_paths(args) -> tuple[int, Any]:
+    config_path = _cli_select_configs([args.tunnel], False)[0]
+    cfg = parse_yaml_config(config_path) or {}
+    if cfg.get("mode") != "client" or not cfg.get("paths"):
+        raise ValueError(f"{config_path.stem} is not a client with paths")
+    if args.apply or args.watch:
+        require_root()
+
+    def evaluate_once() -> Dict[str, Any]:
+        results = evaluate_paths(parse_yaml_config(config_path) or {}, args.probes, args.udp_port)
+        plan = plan_path_weights(results, args.total_pool, args.hysteresis)
+        report = {"stem": config_path.stem, "paths": results, "plan": plan, "changed": path_plan_differs(results, plan)}
+        if (args.apply or args.watch) and report["changed"] and any(r.get("ok") for r in results):
+            report["config_changed"] = update_tunnel_paths(config_path, plan["order"], plan["pools"])
+            if report["config_changed"] and get_service_status(config_path) == "active":
+                report["restarted"] = restart_tunnel(config_path)
+        return report
+
+    if not args.watch:
+        report = evaluate_once()
+        ok = any(r.get("ok") for r in report["paths"]) and report.get("restarted") is not False
+        return (CLI_EXIT_OK if ok else CLI_EXIT_FAILURE), report
+    report: Dict[str, Any] = {}
+    try:
+        while True:
+            report = evaluate_once()
+            summary = ", ".join(f"{r['addr']}={r.get('est_mbps', 'unknown' if r.get('unknown') else 'down')}" for r in report["paths"])
+            action = "rebalanced" if report.get("config_changed") else "unchanged"
+            print(f"{time.strftime('%H:%M:%S')} {config_path.stem}: {summary} -> {action}", file=sys.stderr)
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    return CLI_EXIT_OK, report
+
+def _cli_watchdog(args) -> tuple[int, Any]:
+    stems = [p.stem for p in _cli_select_configs(args.tunnels, False)] if args.tunnels else None
+    if args.action == "events":
+        since = time.time() - args.since * 3600 if args.since else None
+        return CLI_EXIT_OK, load_watchdog_events(stems, since)
+    if args.interval <= 0:
+        raise ValueError("--interval must be positive")
+    policy_path = Path(args.policy) if args.policy else None
+    load_watchdog_policies(policy_path)
+    require_root()
+    if args.action == "install":
+        if stems or args.dry_run or args.once or policy_path:
+            raise ValueError("install runs the watchdog over every tunnel with watchdog.yaml; drop TUNNEL/--dry-run/--once/--policy")
+        ok = install_watchdog_service(args.interval)
+        return (CLI_EXIT_OK if ok else CLI_EXIT_FAILURE), {"service": WATCHDOG_SERVICE, "installed": ok}
+    if args.action == "uninstall":
+        ok = uninstall_watchdog_service()
+        return (CLI_EXIT_OK if ok else CLI_EXIT_FAILURE), {"service": WATCHDOG_SERVICE, "installed": not ok}
+    if not args.once:
+        print(f"watchdog: sampling every {args.interval:g}s, events in {watchdog_events_path()} (Ctrl+C to stop)",
+              file=sys.stderr)
+    events = run_watchdog(args.interval, stems, args.dry_run, args.once, policy_path)
+    return CLI_EXIT_OK, events
+
+def _cli_logs(args) -> tuple[int, Any]:
+    stems = [p.stem for p in _cli_select_configs(args.tunnels, False)] if args.tunnels else None
+    if args.hours <= 0:
+        raise ValueError("--hours must be positive")
+    added = None
+    if args.action == "ingest" or not args.no_ingest:
+        require_root()
+        added = ingest_journal(stems)
+    if args.action == "ingest":
+        return CLI_EXIT_OK, [{"stem": stem, "events": n} for stem, n in sorted(added.items())]
+    return CLI_EXIT_OK, query_log_index(stems, args.hours, args.hourly)
+
+def _cli_accounting(args) -> tuple[int, Any]:
+    if args.prometheus and args.json:
+        raise ValueError("--prometheus and --json are exclusive")
+    require_root()
+    configs = _cli_select_configs(args.tunnels, False) if args.tunnels else None
+    rows = accounting_report(configs, sync=not args.no_sync)
+    if args.prometheus:
+        return CLI_EXIT_OK, format_prometheus_accounting(rows)
+    failed = [r for r in rows if str(r.get("sync") or "").startswith("error")]
+    return (CLI_EXIT_FAILURE if failed else CLI_EXIT_OK), rows
+
+def _cli_qos(args) -> tuple[int, Any]:
+    if args.bandwidth is not None and args.bandwidth < 0:
+        raise ValueError("--bandwidth must be >= 0")
+    if args.action == "bench":
+        if not args.bandwidth:
+            raise ValueError("qos bench needs --bandwidth (the bottleneck to saturate)")
+        require_root()
+        result = bench_qos(args.bandwidth, args.seconds, args.streams, args.qdisc or "htb",
+                           progress=lambda line: print(line, file=sys.stderr))
+        ok = all(not run.get("error") for run in result["runs"].values())
+        return (CLI_EXIT_OK if ok else CLI_EXIT_FAILURE), result
+    config = load_qos_config()
+    config.update({k: v for k, v in (("interface", args.interface), ("bandwidth_mbps", args.bandwidth),
+                                     ("qdisc", args.qdisc)) if v is not None})
+    if args.action == "show":
+        return CLI_EXIT_OK, install_qos(qos_port_classes(config), qos_devices(config), config["qdisc"],
+                                        float(config["bandwidth_mbps"] or 0), dry_run=True)
+    require_root()
+    if args.action == "clear":
+        devices = qos_devices(config)
+        clear_qos(devices)
+        return CLI_EXIT_OK, {"cleared": devices}
+    report = apply_qos(args.dry_run, interface=args.interface, bandwidth_mbps=args.bandwidth, qdisc=args.qdisc)
+    return (CLI_EXIT_FAILURE if report["errors"] else CLI_EXIT_OK), report
+
+def _cli_limits(args) -> tuple[int, Any]:
+    configs = _cli_select_configs(args.tunnels, False) if args.tunnels else None
+    if args.action == "show":
+        rows = limits_report(configs)
+        return (CLI_EXIT_FAILURE if any(r.get("error") for r in rows) else CLI_EXIT_OK), rows
+    require_root()
+    if args.action == "clear":
+        paths = configs or sorted((it["config_path"] for it in list_tunnels()), key=lambda p: p.stem)
+        for path in paths:
+            remove_limits(path)
+        return CLI_EXIT_OK, [{"stem": p.stem, "status": "removed"} for p in paths]
+    status = sync_limits(configs)
+    rows = [{"stem": stem, "status": st} for stem, st in sorted(status.items())]
+    return (CLI_EXIT_FAILURE if any(r["status"].startswith("error") for r in rows) else CLI_EXIT_OK), rows
+
+def _cli_conntrack(args) -> tuple[int, Any]:
+    configs = _cli_select_configs(args.tunnels, False) if args.tunnels else None
+    if args.action == "show":
+        if args.notrack or args.size:
+            raise ValueError("--notrack/--size only apply to 'conntrack apply'")
+        return CLI_EXIT_OK, {"stats": conntrack_stats(), "sizing": conntrack_sizing(), "tunnels": notrack_report(configs)}
+    require_root()
+    paths = configs or sorted((it["config_path"] for it in list_tunnels()), key=lambda p: p.stem)
+    if args.action == "clear":
+        for path in paths:
+            save_notrack(path.stem, "off")
+            remove_notrack(path)
+        return CLI_EXIT_OK, {"tunnels": [{"stem": p.stem, "status": "removed"} for p in paths]}
+    if args.notrack:
+        for path in paths:
+            save_notrack(path.stem, args.notrack)
+    status = sync_notrack(paths)
+    result: Dict[str, Any] = {"tunnels": [{"stem": stem, "status": st} for stem, st in sorted(status.items())]}
+    if args.size:
+        result["sizing"] = apply_conntrack_sizing()
+    failed = any(r["status"].startswith("error") for r in result["tunnels"]) or (result.get("sizing") or {}).get("errors")
+    return (CLI_EXIT_FAILURE if failed else CLI_EXIT_OK), result
+
+def _cli_bench_gen(args) -> tuple[int, Any]:
+    result: Dict[str, Any] = {}
+    if args.wait:
+        ready_at = wait_bench_path(args.host, args.port, args.wait)
+        if ready_at is None:
+            return CLI_EXIT_FAILURE, {"error": f"no echo through {args.host}:{args.port} within {args.wait}s"}
+        result["ready_at"] = ready_at
+    result.update(run_bench_traffic(args.host, args.port, args.streams, args.seconds, args.udp_port))
+    return (CLI_EXIT_OK if result["bytes"] else CLI_EXIT_FAILURE), result
+
+def _cli_bench_sink(args) -> tuple[int, Any]:
+    print(f"bench sink on {args.bind}:{args.port} (Ctrl+C to stop)", file=sys.stderr)
+    serve_bench_sink(args.port, args.bind)
+    return CLI_EXIT_OK, None
+
+def _profile_or_tunnel_values(name: str, transport: Optional[str] = None) -> tuple[Dict[str, dict], Optional[str]]:
+    """Sections of a profile, or of a tunnel config (then also its transport)."""
+    if name.lower() in available_profiles():
+        return profile_values(name.lower(), transport or "kcpmux"), None
+    config_path = find_tunnel_config(name)
+    if not config_path:
+        raise ValueError(f"no profile or tunnel named '{name}' (profiles: {', '.join(available_profiles())})")
+    cfg = parse_yaml_config(config_path) or {}
+    transport = cfg.get("transport") or next((p.get("transport") for p in cfg.get("paths") or [] if isinstance(p, dict)), None)
+    return {s: dict(cfg.get(s) or {}) for s in PROFILE_SECTIONS if cfg.get(s)}, str(transport or "tcpmux")
+
+def _cli_profile(args) -> tuple[int, Any]:
+    if args.action == "list":
+        customs = load_custom_profiles()
+        return CLI_EXIT_OK, [{"name": n, "custom": n in customs, "base": builtin_profile_name(n),
+                              "description": str((customs.get(n) or {}).get("description") or "")} for n in available_profiles()]
+    if args.action == "show":
+        if len(args.names) != 1:
+            raise ValueError("profile show takes one NAME")
+        values, _ = _profile_or_tunnel_values(args.names[0], args.transport)
+        return CLI_EXIT_OK, {"name": args.names[0], "base": builtin_profile_name(args.names[0]), "sections": values}
+    if len(args.names) != 2:
+        raise ValueError("profile diff takes two names (profiles or tunnels)")
+    left, left_transport = _profile_or_tunnel_values(args.names[0], args.transport)
+    right, right_transport = _profile_or_tunnel_values(args.names[1], args.transport or left_transport)
+    if right_transport and not left_transport and not args.transport:
+        left, _ = _profile_or_tunnel_values(args.names[0], right_transport)
+    if left_transport or right_transport:
+        # a tunnel carries only the blocks its transport writes, plus keys no profile sets; compare the overlap
+        shared = {s: set(left.get(s) or {}) & set(right.get(s) or {}) for s in PROFILE_SECTIONS}
+        left = {s: {k: v for k, v in (left.get(s) or {}).items() if k in shared[s]} for s in shared}
+        right = {s: {k: v for k, v in (right.get(s) or {}).items() if k in shared[s]} for s in shared}
+    rows = [{"key": k, "left": a, "right": b} for k, a, b in diff_profile_values(left, right)]
+    return CLI_EXIT_OK, {"left": args.names[0], "right": args.names[1], "differences": rows}
+
+def _cli_cpu(args) -> tuple[int, Any]:
+    return CLI_EXIT_OK, cpu_capability_profile()
+
+def _cli_pmtu(args) -> tuple[int, Any]:
+    if args.tunnels:
+        targets = [(p, parse_yaml_config(p) or {}) for p in _cli_select_configs(args.tunnels, False)]
+    elif args.host:
+        targets = [(None, {})]
+    else:
+        raise ValueError("give tunnel names or --host HOST")
+    if args.apply:
+        require_root()
+    results = []
+    code = CLI_EXIT_OK
+    for config_path, cfg in targets:
+        stem = config_path.stem if config_path else None
+        host = args.host or cfg_pmtu_host(cfg)
+        if not host:
+            results.append({"stem": stem, "error": "no peer address in config; pass --host"})
+            code = CLI_EXIT_FAILURE
+            continue
+        try:
+            found = discover_path_mtu(host, args.method, args.port)
+        except (RuntimeError, OSError) as e:
+            results.append({"stem": stem, "error": str(e)})
+            code = CLI_EXIT_FAILURE
+            continue
+        entry = dict(found, stem=stem, mtus=compute_layer_mtus(found["path_mtu"], cfg, found["ip_version"]) if cfg else {})
+        if args.apply and config_path and entry["mtus"]:
+            entry.update(_cli_update_config(config_path, mtus_to_config_updates(entry["mtus"])))
+            if entry.get("restarted") is False:
+                code = CLI_EXIT_FAILURE
+        results.append(entry)
+    return code, results
+
+def _cli_probe_echo(args) -> tuple[int, Any]:
+    print(f"probe-echo listening on udp {args.bind}:{args.port} (Ctrl+C to stop)", file=sys.stderr)
+    try:
+        echoed = serve_probe_echo(args.port, args.bind, args.duration)
+    except KeyboardInterrupt:
+        echoed = None
+    return CLI_EXIT_OK, {"port": args.port, "echoed": echoed}
+
+def _cli_optimize(args) -> tuple[int, Any]:
+    _, apply_items = render_sysctl_profile(get_sysctl_profile_settings())
+    sysctl_rows = []
+    for key, value in apply_items:
+        current = _read_proc_text("/proc/sys/" + key.replace(".", "/"))
+        sysctl_rows.append({
+            "key": key,
+            "current": " ".join(current.split()) if current else None,
+            "target": str(value),
+            "changed": " ".join(current.split()) != " ".join(str(value).split()),
+        })
+    result = {
+        "dry_run": bool(args.dry_run),
+        "sysctl_file": str(NETRIX_SYSCTL_FILE),
+        "limits_file": str(NETRIX_LIMITS_FILE),
+        "sysctl": sysctl_rows,
+    }
+    if args.dry_run:
+        return CLI_EXIT_OK, result
+    require_root()
+    sysctl_optimizations()
+    limits_optimizations()
+    return CLI_EXIT_OK, result
+
+def _cli_render_table(rows: List[Dict[str, Any]], columns: List[str]):
+    if not rows:
+        print("(none)")
+        return
+    widths = {c: max(len(c), *(len(str(r.get(c, "") if r.get(c) is not None else "-")) for r in rows)) for c in columns}
+    print("  ".join(c.upper().ljust(widths[c]) for c in columns))
+    for r in rows:
+        print("  ".join(str(r.get(c) if r.get(c) is not None else "-").ljust(widths[c]) for c in columns))
+
+def _cli_render_text(command: str, payload: Any):
+    if command == "list":
+        _cli_render_table(payload, ["stem", "mode", "transport", "alive", "pid", "summary"])
+    elif command == "status":
+        _cli_render_table(payload, ["stem", "status", "pid", "health_port", "summary"])
+    elif command == "health":
+        rows = [dict(r, state="healthy" if r["healthy"] else (r["error"] or "unhealthy")) for r in payload]
+        _cli_render_table(rows, ["stem", "health_port", "pid", "state"])
+    elif command == "watchdog":
+        if isinstance(payload, dict):
+            (c_ok if payload["installed"] else c_warn)(f"{payload['service']}: {'installed' if payload['installed'] else 'not installed'}")
+        else:
+            rows = [dict(e, time=time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(e["ts"]))) for e in payload]
+            _cli_render_table(rows, ["time", "stem", "event", "reason", "attempt"])
+    elif command == "logs":
+        if payload and "hour" in payload[0]:
+            rows = [dict(r, hour=time.strftime("%Y-%m-%d %H:00", time.localtime(r["hour"]))) for r in payload]
+            _cli_render_table(rows, ["stem", "hour", *log_event_types(), "total"])
+        elif payload and "events" in payload[0]:
+            _cli_render_table(payload, ["stem", "events"])
+        else:
+            _cli_render_table(payload, ["stem", *log_event_types(), "total", "top_message"])
+    elif command == "accounting":
+        if isinstance(payload, str):
+            sys.stdout.write(payload)
+            return
+        rows = [dict(r, bytes_in=format_bytes(r["bytes_in"]) if r["bytes_in"] is not None else None,
+                     bytes_out=format_bytes(r["bytes_out"]) if r["bytes_out"] is not None else None) for r in payload]
+        _cli_render_table(rows, ["stem", "kind", "mapping", "bytes_in", "bytes_out", "mbps_in", "mbps_out"])
+        for r in payload:
+            if str(r.get("sync") or "").startswith("error"):
+                c_err(f"{r['stem']}: {r['sync']}")
+    elif command == "qos":
+        if "cleared" in payload:
+            c_ok(f"QoS removed from {', '.join(payload['cleared'])}")
+        elif "runs" in payload:
+            rows = [dict(r, run=label) for label, r in payload["runs"].items()]
+            _cli_render_table(rows, ["run", "mbps", "p99_ms", "udp_p50_ms", "udp_p99_ms", "udp_loss_pct", "error"])
+            if payload["udp_p99_delta_ms"] is not None:
+                print(f"latency-class p99 change with QoS: {payload['udp_p99_delta_ms']:+.2f} ms "
+                      f"({payload['qdisc']}, {payload['bandwidth_mbps']:g} Mbit/s bottleneck)")
+        else:
+            print(f"qdisc: {payload['qdisc']}  bandwidth: {payload['bandwidth_mbps'] or 'unshaped'}  "
+                  f"devices: {', '.join(payload['devices'])}")
+            _cli_render_table(payload["classes"], ["stem", "priority", "proto", "ports"])
+            if payload.get("dry_run") and payload["classes"]:
+                print("\n" + payload["nft"])
+                for cmds in payload["tc"].values():
+                    for cmd in cmds:
+                        print(" ".join(cmd))
+            for err in payload["errors"]:
+                c_err(err)
+    elif command == "limits":
+        if payload and "status" in payload[0]:
+            _cli_render_table(payload, ["stem", "status"])
+        else:
+            _cli_render_table(payload, ["stem", "limit", "direction", "rate_limit", "burst_bytes", "hit_packets", "hit_bytes"])
+            for r in payload:
+                if r.get("error"):
+                    c_err(f"{r['stem']}: {r['error']}")
+                elif r.get("skipped") and r["direction"] == "in":
+                    c_warn(f"{r['stem']}: tunnel limit skips {'; '.join(r['skipped'])}")
+    elif command == "conntrack":
+        stats = payload.get("stats")
+        if stats and stats["loaded"]:
+            (c_warn if stats.get("insert_failed") or stats.get("drop") or stats.get("early_drop") else c_ok)(
+                f"conntrack: {stats['count']}/{stats['max']} entries ({stats['usage_pct']}%), "
+                f"insert_failed={stats.get('insert_failed', 0)} drop={stats.get('drop', 0)} early_drop={stats.get('early_drop', 0)}")
+        elif stats:
+            c_ok("conntrack: nf_conntrack is not loaded")
+        sizing = payload.get("sizing")
+        if sizing:
+            applied = "" if "applied" not in sizing else (" (applied)" if sizing["applied"] else f" (not applied: {sizing.get('reason') or '; '.join(sizing['errors'])})")
+            print(f"recommended: nf_conntrack_max={sizing['max']} hashsize={sizing['hashsize']} "
+                  f"(up to {format_bytes(sizing['memory_bytes'])}){applied}")
+        rows = payload.get("tunnels") or []
+        if rows and "status" in rows[0]:
+            _cli_render_table(rows, ["stem", "status"])
+        elif rows:
+            _cli_render_table([dict(r, untracked=", ".join(r["untracked"]) or "-",
+                                    tracked="; ".join(r["tracked"]) or "-")
+                               for r in rows], ["stem", "notrack", "untracked", "tracked", "installed"])
+    elif command == "tun":
+        if "runs" in payload:
+            _cli_render_table(payload["runs"], ["streams", "mbps", "speedup", "p99_ms", "udp_p99_ms", "cpu_ms_per_mb", "error"])
+            if payload["best_streams"]:
+                c_ok(f"best: streams={payload['best_streams']} ({payload['flows']} flows, {payload['transport']})")
+        yes_no = {True: "yes", False: "no", None: "unknown"}
+        for row in payload if isinstance(payload, list) else []:
+            head = f"{row['stem']} ({row['device']})" if row.get("stem") else "host"
+            print(f"{head}: multi-queue TUN kernel {yes_no[row['kernel_multi_queue']]}, core {yes_no[row['core_multi_queue']]}; "
+                  f"{row['cores']} cores" + (f", {row['pps']:.0f} pps" if row.get("pps") is not None else ""))
+            live = row.get("live") or {}
+            if live.get("exists"):
+                print(f"  live: {live.get('queues')} queue(s), multi-queue {yes_no[live.get('multi_queue')]}, "
+                      f"txqueuelen {live.get('txqueuelen')}")
+            current = f"{row['current_streams']} -> " if row.get("current_streams") is not None else ""
+            print(f"  streams {current}{row['streams']}, txqueuelen {row['txqueuelen']} ({row['reason']})")
+            if row.get("restarted") is False:
+                c_err("  config updated but the restart failed")
+            elif row.get("config_changed"):
+                print("  config updated" + (" (tunnel restarted)" if row.get("restarted") else ""))
+            if row.get("txqueuelen_set") is False:
+                c_err(f"  could not set txqueuelen on {row['device']}")
+    elif command == "wait":
+        for r in payload:
+            if r["ready"]:
+                c_ok(f"{r['stem']}: {r['condition']} after {r['elapsed_ms']:.0f} ms ({r['polls']} polls)")
+            else:
+                c_err(f"{r['stem']}: not {r['condition']} after {r['elapsed_ms']:.0f} ms: {r['error']}")
+    elif command in ("start", "stop", "restart"):
+        for r in payload:
+            (c_ok if r["ok"] else c_err)(f"{r['action']} {r['stem']}: {'ok' if r['ok'] else 'failed'}")
+    elif command == "create":
+        state = "written" if payload.get("config_changed") else "unchanged"
+        action = payload.get("action")
+        c_ok(f"Config {state}: {payload['config']}" + (f" ({action})" if action not in (None, "written", "unchanged") else ""))
+    elif command == "apply":
+        rows = [dict(r, changed="config+unit" if r["config_changed"] and r["unit_changed"] else
+                     "config" if r["config_changed"] else "unit" if r["unit_changed"] else "-") for r in payload]
+        _cli_render_table(rows, ["stem", "changed", "action", "ready_ms", "ok"])
+        for r in payload:
+            if r.get("error"):
+                c_warn(f"{r['stem']}: {r['error']}")
+    elif command == "size":
+        for sizing in payload:
+            if sizing.get("error"):
+                c_err(f"{sizing['stem']}: {sizing['error']}")
+                continue
+            if sizing.get("stem"):
+                print(f"{sizing['stem']}:" + (" (config updated)" if sizing.get("config_changed") else ""))
+            print_sizing(sizing)
+    elif command == "fec":
+        for entry in payload:
+            if entry.get("error"):
+                c_err(f"{entry['stem'] or '-'}: {entry['error']}")
+                continue
+            if entry.get("stem"):
+                print(f"{entry['stem']}:" + (" (config updated)" if entry.get("config_changed") else ""))
+            if entry.get("shards"):
+                print(f"  {FG_CYAN}FEC:{RESET} data_shard={entry['shards']['data_shard']} parity_shard={entry['shards']['parity_shard']}")
+                continue
+            print_fec_choice(entry["model"], entry["fec"])
+            if entry.get("apply_command"):
+                c_warn(f"  Advisory, not written. To use it, run on both ends: {entry['apply_command']} / {entry['peer_command']}")
+            elif entry.get("peer_command"):
+                c_warn(f"  Peer needs the same shards: {entry['peer_command']}")
+    elif command == "compressibility":
+        for entry in payload:
+            if entry.get("error"):
+                c_err(f"{entry['stem'] or '-'}: {entry['error']}")
+                continue
+            if entry.get("stem"):
+                print(f"{entry['stem']}:" + (" (config updated)" if entry.get("config_changed") else ""))
+            print_compressibility(entry["stats"], entry["recommendation"])
+    elif command == "memory":
+        print_memory_report(payload)
+    elif command == "autotune":
+        base = payload["baseline"]
+        best = next(h["result"] for h in payload["history"] if h["params"] == payload["best"])
+        print(f"{payload['stem']}: {payload['trials']} trials under rtt {payload['conditions']['rtt_ms']:.1f} ms, "
+              f"loss {payload['conditions']['loss_pct']:.2f}%")
+        print(f"  baseline {base['mbps']} Mbps, p99 {base.get('p99_ms')} ms, {base.get('cpu_ms_per_mb')} ms CPU/MB")
+        print(f"  best     {best['mbps']} Mbps, p99 {best.get('p99_ms')} ms, {best.get('cpu_ms_per_mb')} ms CPU/MB (score {payload['score']})")
+        for key, value in payload["best"].items():
+            print(f"  {key}: {value}")
+        print(f"  saved profile: {payload['profile']}" + (" (config updated)" if payload.get("config_changed") else ""))
+    elif command == "bench":
+        if isinstance(payload, dict):
+            print(f"{payload['old']} -> {payload['new']} on host {payload['host']}: {payload['regressions']} regression(s)")
+            _cli_render_table(payload["rows"], ["transport", "profile", "scenario", "seconds", "streams", "metric",
+                                                "old", "new", "change_pct", "samples", "p_value", "verdict"])
+        else:
+            _cli_render_table(payload, ["transport", "mbps", "setup_ms", "p50_ms", "p99_ms", "udp_p99_ms", "cpu_ms_per_mb", "error"])
+    elif command == "pool":
+        for entry in payload:
+            if entry.get("error"):
+                c_err(f"{entry['stem']}: {entry['error']}")
+                continue
+            head = f"{entry['stem']}: " if entry.get("stem") else ""
+            print(f"{head}{entry['transport']} rtt {entry['rtt_ms']:.1f} ms x {entry['bandwidth_mbps']:g} Mbps "
+                  f"(BDP {format_bytes(entry['bdp_bytes'])}), {entry['cores']} cores, {entry['concurrency']} streams")
+            limits = entry["limits"]
+            print(f"  connection_pool={entry['connection_pool']} mux_con={entry['mux_con']} ({entry['sessions']} sessions; "
+                  f"needs: bdp {limits['bdp']}, cpu {limits['cpu']}, streams {limits['streams']})")
+            for warning in entry["warnings"]:
+                c_warn(f"  {warning}")
+            check = entry.get("validation")
+            if check:
+                verdict = "accepted" if check["accepted"] else "rejected (scores worse than current)"
+                print(f"  bench: current {check['current'].get('mbps')} Mbps p99 {check['current'].get('p99_ms')} ms, "
+                      f"sized {check['sized'].get('mbps')} Mbps p99 {check['sized'].get('p99_ms')} ms, score {check['score']} -> {verdict}")
+            if entry.get("config_changed"):
+                print("  config updated" + (" (tunnel restarted)" if entry.get("restarted") else ""))
+    elif command == "paths":
+        plan = payload["plan"]
+        rows = [dict(r, new_rank=plan["order"].index(r["index"]) + 1, new_pool=plan["pools"][r["index"]])
+                for r in payload["paths"]]
+        _cli_render_table(rows, ["index", "addr", "transport", "method", "handshake_ms", "rtt_ms", "loss_pct",
+                                 "est_mbps", "connection_pool", "new_rank", "new_pool"])
+        for r in payload["paths"]:
+            if r.get("unknown"):
+                c_warn(f"{r['addr']}: {r['error']}; kept in place (use --udp-port with probe-echo on the peer)")
+        if payload.get("config_changed"):
+            print("paths reordered" + (" (tunnel restarted)" if payload.get("restarted") else ""))
+        elif payload["changed"]:
+            print("suggested order/pools differ from the config; --apply writes them")
+    elif command == "bench-matrix":
+        _cli_render_table(payload["ranking"], ["rank", "transport", "profile", "score", "mean_mbps", "worst_p99_ms", "wins", "failures"])
+        print()
+        _cli_render_table(payload["winners"], ["scenario", "winner", "score"])
+        if payload.get("output"):
+            print(f"\nfull report: {payload['output']}")
+    elif command == "bench-gen":
+        if payload.get("error"):
+            c_err(payload["error"])
+        else:
+            print(f"{payload['mbps']} Mbps, p50 {payload['p50_ms']} ms, p99 {payload['p99_ms']} ms ({payload['samples']} echoes)")
+    elif command == "profile":
+        if isinstance(payload, list):
+            _cli_render_table(payload, ["name", "base", "custom", "description"])
+        elif "sections" in payload:
+            print(f"{payload['name']} (base {payload['base']})")
+            for section, values in payload["sections"].items():
+                if values:
+                    print(f"  {section}:")
+                    for key, value in values.items():
+                        print(f"    {key}: {value}")
+        elif not payload["differences"]:
+            print(f"{payload['left']} and {payload['right']} are identical")
+        else:
+            _cli_render_table(payload["differences"], ["key", "left", "right"])
+    elif command == "cpu":
+        print_cpu_profile(payload)
+    elif command == "pmtu":
+        for entry in payload:
+            if entry.get("error"):
+                c_err(f"{entry['stem'] or '-'}: {entry['error']}")
+                continue
+            label = f"{entry['stem']}: " if entry.get("stem") else ""
+            print(f"{label}path MTU to {entry['host']} = {entry['path_mtu']} ({entry['method']}, route MTU {entry['route_mtu']})"
+                  + (" (config updated)" if entry.get("config_changed") else ""))
+            for key, value in entry["mtus"].items():
+                print(f"  {key}: {value}")
+    elif command == "probe-echo":
+        pass
+    elif command == "optimize":
+        rows = [r for r in payload["sysctl"] if r["changed"]]
+        label = "would change" if payload["dry_run"] else "changed"
+        print(f"sysctl: {len(rows)}/{len(payload['sysctl'])} setting(s) {label}")
+        _cli_render_table(rows, ["key", "current", "target"])
+
+def build_cli_parser():
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="netrix-manager",
+        description="Netrix Core manager. Run without arguments for the interactive menu.",
+    )
+    parser.add_argument("--version", action="version", version=f"%(prog)s {VERSION}")
+    parser.add_argument("--startup-profile", action="store_true",
+                        help="re-run the command under -X importtime and report cold-start cost on stderr")
+    sub = parser.add_subparsers(dest="command", metavar="COMMAND")
+
+    def add_json(p):
+        p.add_argument("--json", action="store_true", help="machine-readable output on stdout")
+
+    p = sub.add_parser("list", help="list configured tunnels")
+    add_json(p)
+    p = sub.add_parser("status", help="service state of tunnels (exit 1 if any is not active)")
+    p.add_argument("tunnels", nargs="*", metavar="TUNNEL")
+    add_json(p)
+    p = sub.add_parser("health", help="query tunnel health endpoints (exit 1 if any is unhealthy)")
+    p.add_argument("tunnels", nargs="*", metavar="TUNNEL")
+    p.add_argument("--all", action="store_true", help="all configured tunnels, not only running ones")
+    p.add_argument("--timeout", type=float, default=3.0, help="HTTP timeout in seconds (default: 3)")
+    add_json(p)
+    def add_wait(p):
+        p.add_argument("--wait", choices=READY_CONDITIONS + ("none",), default=READY_DEFAULT_CONDITION,
+                       help=f"readiness to wait for after (re)start (default: {READY_DEFAULT_CONDITION})")
+        p.add_argument("--timeout", type=float, default=READY_DEFAULT_TIMEOUT,
+                       help=f"readiness timeout in seconds (default: {READY_DEFAULT_TIMEOUT:g})")
+
+    for name, text in (("start", "enable and start"), ("stop", "stop and clean firewall rules of"), ("restart", "restart")):
+        p = sub.add_parser(name, help=f"{text} tunnels")
+        p.add_argument("tunnels", nargs="*", metavar="TUNNEL", help="config stem, e.g. server_4000")
+        p.add_argument("--all", action="store_true", help="every configured tunnel")
+        if name != "stop":
+            add_wait(p)
+        add_json(p)
+    p = sub.add_parser("wait", help="wait until tunnels are ready (exit 1 on timeout)")
+    p.add_argument("tunnels", nargs="*", metavar="TUNNEL")
+    p.add_argument("--all", action="store_true", help="every configured tunnel")
+    p.add_argument("--condition", choices=READY_CONDITIONS, default=READY_DEFAULT_CONDITION,
+                   help=f"what to wait for (default: {READY_DEFAULT_CONDITION})")
+    p.add_argument("--timeout", type=float, default=READY_DEFAULT_TIMEOUT,
+                   help=f"seconds to wait (default: {READY_DEFAULT_TIMEOUT:g})")
+    add_json(p)
+    p = sub.add_parser("create", help="create a tunnel config from a YAML spec")
+    p.add_argument("--from", dest="spec", required=True, metavar="SPEC", help="tunnel spec YAML file")
+    p.add_argument("--start", action="store_true", help="start the tunnel after writing it")
+    add_json(p)
+    p = sub.add_parser("apply", help="provision a fleet of tunnels from one spec (idempotent)")
+    p.add_argument("spec", metavar="FLEET", help="fleet spec YAML (defaults: + tunnels:)")
+    p.add_argument("--no-start", action="store_true", help="write configs and units only")
+    add_wait(p)
+    add_json(p)
+    p = sub.add_parser("size", help="size buffers/windows from the bandwidth-delay product")
+    p.add_argument("tunnels", nargs="*", metavar="TUNNEL", help="size these tunnels (RTT measured to their peers)")
+    p.add_argument("--bandwidth", type=float, required=True, metavar="MBPS", help="target bandwidth in Mbit/s")
+    p.add_argument("--rtt", default="auto", metavar="MS", help="round-trip time in ms, or 'auto' (default)")
+    p.add_argument("--profile", type=str.lower, help="profile (built-in or custom) whose MTUs to size against")
+    p.add_argument("--apply", action="store_true", help="write the values into the tunnel configs and restart changed tunnels")
+    add_json(p)
+    p = sub.add_parser("fec", help="choose FEC data/parity shards from measured loss and burstiness")
+    p.add_argument("tunnels", nargs="*", metavar="TUNNEL", help="probe the peers of these tunnels")
+    p.add_argument("--host", help="probe this host instead of the tunnel peer")
+    p.add_argument("--udp-port", type=int, metavar="PORT", help="UDP probe train against a peer running probe-echo (default: ICMP)")
+    p.add_argument("--count", type=int, default=PROBE_DEFAULT_COUNT, help=f"probes to send (default: {PROBE_DEFAULT_COUNT})")
+    p.add_argument("--interval", type=float, default=PROBE_DEFAULT_INTERVAL_MS, metavar="MS", help=f"probe spacing (default: {PROBE_DEFAULT_INTERVAL_MS})")
+    p.add_argument("--loss", type=float, metavar="PCT", help="skip probing and use this loss rate")
+    p.add_argument("--burst", type=float, default=1.0, metavar="LEN", help="mean loss burst length with --loss (default: 1)")
+    p.add_argument("--target", type=float, default=FEC_DEFAULT_TARGET_LOSS * 100, metavar="PCT", help="residual loss target (default: 0.1)")
+    p.add_argument("--shards", metavar="DATA:PARITY", help="skip probing and set these shards (match the peer's choice)")
+    p.add_argument("--apply", action="store_true", help="write the shards into the kcp:/rawsocket: blocks")
+    add_json(p)
+    p = sub.add_parser("compressibility", help="sample mapped-port traffic and recommend compression settings")
+    p.add_argument("tunnels", nargs="*", metavar="TUNNEL", help="sample the mapped ports of these tunnels")
+    p.add_argument("--tcp-port", type=int, action="append", help="also sample this TCP port (repeatable)")
+    p.add_argument("--udp-port", type=int, action="append", help="also sample this UDP port (repeatable)")
+    p.add_argument("--seconds", type=float, default=SAMPLE_DEFAULT_SECONDS, help=f"capture window (default: {SAMPLE_DEFAULT_SECONDS})")
+    p.add_argument("--interface", help="capture on this interface only (default: all)")
+    p.add_argument("--apply", action="store_true", help="write the recommended compression block into the configs")
+    add_json(p)
+    p = sub.add_parser("memory", help="estimate worst-case/typical RAM per tunnel and check it against the host budget")
+    p.add_argument("tunnels", nargs="*", metavar="TUNNEL", help="limit the report (the budget always covers all tunnels)")
+    p.add_argument("--streams", type=int, default=MEM_DEFAULT_STREAMS, help=f"concurrent streams per tunnel (default: {MEM_DEFAULT_STREAMS})")
+    p.add_argument("--apply", action="store_true", help="write the suggested values when over budget")
+    add_json(p)
+    p = sub.add_parser("autotune", help="search smux/kcp/rawsocket parameters on a netns+netem bench and save a profile")
+    p.add_argument("tunnel", metavar="TUNNEL")
+    p.add_argument("--rtt", default="auto", help="path RTT in ms to emulate, or 'auto' to measure (default)")
+    p.add_argument("--loss", default="0", help="one-way loss in %% to emulate, or 'auto' to probe (default: 0)")
+    p.add_argument("--bandwidth", type=float, help="emulated bottleneck in Mbps (default: unlimited)")
+    p.add_argument("--seconds", type=float, default=BENCH_DEFAULT_SECONDS, help=f"traffic per trial (default: {BENCH_DEFAULT_SECONDS})")
+    p.add_argument("--streams", type=int, default=BENCH_DEFAULT_STREAMS, help=f"parallel bulk streams (default: {BENCH_DEFAULT_STREAMS})")
+    p.add_argument("--rounds", type=int, default=AUTOTUNE_DEFAULT_ROUNDS, help=f"coordinate-descent rounds (default: {AUTOTUNE_DEFAULT_ROUNDS})")
+    p.add_argument("--name", help="profile name to save (default: tuned-<tunnel>)")
+    p.add_argument("--apply", action="store_true", help="also write the winning values into the tunnel config")
+    add_json(p)
+    p = sub.add_parser("bench", help="benchmark each transport between two network namespaces, or compare core versions")
+    p.add_argument("action", nargs="?", choices=["run", "compare"], default="run")
+    p.add_argument("versions", nargs="*", metavar="VERSION", help="compare: OLD NEW core versions ('previous', 'current' allowed)")
+    p.add_argument("--transport", action="append", choices=TUNNEL_TRANSPORTS, help="transport to run (repeatable; default: all)")
+    p.add_argument("--profile", default="balanced", help="profile for both ends (default: balanced)")
+    p.add_argument("--seconds", type=float, default=BENCH_DEFAULT_SECONDS, help=f"traffic per transport (default: {BENCH_DEFAULT_SECONDS})")
+    p.add_argument("--streams", type=int, default=BENCH_DEFAULT_STREAMS, help=f"parallel bulk streams (default: {BENCH_DEFAULT_STREAMS})")
+    p.add_argument("--rtt", type=float, default=0.0, help="emulated RTT in ms (netem; default: none)")
+    p.add_argument("--loss", type=float, default=0.0, help="emulated one-way loss in %% (netem; default: none)")
+    p.add_argument("--bandwidth", type=float, help="emulated bottleneck in Mbps (default: unlimited)")
+    p.add_argument("--repeat", type=int, default=1, help="runs per transport (use 5+ for 'bench compare'; default: 1)")
+    p.add_argument("--no-save", action="store_true", help="do not store the results")
+    p.add_argument("--host", help="compare: host fingerprint to compare on (default: this host; 'any' = all hosts)")
+    add_json(p)
+    p = sub.add_parser("watchdog", help="restart tunnels that are alive but stuck, per health policies")
+    p.add_argument("action", nargs="?", choices=["run", "events", "install", "uninstall"], default="run")
+    p.add_argument("tunnels", nargs="*", metavar="TUNNEL", help="watch / show events of these tunnels only")
+    p.add_argument("--interval", type=float, default=WATCHDOG_DEFAULT_INTERVAL,
+                   help=f"seconds between samples (default: {WATCHDOG_DEFAULT_INTERVAL:g})")
+    p.add_argument("--policy", metavar="FILE", help=f"policy file (default: {watchdog_policy_path()})")
+    p.add_argument("--dry-run", action="store_true", help="log would_restart events without restarting")
+    p.add_argument("--once", action="store_true", help="take one sample and exit (conditions with a duration never fire)")
+    p.add_argument("--since", type=float, metavar="HOURS", help="events: only the last HOURS hours")
+    add_json(p)
+    p = sub.add_parser("logs", help="index tunnel journal entries by event type (reconnects, timeouts, ...)")
+    p.add_argument("action", nargs="?", choices=["stats", "ingest"], default="stats")
+    p.add_argument("tunnels", nargs="*", metavar="TUNNEL")
+    p.add_argument("--hours", type=float, default=24, help="stats: window in hours (default: 24)")
+    p.add_argument("--hourly", action="store_true", help="stats: one row per tunnel and hour")
+    p.add_argument("--no-ingest", action="store_true", help="stats: query the index without reading new entries")
+    add_json(p)
+    p = sub.add_parser("accounting", help="bytes/packets/rates per port mapping from kernel counters (nftables or iptables)")
+    p.add_argument("tunnels", nargs="*", metavar="TUNNEL")
+    p.add_argument("--no-sync", action="store_true", help="read the counters without (re)installing rules")
+    p.add_argument("--prometheus", action="store_true", help="print Prometheus text format (e.g. for the textfile collector)")
+    add_json(p)
+    p = sub.add_parser("qos", help="prioritise latency-sensitive mappings (nftables marks + tc tiers)")
+    p.add_argument("action", nargs="?", choices=["apply", "show", "clear", "bench"], default="show")
+    p.add_argument("--interface", help="egress interface (default: qos.yaml or the default route's)")
+    p.add_argument("--bandwidth", type=float, metavar="MBPS", help="link rate to shape to (0 = no shaping)")
+    p.add_argument("--qdisc", choices=QOS_QDISCS, help="tc hierarchy (default: qos.yaml, else cake when shaping, prio otherwise)")
+    p.add_argument("--dry-run", action="store_true", help="apply: print the nft/tc commands only")
+    p.add_argument("--seconds", type=float, default=BENCH_DEFAULT_SECONDS, help=f"bench: traffic per run (default: {BENCH_DEFAULT_SECONDS})")
+    p.add_argument("--streams", type=int, default=BENCH_DEFAULT_STREAMS, help=f"bench: bulk streams (default: {BENCH_DEFAULT_STREAMS})")
+    add_json(p)
+    p = sub.add_parser("limits", help="rate_limit/burst per mapping and tunnel (nftables); show = hits")
+    p.add_argument("action", nargs="?", choices=["show", "apply", "clear"], default="show")
+    p.add_argument("tunnels", nargs="*", metavar="TUNNEL")
+    add_json(p)
+    p = sub.add_parser("conntrack", help="NOTRACK for tunnel (and mapped) ports, table sizing and conntrack counters")
+    p.add_argument("action", nargs="?", choices=["show", "apply", "clear"], default="show")
+    p.add_argument("tunnels", nargs="*", metavar="TUNNEL")
+    p.add_argument("--notrack", choices=NOTRACK_MODES, help="apply: set the mode first (transport = listen/peer ports, "
+                   "all = also mapped ports when no NAT/stateful rule needs them)")
+    p.add_argument("--size", action="store_true", help="apply: also size nf_conntrack_max/hashsize from RAM")
+    add_json(p)
+    p = sub.add_parser("tun", help="multi-queue TUN check and tun.streams/txqueuelen sizing for L3/TUN tunnels")
+    p.add_argument("action", nargs="?", choices=["show", "apply", "bench"], default="show")
+    p.add_argument("tunnels", nargs="*", metavar="TUNNEL")
+    p.add_argument("--pps", type=float, help="packet rate to size for (default: measured on the live TUN device)")
+    p.add_argument("--sample", type=float, default=1.0, help="seconds to sample the TUN packet counters (default: 1, 0 = skip)")
+    p.add_argument("--flows", type=int, help="parallel flows (caps streams; bench default: %d)" % TUN_BENCH_FLOWS)
+    p.add_argument("--streams", type=_int_list, help="bench: comma-separated tun.streams values (default: 1,2,4,8 up to the cores)")
+    p.add_argument("--transport", default="l3", choices=TUNNEL_TRANSPORTS, help="bench: l3, or another transport in TUN mode (default: l3)")
+    p.add_argument("--seconds", type=float, default=BENCH_DEFAULT_SECONDS, help=f"bench: traffic per run (default: {BENCH_DEFAULT_SECONDS})")
+    add_json(p)
+    p = sub.add_parser("bench-matrix", help="rank transport x profile pairs over a netem grid of WAN conditions")
+    p.add_argument("--transport", action="append", choices=TUNNEL_TRANSPORTS, help="transport to run (repeatable; default: all)")
+    p.add_argument("--profile", action="append", help="profile to run (repeatable; default: the built-ins)")
+    for axis, flag, unit in (("rtt_ms", "--rtt", "RTT in ms"), ("jitter_ms", "--jitter", "jitter in ms"),
+                             ("loss_pct", "--loss", "one-way loss in %%"), ("reorder_pct", "--reorder", "reordering in %%"),
+                             ("rate_mbps", "--rate", "bottleneck in Mbps, 0 = unlimited")):
+        default = ",".join(f"{v:g}" for v in WAN_GRID_DEFAULTS[axis])
+        p.add_argument(flag, type=_float_list, help=f"comma-separated {unit} (default: {default})")
+    p.add_argument("--seconds", type=float, default=BENCH_DEFAULT_SECONDS, help=f"traffic per run (default: {BENCH_DEFAULT_SECONDS})")
+    p.add_argument("--streams", type=int, default=BENCH_DEFAULT_STREAMS, help=f"parallel bulk streams (default: {BENCH_DEFAULT_STREAMS})")
+    p.add_argument("--output", help="also write the full JSON report (every run) to this file")
+    p.add_argument("--no-save", action="store_true", help="do not store the results")
+    add_json(p)
+    p = sub.add_parser("pool", help="size connection_pool x mux_con from cores, RTT/BDP and stream concurrency")
+    p.add_argument("tunnels", nargs="*", metavar="TUNNEL")
+    p.add_argument("--rtt", default="auto", help="path RTT in ms, or 'auto' to measure (default)")
+    p.add_argument("--bandwidth", type=float, default=POOL_DEFAULT_BANDWIDTH, help=f"target Mbps (default: {POOL_DEFAULT_BANDWIDTH})")
+    p.add_argument("--concurrency", type=int, default=POOL_DEFAULT_CONCURRENCY,
+                   help=f"expected concurrently active streams (default: {POOL_DEFAULT_CONCURRENCY})")
+    p.add_argument("--transport", default="tcpmux", choices=TUNNEL_TRANSPORTS[:-1], help="transport when no tunnel is given")
+    p.add_argument("--validate", action="store_true", help="bench current vs sized values under the RTT first (netns+netem)")
+    p.add_argument("--seconds", type=float, default=BENCH_DEFAULT_SECONDS, help=f"traffic per validation run (default: {BENCH_DEFAULT_SECONDS})")
+    p.add_argument("--apply", action="store_true", help="write the values (only if validation, when run, accepts them)")
+    add_json(p)
+    p = sub.add_parser("paths", help="score a client's paths and reorder them / split connection_pool by estimated goodput")
+    p.add_argument("tunnel", metavar="TUNNEL")
+    p.add_argument("--probes", type=int, default=PATH_EVAL_PROBES, help=f"loss probes per path (default: {PATH_EVAL_PROBES})")
+    p.add_argument("--udp-port", type=int, metavar="PORT", help="probe kcpmux/rawsocket paths via probe-echo on this port (default: ICMP)")
+    p.add_argument("--total-pool", type=int, help="connections to split across paths (default: current sum)")
+    p.add_argument("--hysteresis", type=float, default=PATH_EVAL_HYSTERESIS,
+                   help=f"keep the current primary within this fraction of the best (default: {PATH_EVAL_HYSTERESIS})")
+    p.add_argument("--apply", action="store_true", help="write the new order and pools, restart if running")
+    p.add_argument("--watch", action="store_true", help="re-evaluate every --interval seconds and rebalance (implies --apply)")
+    p.add_argument("--interval", type=float, default=PATH_WATCH_INTERVAL, help=f"watch interval in seconds (default: {PATH_WATCH_INTERVAL})")
+    add_json(p)
+    p = sub.add_parser("bench-gen", help="traffic generator used by the bench harness")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=BENCH_MAP_PORT)
+    p.add_argument("--streams", type=int, default=BENCH_DEFAULT_STREAMS)
+    p.add_argument("--seconds", type=float, default=BENCH_DEFAULT_SECONDS)
+    p.add_argument("--wait", type=float, default=0, help="first wait up to N seconds for an echo to get through")
+    p.add_argument("--udp-port", type=int, help="also probe UDP echo latency/loss through this port")
+    add_json(p)
+    p = sub.add_parser("bench-sink", help="traffic sink used by the bench harness")
+    p.add_argument("--port", type=int, default=BENCH_SINK_PORT)
+    p.add_argument("--bind", default="0.0.0.0")
+    p = sub.add_parser("profile", help="list/show custom profiles, or diff two profiles or tunnels")
+    p.add_argument("action", choices=["list", "show", "diff"])
+    p.add_argument("names", nargs="*", metavar="NAME", help="profile or tunnel names")
+    p.add_argument("--transport", help="transport for the advanced section of a profile (default: kcpmux, or the tunnel's)")
+    add_json(p)
+    p = sub.add_parser("cpu", help="probe CPU crypto/SIMD flags, benchmark AEAD and compression, recommend algorithms")
+    add_json(p)
+    p = sub.add_parser("pmtu", help="discover the path MTU and derive kcp/rawsocket/tun/L3 MTUs")
+    p.add_argument("tunnels", nargs="*", metavar="TUNNEL", help="probe the peers of these tunnels")
+    p.add_argument("--host", help="probe this host instead of the tunnel peer")
+    p.add_argument("--method", choices=["icmp", "udp", "tcp"], default="icmp", help="DF probe type (default: icmp)")
+    p.add_argument("--port", type=int, help="probe-echo port (udp) or listening port (tcp) on the peer")
+    p.add_argument("--apply", action="store_true", help="write the MTUs into the tunnel configs")
+    add_json(p)
+    p = sub.add_parser("probe-echo", help="UDP responder for 'fec --udp-port' / 'pmtu --method udp' probes")
+    p.add_argument("--port", type=int, required=True)
+    p.add_argument("--bind", default="0.0.0.0")
+    p.add_argument("--duration", type=float, default=0.0, metavar="SEC", help="stop after SEC seconds (default: run until Ctrl+C)")
+    add_json(p)
+    p = sub.add_parser("optimize", help="apply the sysctl/limits profile")
+    p.add_argument("--dry-run", action="store_true", help="show current vs target values only")
+    add_json(p)
+    return parser
+
+CLI_HANDLERS = {
+    "list": _cli_list,
+    "status": _cli_status,
+    "health": _cli_health,
+    "start": _cli_lifecycle,
+    "stop": _cli_lifecycle,
+    "restart": _cli_lifecycle,
+    "wait": _cli_wait,
+    "watchdog": _cli_watchdog,
+    "logs": _cli_logs,
+    "accounting": _cli_accounting,
+    "qos": _cli_qos,
+    "limits": _cli_limits,
+    "conntrack": _cli_conntrack,
+    "tun": _cli_tun,
+    "create": _cli_create,
+    "apply": _cli_apply,
+    "size": _cli_size,
+    "fec": _cli_fec,
+    "compressibility": _cli_compressibility,
+    "memory": _cli_memory,
+    "autotune": _cli_autotune,
+    "bench": _cli_bench,
+    "bench-matrix": _cli_bench_matrix,
+    "pool": _cli_pool,
+    "paths": _cli_paths,
+    "bench-gen": _cli_bench_gen,
+    "bench-sink": _cli_bench_sink,
+    "profile": _cli_profile,
+    "cpu": _cli_cpu,
+    "pmtu": _cli_pmtu,
+    "probe-echo": _cli_probe_echo,
+    "optimize": _cli_optimize,
+}
+
+def _cli_report_error(command: str, error: Exception, as_json: bool):
+    """Error on stderr; with --json also as {"error": ...} on stdout, so scripts always get a document."""
+    print(f"netrix-manager {command}: {error}", file=sys.stderr)
+    if as_json:
+        print(json.dumps({"error": str(error)}))
+
+def run_cli(argv: List[str]) -> int:
+    """Run one non-interactive command and return its exit code."""
+    import contextlib
+    parser = build_cli_parser()
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.print_help()
+        return CLI_EXIT_USAGE
+    as_json = getattr(args, "json", False)
+    try:
+        if as_json:
+            with contextlib.redirect_stdout(sys.stderr):
+                code, payload = CLI_HANDLERS[args.command](args)
+            print(json.dumps(payload, indent=2, default=str))
+        else:
+            code, payload = CLI_HANDLERS[args.command](args)
+            _cli_render_text(args.command, payload)
+        return code
+    except ValueError as e:
+        _cli_report_error(args.command, e, as_json)
+        return CLI_EXIT_USAGE
+    except (RuntimeError, OSError, subprocess.SubprocessError) as e:
+        # probes and subprocess calls fail with OSError/TimeoutExpired: an operation failure, not a traceback
+        _cli_report_error(args.command, e, as_json)
+        return CLI_EXIT_FAILURE
+    except KeyboardInterrupt:
+        return 130
+
+STARTUP_PROFILE_ENV = "NETRIX_STARTUP_PROFILE"
+STARTUP_PROFILE_PREFIX = "netrix-startup:"
+MANAGER_LAUNCHER = "netrix-manager"    # thin entry script that imports this file with cached bytecode
+
+def manager_command() -> List[str]:
+    """argv prefix that re-runs this manager, through the launcher next to it when installed."""
+    script = os.path.abspath(__file__)
+    launcher = os.path.join(os.path.dirname(script), MANAGER_LAUNCHER)
+    return [sys.executable, launcher if os.path.isfile(launcher) else script]
+
+def _emit_startup_phases(main_t0: float):
+    """Child side of --startup-profile: report phase timings on stderr for the parent to collect."""
+    done = time.perf_counter()
+    print(f"{STARTUP_PROFILE_PREFIX} module={(main_t0 - _STARTUP_T0) * 1000.0:.2f}", file=sys.stderr)
+    print(f"{STARTUP_PROFILE_PREFIX} command={(done - main_t0) * 1000.0:.2f}", file=sys.stderr)
+    for name, ms in STARTUP_IMPORT_TIMES:
+        print(f"{STARTUP_PROFILE_PREFIX} lazy:{name}={ms:.2f}", file=sys.stderr)
+
+def run_startup_profile(argv: List[str]) -> int:
+    """Run `argv` (default: list --json) in a fresh interpreter with -X importtime and summarize its cold start."""
+    argv = argv or ["list", "--json"]
+    script = os.path.abspath(__file__)
+    entry = manager_command()[1]
+    compile_ms = None
+    if entry == script:
+        try:
+            t0 = time.perf_counter()
+            compile(Path(script).read_bytes(), script, "exec")
+            compile_ms = (time.perf_counter() - t0) * 1000.0
+        except Exception:
+            pass
+    env = dict(os.environ, **{STARTUP_PROFILE_ENV: "1"})
+    t0 = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", entry, *argv], stderr=subprocess.PIPE, text=True, env=env)
+    wall_ms = (time.perf_counter() - t0) * 1000.0
+
+    imports = []
+    phases = {}
+    for line in proc.stderr.splitlines():
+        if line.startswith("import time:"):
+            fields = line[len("import time:"):].split("|")
+            if len(fields) == 3 and fields[0].strip().isdigit():
+                name = fields[2].rstrip()
+                imports.append((int(fields[1]), int(fields[0]), name.strip(), len(name) - len(name.lstrip())))
+        elif line.startswith(STARTUP_PROFILE_PREFIX):
+            key, _, value = line[len(STARTUP_PROFILE_PREFIX):].strip().partition("=")
+            try:
+                phases[key] = float(value)
+            except ValueError:
+                pass
+        else:
+            print(line, file=sys.stderr)
+
+    err = sys.stderr
+    print(f"\nstartup profile: netrix-manager {' '.join(argv)} (exit {proc.returncode})", file=err)
+    print(f"  wall clock       {wall_ms:8.1f} ms", file=err)
+    if compile_ms is not None:
+        print(f"  script compile   {compile_ms:8.1f} ms  (a __main__ script is not bytecode-cached; "
+              f"install the {MANAGER_LAUNCHER} launcher next to it)", file=err)
+    else:
+        print(f"  script compile   cached     (run through {entry})", file=err)
+    if "module" in phases:
+        print(f"  module body      {phases['module']:8.1f} ms  (eager imports + definitions)", file=err)
+    if "command" in phases:
+        print(f"  command          {phases['command']:8.1f} ms  (includes lazy imports below)", file=err)
+    lazy = [(k[len("lazy:"):], v) for k, v in phases.items() if k.startswith("lazy:")]
+    if lazy:
+        print("  lazy imports:", file=err)
+        for name, ms in lazy:
+            print(f"    {ms:8.1f} ms  {name}", file=err)
+    top = sorted((row for row in imports if row[3] <= 1), reverse=True)[:12]
+    if top:
+        print("  top-level imports (-X importtime, us):", file=err)
+        print(f"    {'cumulative':>10} | {'self':>8} | module", file=err)
+        for cumulative, self_us, name, _ in top:
+            print(f"    {cumulative:>10} | {self_us:>8} | {name}", file=err)
+    return proc.returncode
+
+def main(argv: Optional[List[str]] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if "--startup-profile" in argv:
+        sys.exit(run_startup_profile([a for a in argv if a != "--startup-profile"]))
+    if argv:
+        main_t0 = time.perf_counter()
+        code = run_cli(argv)
+        if os.environ.get(STARTUP_PROFILE_ENV):
+            _emit_startup_phases(main_t0)
+        sys.exit(code)
     require_root()
     
     main_menu()